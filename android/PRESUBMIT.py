@@ -74,14 +74,25 @@ def CommonChecks(input_api, output_api):
           unit_tests=[
               J('.', 'emma_coverage_stats_test.py'),
               J('.', 'list_class_verification_failures_test.py'),
+              J('gyp', 'util', 'build_config_index_test.py'),
               J('gyp', 'util', 'build_utils_test.py'),
+              J('gyp', 'util', 'content_cache_test.py'),
+              J('gyp', 'util', 'dependency_graph_test.py'),
+              J('gyp', 'util', 'jar_index_test.py'),
+              J('gyp', 'util', 'java_abi_test.py'),
+              J('gyp', 'util', 'jvm_workers_test.py'),
               J('gyp', 'util', 'manifest_utils_test.py'),
               J('gyp', 'util', 'md5_check_test.py'),
+              J('gyp', 'util', 'protoresources_test.py'),
               J('gyp', 'util', 'resource_utils_test.py'),
+              J('pylib', 'base', 'test_durations_unittest.py'),
               J('pylib', 'constants', 'host_paths_unittest.py'),
+              J('pylib', 'dex', 'dex_parser_test.py'),
+              J('pylib', 'gtest', 'gtest_output_parser_test.py'),
               J('pylib', 'gtest', 'gtest_test_instance_test.py'),
               J('pylib', 'instrumentation',
                 'instrumentation_test_instance_test.py'),
+              J('pylib', 'local', 'device', 'device_state_test.py'),
               J('pylib', 'local', 'device',
                 'local_device_instrumentation_test_run_test.py'),
               J('pylib', 'local', 'device', 'local_device_test_run_test.py'),
@@ -94,7 +105,11 @@ def CommonChecks(input_api, output_api):
               J('pylib', 'symbols', 'apk_native_libs_unittest.py'),
               J('pylib', 'symbols', 'elf_symbolizer_unittest.py'),
               J('pylib', 'symbols', 'symbol_utils_unittest.py'),
+              J('pylib', 'symbols', 'symbolizer_service_unittest.py'),
+              J('pylib', 'symbols', 'mapping_deobfuscator_unittest.py'),
+              J('pylib', 'symbols', 'native_frame_symbolizer_unittest.py'),
               J('pylib', 'utils', 'chrome_proxy_utils_test.py'),
+              J('pylib', 'utils', 'data_deps_sync_test.py'),
               J('pylib', 'utils', 'decorators_test.py'),
               J('pylib', 'utils', 'device_dependencies_test.py'),
               J('pylib', 'utils', 'dexdump_test.py'),
@@ -23,7 +23,10 @@ import subprocess
 import sys
 import tempfile
 import textwrap
+import threading
+import time
 import zipfile
+from multiprocessing.pool import ThreadPool
 
 import adb_command_line
 import devil_chromium
@@ -48,7 +51,10 @@ with devil_env.SysPath(
 
 from incremental_install import installer
 from pylib import constants
-from pylib.symbols import deobfuscator
+from pylib.symbols import apk_native_libs
+from pylib.symbols import mapping_deobfuscator
+from pylib.symbols import native_frame_symbolizer
+from pylib.symbols import symbol_utils
 from pylib.utils import simpleperf
 from pylib.utils import app_bundle_utils
 
@@ -569,34 +575,87 @@ class _LogcatProcessor(object):
       ['date', 'invokation_time', 'pid', 'tid', 'priority', 'tag', 'message'])
 
   class NativeStackSymbolizer(object):
-    """Buffers lines from native stacks and symbolizes them when done."""
+    """Buffers lines from native stacks and symbolizes them in the background.
+
+    Lines are printed in the order they were added: lines that follow a stack
+    are held back until it is symbolized.
+    """
     # E.g.: #06 pc 0x0000d519 /apex/com.android.runtime/lib/libart.so
     # E.g.: #01 pc 00180c8d  /data/data/.../lib/libbase.cr.so
     _STACK_PATTERN = re.compile(r'\s*#\d+\s+(?:pc )?(0x)?[0-9a-f]{8,16}\s')
+    # Number of stacks symbolized in parallel. Only stack.py runs in parallel:
+    # the in-process symbolizer handles one stack at a time.
+    _SYMBOLIZE_THREADS = 4
 
-    def __init__(self, stack_script_context, print_func):
+    def __init__(self, stack_script_context, print_func, device=None,
+                 package_name=None):
       # To symbolize native stacks, we need to pass all lines at once.
       self._stack_script_context = stack_script_context
       self._print_func = print_func
+      self._device = device
+      self._package_name = package_name
       self._crash_lines_buffer = None
-
-    def _FlushLines(self):
-      """Prints queued lines after sending them through stack.py."""
-      crash_lines = self._crash_lines_buffer
-      self._crash_lines_buffer = None
+      # Lists of (parsed_line, dim) to print, and AsyncResults of such lists
+      # for stacks being symbolized, in the order they must be printed.
+      self._pending = collections.deque()
+      self._pool = None
+      self._frame_symbolizer_lock = threading.Lock()
+      self._frame_symbolizer = None
+      self._frame_symbolizer_created = False
+      self.num_stacks_symbolized_in_process = 0
+      self.num_stacks_symbolized_by_stack_script = 0
+
+    def _GetFrameSymbolizer(self):
+      if not self._frame_symbolizer_created:
+        self._frame_symbolizer_created = True
+        if self._device:
+          self._frame_symbolizer = (
+              self._stack_script_context.CreateFrameSymbolizer(
+                  self._device.product_cpu_abi, self._package_name))
+      return self._frame_symbolizer
+
+    def _RunStackScript(self, messages):
       with tempfile.NamedTemporaryFile() as f:
-        f.writelines(x[0].message + '\n' for x in crash_lines)
+        f.writelines(x + '\n' for x in messages)
         f.flush()
         proc = self._stack_script_context.Popen(
             input_file=f.name, stdout=subprocess.PIPE)
-        lines = proc.communicate()[0].splitlines()
+        return proc.communicate()[0].splitlines()
 
+    def _Symbolize(self, crash_lines):
+      """Returns |crash_lines| symbolized. Runs on the pool's thread."""
+      messages = [x[0].message for x in crash_lines]
+      lines = None
+      with self._frame_symbolizer_lock:
+        try:
+          frame_symbolizer = self._GetFrameSymbolizer()
+          if frame_symbolizer:
+            lines = frame_symbolizer.SymbolizeLines(messages)
+        except Exception:  # pylint: disable=broad-except
+          logging.exception('Failed to symbolize stack, using stack.py')
+        if lines:
+          self.num_stacks_symbolized_in_process += 1
+        else:
+          self.num_stacks_symbolized_by_stack_script += 1
+      if not lines:
+        # No frame of a known library, which stack.py may still find in the
+        # APKs (e.g. for bundles), or in other symbol locations.
+        lines = self._RunStackScript(messages)
+
+      ret = []
       for i, line in enumerate(lines):
         parsed_line, dim = crash_lines[min(i, len(crash_lines) - 1)]
-        d = parsed_line._asdict()
-        d['message'] = line
-        parsed_line = _LogcatProcessor.ParsedLine(**d)
-        self._print_func(parsed_line, dim)
+        ret.append((parsed_line._replace(message=line), dim))
+      return ret
+
+    def _FlushLines(self):
+      """Queues buffered lines to be symbolized, and printed when done."""
+      crash_lines = self._crash_lines_buffer
+      self._crash_lines_buffer = None
+      if self._pool is None:
+        self._pool = ThreadPool(self._SYMBOLIZE_THREADS)
+      self._pending.append(self._pool.apply_async(self._Symbolize,
+                                                  (crash_lines, )))
 
     def AddLine(self, parsed_line, dim):
       # Assume all lines from DEBUG are stacks.
@@ -615,7 +674,44 @@ class _LogcatProcessor(object):
       if self._crash_lines_buffer is not None:
         self._FlushLines()
 
-      self._print_func(parsed_line, dim)
+      if not self._pending:
+        self._print_func(parsed_line, dim)
+      elif isinstance(self._pending[-1], list):
+        self._pending[-1].append((parsed_line, dim))
+      else:
+        self._pending.append([(parsed_line, dim)])
+
+    def GetNumPendingStacks(self):
+      """Returns the number of stacks waiting to be symbolized or printed."""
+      return sum(1 for x in self._pending if not isinstance(x, list))
+
+    def PrintReadyLines(self):
+      """Prints pending lines up to the first stack still being symbolized."""
+      while self._pending:
+        lines = self._pending[0]
+        if not isinstance(lines, list):
+          if not lines.ready():
+            return
+          lines = lines.get()
+        self._pending.popleft()
+        for parsed_line, dim in lines:
+          self._print_func(parsed_line, dim)
+
+    def Finish(self):
+      """Symbolizes buffered lines, and prints all pending lines."""
+      if self._crash_lines_buffer is not None:
+        self._FlushLines()
+      for lines in self._pending:
+        if not isinstance(lines, list):
+          lines = lines.get()
+        for parsed_line, dim in lines:
+          self._print_func(parsed_line, dim)
+      self._pending.clear()
+
+    def Close(self):
+      if self._pool:
+        self._pool.terminate()
+        self._pool = None
 
 
   # Logcat tags for messages that are generally relevant but are not from PIDs
@@ -626,6 +722,9 @@ class _LogcatProcessor(object):
       'AndroidRuntime',  # Java crash dumps
       'DEBUG',  # Native crash dump.
   }
+  # The tag tokens of lines with _WHITELISTED_TAGS (see _ParseLine()).
+  _WHITELISTED_TAG_TOKENS = _WHITELISTED_TAGS | {
+      t + ':' for t in _WHITELISTED_TAGS}
 
   # Matches messages only on pre-L (Dalvik) that are spammy and unimportant.
   _DALVIK_IGNORE_PATTERN = re.compile('|'.join([
@@ -642,6 +741,12 @@ class _LogcatProcessor(object):
       r'^WAIT_',
   ]))
 
+  # Splits a line in "threadtime" format into the same tokens as
+  # line.split(None, 6), when it has at least 6 of them and numeric PID / TID.
+  _THREADTIME_PATTERN = re.compile(
+      r'\s*(\S+)\s+(\S+)\s+(\d+)\s+(\d+)\s+(\S+)\s+(\S+)(?:\s+(.*))?$',
+      re.DOTALL)
+
   def __init__(self,
                device,
                package_name,
@@ -653,26 +758,28 @@ class _LogcatProcessor(object):
     self._verbose = verbose
     self._deobfuscator = deobfuscate
     self._native_stack_symbolizer = _LogcatProcessor.NativeStackSymbolizer(
-        stack_script_context, self._PrintParsedLine)
+        stack_script_context, self._PrintParsedLine, device, package_name)
+    self.num_lines_printed = 0
     # Process ID for the app's main process (with no :name suffix).
     self._primary_pid = None
     # Set of all Process IDs that belong to the app.
     self._my_pids = set()
     # Set of all Process IDs that we've parsed at some point.
     self._seen_pids = set()
-    # Start proc 22953:com.google.chromeremotedesktop/
-    self._pid_pattern = re.compile(r'Start proc (\d+):{}/'.format(package_name))
+    # Matches either of:
     # START u0 {act=android.intent.action.MAIN \
     # cat=[android.intent.category.LAUNCHER] \
     # flg=0x10000000 pkg=com.google.chromeremotedesktop} from uid 2000
-    self._start_pattern = re.compile(r'START .*pkg=' + package_name)
+    # Start proc 22953:com.google.chromeremotedesktop/
+    self._launch_pattern = re.compile(
+        r'START .*pkg={0}|Start proc (\d+):{0}/'.format(package_name))
 
     self.nonce = 'Chromium apk_operations.py nonce={}'.format(random.random())
     # Holds lines buffered on start-up, before we find our nonce message.
     self._initial_buffered_lines = []
     self._UpdateMyPids()
     # Give preference to PID reported by "ps" over those found from
-    # _start_pattern. There can be multiple "Start proc" messages from prior
+    # _launch_pattern. There can be multiple "Start proc" messages from prior
     # runs of the app.
     self._found_initial_pid = self._primary_pid != None
 
@@ -713,19 +820,26 @@ class _LogcatProcessor(object):
       style += colorama.Back.BLUE
     return style
 
-  def _ParseLine(self, line):
-    tokens = line.split(None, 6)
+  def _ParseLine(self, line, match=None):
+    """Parses |line|, given its _THREADTIME_PATTERN match if any."""
+    if match:
+      (date, invokation_time, pid, tid, priority, tag,
+       original_message) = match.groups('')
+      pid = int(pid)
+      tid = int(tid)
+    else:
+      tokens = line.split(None, 6)
 
-    def consume_token_or_default(default):
-      return tokens.pop(0) if len(tokens) > 0 else default
+      def consume_token_or_default(default):
+        return tokens.pop(0) if len(tokens) > 0 else default
 
-    date = consume_token_or_default('')
-    invokation_time = consume_token_or_default('')
-    pid = int(consume_token_or_default(-1))
-    tid = int(consume_token_or_default(-1))
-    priority = consume_token_or_default('')
-    tag = consume_token_or_default('')
-    original_message = consume_token_or_default('')
+      date = consume_token_or_default('')
+      invokation_time = consume_token_or_default('')
+      pid = int(consume_token_or_default(-1))
+      tid = int(consume_token_or_default(-1))
+      priority = consume_token_or_default('')
+      tag = consume_token_or_default('')
+      original_message = consume_token_or_default('')
 
     # Example:
     #   09-19 06:35:51.113  9060  9154 W GCoreFlp: No location...
@@ -740,6 +854,7 @@ class _LogcatProcessor(object):
         date, invokation_time, pid, tid, priority, tag, original_message)
 
   def _PrintParsedLine(self, parsed_line, dim=False):
+    self.num_lines_printed += 1
     tid_style = colorama.Style.NORMAL
     # Make the main thread bright.
     if not dim and parsed_line.pid == parsed_line.tid:
@@ -779,7 +894,17 @@ class _LogcatProcessor(object):
 
     nonce_found = self.nonce is None
 
-    log = self._ParseLine(line)
+    match = self._THREADTIME_PATTERN.match(line)
+    # Most lines are dropped. Do so before fully parsing them, when they are
+    # from a known PID that is not ours, and are not otherwise relevant.
+    if match and nonce_found and not self._verbose:
+      pid = int(match.group(3))
+      if (pid in self._seen_pids and pid not in self._my_pids
+          and match.group(5) != 'F'
+          and match.group(6) not in self._WHITELISTED_TAG_TOKENS):
+        return
+
+    log = self._ParseLine(line, match)
     if log.pid not in self._seen_pids:
       self._seen_pids.add(log.pid)
       if nonce_found:
@@ -788,22 +913,20 @@ class _LogcatProcessor(object):
 
     # Search for "Start proc $pid:$package_name/" message.
     if not nonce_found:
-      # Capture logs before the nonce. Start with the most recent "am start".
-      if self._start_pattern.match(log.message):
+      m = self._launch_pattern.match(log.message)
+      if m and m.group(1) is None:
+        # Capture logs before the nonce. Start with the most recent "am start".
         self._initial_buffered_lines = []
-
-      # If we didn't find the PID via "ps", then extract it from log messages.
-      # This will happen if the app crashes too quickly.
-      if not self._found_initial_pid:
-        m = self._pid_pattern.match(log.message)
-        if m:
-          # Find the most recent "Start proc" line before the nonce.
-          # Track only the primary pid in this mode.
-          # The main use-case is to find app logs when no current PIDs exist.
-          # E.g.: When the app crashes on launch.
-          self._primary_pid = m.group(1)
-          self._my_pids.clear()
-          self._my_pids.add(m.group(1))
+      elif m and not self._found_initial_pid:
+        # If we didn't find the PID via "ps", then extract it from log
+        # messages. This will happen if the app crashes too quickly.
+        # Find the most recent "Start proc" line before the nonce.
+        # Track only the primary pid in this mode.
+        # The main use-case is to find app logs when no current PIDs exist.
+        # E.g.: When the app crashes on launch.
+        self._primary_pid = int(m.group(1))
+        self._my_pids.clear()
+        self._my_pids.add(self._primary_pid)
 
     owned_pid = log.pid in self._my_pids
     if owned_pid and not self._verbose and log.tag == 'dalvikvm':
@@ -817,22 +940,173 @@ class _LogcatProcessor(object):
       else:
         self._initial_buffered_lines.append((log, not owned_pid))
 
+  def GetNumPendingStacks(self):
+    """Returns the number of native stacks not yet printed."""
+    return self._native_stack_symbolizer.GetNumPendingStacks()
+
+  def GetNumStacksSymbolized(self):
+    """Returns the number of stacks symbolized in-process and by stack.py."""
+    return (self._native_stack_symbolizer.num_stacks_symbolized_in_process,
+            self._native_stack_symbolizer.num_stacks_symbolized_by_stack_script)
+
+  def PrintReadyLines(self):
+    """Prints the lines that were held back by a stack now symbolized."""
+    self._native_stack_symbolizer.PrintReadyLines()
+
+  def Finish(self):
+    """Prints all remaining lines, once logcat has ended."""
+    self._native_stack_symbolizer.Finish()
+
+  def Close(self):
+    self._native_stack_symbolizer.Close()
+
+
+class _LogcatReader(object):
+  """Reads logcat on a background thread, and hands lines over in batches.
+
+  This keeps adb drained while lines are processed. Lines are passed through a
+  deque, whose appends and pops are atomic, so that only waiting for lines
+  involves a lock.
+  """
+  # Maximum number of lines returned at once by IterBatches().
+  _MAX_BATCH_SIZE = 1000
+  # Interval at which IterBatches() yields while logcat is quiet.
+  _IDLE_TIMEOUT_SECONDS = 0.1
+  # Appended to the lines once logcat ends.
+  _END = object()
+
+  def __init__(self, device):
+    self._lines = collections.deque()
+    self._error = None
+    # Set when the main thread waits for lines, for the reader to wake it up.
+    self._waiting = False
+    self._lines_available = threading.Event()
+    self._thread = threading.Thread(
+        target=self._ReadLines, args=(device, ), name='logcat_reader')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _ReadLines(self, device):
+    lines = self._lines
+    try:
+      for line in device.adb.Logcat(logcat_format='threadtime'):
+        lines.append(line)
+        if self._waiting:
+          self._lines_available.set()
+    except Exception as e:  # pylint: disable=broad-except
+      # Raised on the main thread by IterBatches().
+      self._error = e
+    lines.append(self._END)
+    self._lines_available.set()
+
+  def GetBacklog(self):
+    """Returns the number of lines read but not yet handed over."""
+    return len(self._lines)
+
+  def _WaitForLines(self):
+    # _waiting is set before lines are checked one last time, so that a line
+    # appended after that check is followed by a wake up.
+    self._waiting = True
+    self._lines_available.clear()
+    if not self._lines:
+      self._lines_available.wait(self._IDLE_TIMEOUT_SECONDS)
+    self._waiting = False
+
+  def IterBatches(self):
+    """Yields lists of logcat lines, until logcat ends.
+
+    Empty lists are yielded while logcat is quiet. Errors from reading logcat
+    are raised once the lines read before them have been yielded.
+    """
+    lines = self._lines
+    while True:
+      if not lines:
+        self._WaitForLines()
+        if not lines:
+          yield []
+          continue
+      batch = [
+          lines.popleft()
+          for _ in range(min(len(lines), self._MAX_BATCH_SIZE))
+      ]
+      if batch[-1] is not self._END:
+        yield batch
+        continue
+      yield batch[:-1]
+      if self._error:
+        raise self._error  # pylint: disable=raising-bad-type
+      return
+
+
+class _LogcatStats(object):
+  """Reports the throughput and backlog of the logcat pipeline to stderr."""
+  _REPORT_INTERVAL_SECONDS = 5
+
+  def __init__(self, reader, processor):
+    self._reader = reader
+    self._processor = processor
+    self._start_time = time.time()
+    self._num_lines = 0
+    self._max_backlog = 0
+    self._last_report_time = self._start_time
+    self._last_report_num_lines = 0
+
+  def AddLines(self, num_lines):
+    """Records that |num_lines| were processed, and reports periodically."""
+    self._num_lines += num_lines
+    backlog = self._reader.GetBacklog()
+    self._max_backlog = max(self._max_backlog, backlog)
+    now = time.time()
+    elapsed = now - self._last_report_time
+    if elapsed < self._REPORT_INTERVAL_SECONDS:
+      return
+    sys.stderr.write(
+        'logcat: {:.0f} lines/s, backlog: {} lines, {} stacks pending\n'.format(
+            (self._num_lines - self._last_report_num_lines) / elapsed, backlog,
+            self._processor.GetNumPendingStacks()))
+    self._last_report_time = now
+    self._last_report_num_lines = self._num_lines
+
+  def PrintSummary(self):
+    elapsed = max(time.time() - self._start_time, 1e-6)
+    in_process, by_stack_script = self._processor.GetNumStacksSymbolized()
+    sys.stderr.write(
+        'logcat: Processed {} lines in {:.1f}s ({:.0f} lines/s), printed {}.\n'
+        'logcat: Max backlog: {} lines. Stacks symbolized in-process: {}, '
+        'by stack.py: {}.\n'.format(self._num_lines, elapsed,
+                                    self._num_lines / elapsed,
+                                    self._processor.num_lines_printed,
+                                    self._max_backlog, in_process,
+                                    by_stack_script))
+
 
 def _RunLogcat(device, package_name, stack_script_context, deobfuscate,
-               verbose):
+               verbose, show_stats=False):
   logcat_processor = _LogcatProcessor(
       device, package_name, stack_script_context, deobfuscate, verbose)
   device.RunShellCommand(['log', logcat_processor.nonce])
-  for line in device.adb.Logcat(logcat_format='threadtime'):
-    try:
-      logcat_processor.ProcessLine(line)
-    except:
-      sys.stderr.write('Failed to process line: ' + line + '\n')
-      # Skip stack trace for the common case of the adb server being
-      # restarted.
-      if 'unexpected EOF' in line:
-        sys.exit(1)
-      raise
+  reader = _LogcatReader(device)
+  stats = _LogcatStats(reader, logcat_processor) if show_stats else None
+  try:
+    for lines in reader.IterBatches():
+      for line in lines:
+        try:
+          logcat_processor.ProcessLine(line)
+        except:
+          sys.stderr.write('Failed to process line: ' + line + '\n')
+          # Skip stack trace for the common case of the adb server being
+          # restarted.
+          if 'unexpected EOF' in line:
+            sys.exit(1)
+          raise
+      logcat_processor.PrintReadyLines()
+      if stats:
+        stats.AddLines(len(lines))
+    logcat_processor.Finish()
+  finally:
+    logcat_processor.Close()
+    if stats:
+      stats.PrintSummary()
 
 
 def _GetPackageProcesses(device, package_name):
@@ -955,6 +1229,34 @@ class _StackScriptContext(object):
       output = os.path.join(self._staging_dir, os.path.basename(self._apk_path))
       os.symlink(self._apk_path, output)
 
+  def CreateFrameSymbolizer(self, android_abi, package_name):
+    """Returns a NativeFrameSymbolizer for the APK's libraries, or None.
+
+    Unlike stack.py, it symbolizes stacks in-process, with warm symbolizers.
+    """
+    if not self._output_directory:
+      return None
+    lib_dir = os.path.join(self._output_directory, 'lib.unstripped')
+    if not os.path.isdir(lib_dir):
+      return None
+    host_lib_finder = symbol_utils.HostLibraryFinder(index_path=os.path.join(
+        self._output_directory, 'lib.unstripped.index.json'))
+    host_lib_finder.AddSearchDir(lib_dir)
+
+    # Libraries mapped from the splits of a bundle are left to stack.py, which
+    # knows how splits are named on the device.
+    apk_translator = None
+    if self._apk_path and not self._bundle_generation_info:
+      with apk_native_libs.ApkReader(self._apk_path) as apk_reader:
+        native_libs = apk_native_libs.ApkNativeLibraries(apk_reader)
+      apk_translator = apk_native_libs.ApkLibraryPathTranslator()
+      apk_translator.AddHostApk(package_name, native_libs)
+    return native_frame_symbolizer.NativeFrameSymbolizer(
+        android_abi,
+        host_lib_finder,
+        apk_translator=apk_translator,
+        symbol_cache_dir=os.path.join(self._output_directory, 'symbol_cache'))
+
   def Close(self):
     if self._staging_dir:
       logging.debug('Clearing stack staging directory')
@@ -1471,6 +1773,7 @@ Colors:
   * UI thread has a bolded Thread-ID
 
 Java stack traces are detected and deobfuscated (for release builds).
+Native stacks are symbolized in the background, without reordering lines.
 
 To disable filtering, (but keep coloring), use --verbose.
 """
@@ -1480,7 +1783,8 @@ To disable filtering, (but keep coloring), use --verbose.
   def Run(self):
     deobfuscate = None
     if self.args.proguard_mapping_path and not self.args.no_deobfuscate:
-      deobfuscate = deobfuscator.Deobfuscator(self.args.proguard_mapping_path)
+      deobfuscate = mapping_deobfuscator.MappingDeobfuscator(
+          self.args.proguard_mapping_path)
 
     stack_script_context = _StackScriptContext(
         self.args.output_directory,
@@ -1489,7 +1793,7 @@ To disable filtering, (but keep coloring), use --verbose.
         quiet=True)
     try:
       _RunLogcat(self.devices[0], self.args.package_name, stack_script_context,
-                 deobfuscate, bool(self.args.verbose_count))
+                 deobfuscate, bool(self.args.verbose_count), self.args.stats)
     except KeyboardInterrupt:
       pass  # Don't show stack trace upon Ctrl-C
     finally:
@@ -1505,6 +1809,9 @@ To disable filtering, (but keep coloring), use --verbose.
       group.set_defaults(no_deobfuscate=False)
       group.add_argument('--proguard-mapping-path',
           help='Path to ProGuard map (enables deobfuscation)')
+    group.add_argument('--stats', action='store_true',
+        help='Print the throughput and backlog of logcat processing to '
+             'stderr every few seconds, and a summary on exit.')
 
 
 class _PsCommand(_Command):
@@ -246,21 +246,17 @@ def _AddFiles(apk, details):
     details: A list of file detail tuples (src_path, apk_path, compress,
     alignment) representing what and how files are added to the APK.
   """
-  for apk_path, src_path, compress, alignment in details:
-    # This check is only relevant for assets, but it should not matter if it is
-    # checked for the whole list of files.
-    try:
-      apk.getinfo(apk_path)
+  # This check is only relevant for assets, but it should not matter if it is
+  # checked for the whole list of files.
+  apk_paths = set(apk.namelist())
+  for apk_path, _, _, _ in details:
+    if apk_path in apk_paths:
       # Should never happen since write_build_config.py handles merging.
       raise Exception(
           'Multiple targets specified the asset path: %s' % apk_path)
-    except KeyError:
-      zipalign.AddToZipHermetic(
-          apk,
-          apk_path,
-          src_path=src_path,
-          compress=compress,
-          alignment=alignment)
+    apk_paths.add(apk_path)
+  zipalign.AddFilesToZipHermetic(
+      apk, details, jobs=build_utils.DefaultZipJobs())
 
 
 def _GetNativeLibrariesToAdd(native_libs, android_abi, uncompress, fast_align,
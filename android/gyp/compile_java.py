@@ -6,10 +6,13 @@
 
 import distutils.spawn
 import functools
+import itertools
+import json
 import logging
 import multiprocessing
 import optparse
 import os
+import posixpath
 import re
 import shutil
 import sys
@@ -17,8 +20,10 @@ import time
 import zipfile
 
 from util import build_utils
-from util import md5_check
 from util import jar_info_utils
+from util import java_abi
+from util import jvm_workers
+from util import md5_check
 
 sys.path.insert(
     0,
@@ -280,6 +285,8 @@ class _InfoFileContext(object):
     self._excluded_globs = excluded_globs
     # Map of .java path -> .srcjar/nested/path.java.
     self._srcjar_files = {}
+    # Map of .java path -> (package name, class names).
+    self._parsed_files = {}
     # List of generators from pool.imap_unordered().
     self._results = []
     # Lazily created multiprocessing.Pool.
@@ -292,6 +299,25 @@ class _InfoFileContext(object):
       self._srcjar_files[path] = '{}/{}'.format(
           srcjar_path, os.path.relpath(path, parent_dir))
 
+  def AddSrcJarFiles(self, srcjar_files):
+    """Adds the result of a previous GetSrcJarFiles()."""
+    self._srcjar_files.update(srcjar_files)
+
+  def AddParsedFiles(self, parsed_files):
+    """Adds the result of a previous GetParsedFiles(), or of parsing files with
+    _ParsePackageAndClassNames()."""
+    self._parsed_files.update(parsed_files)
+
+  def GetSrcJarFiles(self):
+    return self._srcjar_files
+
+  def GetParsedFiles(self):
+    """Returns a map of .java path -> (package name, class names).
+
+    Must be called after Commit().
+    """
+    return self._parsed_files
+
   def SubmitFiles(self, java_files):
     if self._pool is None:
       # Restrict to just one process to not slow down compiling. Compiling
@@ -327,17 +353,19 @@ class _InfoFileContext(object):
     return not build_utils.MatchesGlob(name_as_class_glob, self._excluded_globs)
 
   def _Collect(self):
-    if self._pool is None:
-      return {}
+    if self._pool is not None:
+      for result in self._results:
+        for java_file, package_name, class_names in result:
+          self._parsed_files[java_file] = (package_name, class_names)
+      self._results = []
+      self._pool.terminate()
     ret = {}
-    for result in self._results:
-      for java_file, package_name, class_names in result:
-        source = self._srcjar_files.get(java_file, java_file)
-        for fully_qualified_name in self._ProcessInfo(java_file, package_name,
-                                                      class_names, source):
-          if self._ShouldIncludeInJarInfo(fully_qualified_name):
-            ret[fully_qualified_name] = java_file
-    self._pool.terminate()
+    for java_file, (package_name, class_names) in self._parsed_files.items():
+      source = self._srcjar_files.get(java_file, java_file)
+      for fully_qualified_name in self._ProcessInfo(java_file, package_name,
+                                                    class_names, source):
+        if self._ShouldIncludeInJarInfo(fully_qualified_name):
+          ret[fully_qualified_name] = java_file
     return ret
 
   def __del__(self):
@@ -384,7 +412,215 @@ def _CreateJarFile(jar_path, service_provider_configuration_dir,
   logging.info('Completed jar file: %s', jar_path)
 
 
-def _OnStaleMd5(options, javac_cmd, javac_args, java_files):
+def _ExtractServiceProviderConfigs(header_jar, dest_dir):
+  logging.info('Extracting service provider configs')
+  # Extract META-INF/services/* so that it can be copied into the output .jar
+  build_utils.ExtractAll(header_jar,
+                         no_clobber=True,
+                         path=dest_dir,
+                         pattern='META-INF/services/*')
+  logging.info('Done extracting service provider configs')
+
+
+def _GetIncrementalStatePath(jar_path):
+  return jar_path + '.incremental.json'
+
+
+def _ReadIncrementalState(jar_path):
+  try:
+    with open(_GetIncrementalStatePath(jar_path)) as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return None
+
+
+def _WriteOutputs(options, jar_path, service_provider_configuration,
+                  classes_dir, info_file_context):
+  # The state describes the previous .jar, so it must not outlive it.
+  state_path = _GetIncrementalStatePath(jar_path)
+  if os.path.exists(state_path):
+    os.unlink(state_path)
+
+  _CreateJarFile(jar_path, service_provider_configuration,
+                 options.additional_jar_files, classes_dir)
+  info_file_context.Commit(jar_path + '.info')
+
+  if options.incremental:
+    state = {
+        'parsed_files': info_file_context.GetParsedFiles(),
+        'srcjar_files': info_file_context.GetSrcJarFiles(),
+    }
+    build_utils.WriteJson(state, state_path)
+
+
+def _FindChangedSources(changes, options, java_files, state):
+  """Returns the sources that need to be recompiled.
+
+  Returns:
+    A tuple of (changed .java files, {srcjar: changed .java subpaths}), or None
+    if the change cannot be compiled incrementally.
+  """
+  # A different set of sources, javac flags or classpath means that the
+  # classes of the previous compile cannot be reused.
+  if (state is None or changes.HasStringChanges() or changes.missing_outputs
+      or changes.too_new or any(changes.IterAddedPaths())
+      or any(changes.IterRemovedPaths())):
+    return None
+  parsed_files = state['parsed_files']
+  if not all(f in parsed_files for f in java_files):
+    return None
+  if not all(os.path.exists(f) for f in parsed_files):
+    return None
+
+  # These are copied into the .jar as-is.
+  repackaged_paths = set(x[0] for x in options.additional_jar_files)
+  if options.header_jar:
+    repackaged_paths.add(options.header_jar)
+
+  input_srcjars_dir = os.path.join(options.generated_dir, 'input_srcjars')
+  java_files = set(java_files)
+  srcjars = set(options.java_srcjars)
+  changed_files = []
+  srcjar_subpaths = {}
+  for path in changes.IterModifiedPaths():
+    if path in java_files:
+      changed_files.append(path)
+    elif path in srcjars:
+      if any(p.endswith('.java') for p in itertools.chain(
+          changes.IterAddedSubpaths(path), changes.IterRemovedSubpaths(path))):
+        return None
+      subpaths = [
+          p for p in changes.IterModifiedSubpaths(path) if p.endswith('.java')
+      ]
+      if subpaths:
+        srcjar_subpaths[path] = subpaths
+        changed_files.extend(
+            os.path.join(input_srcjars_dir, p) for p in subpaths)
+    elif path not in repackaged_paths:
+      return None
+  return changed_files, srcjar_subpaths
+
+
+def _ReadClassAbis(classes_dir):
+  """Returns {class path: ABI} of the referencable classes in |classes_dir|."""
+  ret = {}
+  for path in build_utils.FindInDirectory(classes_dir, '*.class'):
+    class_path = os.path.relpath(path, classes_dir)
+    if not java_abi.IsAnonymousOrLocalClass(class_path):
+      with open(path, 'rb') as f:
+        ret[class_path] = java_abi.ComputeClassAbi(f.read())
+  return ret
+
+
+def _RunIncrementalCompiler(changes, options, javac_cmd, java_files):
+  """Recompiles only the sources that changed since the previous compile.
+
+  The classes of the previous compile are used for the sources that did not
+  change. This is correct only as long as the ABI of the changed sources did
+  not change, since otherwise dependent sources would need to be recompiled as
+  well.
+
+  Returns:
+    Whether the outputs were written. When False, a full compile is needed.
+  """
+  if options.processors:
+    return False
+  state = _ReadIncrementalState(options.jar_path)
+  result = _FindChangedSources(changes, options, java_files, state)
+  if result is None:
+    logging.info('Cannot compile incrementally')
+    return False
+  changed_files, srcjar_subpaths = result
+  logging.info('Compiling incrementally: %d changed files',
+               len(changed_files))
+
+  # Map classes to the sources that they come from.
+  parsed_files = state['parsed_files']
+  source_by_class = {}
+  for java_file, (package_name, class_names) in parsed_files.items():
+    if os.path.basename(java_file) == 'package-info.java':
+      class_names = class_names + ['package-info']
+    package_path = package_name.replace('.', '/')
+    for class_name in class_names:
+      source_by_class[posixpath.join(package_path, class_name)] = java_file
+
+  temp_dir = options.jar_path + '.staging'
+  shutil.rmtree(temp_dir, True)
+  os.makedirs(temp_dir)
+  try:
+    classes_dir = os.path.join(temp_dir, 'classes')
+    new_classes_dir = os.path.join(temp_dir, 'new_classes')
+    service_provider_configuration = os.path.join(
+        temp_dir, 'service_provider_configuration')
+
+    logging.info('Extracting classes of unchanged sources')
+    changed_set = set(changed_files)
+    old_abis = {}
+    with zipfile.ZipFile(options.jar_path) as z:
+      for name in z.namelist():
+        if not name.endswith('.class'):
+          continue
+        java_file = source_by_class.get(name[:-len('.class')].split('$')[0])
+        if java_file is None:
+          logging.info('Cannot find the source of %s', name)
+          return False
+        if java_file not in changed_set:
+          z.extract(name, classes_dir)
+        elif not java_abi.IsAnonymousOrLocalClass(name):
+          old_abis[name] = java_abi.ComputeClassAbi(z.read(name))
+
+    input_srcjars_dir = os.path.join(options.generated_dir, 'input_srcjars')
+    for srcjar, subpaths in srcjar_subpaths.items():
+      build_utils.ExtractAll(srcjar,
+                             no_clobber=False,
+                             path=input_srcjars_dir,
+                             predicate=set(subpaths).__contains__)
+
+    if options.header_jar:
+      _ExtractServiceProviderConfigs(options.header_jar,
+                                     service_provider_configuration)
+
+    os.makedirs(new_classes_dir)
+    if changed_files:
+      cmd = list(javac_cmd) + [
+          '-d', new_classes_dir, '-classpath',
+          ':'.join([classes_dir] + options.classpath)
+      ]
+      _RunJavac(options, cmd, changed_files, temp_dir)
+
+    new_abis = _ReadClassAbis(new_classes_dir)
+    if new_abis != old_abis:
+      logging.info('ABI changed, recompiling all sources')
+      return False
+
+    for path in build_utils.FindInDirectory(new_classes_dir):
+      dest = os.path.join(classes_dir, os.path.relpath(path, new_classes_dir))
+      build_utils.MakeDirectory(os.path.dirname(dest))
+      shutil.move(path, dest)
+
+    info_file_context = _InfoFileContext(options.chromium_code,
+                                         options.jar_info_exclude_globs)
+    info_file_context.AddSrcJarFiles(state['srcjar_files'])
+    info_file_context.AddParsedFiles(
+        {f: v
+         for f, v in parsed_files.items() if f not in changed_set})
+    info_file_context.AddParsedFiles(
+        {f: _ParsePackageAndClassNames(f)
+         for f in changed_files})
+
+    _WriteOutputs(options, options.jar_path, service_provider_configuration,
+                  classes_dir, info_file_context)
+    logging.info('Completed incremental compile')
+    return True
+  except java_abi.ClassFormatError as e:
+    # E.g. class files of a newer version, or a corrupt previous output.
+    logging.info('Cannot compare class ABIs: %s', e)
+    return False
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def _OnStaleMd5(changes, options, javac_cmd, javac_args, java_files):
   logging.info('Starting _OnStaleMd5')
   if options.enable_kythe_annotations:
     # Kythe requires those env variables to be set and compile_java.py does the
@@ -407,6 +643,12 @@ def _OnStaleMd5(options, javac_cmd, javac_args, java_files):
       # codesearch. Log and error and move on.
       logging.error('Could not generate kzip: %s', e)
 
+  if options.incremental and not options.enable_errorprone:
+    if _RunIncrementalCompiler(changes, options, javac_cmd + javac_args,
+                               java_files):
+      logging.info('Completed all steps in _OnStaleMd5')
+      return
+
   # Compiles with Error Prone take twice as long to run as pure javac. Thus GN
   # rules run both in parallel, with Error Prone only used for checks.
   _RunCompiler(options, javac_cmd + javac_args, java_files,
@@ -415,6 +657,25 @@ def _OnStaleMd5(options, javac_cmd, javac_args, java_files):
   logging.info('Completed all steps in _OnStaleMd5')
 
 
+def _RunJavac(options, cmd, java_files, temp_dir):
+  # Pass source paths as response files to avoid extremely long command
+  # lines that are tedius to debug.
+  java_files_rsp_path = os.path.join(temp_dir, 'files_list.txt')
+  with open(java_files_rsp_path, 'w') as f:
+    f.write(' '.join(java_files))
+  cmd = cmd + ['@' + java_files_rsp_path]
+
+  logging.debug('Build command %s', cmd)
+  start = time.time()
+  jvm_workers.CheckOutput(cmd,
+                          print_stdout=options.chromium_code,
+                          stdout_filter=ProcessJavacOutput,
+                          stderr_filter=ProcessJavacOutput,
+                          fail_on_output=options.warnings_as_errors)
+  end = time.time() - start
+  logging.info('Java compilation took %ss', end)
+
+
 def _RunCompiler(options, javac_cmd, java_files, classpath, jar_path,
                  save_outputs=True):
   logging.info('Starting _RunCompiler')
@@ -459,14 +720,8 @@ def _RunCompiler(options, javac_cmd, java_files, classpath, jar_path,
       logging.info('Done extracting srcjars')
 
     if options.header_jar:
-      logging.info('Extracting service provider configs')
-      # Extract META-INF/services/* so that it can be copied into the output
-      # .jar
-      build_utils.ExtractAll(options.header_jar,
-                             no_clobber=True,
-                             path=service_provider_configuration,
-                             pattern='META-INF/services/*')
-      logging.info('Done extracting service provider configs')
+      _ExtractServiceProviderConfigs(options.header_jar,
+                                     service_provider_configuration)
 
     if save_outputs and java_files:
       info_file_context.SubmitFiles(java_files)
@@ -485,22 +740,7 @@ def _RunCompiler(options, javac_cmd, java_files, classpath, jar_path,
       if classpath:
         cmd += ['-classpath', ':'.join(classpath)]
 
-      # Pass source paths as response files to avoid extremely long command
-      # lines that are tedius to debug.
-      java_files_rsp_path = os.path.join(temp_dir, 'files_list.txt')
-      with open(java_files_rsp_path, 'w') as f:
-        f.write(' '.join(java_files))
-      cmd += ['@' + java_files_rsp_path]
-
-      logging.debug('Build command %s', cmd)
-      start = time.time()
-      build_utils.CheckOutput(cmd,
-                              print_stdout=options.chromium_code,
-                              stdout_filter=ProcessJavacOutput,
-                              stderr_filter=ProcessJavacOutput,
-                              fail_on_output=options.warnings_as_errors)
-      end = time.time() - start
-      logging.info('Java compilation took %ss', end)
+      _RunJavac(options, cmd, java_files, temp_dir)
 
     if save_outputs:
       if options.processors:
@@ -509,10 +749,8 @@ def _RunCompiler(options, javac_cmd, java_files, classpath, jar_path,
         if annotation_processor_java_files:
           info_file_context.SubmitFiles(annotation_processor_java_files)
 
-      _CreateJarFile(jar_path, service_provider_configuration,
-                     options.additional_jar_files, classes_dir)
-
-      info_file_context.Commit(jar_path + '.info')
+      _WriteOutputs(options, jar_path, service_provider_configuration,
+                    classes_dir, info_file_context)
     else:
       build_utils.Touch(jar_path)
 
@@ -600,6 +838,11 @@ def _ParseOptions(argv):
       '--header-jar',
       help='This is the header jar for the current target that contains '
       'META-INF/services/* files to be included in the output jar.')
+  parser.add_option(
+      '--incremental',
+      action='store_true',
+      help='Recompile only the sources that changed since the previous '
+      'compile, unless their ABI changed.')
 
   options, args = parser.parse_args(argv)
   build_utils.CheckOptions(options, parser, required=('jar_path', ))
@@ -731,12 +974,16 @@ def main(argv):
   ]
 
   md5_check.CallAndWriteDepfileIfStale(
-      lambda: _OnStaleMd5(options, javac_cmd, javac_args, java_files),
+      lambda changes: _OnStaleMd5(changes, options, javac_cmd, javac_args,
+                                  java_files),
       options,
       depfile_deps=depfile_deps,
       input_paths=input_paths,
       input_strings=input_strings,
-      output_paths=output_paths)
+      output_paths=output_paths,
+      pass_changes=True,
+      track_subpaths_allowlist=(options.java_srcjars
+                                if options.incremental else None))
 
 
 if __name__ == '__main__':
@@ -17,7 +17,9 @@ import collections
 import contextlib
 import filecmp
 import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import re
 import shutil
@@ -25,10 +27,12 @@ import subprocess
 import sys
 import tempfile
 import textwrap
+import time
 import zipfile
 from xml.etree import ElementTree
 
 from util import build_utils
+from util import content_cache
 from util import diff_utils
 from util import manifest_utils
 from util import md5_check
@@ -178,6 +182,22 @@ def _ParseArgs(args):
                           help='Path to the cwebp binary.')
   input_opts.add_argument(
       '--webp-cache-dir', help='The directory to store webp image cache.')
+  input_opts.add_argument(
+      '--webp-cache-max-size-mb',
+      type=int,
+      default=512,
+      help='Size above which least-recently-used entries are evicted from '
+      '--webp-cache-dir.')
+  input_opts.add_argument(
+      '--partials-cache-dir',
+      help='Directory to cache compiled dependency resources in. Entries are '
+      'reused when a target is rebuilt with unchanged dependency resources.')
+  input_opts.add_argument(
+      '--partials-cache-max-size-mb',
+      type=int,
+      default=2048,
+      help='Size above which least-recently-used entries are evicted from '
+      '--partials-cache-dir.')
 
   input_opts.add_argument(
       '--no-xml-namespaces',
@@ -532,58 +552,216 @@ def _ComputeSha1(path):
   return hashlib.sha1(data).hexdigest()
 
 
-def _ConvertToWebPSingle(png_path, cwebp_binary, cwebp_version, webp_cache_dir):
-  sha1_hash = _ComputeSha1(png_path)
+# The cwebp arguments that affect its output, and so are part of cache keys.
+_CWEBP_QUALITY_ARGS = ['-m', '6', '-q', '100', '-lossless']
 
-  # The set of arguments that will appear in the cache key.
-  quality_args = ['-m', '6', '-q', '100', '-lossless']
+# Maximum number of distinct images converted per worker call. cwebp converts
+# a single image per invocation, so this only amortizes the overhead of
+# dispatching work to the worker processes.
+_WEBP_MAX_BATCH_SIZE = 32
 
-  webp_cache_path = os.path.join(
-      webp_cache_dir, '{}-{}-{}'.format(sha1_hash, cwebp_version,
-                                        ''.join(quality_args)))
-  # No need to add .webp. Android can load images fine without them.
-  webp_path = os.path.splitext(png_path)[0]
 
-  cache_hit = os.path.exists(webp_cache_path)
-  if cache_hit:
-    os.link(webp_cache_path, webp_path)
-  else:
-    # We place the generated webp image to webp_path, instead of in the
-    # webp_cache_dir to avoid concurrency issues.
-    args = [cwebp_binary, png_path, '-o', webp_path, '-quiet'] + quality_args
-    subprocess.check_call(args)
+class _PngDigestIndex(object):
+  """Remembers the SHA-1 of the .png files within dependency .zip files.
+
+  Files extracted from a .zip get new mtimes on every build, so they are
+  identified by the .zip that they came from instead. Digests recorded for a
+  .zip are reused for as long as its size and mtime do not change.
+
+  The index is stored as JSON: {zip path: [size, mtime, {path: sha1}]}, where
+  paths are relative to the directory the .zip was extracted into. Each target
+  has an index of its own, so that actions never write the same file.
+  """
+
+  def __init__(self, index_path):
+    self._index_path = index_path
+    self._entries = self._Load()
+    self._used_zips = set()
+    self._updated = False
+    self._zip_stamps = {}
 
+  def _Load(self):
     try:
-      os.link(webp_path, webp_cache_path)
-    except OSError:
-      # Because of concurrent run, a webp image may already exists in
-      # webp_cache_path.
-      pass
+      with open(self._index_path) as f:
+        return json.load(f)
+    except (IOError, ValueError):
+      return {}
+
+  def _GetStamp(self, zip_path):
+    stamp = self._zip_stamps.get(zip_path)
+    if stamp is None:
+      st = os.stat(zip_path)
+      stamp = [st.st_size, st.st_mtime]
+      self._zip_stamps[zip_path] = stamp
+    return stamp
+
+  def Lookup(self, zip_path, rel_path):
+    """Returns the recorded SHA-1 of |rel_path| within |zip_path|, or None."""
+    self._used_zips.add(zip_path)
+    entry = self._entries.get(zip_path)
+    if not entry or entry[:2] != self._GetStamp(zip_path):
+      return None
+    return entry[2].get(rel_path)
+
+  def Update(self, zip_path, rel_path, sha1):
+    entry = self._entries.get(zip_path)
+    if not entry or entry[:2] != self._GetStamp(zip_path):
+      entry = self._GetStamp(zip_path) + [{}]
+      self._entries[zip_path] = entry
+    entry[2][rel_path] = sha1
+    self._used_zips.add(zip_path)
+    self._updated = True
+
+  def Save(self):
+    """Writes the entries of the .zip files used since the index was loaded."""
+    # Entries of .zip files that are no longer dependencies are dropped.
+    if not self._updated and self._used_zips == set(self._entries):
+      return
+    entries = {
+        k: v
+        for k, v in self._entries.items() if k in self._used_zips
+    }
+    with build_utils.AtomicOutput(self._index_path, mode='w') as f:
+      json.dump(entries, f, sort_keys=True)
 
-  os.remove(png_path)
-  original_dir = os.path.dirname(os.path.dirname(png_path))
-  rename_tuple = (os.path.relpath(png_path, original_dir),
-                  os.path.relpath(webp_path, original_dir))
-  return rename_tuple, cache_hit
 
+def _RecordPngSources(zip_path, dep_subdirs, deps_dir, png_sources):
+  """Records which .zip each extracted .png came from.
 
-def _ConvertToWebP(cwebp_binary, png_paths, path_info, webp_cache_dir):
-  cwebp_version = subprocess.check_output([cwebp_binary, '-version']).rstrip()
-  shard_args = [(f, ) for f in png_paths
-                if not _PNG_WEBP_EXCLUSION_PATTERN.match(f)]
+  Files are identified by inode, which does not change when _PackageApk()
+  renames their directories.
+  """
+  for directory in dep_subdirs:
+    for path in _IterFiles(directory):
+      if path.endswith('.png'):
+        st = os.stat(path)
+        png_sources[(st.st_dev, st.st_ino)] = (zip_path,
+                                               os.path.relpath(path, deps_dir))
 
-  build_utils.MakeDirectory(webp_cache_dir)
-  results = parallel.BulkForkAndCall(_ConvertToWebPSingle,
-                                     shard_args,
+
+def _ConvertToWebPBatch(jobs, cwebp_binary, cwebp_version, webp_cache_dir):
+  """Converts groups of identical .png files to .webp.
+
+  Args:
+    jobs: List of (sha1, png_paths) tuples. Only the first .png of each group
+        is converted (or found in |webp_cache_dir|). The others are hard linked
+        to its output.
+    cwebp_binary: Path to cwebp.
+    cwebp_version: Output of "cwebp -version".
+    webp_cache_dir: Directory of the shared webp cache.
+  Returns:
+    A list of (rename_tuples, cache_hit, png_size, webp_size, cwebp_time) per
+    job, where sizes are totals over the whole group.
+  """
+  cache = content_cache.ContentCache(webp_cache_dir)
+  results = []
+  for sha1, png_paths in jobs:
+    key = content_cache.ComputeKey(strings=[sha1, cwebp_version] +
+                                   _CWEBP_QUALITY_ARGS)
+    # No need to add .webp. Android can load images fine without them.
+    webp_paths = [os.path.splitext(p)[0] for p in png_paths]
+    cwebp_time = 0
+    cache_hit = cache.Get(key, webp_paths[0])
+    if not cache_hit:
+      start_time = time.time()
+      # Converted into the output directory rather than the cache so that
+      # concurrent actions never see a partially written entry.
+      subprocess.check_call(
+          [cwebp_binary, png_paths[0], '-o', webp_paths[0], '-quiet'] +
+          _CWEBP_QUALITY_ARGS)
+      cwebp_time = time.time() - start_time
+      # Eviction is done once by the parent process.
+      cache.Put(key, webp_paths[0], evict=False)
+    for webp_path in webp_paths[1:]:
+      os.link(webp_paths[0], webp_path)
+
+    png_size = os.path.getsize(png_paths[0]) * len(png_paths)
+    webp_size = os.path.getsize(webp_paths[0]) * len(webp_paths)
+    rename_tuples = []
+    for png_path, webp_path in zip(png_paths, webp_paths):
+      os.remove(png_path)
+      original_dir = os.path.dirname(os.path.dirname(png_path))
+      rename_tuples.append((os.path.relpath(png_path, original_dir),
+                            os.path.relpath(webp_path, original_dir)))
+    results.append((rename_tuples, cache_hit, png_size, webp_size, cwebp_time))
+  return results
+
+
+def _ComputePngDigests(png_paths, png_sources, digest_index):
+  """Returns {sha1: [png paths]}, hashing only files not in |digest_index|."""
+  paths_by_sha1 = collections.OrderedDict()
+  num_hashed = 0
+  for png_path in png_paths:
+    st = os.stat(png_path)
+    source = png_sources.get((st.st_dev, st.st_ino))
+    sha1 = source and digest_index.Lookup(*source)
+    if not sha1:
+      sha1 = _ComputeSha1(png_path)
+      num_hashed += 1
+      if source:
+        digest_index.Update(source[0], source[1], sha1)
+    paths_by_sha1.setdefault(sha1, []).append(png_path)
+  logging.debug('png->webp: hashed %d/%d pngs', num_hashed, len(png_paths))
+  return paths_by_sha1
+
+
+def _ConvertToWebP(cwebp_binary, png_paths, png_sources, path_info,
+                   webp_cache_dir, webp_cache_max_size, target_path):
+  start_time = time.time()
+  cwebp_version = subprocess.check_output([cwebp_binary, '-version']).rstrip()
+  png_paths = [
+      f for f in png_paths if not _PNG_WEBP_EXCLUSION_PATTERN.match(f)
+  ]
+  if not png_paths:
+    return
+
+  cache = content_cache.ContentCache(webp_cache_dir,
+                                     max_size=webp_cache_max_size)
+  # Stored in a subdirectory, which is never considered for eviction. Named
+  # after the target's output, so that each target has its own.
+  index_name = hashlib.md5(
+      os.path.abspath(target_path).encode('utf-8')).hexdigest()
+  digest_index = _PngDigestIndex(
+      os.path.join(webp_cache_dir, 'png_sha1s', index_name + '.json'))
+  paths_by_sha1 = _ComputePngDigests(png_paths, png_sources, digest_index)
+  digest_index.Save()
+
+  # Identical images (e.g. the same icon in several targets) are converted
+  # once. Batches are sized so that all cores are kept busy.
+  jobs = list(paths_by_sha1.items())
+  batch_size = max(
+      1,
+      min(_WEBP_MAX_BATCH_SIZE,
+          len(jobs) // (4 * multiprocessing.cpu_count())))
+  batches = [(jobs[i:i + batch_size], )
+             for i in range(0, len(jobs), batch_size)]
+  results = parallel.BulkForkAndCall(_ConvertToWebPBatch,
+                                     batches,
                                      cwebp_binary=cwebp_binary,
                                      cwebp_version=cwebp_version,
                                      webp_cache_dir=webp_cache_dir)
-  total_cache_hits = 0
-  for rename_tuple, cache_hit in results:
-    path_info.RegisterRename(*rename_tuple)
-    total_cache_hits += int(cache_hit)
-
-  logging.debug('png->webp cache: %d/%d', total_cache_hits, len(shard_args))
+  cache_hits = 0
+  total_png_size = 0
+  total_webp_size = 0
+  total_cwebp_time = 0
+  for batch_results in results:
+    for (rename_tuples, cache_hit, png_size, webp_size,
+         cwebp_time) in batch_results:
+      for rename_tuple in rename_tuples:
+        path_info.RegisterRename(*rename_tuple)
+      cache_hits += int(cache_hit)
+      total_png_size += png_size
+      total_webp_size += webp_size
+      total_cwebp_time += cwebp_time
+  cache.MaybeEvict()
+
+  logging.debug(
+      'png->webp: %d pngs (%d unique), cache: %d/%d, '
+      'saved %d KiB (%d KiB -> %d KiB), cwebp: %.1fs, total: %.1fs',
+      len(png_paths), len(jobs), cache_hits, len(jobs),
+      (total_png_size - total_webp_size) // 1024, total_png_size // 1024,
+      total_webp_size // 1024, total_cwebp_time,
+      time.time() - start_time)
 
 
 def _RemoveImageExtensions(directory, path_info):
@@ -603,13 +781,8 @@ def _RemoveImageExtensions(directory, path_info):
             os.path.relpath(path_no_extension, directory))
 
 
-def _CompileSingleDep(index, dep_subdir, keep_predicate, aapt2_path,
-                      partials_dir):
-  unique_name = '{}_{}'.format(index, os.path.basename(dep_subdir))
-  partial_path = os.path.join(partials_dir, '{}.zip'.format(unique_name))
-
+def _RunAapt2Compile(aapt2_path, dep_subdir, partial_path, keep_predicate):
   compile_command = [
-      aapt2_path,
       'compile',
       # TODO(wnwen): Turn this on once aapt2 forces 9-patch to be crunched.
       # '--no-crunch',
@@ -622,7 +795,7 @@ def _CompileSingleDep(index, dep_subdir, keep_predicate, aapt2_path,
   # There are resources targeting API-versions lower than our minapi. For
   # various reasons it's easier to let aapt2 ignore these than for us to
   # remove them from our build (e.g. it's from a 3rd party library).
-  build_utils.CheckOutput(
+  resource_utils.GetAapt2Daemon(aapt2_path).CheckOutput(
       compile_command,
       stderr_filter=lambda output: build_utils.FilterLines(
           output, r'ignoring configuration .* for (styleable|attribute)'))
@@ -632,40 +805,110 @@ def _CompileSingleDep(index, dep_subdir, keep_predicate, aapt2_path,
   if keep_predicate:
     logging.debug('Applying .arsc filtering to %s', dep_subdir)
     protoresources.StripUnwantedResources(partial_path, keep_predicate)
-  return partial_path
 
 
-def _CreateValuesKeepPredicate(exclusion_rules, dep_subdir):
-  patterns = [
+def _ComputePartialCacheKey(dep_subdir, values_filter_patterns, aapt2_version):
+  # Sources are hashed after all of the transformations applied by
+  # _PackageApk() (locale renames, exclusions, webp conversion, ...), so the
+  # key does not need to depend on the flags that control them. Partials embed
+  # the paths of their sources, so entries are only reused by compiles of the
+  # same |dep_subdir|.
+  rel_paths = sorted(
+      os.path.relpath(p, dep_subdir) for p in _IterFiles(dep_subdir))
+  strings = [aapt2_version, os.path.abspath(dep_subdir)]
+  strings.append(str(len(values_filter_patterns)))
+  strings += values_filter_patterns
+  strings += rel_paths
+  return content_cache.ComputeKey(
+      strings=strings,
+      paths=[os.path.join(dep_subdir, p) for p in rel_paths])
+
+
+def _CompileSingleDep(index, dep_subdir, values_filter_patterns, aapt2_path,
+                      aapt2_version, partials_dir, partials_cache_dir,
+                      partials_cache_max_size):
+  """Compiles a dependency's resources into a partial .zip of .flat files.
+
+  Returns:
+    A tuple of (partial path, whether it was found in |partials_cache_dir|).
+  """
+  unique_name = '{}_{}'.format(index, os.path.basename(dep_subdir))
+  partial_path = os.path.join(partials_dir, '{}.zip'.format(unique_name))
+  keep_predicate = _CreateValuesKeepPredicate(values_filter_patterns)
+
+  if not partials_cache_dir:
+    _RunAapt2Compile(aapt2_path, dep_subdir, partial_path, keep_predicate)
+    return partial_path, False
+
+  cache = content_cache.ContentCache(partials_cache_dir,
+                                     max_size=partials_cache_max_size)
+  key = _ComputePartialCacheKey(dep_subdir, values_filter_patterns,
+                                aapt2_version)
+  if cache.Get(key, partial_path):
+    return partial_path, True
+  with cache.Lock(key):
+    # Another action may have compiled the same resources in the meantime.
+    if cache.Get(key, partial_path):
+      return partial_path, True
+    _RunAapt2Compile(aapt2_path, dep_subdir, partial_path, keep_predicate)
+    cache.Put(key, partial_path)
+  return partial_path, False
+
+
+def _GetValuesFilterPatterns(exclusion_rules, dep_subdir):
+  return [
       x[1] for x in exclusion_rules
       if build_utils.MatchesGlob(dep_subdir, [x[0]])
   ]
+
+
+def _CreateValuesKeepPredicate(patterns):
   if not patterns:
     return None
 
-  regexes = [re.compile(p) for p in patterns]
-  return lambda x: not any(r.search(x) for r in regexes)
+  # A single regex is much faster than a list of them when applied to every
+  # resource.
+  regex = re.compile('|'.join('(?:{})'.format(p) for p in patterns))
+  return lambda x: not regex.search(x)
 
 
 def _CompileDeps(aapt2_path, dep_subdirs, dep_subdir_overlay_set, temp_dir,
-                 exclusion_rules):
+                 exclusion_rules, partials_cache_dir, partials_cache_max_size):
   partials_dir = os.path.join(temp_dir, 'partials')
   build_utils.MakeDirectory(partials_dir)
 
   job_params = [(i, dep_subdir,
-                 _CreateValuesKeepPredicate(exclusion_rules, dep_subdir))
+                 _GetValuesFilterPatterns(exclusion_rules, dep_subdir))
                 for i, dep_subdir in enumerate(dep_subdirs)]
 
-  # Filtering is slow, so ensure jobs with keep_predicate are started first.
+  cache = None
+  aapt2_version = None
+  if partials_cache_dir:
+    cache = content_cache.ContentCache(partials_cache_dir,
+                                       max_size=partials_cache_max_size)
+    # "aapt2 version" writes to stderr.
+    aapt2_version = resource_utils.GetAapt2Daemon(aapt2_path).Run(
+        ['version'])[2].strip()
+
+  # Filtering is slow, so ensure jobs with filters are started first.
   job_params.sort(key=lambda x: not x[2])
-  partials = list(
+  results = list(
       parallel.BulkForkAndCall(_CompileSingleDep,
                                job_params,
                                aapt2_path=aapt2_path,
-                               partials_dir=partials_dir))
+                               aapt2_version=aapt2_version,
+                               partials_dir=partials_dir,
+                               partials_cache_dir=partials_cache_dir,
+                               partials_cache_max_size=partials_cache_max_size))
+
+  if cache:
+    # Lookups happen in the forked jobs, so tally their results here.
+    cache.hits = sum(1 for _, cache_hit in results if cache_hit)
+    cache.misses = len(results) - cache.hits
+    logging.debug('aapt2 compile cache: %s', cache.DescribeStats())
 
   partials_cmd = list()
-  for i, partial in enumerate(partials):
+  for i, (partial, _) in enumerate(results):
     dep_subdir = job_params[i][1]
     if dep_subdir in dep_subdir_overlay_set:
       partials_cmd += ['-R']
@@ -768,10 +1011,14 @@ def _PackageApk(options, build):
   logging.debug('Extracting resource .zips')
   dep_subdirs = []
   dep_subdir_overlay_set = set()
+  png_sources = {}
   for dependency_res_zip in options.dependencies_res_zips:
     extracted_dep_subdirs = resource_utils.ExtractDeps([dependency_res_zip],
                                                        build.deps_dir)
     dep_subdirs += extracted_dep_subdirs
+    if options.png_to_webp:
+      _RecordPngSources(dependency_res_zip, extracted_dep_subdirs,
+                        build.deps_dir, png_sources)
     if dependency_res_zip in options.dependencies_res_zip_overlays:
       dep_subdir_overlay_set.update(extracted_dep_subdirs)
 
@@ -792,8 +1039,10 @@ def _PackageApk(options, build):
 
   if png_paths and options.png_to_webp:
     logging.debug('Converting png->webp')
-    _ConvertToWebP(options.webp_binary, png_paths, path_info,
-                   options.webp_cache_dir)
+    _ConvertToWebP(options.webp_binary, png_paths, png_sources, path_info,
+                   options.webp_cache_dir,
+                   options.webp_cache_max_size_mb * 1024 * 1024,
+                   options.arsc_path or options.proto_path)
   logging.debug('Applying drawable transformations')
   for directory in dep_subdirs:
     _MoveImagesToNonMdpiFolders(directory, path_info)
@@ -803,10 +1052,10 @@ def _PackageApk(options, build):
   exclusion_rules = [x.split(':', 1) for x in options.values_filter_rules]
   partials = _CompileDeps(options.aapt2_path, dep_subdirs,
                           dep_subdir_overlay_set, build.temp_dir,
-                          exclusion_rules)
+                          exclusion_rules, options.partials_cache_dir,
+                          options.partials_cache_max_size_mb * 1024 * 1024)
 
   link_command = [
-      options.aapt2_path,
       'link',
       '--auto-add-overlay',
       '--no-version-vectors',
@@ -877,17 +1126,16 @@ def _PackageApk(options, build):
   link_command += ['-o', build.arsc_path]
 
   logging.debug('Starting: aapt2 link')
-  link_proc = subprocess.Popen(link_command)
+  aapt2 = resource_utils.GetAapt2Daemon(options.aapt2_path)
+  aapt2.Send(link_command)
 
   # Create .res.info file in parallel.
   _CreateResourceInfoFile(path_info, build.info_path,
                           options.dependencies_res_zips)
   logging.debug('Created .res.info file')
 
-  exit_code = link_proc.wait()
+  aapt2.Wait(print_stdout=True, fail_on_output=False)
   logging.debug('Finished: aapt2 link')
-  if exit_code:
-    raise subprocess.CalledProcessError(exit_code, link_command)
 
   if options.proguard_file and (options.shared_resources
                                 or options.app_as_shared_lib):
@@ -903,9 +1151,9 @@ def _PackageApk(options, build):
       proguard_file.write(textwrap.dedent(keep_rule))
 
   logging.debug('Running aapt2 convert')
-  build_utils.CheckOutput([
-      options.aapt2_path, 'convert', '--output-format', 'proto', '-o',
-      build.proto_path, build.arsc_path
+  aapt2.CheckOutput([
+      'convert', '--output-format', 'proto', '-o', build.proto_path,
+      build.arsc_path
   ])
 
   # Workaround for b/147674078. This is only needed for WebLayer and does not
@@ -916,9 +1164,9 @@ def _PackageApk(options, build):
         build.proto_path, options.is_bundle_module,
         options.shared_resources_allowlist)
 
-    build_utils.CheckOutput([
-        options.aapt2_path, 'convert', '--output-format', 'binary', '-o',
-        build.arsc_path, build.proto_path
+    aapt2.CheckOutput([
+        'convert', '--output-format', 'binary', '-o', build.arsc_path,
+        build.proto_path
     ])
 
   if build.arsc_path is None:
@@ -953,7 +1201,6 @@ def _OptimizeApk(output, options, temp_dir, unoptimized_path, r_txt_path):
     r_txt_path: path to the R.txt file of the unoptimized apk.
   """
   optimize_command = [
-      options.aapt2_path,
       'optimize',
       unoptimized_path,
       '-o',
@@ -985,7 +1232,7 @@ def _OptimizeApk(output, options, temp_dir, unoptimized_path, r_txt_path):
     ]
 
   logging.debug('Running aapt2 optimize')
-  build_utils.CheckOutput(
+  resource_utils.GetAapt2Daemon(options.aapt2_path).CheckOutput(
       optimize_command, print_stdout=False, print_stderr=False)
 
 
@@ -1207,6 +1454,7 @@ def main(args):
       options.version_code,
       options.version_name,
       options.webp_cache_dir,
+      options.partials_cache_dir,
   ]
   output_paths = [options.srcjar_out]
   possible_output_paths = [
@@ -14,6 +14,10 @@ import tempfile
 import zipfile
 
 from util import build_utils
+from util import content_cache
+from util import jar_index
+from util import java_abi
+from util import jvm_workers
 from util import md5_check
 from util import zipalign
 
@@ -59,6 +63,15 @@ def _ParseArgs(args):
   parser.add_argument(
       '--incremental-dir',
       help='Path of directory to put intermediate dex files.')
+  parser.add_argument(
+      '--cache-dir',
+      help='Path of directory to cache intermediate dex files in. Shared '
+      'between targets.')
+  parser.add_argument('--cache-max-size-mb',
+                      type=int,
+                      default=4096,
+                      help='Size above which least-recently-used entries are '
+                      'evicted from --cache-dir.')
   parser.add_argument(
       '--main-dex-list-path',
       help='File containing a list of the classes to include in the main dex.')
@@ -189,7 +202,7 @@ def _RunD8(dex_cmd, input_paths, output_path, warnings_as_errors,
 
     # stdout sometimes spams with things like:
     # Stripped invalid locals information from 1 method.
-    build_utils.CheckOutput(dex_cmd,
+    jvm_workers.CheckOutput(dex_cmd,
                             stderr_filter=stderr_filter,
                             fail_on_output=warnings_as_errors)
 
@@ -312,7 +325,8 @@ def _ZipMultidex(file_dir, dex_files):
   zip_name = os.path.join(file_dir, 'multidex_classes.zip')
   build_utils.DoZip(((archive_name, os.path.join(file_dir, file_name))
                      for archive_name, file_name in ordered_files),
-                    zip_name)
+                    zip_name,
+                    jobs=build_utils.DefaultZipJobs())
   return zip_name
 
 
@@ -324,9 +338,10 @@ def _ZipAligned(dex_files, output_path):
     output_path: The output file in which to write the zip.
   """
   with zipfile.ZipFile(output_path, 'w') as z:
-    for i, dex_file in enumerate(dex_files):
-      name = 'classes{}.dex'.format(i + 1 if i > 0 else '')
-      zipalign.AddToZipHermetic(z, name, src_path=dex_file, alignment=4)
+    zipalign.AddFilesToZipHermetic(
+        z, [('classes{}.dex'.format(i + 1 if i > 0 else ''), dex_file, None, 4)
+            for i, dex_file in enumerate(dex_files)],
+        jobs=build_utils.DefaultZipJobs())
 
 
 def _PerformDexlayout(tmp_dir, tmp_dex_output, options):
@@ -417,6 +432,59 @@ def _DeleteStaleIncrementalDexFiles(dex_dir, dex_files):
       os.unlink(path)
 
 
+def _StripClasspathArgs(dex_cmd, paths):
+  """Returns |dex_cmd| without the --lib and --classpath args for |paths|."""
+  paths = set(paths)
+  ret = []
+  skip_next = False
+  for i, arg in enumerate(dex_cmd):
+    if skip_next:
+      skip_next = False
+    elif (arg in ('--lib', '--classpath') and i + 1 < len(dex_cmd)
+          and dex_cmd[i + 1] in paths):
+      skip_next = True
+    else:
+      ret.append(arg)
+  return ret
+
+
+def _ComputeCacheKeys(options, dex_cmd, class_inputs):
+  """Returns a dict of class jar -> cache key for its intermediate dex files.
+
+  Keys cover the contents of the jar and the ABI of the classes it depends on,
+  rather than the classpath of the target, so that targets with different
+  classpaths share entries. Jars that cannot be keyed are left out.
+  """
+  classpath = []
+  if options.desugar:
+    # Desugaring looks at the supertypes of classes, from the classpath and
+    # from the other inputs.
+    if options.classpath:
+      classpath += options.bootclasspath + options.classpath
+    classpath += options.class_inputs
+  # The command line contains all flags, but not the contents of the files it
+  # references.
+  key_paths = [options.r8_jar_path]
+  if options.desugar_jdk_libs_json:
+    key_paths.append(options.desugar_jdk_libs_json)
+  flags_key = content_cache.ComputeKey(
+      strings=_StripClasspathArgs(dex_cmd, classpath), paths=key_paths)
+
+  index = jar_index.JarIndex(os.path.join(options.cache_dir, 'jar-index'))
+  ret = {}
+  for jar in class_inputs:
+    deps_key = ''
+    if classpath:
+      try:
+        deps_key = index.ComputeDepsKey(jar, classpath)
+      except java_abi.ClassFormatError as e:
+        logging.warning('Not caching %s: %s', jar, e)
+        continue
+    ret[jar] = content_cache.ComputeKey(strings=[flags_key, deps_key],
+                                        paths=[jar])
+  return ret
+
+
 def _ExtractClassFiles(changes, tmp_dir, class_inputs):
   classes_list = []
   for jar in class_inputs:
@@ -431,38 +499,88 @@ def _ExtractClassFiles(changes, tmp_dir, class_inputs):
   return classes_list
 
 
-def _CreateIntermediateDexFiles(changes, options, tmp_dir, dex_cmd):
+def _CreateIntermediateDexFiles(changes,
+                                options,
+                                tmp_dir,
+                                dex_cmd,
+                                dex_dir,
+                                cache=None,
+                                extract_cache_hits=True):
+  """Dexes class files from |options.class_inputs| into |dex_dir|.
+
+  Returns:
+    A dict of class jar -> path of a zip of its intermediate dex files, for
+    jars that were found in |cache| but not extracted into |dex_dir|.
+  """
   # Create temporary directory for classes to be extracted to.
   tmp_extract_dir = os.path.join(tmp_dir, 'tmp_extract_dir')
   os.mkdir(tmp_extract_dir)
 
   # Do a full rebuild when changes are to classpath or other non-input files.
-  allowed_changed = set(options.class_inputs)
-  allowed_changed.update(options.dex_inputs)
-  strings_changed = changes.HasStringChanges()
-  non_direct_input_changed = next(
-      (p for p in changes.IterChangedPaths() if p not in allowed_changed), None)
-
-  if strings_changed or non_direct_input_changed:
-    logging.debug('Full dex required: strings_changed=%s path_changed=%s',
-                  strings_changed, non_direct_input_changed)
-    changes = None
-  class_files = _ExtractClassFiles(changes, tmp_extract_dir,
-                                   options.class_inputs)
+  if changes:
+    allowed_changed = set(options.class_inputs)
+    allowed_changed.update(options.dex_inputs)
+    strings_changed = changes.HasStringChanges()
+    non_direct_input_changed = next(
+        (p for p in changes.IterChangedPaths() if p not in allowed_changed),
+        None)
+
+    if strings_changed or non_direct_input_changed:
+      logging.debug('Full dex required: strings_changed=%s path_changed=%s',
+                    strings_changed, non_direct_input_changed)
+      changes = None
+
+  dex_cmd = dex_cmd + ['--intermediate', '--file-per-class-file']
+  class_inputs = options.class_inputs
+  cached_zips = {}
+  cache_misses = []
+  if cache:
+    if changes:
+      changed_paths = set(changes.IterChangedPaths())
+      class_inputs = [p for p in class_inputs if p in changed_paths]
+    cache_keys = _ComputeCacheKeys(options, dex_cmd, class_inputs)
+    for i, jar in enumerate(class_inputs):
+      cached_zip = os.path.join(tmp_dir, 'cached%d.zip' % i)
+      if jar not in cache_keys or not cache.Get(cache_keys[jar], cached_zip):
+        cache_misses.append(jar)
+      elif extract_cache_hits:
+        build_utils.ExtractAll(cached_zip, path=dex_dir, no_clobber=False)
+      else:
+        cached_zips[jar] = cached_zip
+    logging.debug('Dex cache: %s', cache.DescribeStats())
+    class_inputs = cache_misses
+
+  class_files = _ExtractClassFiles(changes, tmp_extract_dir, class_inputs)
   logging.debug('Extracted class files: %d', len(class_files))
 
   # If the only change is deleting a file, class_files will be empty.
   if class_files:
     # Dex necessary classes into intermediate dex files.
-    dex_cmd = dex_cmd + ['--intermediate', '--file-per-class-file']
-    _RunD8(dex_cmd, class_files, options.incremental_dir,
-           options.warnings_as_errors,
+    _RunD8(dex_cmd, class_files, dex_dir, options.warnings_as_errors,
            options.show_desugar_default_interface_warnings)
     logging.debug('Dexed class files.')
 
+  for jar in cache_misses:
+    if jar not in cache_keys:
+      continue
+    dex_files = _IntermediateDexFilePathsFromInputJars([jar], dex_dir)
+    tmp_zip = os.path.join(tmp_dir, 'to_cache.zip')
+    build_utils.DoZip(dex_files,
+                      tmp_zip,
+                      base_dir=dex_dir,
+                      jobs=build_utils.DefaultZipJobs())
+    cache.Put(cache_keys[jar], tmp_zip)
+    os.unlink(tmp_zip)
+
+  return cached_zips
+
 
 def _OnStaleMd5(changes, options, final_dex_inputs, dex_cmd):
   logging.debug('_OnStaleMd5')
+  cache = None
+  if options.cache_dir:
+    cache = content_cache.ContentCache(
+        options.cache_dir, max_size=options.cache_max_size_mb * 1024 * 1024)
   with build_utils.TempDir() as tmp_dir:
     if options.incremental_dir:
       # Create directory for all intermediate dex files.
@@ -471,7 +589,32 @@ def _OnStaleMd5(changes, options, final_dex_inputs, dex_cmd):
 
       _DeleteStaleIncrementalDexFiles(options.incremental_dir, final_dex_inputs)
       logging.debug('Stale files deleted')
-      _CreateIntermediateDexFiles(changes, options, tmp_dir, dex_cmd)
+      _CreateIntermediateDexFiles(changes,
+                                  options,
+                                  tmp_dir,
+                                  dex_cmd,
+                                  options.incremental_dir,
+                                  cache=cache)
+    elif cache and options.class_inputs:
+      # Dex class jars that are not cached, and merge the rest straight from
+      # the cache.
+      tmp_dex_dir = os.path.join(tmp_dir, 'tmp_intermediate_dex_dir')
+      os.mkdir(tmp_dex_dir)
+      cached_zips = _CreateIntermediateDexFiles(None,
+                                                options,
+                                                tmp_dir,
+                                                dex_cmd,
+                                                tmp_dex_dir,
+                                                cache=cache,
+                                                extract_cache_hits=False)
+      final_dex_inputs = []
+      for jar in options.class_inputs:
+        if jar in cached_zips:
+          final_dex_inputs.append(cached_zips[jar])
+        else:
+          final_dex_inputs += _IntermediateDexFilePathsFromInputJars(
+              [jar], tmp_dex_dir)
+      final_dex_inputs += options.dex_inputs
 
     _CreateFinalDex(
         final_dex_inputs, options.output, tmp_dir, dex_cmd, options=options)
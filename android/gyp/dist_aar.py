@@ -120,8 +120,10 @@ def main(args):
         path_transform = filter_zip.CreatePathTransform(
             options.jar_excluded_globs, options.jar_included_globs, [])
         with tempfile.NamedTemporaryFile() as jar_file:
-          build_utils.MergeZips(
-              jar_file.name, options.jars, path_transform=path_transform)
+          build_utils.MergeZips(jar_file.name,
+                                options.jars,
+                                path_transform=path_transform,
+                                jobs=build_utils.DefaultZipJobs())
           build_utils.AddToZipHermetic(z, 'classes.jar', src_path=jar_file.name)
 
         build_utils.AddToZipHermetic(
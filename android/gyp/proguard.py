@@ -19,6 +19,7 @@ import dex_jdk_libs
 from pylib.dex import dex_parser
 from util import build_utils
 from util import diff_utils
+from util import jvm_workers
 
 _API_LEVEL_VERSION_CODE = [
     (21, 'L'),
@@ -321,7 +322,7 @@ def _OptimizeWithR8(options,
       stderr_filter = dex.CreateStderrFilter(
           options.show_desugar_default_interface_warnings)
       logging.debug('Running R8')
-      build_utils.CheckOutput(cmd,
+      jvm_workers.CheckOutput(cmd,
                               print_stdout=print_stdout,
                               stderr_filter=stderr_filter,
                               fail_on_output=options.warnings_as_errors)
@@ -458,7 +459,7 @@ out/Release/apks/YourApk.apk > dex.txt
     return stderr
 
   logging.debug('cmd: %s', ' '.join(cmd))
-  build_utils.CheckOutput(cmd,
+  jvm_workers.CheckOutput(cmd,
                           print_stdout=True,
                           stderr_filter=stderr_filter,
                           fail_on_output=warnings_as_errors)
@@ -500,7 +501,7 @@ def _SplitChildFeatures(options, feature_contexts, base_dex_context, tmp_dir,
     for file_name in os.listdir(parent_dir):
       split_cmd += ['--input', os.path.join(parent_dir, file_name)]
     logging.debug('Running R8 DexSplitter')
-    build_utils.CheckOutput(split_cmd,
+    jvm_workers.CheckOutput(split_cmd,
                             print_stdout=print_stdout,
                             fail_on_output=options.warnings_as_errors)
 
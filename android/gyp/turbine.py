@@ -12,6 +12,7 @@ import sys
 import time
 
 from util import build_utils
+from util import jvm_workers
 from util import md5_check
 
 
@@ -46,7 +47,7 @@ def _OnStaleMd5(options, cmd, javac_cmd, files, classpath):
     cmd += ['--output', output_jar.name, '--gensrc_output', generated_jar.name]
     logging.debug('Command: %s', cmd)
     start = time.time()
-    build_utils.CheckOutput(cmd,
+    jvm_workers.CheckOutput(cmd,
                             print_stdout=True,
                             fail_on_output=options.warnings_as_errors)
     end = time.time() - start
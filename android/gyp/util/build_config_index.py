@@ -0,0 +1,132 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A binary sidecar of a .build_config that holds its dependency graph.
+
+write_build_config.py runs once per target, and each run used to parse the
+.build_config of every transitive dependency just to find out what they are.
+Each run now also writes "<build_config>.bin", which lists the target and all
+of its transitive deps (in dependency order) along with their types and
+direct deps, so that dependents can load the graph below their direct deps
+without parsing any .build_config.
+
+Sidecar layout (all integers are little-endian):
+  Header: magic, .build_config size, .build_config mtime, the number of
+      nodes, then the offsets of the tables below.
+  Node table: (path, type, first edge, number of edges) records. Strings are
+      string table offsets.
+  Edge table: Indices into the node table of the direct deps of each node.
+  String table: (u32 length, utf-8 bytes) entries. Each distinct string is
+      stored once.
+"""
+
+import os
+import struct
+import sys
+
+from util import build_utils
+
+_MAGIC = b'CRBCIX02'
+_HEADER_FORMAT = '<8sQQIIII'
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+if sys.version_info[0] == 2:
+  _ToBytes = lambda s: s.encode('utf-8') if isinstance(s, unicode) else s
+else:
+  _ToBytes = lambda s: s if isinstance(s, bytes) else s.encode('utf-8')
+
+
+def _GetMtimeNs(st):
+  return getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1e9)
+
+
+def GetIndexPath(build_config_path):
+  return build_config_path + '.bin'
+
+
+def WriteIndex(build_config_path, nodes):
+  """Writes the sidecar of |build_config_path|, which must already exist.
+
+  Args:
+    build_config_path: Path to the .build_config.
+    nodes: List of (.build_config path, type, direct dep paths) of the target
+        and all of its transitive deps, in the order returned by
+        build_utils.GetSortedTransitiveDependencies().
+  """
+  strings = bytearray()
+  string_offsets = {}
+
+  def intern(s):
+    s = _ToBytes(s)
+    offset = string_offsets.get(s)
+    if offset is None:
+      offset = len(strings)
+      strings.extend(struct.pack('<I', len(s)))
+      strings.extend(s)
+      string_offsets[s] = offset
+    return offset
+
+  index_by_path = {n[0]: i for i, n in enumerate(nodes)}
+  node_table = []
+  edge_table = []
+  for path, node_type, dep_paths in nodes:
+    node_table.extend((intern(path), intern(node_type), len(edge_table),
+                       len(dep_paths)))
+    edge_table.extend(index_by_path[p] for p in dep_paths)
+
+  st = os.stat(build_config_path)
+  nodes_offset = _HEADER_SIZE
+  edges_offset = nodes_offset + 4 * len(node_table)
+  strings_offset = edges_offset + 4 * len(edge_table)
+  with build_utils.AtomicOutput(GetIndexPath(build_config_path)) as f:
+    f.write(
+        struct.pack(_HEADER_FORMAT, _MAGIC, st.st_size, _GetMtimeNs(st),
+                    len(nodes), nodes_offset, edges_offset, strings_offset))
+    f.write(struct.pack('<%dI' % len(node_table), *node_table))
+    f.write(struct.pack('<%dI' % len(edge_table), *edge_table))
+    f.write(strings)
+
+
+def ReadIndex(build_config_path):
+  """Returns the nodes passed to WriteIndex() for |build_config_path|.
+
+  Returns None when the sidecar does not exist or does not match the
+  .build_config (e.g. when the .build_config was written by an older version
+  of write_build_config.py).
+  """
+  try:
+    with open(GetIndexPath(build_config_path), 'rb') as f:
+      data = f.read()
+  except IOError:
+    return None
+  if len(data) < _HEADER_SIZE:
+    return None
+  (magic, size, mtime_ns, num_nodes, nodes_offset, edges_offset,
+   strings_offset) = struct.unpack_from(_HEADER_FORMAT, data)
+  st = os.stat(build_config_path)
+  if (magic != _MAGIC or size != st.st_size
+      or mtime_ns != _GetMtimeNs(st)):
+    return None
+
+  strings = {}
+
+  def get_string(offset):
+    ret = strings.get(offset)
+    if ret is None:
+      start = strings_offset + offset
+      length, = struct.unpack_from('<I', data, start)
+      ret = data[start + 4:start + 4 + length].decode('utf-8')
+      strings[offset] = ret
+    return ret
+
+  fields = struct.unpack_from('<%dI' % (4 * num_nodes), data, nodes_offset)
+  edges = struct.unpack_from('<%dI' % ((strings_offset - edges_offset) // 4),
+                             data, edges_offset)
+  paths = [get_string(fields[i]) for i in range(0, len(fields), 4)]
+  ret = []
+  for i, path in enumerate(paths):
+    node_type, first_edge, num_edges = fields[4 * i + 1:4 * i + 4]
+    dep_paths = [paths[e] for e in edges[first_edge:first_edge + num_edges]]
+    ret.append((path, get_string(node_type), dep_paths))
+  return ret
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_config_index
+
+_TEST_NODES = [
+    ('gen/base/base_java.build_config', 'java_library', []),
+    ('gen/ui/ui_java_resources.build_config', 'android_resources', []),
+    ('gen/ui/ui_java.build_config', 'java_library', [
+        'gen/base/base_java.build_config',
+        'gen/ui/ui_java_resources.build_config'
+    ]),
+    ('foo.build_config', 'android_apk', ['gen/ui/ui_java.build_config']),
+]
+
+
+class BuildConfigIndexTest(unittest.TestCase):
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp()
+    self._build_config = os.path.join(self._tmp_dir, 'foo.build_config')
+    with open(self._build_config, 'w') as f:
+      f.write('{"deps_info": {}}')
+
+  def tearDown(self):
+    shutil.rmtree(self._tmp_dir)
+
+  def testRoundTrip(self):
+    build_config_index.WriteIndex(self._build_config, _TEST_NODES)
+    self.assertEqual(_TEST_NODES,
+                     build_config_index.ReadIndex(self._build_config))
+
+  def testNoDeps(self):
+    nodes = [('foo.build_config', 'group', [])]
+    build_config_index.WriteIndex(self._build_config, nodes)
+    self.assertEqual(nodes, build_config_index.ReadIndex(self._build_config))
+
+  def testMissing(self):
+    self.assertIsNone(build_config_index.ReadIndex(self._build_config))
+
+  def testStale(self):
+    build_config_index.WriteIndex(self._build_config, _TEST_NODES)
+    with open(self._build_config, 'w') as f:
+      f.write('{"deps_info": {"deps_configs": []}}')
+    self.assertIsNone(build_config_index.ReadIndex(self._build_config))
+
+
+if __name__ == '__main__':
+  unittest.main()
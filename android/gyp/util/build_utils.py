@@ -9,17 +9,22 @@ import collections
 import contextlib
 import filecmp
 import fnmatch
+import functools
 import json
 import logging
+import multiprocessing
 import os
 import pipes
 import re
 import shutil
 import stat
+import struct
 import subprocess
 import sys
 import tempfile
 import zipfile
+import zlib
+from multiprocessing.pool import ThreadPool
 
 sys.path.append(os.path.join(os.path.dirname(__file__),
                              os.pardir, os.pardir, os.pardir))
@@ -238,9 +243,19 @@ def FilterReflectiveAccessJavaWarnings(output):
       'All illegal access operations)')
 
 
+def _RunProcess(args, cwd, env):
+  child = subprocess.Popen(args,
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, env=env)
+  stdout, stderr = child.communicate()
+  return child.returncode, stdout, stderr
+
+
 # This can be used in most cases like subprocess.check_output(). The output,
 # particularly when the command fails, better highlights the command's failure.
 # If the command fails, raises a build_utils.CalledProcessError.
+#
+# |run_func| runs the command. It takes (args, cwd, env) and returns
+# (returncode, stdout, stderr). By default, |args| is run as a subprocess.
 def CheckOutput(args,
                 cwd=None,
                 env=None,
@@ -249,13 +264,12 @@ def CheckOutput(args,
                 stdout_filter=None,
                 stderr_filter=None,
                 fail_on_output=True,
-                fail_func=lambda returncode, stderr: returncode != 0):
+                fail_func=lambda returncode, stderr: returncode != 0,
+                run_func=_RunProcess):
   if not cwd:
     cwd = os.getcwd()
 
-  child = subprocess.Popen(args,
-      stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, env=env)
-  stdout, stderr = child.communicate()
+  returncode, stdout, stderr = run_func(args, cwd, env)
 
   # For Python3 only:
   if isinstance(stdout, bytes) and sys.version_info >= (3, ):
@@ -268,7 +282,7 @@ def CheckOutput(args,
   if stderr_filter is not None:
     stderr = stderr_filter(stderr)
 
-  if fail_func and fail_func(child.returncode, stderr):
+  if fail_func and fail_func(returncode, stderr):
     raise CalledProcessError(cwd, args, stdout + stderr)
 
   if print_stdout:
@@ -374,6 +388,146 @@ def HermeticZipInfo(*args, **kwargs):
   return ret
 
 
+# Size of the fixed-length portion of a zip local file header.
+_ZIP_LOCAL_HEADER_FORMAT = '<4s2B4HL2L2H'
+_ZIP_LOCAL_HEADER_SIZE = struct.calcsize(_ZIP_LOCAL_HEADER_FORMAT)
+_ZIP_LOCAL_HEADER_SIGNATURE = b'PK\003\004'
+
+
+def _ResolveCompressType(zip_file, compress):
+  # None converts to ZIP_STORED, when passed explicitly rather than the
+  # default passed to the ZipFile constructor.
+  if compress is None:
+    return zip_file.compression
+  return zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+
+
+def _PrepareHermeticEntry(zipinfo, compress_type, src_path=None, data=None):
+  """Reads and compresses an entry the same way AddToZipHermetic() would.
+
+  Does not touch any ZipFile, so it is safe to call from worker threads.
+
+  Returns:
+    A (zipinfo, raw_data) tuple for _WriteRawZipEntry().
+  """
+  if src_path and os.path.islink(src_path):
+    zipinfo.external_attr |= stat.S_IFLNK << 16  # mark as a symlink
+    data = os.readlink(src_path)
+    if not isinstance(data, bytes):
+      data = data.encode('utf-8')
+  else:
+    if src_path:
+      st = os.stat(src_path)
+      for mode in (stat.S_IXUSR, stat.S_IXGRP, stat.S_IXOTH):
+        if st.st_mode & mode:
+          zipinfo.external_attr |= mode << 16
+      with open(src_path, 'rb') as f:
+        data = f.read()
+    elif not isinstance(data, bytes):
+      data = data.encode('utf-8')
+    # See AddToZipHermetic().
+    if len(data) < 16:
+      compress_type = zipfile.ZIP_STORED
+
+  zipinfo.compress_type = compress_type
+  zipinfo.file_size = len(data)
+  zipinfo.CRC = zlib.crc32(data) & 0xffffffff
+  if compress_type == zipfile.ZIP_DEFLATED:
+    # Same settings as zipfile uses, so output is identical to writestr().
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  -15)
+    data = compressor.compress(data) + compressor.flush()
+  zipinfo.compress_size = len(data)
+  return zipinfo, data
+
+
+def _CanCopyRawZipEntry(info, compress_type):
+  """Returns whether an entry's compressed bytes can be copied verbatim."""
+  return (info.compress_type == compress_type
+          and info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+          # Encrypted.
+          and not info.flag_bits & 0x1
+          # AddToZipHermetic() would store these uncompressed.
+          and info.file_size >= 16
+          and info.file_size < zipfile.ZIP64_LIMIT
+          and info.compress_size < zipfile.ZIP64_LIMIT)
+
+
+def _ReadRawZipEntry(zip_file, info):
+  """Returns the still-compressed data of |info| from |zip_file|."""
+  zip_file.fp.seek(info.header_offset)
+  header = struct.unpack(_ZIP_LOCAL_HEADER_FORMAT,
+                         zip_file.fp.read(_ZIP_LOCAL_HEADER_SIZE))
+  if header[0] != _ZIP_LOCAL_HEADER_SIGNATURE:
+    raise Exception('Bad local file header for %s' % info.filename)
+  name_len, extra_len = header[10], header[11]
+  zip_file.fp.seek(name_len + extra_len, os.SEEK_CUR)
+  return zip_file.fp.read(info.compress_size)
+
+
+def _WriteRawZipEntry(zip_file, zipinfo, raw_data, before_write=None):
+  """Appends an entry whose CRC, sizes and compressed data are already known."""
+  _CheckZipPath(zipinfo.filename)
+  fp = zip_file.fp
+  # Python 3 tracks where the central directory is to be written.
+  if hasattr(zip_file, 'start_dir'):
+    fp.seek(zip_file.start_dir)
+  if before_write:
+    before_write(zip_file, zipinfo)
+  zipinfo.header_offset = fp.tell()
+  fp.write(zipinfo.FileHeader())
+  fp.write(raw_data)
+  if hasattr(zip_file, 'start_dir'):
+    zip_file.start_dir = fp.tell()
+  zip_file.filelist.append(zipinfo)
+  zip_file.NameToInfo[zipinfo.filename] = zipinfo
+  zip_file._didModify = True  # pylint: disable=protected-access
+
+
+def _WriteZipEntries(zip_file, entries, jobs, before_write=None):
+  """Writes entries to |zip_file| in order, compressing them on |jobs| threads.
+
+  Only a bounded number of entries are held in memory at once.
+
+  Args:
+    zip_file: ZipFile instance to add entries to.
+    entries: Iterable of (zipinfo, raw_data) tuples, or of functions that return
+        them. Functions are run on a thread pool when |jobs| > 1.
+    jobs: Number of worker threads.
+    before_write: Optional function called with |zip_file| and the ZipInfo of
+        each entry just before the entry is written.
+  """
+  if jobs <= 1:
+    for entry in entries:
+      zipinfo, raw_data = entry() if callable(entry) else entry
+      _WriteRawZipEntry(zip_file, zipinfo, raw_data, before_write)
+    return
+
+  # zlib and file I/O release the GIL, so threads suffice.
+  pool = ThreadPool(jobs)
+  pending = collections.deque()
+
+  def write_next():
+    entry = pending.popleft()
+    zipinfo, raw_data = entry.get() if entry else pending.popleft()
+    _WriteRawZipEntry(zip_file, zipinfo, raw_data, before_write)
+
+  try:
+    for entry in entries:
+      if callable(entry):
+        pending.append(pool.apply_async(entry))
+      else:
+        # A None marker keeps ready entries ordered relative to async ones.
+        pending.extend((None, entry))
+      while len(pending) > jobs * 4:
+        write_next()
+    while pending:
+      write_next()
+  finally:
+    pool.terminate()
+    pool.join()
+
+
 def AddToZipHermetic(zip_file,
                      zip_path,
                      src_path=None,
@@ -424,16 +578,43 @@ def AddToZipHermetic(zip_file,
   if len(data) < 16:
     compress = False
 
-  # None converts to ZIP_STORED, when passed explicitly rather than the
-  # default passed to the ZipFile constructor.
-  compress_type = zip_file.compression
-  if compress is not None:
-    compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+  compress_type = _ResolveCompressType(zip_file, compress)
   zip_file.writestr(zipinfo, data, compress_type)
 
 
+def AddFilesToZipHermetic(zip_file, entries, jobs=1, before_write=None):
+  """Adds files to |zip_file| as AddToZipHermetic() would, on |jobs| threads.
+
+  Args:
+    zip_file: ZipFile instance to add the files to.
+    entries: Iterable of (zip_path, src_path, compress) tuples. Files are
+        added in this order.
+    jobs: Number of threads to read and compress files on. Output is identical
+        regardless of this value.
+    before_write: Optional function called with |zip_file| and the ZipInfo of
+        each entry just before the entry is written, e.g. to align it.
+  """
+
+  def iter_entries():
+    for zip_path, src_path, compress in entries:
+      if os.path.islink(src_path):
+        # Symlinks ignore |compress|. See AddToZipHermetic().
+        compress = None
+      yield functools.partial(_PrepareHermeticEntry,
+                              HermeticZipInfo(filename=zip_path),
+                              _ResolveCompressType(zip_file, compress),
+                              src_path=src_path)
+
+  _WriteZipEntries(zip_file, iter_entries(), jobs, before_write)
+
+
+def DefaultZipJobs():
+  """Returns the number of threads that build steps compress zips on."""
+  return multiprocessing.cpu_count()
+
+
 def DoZip(inputs, output, base_dir=None, compress_fn=None,
-          zip_prefix_path=None):
+          zip_prefix_path=None, jobs=1):
   """Creates a zip file from a list of files.
 
   Args:
@@ -443,6 +624,8 @@ def DoZip(inputs, output, base_dir=None, compress_fn=None,
     compress_fn: Applied to each input to determine whether or not to compress.
         By default, items will be |zipfile.ZIP_STORED|.
     zip_prefix_path: Path prepended to file path in zip file.
+    jobs: Number of threads to read and compress files on. Output is identical
+        regardless of this value.
   """
   if base_dir is None:
     base_dir = '.'
@@ -461,18 +644,27 @@ def DoZip(inputs, output, base_dir=None, compress_fn=None,
   if not isinstance(output, zipfile.ZipFile):
     out_zip = zipfile.ZipFile(output, 'w')
 
-  try:
+  def iter_entries():
     for zip_path, fs_path in input_tuples:
       if zip_prefix_path:
         zip_path = os.path.join(zip_prefix_path, zip_path)
       compress = compress_fn(zip_path) if compress_fn else None
-      AddToZipHermetic(out_zip, zip_path, src_path=fs_path, compress=compress)
+      if os.path.islink(fs_path):
+        # Symlinks ignore |compress|. See AddToZipHermetic().
+        compress = None
+      yield functools.partial(_PrepareHermeticEntry,
+                              HermeticZipInfo(filename=zip_path),
+                              _ResolveCompressType(out_zip, compress),
+                              src_path=fs_path)
+
+  try:
+    _WriteZipEntries(out_zip, iter_entries(), jobs)
   finally:
     if output is not out_zip:
       out_zip.close()
 
 
-def ZipDir(output, base_dir, compress_fn=None, zip_prefix_path=None):
+def ZipDir(output, base_dir, compress_fn=None, zip_prefix_path=None, jobs=1):
   """Creates a zip file from a directory."""
   inputs = []
   for root, _, files in os.walk(base_dir):
@@ -485,7 +677,8 @@ def ZipDir(output, base_dir, compress_fn=None, zip_prefix_path=None):
         output,
         base_dir,
         compress_fn=compress_fn,
-        zip_prefix_path=zip_prefix_path)
+        zip_prefix_path=zip_prefix_path,
+        jobs=jobs)
   else:
     with AtomicOutput(output) as f:
       DoZip(
@@ -493,7 +686,8 @@ def ZipDir(output, base_dir, compress_fn=None, zip_prefix_path=None):
           f,
           base_dir,
           compress_fn=compress_fn,
-          zip_prefix_path=zip_prefix_path)
+          zip_prefix_path=zip_prefix_path,
+          jobs=jobs)
 
 
 def MatchesGlob(path, filters):
@@ -501,15 +695,19 @@ def MatchesGlob(path, filters):
   return filters and any(fnmatch.fnmatch(path, f) for f in filters)
 
 
-def MergeZips(output, input_zips, path_transform=None, compress=None):
+def MergeZips(output, input_zips, path_transform=None, compress=None, jobs=1):
   """Combines all files from |input_zips| into |output|.
 
+  Entries whose compression does not change are copied without being inflated
+  and re-deflated.
+
   Args:
     output: Path, fileobj, or ZipFile instance to add files to.
     input_zips: Iterable of paths to zip files to merge.
     path_transform: Called for each entry path. Returns a new path, or None to
         skip the file.
     compress: Overrides compression setting from origin zip entries.
+    jobs: Number of threads to compress entries on.
   """
   path_transform = path_transform or (lambda p: p)
   added_names = set()
@@ -518,28 +716,39 @@ def MergeZips(output, input_zips, path_transform=None, compress=None):
   if not isinstance(output, zipfile.ZipFile):
     out_zip = zipfile.ZipFile(output, 'w')
 
+  def iter_entries(in_zip):
+    for info in in_zip.infolist():
+      # Ignore directories.
+      if info.filename[-1] == '/':
+        continue
+      dst_name = path_transform(info.filename)
+      if not dst_name:
+        continue
+      already_added = dst_name in added_names
+      if not already_added:
+        if compress is not None:
+          compress_entry = compress
+        else:
+          compress_entry = info.compress_type != zipfile.ZIP_STORED
+        compress_type = _ResolveCompressType(out_zip, compress_entry)
+        zipinfo = HermeticZipInfo(filename=dst_name)
+        if _CanCopyRawZipEntry(info, compress_type):
+          zipinfo.compress_type = compress_type
+          zipinfo.file_size = info.file_size
+          zipinfo.compress_size = info.compress_size
+          zipinfo.CRC = info.CRC
+          yield zipinfo, _ReadRawZipEntry(in_zip, info)
+        else:
+          yield functools.partial(_PrepareHermeticEntry,
+                                  zipinfo,
+                                  compress_type,
+                                  data=in_zip.read(info))
+        added_names.add(dst_name)
+
   try:
     for in_file in input_zips:
       with zipfile.ZipFile(in_file, 'r') as in_zip:
-        for info in in_zip.infolist():
-          # Ignore directories.
-          if info.filename[-1] == '/':
-            continue
-          dst_name = path_transform(info.filename)
-          if not dst_name:
-            continue
-          already_added = dst_name in added_names
-          if not already_added:
-            if compress is not None:
-              compress_entry = compress
-            else:
-              compress_entry = info.compress_type != zipfile.ZIP_STORED
-            AddToZipHermetic(
-                out_zip,
-                dst_name,
-                data=in_zip.read(info),
-                compress=compress_entry)
-            added_names.add(dst_name)
+        _WriteZipEntries(out_zip, iter_entries(in_zip), jobs)
   finally:
     if output is not out_zip:
       out_zip.close()
@@ -6,7 +6,9 @@
 import collections
 import os
 import sys
+import tempfile
 import unittest
+import zipfile
 
 sys.path.insert(
     0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
@@ -43,6 +45,73 @@ class BuildUtilsTest(unittest.TestCase):
     actual = build_utils.GetSortedTransitiveDependencies(TOP, _DEPS.get)
     self.assertEqual(EXPECTED, actual)
 
+  def testMergeZips_rawCopyMatchesRecompress(self):
+    with build_utils.TempDir() as tmp_dir:
+      input_path = os.path.join(tmp_dir, 'in.zip')
+      with zipfile.ZipFile(input_path, 'w') as z:
+        build_utils.AddToZipHermetic(z, 'a.txt', data='a' * 100, compress=True)
+        build_utils.AddToZipHermetic(z, 'b.txt', data='b' * 100, compress=False)
+        build_utils.AddToZipHermetic(z, 'c.txt', data='tiny', compress=True)
+
+      # Recompresses every entry with AddToZipHermetic().
+      expected_path = os.path.join(tmp_dir, 'expected.zip')
+      with zipfile.ZipFile(input_path) as in_zip, \
+          zipfile.ZipFile(expected_path, 'w') as out_zip:
+        for info in in_zip.infolist():
+          build_utils.AddToZipHermetic(
+              out_zip,
+              info.filename,
+              data=in_zip.read(info),
+              compress=info.compress_type != zipfile.ZIP_STORED)
+
+      for jobs in (1, 4):
+        output_path = os.path.join(tmp_dir, 'out%d.zip' % jobs)
+        build_utils.MergeZips(output_path, [input_path], jobs=jobs)
+        with open(expected_path, 'rb') as f1, open(output_path, 'rb') as f2:
+          self.assertEqual(f1.read(), f2.read())
+
+  def testDoZip_jobs(self):
+    with build_utils.TempDir() as tmp_dir:
+      inputs = []
+      for i in range(20):
+        path = os.path.join(tmp_dir, '%d.txt' % i)
+        with open(path, 'w') as f:
+          f.write(str(i) * i * 10)
+        inputs.append(path)
+
+      outputs = []
+      for jobs in (1, 4):
+        with tempfile.TemporaryFile() as f:
+          build_utils.DoZip(inputs, f, base_dir=tmp_dir,
+                            compress_fn=lambda _: True, jobs=jobs)
+          f.seek(0)
+          outputs.append(f.read())
+      self.assertEqual(outputs[0], outputs[1])
+
+  def testAddFilesToZipHermetic_matchesAddToZipHermetic(self):
+    with build_utils.TempDir() as tmp_dir:
+      entries = []
+      for i in range(20):
+        path = os.path.join(tmp_dir, '%d.txt' % i)
+        with open(path, 'w') as f:
+          f.write(str(i) * i * 10)
+        entries.append(('dir/%d.txt' % i, path, i % 2 == 0))
+
+      with tempfile.TemporaryFile() as f:
+        with zipfile.ZipFile(f, 'w') as z:
+          for zip_path, src_path, compress in entries:
+            build_utils.AddToZipHermetic(
+                z, zip_path, src_path=src_path, compress=compress)
+        f.seek(0)
+        expected = f.read()
+
+      for jobs in (1, 4):
+        with tempfile.TemporaryFile() as f:
+          with zipfile.ZipFile(f, 'w') as z:
+            build_utils.AddFilesToZipHermetic(z, entries, jobs=jobs)
+          f.seek(0)
+          self.assertEqual(expected, f.read())
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,170 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A content-addressed cache of build outputs that is shared between actions.
+
+Entries are files named by a key that is computed from everything that affects
+their contents (input file contents, tool versions, flags). Entries are
+inserted atomically and are never modified once inserted, so the cache is safe
+to use from concurrent build actions. The cache is capped in size by evicting
+the least-recently-used entries.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import tempfile
+
+from util import build_utils
+
+_TMP_SUFFIX = '.tmp'
+_LOCK_SUFFIX = '.lock'
+
+
+def ComputeKey(strings=None, paths=None):
+  """Returns a cache key for the given strings and file contents.
+
+  Args:
+    strings: List of strings that affect the output (e.g. command-line flags).
+    paths: List of files whose contents affect the output. Order matters.
+  """
+  md5 = hashlib.md5()
+  for s in strings or ():
+    md5.update(str(s).encode('utf-8'))
+    md5.update(b'\0')
+  for path in paths or ():
+    with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        md5.update(chunk)
+    md5.update(b'\0')
+  return md5.hexdigest()
+
+
+class ContentCache(object):
+  """A directory of files keyed by a digest of their inputs.
+
+  Args:
+    cache_dir: Directory to store entries in. Created if it does not exist.
+    max_size: Maximum total size of entries in bytes, or None for no limit.
+  """
+
+  def __init__(self, cache_dir, max_size=None):
+    self._cache_dir = cache_dir
+    self._max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    build_utils.MakeDirectory(cache_dir)
+
+  def _EntryPath(self, key):
+    return os.path.join(self._cache_dir, key)
+
+  def Get(self, key, dest_path):
+    """Places the entry for |key| at |dest_path|.
+
+    |dest_path| is hard linked to the entry when possible, so it must not be
+    modified in-place.
+
+    Returns:
+      Whether the entry existed.
+    """
+    entry_path = self._EntryPath(key)
+    try:
+      try:
+        os.link(entry_path, dest_path)
+      except OSError:
+        if not os.path.exists(entry_path):
+          raise
+        # Different filesystem.
+        shutil.copyfile(entry_path, dest_path)
+      # Entry mtimes track the last use for eviction.
+      os.utime(entry_path, None)
+    except (IOError, OSError):
+      # Also covers an entry being evicted by a concurrent action.
+      self.misses += 1
+      return False
+    self.hits += 1
+    return True
+
+  def Put(self, key, src_path, evict=True):
+    """Adds a copy of |src_path| to the cache as the entry for |key|.
+
+    Args:
+      key: Key of the entry.
+      src_path: File to copy into the cache.
+      evict: Whether to enforce |max_size| right away. Callers inserting many
+          entries should pass False and call MaybeEvict() once at the end,
+          since each eviction check lists the whole cache directory.
+    """
+    with tempfile.NamedTemporaryFile(
+        dir=self._cache_dir, suffix=_TMP_SUFFIX, delete=False) as tmp_file:
+      pass
+    try:
+      shutil.copyfile(src_path, tmp_file.name)
+      # Atomic, so concurrent readers never see a partial entry.
+      os.rename(tmp_file.name, self._EntryPath(key))
+    finally:
+      if os.path.exists(tmp_file.name):
+        os.unlink(tmp_file.name)
+    if evict:
+      self.MaybeEvict()
+
+  @contextlib.contextmanager
+  def Lock(self, key):
+    """Holds an exclusive lock on |key| across all actions sharing the cache.
+
+    Use this to avoid computing an entry that a concurrent action is already
+    computing. Keys share a fixed number of lock files, so unrelated keys may
+    occasionally wait for one another.
+    """
+    lock_path = os.path.join(self._cache_dir, key[:2] + _LOCK_SUFFIX)
+    with open(lock_path, 'a') as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  def MaybeEvict(self):
+    """Deletes least-recently-used entries until the cache fits |max_size|."""
+    if self._max_size is None:
+      return
+    entries = []
+    total_size = 0
+    for name in os.listdir(self._cache_dir):
+      if name.endswith(_TMP_SUFFIX) or name.endswith(_LOCK_SUFFIX):
+        continue
+      path = os.path.join(self._cache_dir, name)
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      if not stat.S_ISREG(st.st_mode):
+        continue
+      entries.append((st.st_mtime, st.st_size, path))
+      total_size += st.st_size
+    if total_size <= self._max_size:
+      return
+
+    entries.sort()
+    num_evicted = 0
+    for _, size, path in entries:
+      if total_size <= self._max_size:
+        break
+      try:
+        os.unlink(path)
+        num_evicted += 1
+      except OSError:
+        pass  # Already evicted by a concurrent action.
+      total_size -= size
+    logging.debug('Evicted %d entries from %s', num_evicted, self._cache_dir)
+
+  def DescribeStats(self):
+    """Returns a human-readable summary of cache hits."""
+    total = self.hits + self.misses
+    return '%s: %d/%d hits (%.0f%%)' % (self._cache_dir, self.hits, total,
+                                        100.0 * self.hits / (total or 1))
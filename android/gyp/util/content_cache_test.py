@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import content_cache
+
+
+def _WriteFile(path, data):
+  with open(path, 'w') as f:
+    f.write(data)
+
+
+def _ReadFile(path):
+  with open(path) as f:
+    return f.read()
+
+
+class ContentCacheTest(unittest.TestCase):
+  def testComputeKey(self):
+    with build_utils.TempDir() as tmp_dir:
+      path = os.path.join(tmp_dir, 'input')
+      _WriteFile(path, 'a')
+      key = content_cache.ComputeKey(strings=['--flag'], paths=[path])
+      self.assertEqual(key,
+                       content_cache.ComputeKey(strings=['--flag'], paths=[path]))
+      self.assertNotEqual(key, content_cache.ComputeKey(strings=['--flag']))
+      _WriteFile(path, 'b')
+      self.assertNotEqual(
+          key, content_cache.ComputeKey(strings=['--flag'], paths=[path]))
+
+  def testGetAndPut(self):
+    with build_utils.TempDir() as tmp_dir:
+      cache = content_cache.ContentCache(os.path.join(tmp_dir, 'cache'))
+      src_path = os.path.join(tmp_dir, 'src')
+      dest_path = os.path.join(tmp_dir, 'dest')
+      _WriteFile(src_path, 'data')
+
+      self.assertFalse(cache.Get('key', dest_path))
+      cache.Put('key', src_path)
+      self.assertTrue(cache.Get('key', dest_path))
+      self.assertEqual('data', _ReadFile(dest_path))
+      self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+  def testEviction(self):
+    with build_utils.TempDir() as tmp_dir:
+      cache = content_cache.ContentCache(os.path.join(tmp_dir, 'cache'),
+                                         max_size=10)
+      src_path = os.path.join(tmp_dir, 'src')
+      _WriteFile(src_path, '12345')
+      cache.Put('old', src_path)
+      cache.Put('new', src_path)
+      os.utime(os.path.join(tmp_dir, 'cache', 'old'), (1, 1))
+      # Exceeds max_size, so the least-recently-used entry is evicted.
+      cache.Put('newest', src_path)
+
+      self.assertFalse(cache.Get('old', os.path.join(tmp_dir, 'dest1')))
+      self.assertTrue(cache.Get('new', os.path.join(tmp_dir, 'dest2')))
+      self.assertTrue(cache.Get('newest', os.path.join(tmp_dir, 'dest3')))
+
+  def testDeferredEviction(self):
+    with build_utils.TempDir() as tmp_dir:
+      cache = content_cache.ContentCache(os.path.join(tmp_dir, 'cache'),
+                                         max_size=10)
+      src_path = os.path.join(tmp_dir, 'src')
+      _WriteFile(src_path, '12345')
+      for key in ('a', 'b', 'c'):
+        cache.Put(key, src_path, evict=False)
+      self.assertEqual(3, len(os.listdir(os.path.join(tmp_dir, 'cache'))))
+      cache.MaybeEvict()
+      self.assertEqual(2, len(os.listdir(os.path.join(tmp_dir, 'cache'))))
+
+  def testLock(self):
+    with build_utils.TempDir() as tmp_dir:
+      cache = content_cache.ContentCache(os.path.join(tmp_dir, 'cache'),
+                                         max_size=0)
+      with cache.Lock('key'):
+        # Lock files and directories are not entries, so are never evicted.
+        os.mkdir(os.path.join(tmp_dir, 'cache', 'key.src'))
+        cache.Put('key', __file__)
+      self.assertEqual(['ke.lock', 'key.src'],
+                       sorted(os.listdir(os.path.join(tmp_dir, 'cache'))))
+
+
+if __name__ == '__main__':
+  unittest.main()
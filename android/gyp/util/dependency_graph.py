@@ -0,0 +1,134 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A dependency graph that answers transitive dependency queries quickly.
+
+Nodes are interned into integers when they are first seen, such that every
+node is numbered after all of its dependencies. Sets of nodes are bitsets
+(Python ints), so the transitive closure of each node is computed only once,
+and unions, intersections and differences of closures are cheap.
+"""
+
+
+def _FlagsToMask(flags):
+  """Returns a bitset with bit i set when flags[i] is true."""
+  return int(''.join('1' if f else '0' for f in reversed(flags)) or '0', 2)
+
+
+class DependencyGraph(object):
+  """Lazily built graph of the nodes reachable from those it is queried for.
+
+  Args:
+    deps_func: A function that takes a node and returns a list of its direct
+        dependencies. Called once per node.
+    type_func: A function that takes a node and returns its type. Needed only
+        for TypeMask().
+  """
+
+  def __init__(self, deps_func, type_func=None):
+    self._deps_func = deps_func
+    self._type_func = type_func
+    self._index_by_node = {}
+    self._nodes = []
+    # Direct deps of each node, as indices.
+    self._deps = []
+    # Bitset of each node and its transitive deps.
+    self._closures = []
+    self._types = []
+    self._type_masks = {}
+    self._sorted_cache = {}
+
+  def _Intern(self, node):
+    index = self._index_by_node.get(node)
+    if index is not None:
+      return index
+    # Post-order DFS. Iterative since chains of deps can be longer than the
+    # recursion limit.
+    stack = [[node, list(self._deps_func(node)), 0]]
+    pending = set([node])
+    while stack:
+      entry = stack[-1]
+      cur, cur_deps, pos = entry
+      if pos < len(cur_deps):
+        entry[2] += 1
+        dep = cur_deps[pos]
+        if dep not in self._index_by_node:
+          if dep in pending:
+            raise Exception('Dependency cycle involving: %s' % dep)
+          pending.add(dep)
+          stack.append([dep, list(self._deps_func(dep)), 0])
+        continue
+      stack.pop()
+      pending.discard(cur)
+      index = len(self._nodes)
+      dep_indices = [self._index_by_node[d] for d in cur_deps]
+      closure = 1 << index
+      for i in dep_indices:
+        closure |= self._closures[i]
+      self._index_by_node[cur] = index
+      self._nodes.append(cur)
+      self._deps.append(dep_indices)
+      self._closures.append(closure)
+      self._types.append(self._type_func(cur) if self._type_func else None)
+    return self._index_by_node[node]
+
+  def GetSortedTransitiveDependencies(self, top):
+    """Same as build_utils.GetSortedTransitiveDependencies()."""
+    key = tuple(top)
+    ret = self._sorted_cache.get(key)
+    if ret is not None:
+      return list(ret)
+    top_indices = [self._Intern(n) for n in top]
+    visited = bytearray(len(self._nodes))
+    order = []
+    for root in top_indices:
+      if visited[root]:
+        continue
+      visited[root] = 1
+      stack = [[root, 0]]
+      while stack:
+        entry = stack[-1]
+        cur_deps = self._deps[entry[0]]
+        while entry[1] < len(cur_deps) and visited[cur_deps[entry[1]]]:
+          entry[1] += 1
+        if entry[1] < len(cur_deps):
+          dep = cur_deps[entry[1]]
+          entry[1] += 1
+          visited[dep] = 1
+          stack.append([dep, 0])
+        else:
+          stack.pop()
+          order.append(entry[0])
+    ret = [self._nodes[i] for i in order]
+    self._sorted_cache[key] = ret
+    return list(ret)
+
+  def ClosureMask(self, nodes):
+    """Returns the bitset of |nodes| and all of their transitive deps."""
+    ret = 0
+    for n in nodes:
+      ret |= self._closures[self._Intern(n)]
+    return ret
+
+  def TypeMask(self, wanted_type):
+    """Returns the bitset of all nodes seen so far whose type is |wanted_type|.
+    """
+    num_nodes, mask = self._type_masks.get(wanted_type, (None, None))
+    if num_nodes != len(self._nodes):
+      mask = _FlagsToMask([t == wanted_type for t in self._types])
+      self._type_masks[wanted_type] = (len(self._nodes), mask)
+    return mask
+
+  def Select(self, nodes, mask):
+    """Returns the nodes of |nodes| that are in |mask|, in the same order."""
+    # Checking bits of a string is O(1), whereas bit operations on a long int
+    # are O(size of the int).
+    bits = bin(mask)[:1:-1]
+    num_bits = len(bits)
+    ret = []
+    for n in nodes:
+      i = self._Intern(n)
+      if i < num_bits and bits[i] == '1':
+        ret.append(n)
+    return ret
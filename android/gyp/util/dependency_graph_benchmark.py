@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Measures dependency_graph.DependencyGraph on synthetic graphs.
+
+For each graph size, runs the queries that write_build_config.py makes for an
+APK (all deps, deps of a few types, and deps that are not deps of a base
+module) with both build_utils.GetSortedTransitiveDependencies() plus list
+filtering (the former implementation) and DependencyGraph, and reports the
+time taken by each.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import dependency_graph
+
+_TYPES = ('java_library', 'java_library', 'java_library', 'android_resources',
+          'android_assets', 'group')
+
+
+def _CreateGraph(num_nodes, max_deps, seed):
+  rand = random.Random(seed)
+  deps = {}
+  types = {}
+  for i in range(num_nodes):
+    node = 'gen/target%d.build_config' % i
+    candidates = ['gen/target%d.build_config' % j for j in range(i)]
+    deps[node] = rand.sample(candidates,
+                             min(len(candidates), rand.randint(0, max_deps)))
+    types[node] = rand.choice(_TYPES)
+  return deps, types
+
+
+def _RunLists(deps, types, top, base_top):
+  all_deps = build_utils.GetSortedTransitiveDependencies(top, deps.get)
+  for wanted_type in _TYPES:
+    [n for n in all_deps if types[n] == wanted_type]
+  base_deps = build_utils.GetSortedTransitiveDependencies(base_top, deps.get)
+  return [n for n in all_deps if n not in base_deps]
+
+
+def _RunGraph(deps, types, top, base_top):
+  graph = dependency_graph.DependencyGraph(deps.get, types.get)
+  all_deps = graph.GetSortedTransitiveDependencies(top)
+  for wanted_type in _TYPES:
+    graph.Select(all_deps, graph.TypeMask(wanted_type))
+  return graph.Select(all_deps,
+                      graph.ClosureMask(top) & ~graph.ClosureMask(base_top))
+
+
+def _Time(func, *args):
+  start = time.time()
+  ret = func(*args)
+  return time.time() - start, ret
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--sizes', default='1000,2500,5000,10000',
+                      help='Comma-separated numbers of nodes.')
+  parser.add_argument('--max-deps', type=int, default=8,
+                      help='Maximum number of direct deps per node.')
+  parser.add_argument('--direct-deps', type=int, default=50,
+                      help='Number of direct deps of the APK.')
+  args = parser.parse_args()
+
+  print('%8s %10s %10s %10s' % ('Nodes', 'Deps', 'lists', 'graph'))
+  for size in (int(s) for s in args.sizes.split(',')):
+    deps, types = _CreateGraph(size, args.max_deps, seed=size)
+    rand = random.Random(0)
+    nodes = sorted(deps)
+    top = rand.sample(nodes, args.direct_deps)
+    base_top = top[:args.direct_deps // 2]
+    lists_time, expected = _Time(_RunLists, deps, types, top, base_top)
+    graph_time, actual = _Time(_RunGraph, deps, types, top, base_top)
+    if expected != actual:
+      print('Mismatch for %d nodes' % size)
+      return 1
+    num_deps = len(build_utils.GetSortedTransitiveDependencies(top, deps.get))
+    print('%8d %10d %9.3fs %9.3fs' % (size, num_deps, lists_time, graph_time))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
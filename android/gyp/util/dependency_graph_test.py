@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import collections
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import dependency_graph
+
+_DEPS = collections.OrderedDict()
+_DEPS['a'] = []
+_DEPS['b'] = []
+_DEPS['c'] = ['a']
+_DEPS['d'] = ['a']
+_DEPS['e'] = ['f']
+_DEPS['f'] = ['a', 'd']
+_DEPS['g'] = []
+_DEPS['h'] = ['d', 'b', 'f']
+_DEPS['i'] = ['f']
+
+_TYPES = {'a': 'lib', 'b': 'res', 'd': 'res', 'f': 'lib', 'h': 'lib'}
+
+
+def _CreateRandomGraph(num_nodes, seed):
+  rand = random.Random(seed)
+  deps = {}
+  for i in range(num_nodes):
+    candidates = list(range(max(0, i - 50), i))
+    deps[i] = rand.sample(candidates, min(len(candidates), rand.randint(0, 5)))
+  return deps
+
+
+class DependencyGraphTest(unittest.TestCase):
+  def _CreateGraph(self, deps=None):
+    return dependency_graph.DependencyGraph((deps or _DEPS).get, _TYPES.get)
+
+  def testGetSortedTransitiveDependencies(self):
+    graph = self._CreateGraph()
+    for top in (list(_DEPS), ['h', 'e'], ['e', 'h'], ['d', 'i', 'd']):
+      self.assertEqual(
+          build_utils.GetSortedTransitiveDependencies(top, _DEPS.get),
+          graph.GetSortedTransitiveDependencies(top))
+
+  def testGetSortedTransitiveDependencies_random(self):
+    deps = _CreateRandomGraph(500, seed=1)
+    graph = self._CreateGraph(deps)
+    rand = random.Random(2)
+    for _ in range(50):
+      top = rand.sample(range(500), 10)
+      self.assertEqual(
+          build_utils.GetSortedTransitiveDependencies(top, deps.get),
+          graph.GetSortedTransitiveDependencies(top))
+
+  def testResultsAreCopies(self):
+    graph = self._CreateGraph()
+    graph.GetSortedTransitiveDependencies(['c']).append('x')
+    self.assertEqual(['a', 'c'], graph.GetSortedTransitiveDependencies(['c']))
+
+  def testDeepChain(self):
+    deps = {i: [i - 1] if i else [] for i in range(sys.getrecursionlimit() * 2)}
+    graph = self._CreateGraph(deps)
+    top = [len(deps) - 1]
+    self.assertEqual(list(range(len(deps))),
+                     graph.GetSortedTransitiveDependencies(top))
+
+  def testCycle(self):
+    graph = self._CreateGraph({'a': ['b'], 'b': ['c'], 'c': ['a']})
+    with self.assertRaises(Exception):
+      graph.GetSortedTransitiveDependencies(['a'])
+
+  def testSelectByType(self):
+    graph = self._CreateGraph()
+    all_deps = graph.GetSortedTransitiveDependencies(['h'])
+    self.assertEqual(['a', 'f', 'h'],
+                     graph.Select(all_deps, graph.TypeMask('lib')))
+    self.assertEqual(['d', 'b'], graph.Select(all_deps, graph.TypeMask('res')))
+    self.assertEqual([], graph.Select(all_deps, graph.TypeMask('apk')))
+
+  def testTypeMaskIncludesNewNodes(self):
+    graph = self._CreateGraph()
+    graph.GetSortedTransitiveDependencies(['c'])
+    graph.TypeMask('res')
+    all_deps = graph.GetSortedTransitiveDependencies(['h'])
+    self.assertEqual(['d', 'b'], graph.Select(all_deps, graph.TypeMask('res')))
+
+  def testClosureMask(self):
+    graph = self._CreateGraph()
+    all_deps = graph.GetSortedTransitiveDependencies(list(_DEPS))
+    mask = graph.ClosureMask(['h']) & ~graph.ClosureMask(['f'])
+    self.assertEqual(['b', 'h'], graph.Select(all_deps, mask))
+
+
+if __name__ == '__main__':
+  unittest.main()
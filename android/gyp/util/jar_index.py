@@ -0,0 +1,141 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Indexes the classes of jars, to key cache entries on the classes they use.
+
+Reading every class of a classpath is slow, so the index of each jar is kept
+on disk and is only recomputed when the mtime or size of the jar changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import zipfile
+
+from util import build_utils
+from util import java_abi
+
+
+def _ReadJar(jar_path):
+  """Returns the classes of a jar, and the classes that they reference.
+
+  Raises:
+    java_abi.ClassFormatError: If the jar contains an invalid class file.
+  """
+  classes = {}
+  references = set()
+  with zipfile.ZipFile(jar_path) as z:
+    for info in z.infolist():
+      if not info.filename.endswith('.class'):
+        continue
+      data = z.read(info)
+      name, super_name, interfaces, class_references = (
+          java_abi.ReadClassInfo(data))
+      classes[name.decode('utf-8')] = [
+          java_abi.ComputeClassAbi(data),
+          super_name.decode('utf-8'),
+          sorted(i.decode('utf-8') for i in interfaces),
+      ]
+      references.update(class_references)
+  references = set(r.decode('utf-8') for r in references)
+  return {
+      'classes': classes,
+      'references': sorted(references.difference(classes)),
+  }
+
+
+class JarIndex(object):
+  """The classes of jars, cached on disk by jar mtime and size.
+
+  Args:
+    index_dir: Directory to keep the index of each jar in. Created if it does
+        not exist. Safe to share between concurrent build actions.
+  """
+
+  def __init__(self, index_dir):
+    self._index_dir = index_dir
+    self._jars = {}
+    self._classpaths = {}
+    build_utils.MakeDirectory(index_dir)
+
+  def _IndexPath(self, jar_path):
+    digest = hashlib.md5(os.path.abspath(jar_path).encode('utf-8'))
+    return os.path.join(self._index_dir, digest.hexdigest() + '.json')
+
+  def Get(self, jar_path):
+    """Returns the index of a jar.
+
+    Returns:
+      A dict with 'classes', mapping the names of the classes of the jar to
+      [ABI digest, superclass name, interface names], and 'references', the
+      names of the classes that the jar references but does not contain.
+    Raises:
+      java_abi.ClassFormatError: If the jar contains an invalid class file.
+    """
+    if jar_path in self._jars:
+      return self._jars[jar_path]
+    st = os.stat(jar_path)
+    stamp = [st.st_mtime, st.st_size]
+    index_path = self._IndexPath(jar_path)
+    index = None
+    try:
+      with open(index_path) as f:
+        obj = json.load(f)
+      if obj.get('stamp') == stamp:
+        index = obj['index']
+    except (IOError, ValueError, KeyError):
+      pass
+    if index is None:
+      logging.debug('Indexing classes of %s', jar_path)
+      index = _ReadJar(jar_path)
+      # Atomic, so concurrent actions never read a partial index.
+      with build_utils.AtomicOutput(index_path, mode='w') as f:
+        json.dump({'stamp': stamp, 'index': index}, f)
+    self._jars[jar_path] = index
+    return index
+
+  def _GetClasses(self, classpath):
+    classpath = tuple(classpath)
+    classes = self._classpaths.get(classpath)
+    if classes is None:
+      classes = {}
+      # Like the JVM, the first jar that contains a class wins.
+      for jar_path in reversed(classpath):
+        classes.update(self.Get(jar_path)['classes'])
+      self._classpaths[classpath] = classes
+    return classes
+
+  def ComputeDepsKey(self, jar_path, classpath):
+    """Returns a digest of the classes of |classpath| that a jar depends on.
+
+    These are the classes that the jar references and, transitively, their
+    superclasses and interfaces, which is what D8 looks at when desugaring.
+    Classes are compared by ABI, so that changes to method bodies elsewhere
+    on the classpath do not change the key.
+
+    Args:
+      jar_path: Path of the jar.
+      classpath: List of jars to look up the referenced classes in, in order.
+    Raises:
+      java_abi.ClassFormatError: If a jar contains an invalid class file.
+    """
+    classes = self._GetClasses(classpath)
+    abis = {}
+    pending = list(self.Get(jar_path)['references'])
+    while pending:
+      name = pending.pop()
+      if not name or name in abis:
+        continue
+      info = classes.get(name)
+      # Missing classes are part of the key too, since adding them may change
+      # the output.
+      abis[name] = info[0] if info else '-'
+      if info:
+        pending.append(info[1])
+        pending.extend(info[2])
+    md5 = hashlib.md5()
+    for name in sorted(abis):
+      md5.update(('%s %s\n' % (name, abis[name])).encode('utf-8'))
+    return md5.hexdigest()
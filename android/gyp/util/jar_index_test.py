@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import jar_index
+from util import java_abi_test
+
+_ACC_PUBLIC = 0x0001
+
+
+def _Class(name, super_name='java/lang/Object', methods=()):
+  # pylint: disable=protected-access
+  builder = java_abi_test._ClassBuilder(name, super_name)
+  builder.methods = [(_ACC_PUBLIC, m, '()V', b'\xb1') for m in methods]
+  return builder.Build()
+
+
+class JarIndexTest(unittest.TestCase):
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+    self._index_dir = os.path.join(self._temp_dir, 'index')
+    self._jar = self._WriteJar('input.jar', [_Class('org/Foo', 'org/Base')])
+    self._base_jar = self._WriteJar(
+        'base.jar', [_Class('org/Base', 'org/Root'),
+                     _Class('org/Root')])
+    self._other_jar = self._WriteJar('other.jar', [_Class('org/Other')])
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def _WriteJar(self, name, classes, mtime=1000):
+    path = os.path.join(self._temp_dir, name)
+    with zipfile.ZipFile(path, 'w') as z:
+      for data in classes:
+        z.writestr('%d.class' % len(z.namelist()), data)
+    os.utime(path, (mtime, mtime))
+    return path
+
+  def _DepsKey(self):
+    index = jar_index.JarIndex(self._index_dir)
+    return index.ComputeDepsKey(self._jar, [self._other_jar, self._base_jar])
+
+  def testGet(self):
+    index = jar_index.JarIndex(self._index_dir).Get(self._jar)
+    self.assertEqual(['org/Foo'], list(index['classes']))
+    self.assertEqual(['org/Base'], index['references'])
+
+  def testUnrelatedClassChanged(self):
+    key = self._DepsKey()
+    self._WriteJar('other.jar', [_Class('org/Other', methods=['foo'])], 2000)
+    self.assertEqual(key, self._DepsKey())
+
+  def testSuperclassChanged(self):
+    key = self._DepsKey()
+    self._WriteJar('base.jar',
+                   [_Class('org/Base', 'org/Root'),
+                    _Class('org/Root', methods=['foo'])], 2000)
+    self.assertNotEqual(key, self._DepsKey())
+
+  def testMissingClassAdded(self):
+    key = self._DepsKey()
+    self._WriteJar('other.jar',
+                   [_Class('org/Other'), _Class('java/lang/Object')], 2000)
+    self.assertNotEqual(key, self._DepsKey())
+
+  def testIndexCachedByMtime(self):
+    key = self._DepsKey()
+    # The jar is not read again while its mtime and size are unchanged.
+    size = os.path.getsize(self._base_jar)
+    with open(self._base_jar, 'wb') as f:
+      f.write(b'x' * size)
+    os.utime(self._base_jar, (1000, 1000))
+    self.assertEqual(key, self._DepsKey())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,265 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Computes the ABI signature of .class files.
+
+The signature of a class covers everything that other classes can compile
+against: its name, access flags, superclass and interfaces, and the names,
+descriptors, generic signatures, declared exceptions and constant values of
+its non-private members. It does not cover method bodies or private members,
+so that changing those does not require recompiling dependents.
+
+Class files are parsed in pure Python (see "The class File Format" chapter of
+the JVM specification).
+"""
+
+import hashlib
+import re
+import struct
+
+_MAGIC = 0xCAFEBABE
+
+_ACC_PRIVATE = 0x0002
+_ACC_SUPER = 0x0020
+_ACC_SYNTHETIC = 0x1000
+
+# Constant pool tag -> size of the entry (excluding the tag). Utf8 entries
+# (tag 1) have a variable size.
+_CONSTANT_SIZES = {
+    3: 4,  # Integer
+    4: 4,  # Float
+    5: 8,  # Long
+    6: 8,  # Double
+    7: 2,  # Class
+    8: 2,  # String
+    9: 4,  # Fieldref
+    10: 4,  # Methodref
+    11: 4,  # InterfaceMethodref
+    12: 4,  # NameAndType
+    15: 3,  # MethodHandle
+    16: 2,  # MethodType
+    17: 4,  # Dynamic
+    18: 4,  # InvokeDynamic
+    19: 2,  # Module
+    20: 2,  # Package
+}
+_CONSTANT_UTF8 = 1
+_CONSTANT_LONG = 5
+_CONSTANT_DOUBLE = 6
+_CONSTANT_CLASS = 7
+_CONSTANT_STRING = 8
+
+# Anonymous and local classes (e.g. Foo$1.class, Foo$1Local.class) cannot be
+# referenced from other source files.
+_ANONYMOUS_OR_LOCAL_CLASS_RE = re.compile(r'\$\d')
+
+# Class names in descriptors and signatures, e.g. "Lorg/chromium/Foo;".
+_DESCRIPTOR_CLASS_RE = re.compile(br'L([^;<>\[]+)[;<]')
+
+
+class ClassFormatError(Exception):
+  pass
+
+
+def IsAnonymousOrLocalClass(class_path):
+  """Returns whether |class_path| (e.g. org/Foo$1.class) cannot be referenced.
+  """
+  return bool(_ANONYMOUS_OR_LOCAL_CLASS_RE.search(class_path))
+
+
+class _ClassReader(object):
+  def __init__(self, data):
+    self._data = data
+    self._pos = 0
+    # Index -> (tag, offset of the entry's data).
+    self._constants = {}
+
+  def _Unpack(self, fmt):
+    try:
+      ret = struct.unpack_from(fmt, self._data, self._pos)
+    except struct.error:
+      raise ClassFormatError('Truncated class file')
+    self._pos += struct.calcsize(fmt)
+    return ret
+
+  def _U2(self):
+    return self._Unpack('>H')[0]
+
+  def _ReadConstantPool(self):
+    count = self._U2()
+    i = 1
+    while i < count:
+      tag = self._Unpack('>B')[0]
+      self._constants[i] = (tag, self._pos)
+      if tag == _CONSTANT_UTF8:
+        self._pos += 2 + self._U2()
+      elif tag in _CONSTANT_SIZES:
+        self._pos += _CONSTANT_SIZES[tag]
+      else:
+        raise ClassFormatError('Unknown constant pool tag: %d' % tag)
+      # Long and Double entries take up two slots.
+      i += 2 if tag in (_CONSTANT_LONG, _CONSTANT_DOUBLE) else 1
+
+  def _GetConstant(self, index, expected_tag=None):
+    try:
+      tag, offset = self._constants[index]
+    except KeyError:
+      raise ClassFormatError('Invalid constant pool index: %d' % index)
+    if expected_tag is not None and tag != expected_tag:
+      raise ClassFormatError('Constant %d has tag %d, expected %d' %
+                             (index, tag, expected_tag))
+    return tag, offset
+
+  def Utf8(self, index):
+    _, offset = self._GetConstant(index, _CONSTANT_UTF8)
+    length = struct.unpack_from('>H', self._data, offset)[0]
+    return self._data[offset + 2:offset + 2 + length]
+
+  def ClassName(self, index):
+    if index == 0:
+      return b''
+    _, offset = self._GetConstant(index, _CONSTANT_CLASS)
+    return self.Utf8(struct.unpack_from('>H', self._data, offset)[0])
+
+  def ConstantValue(self, index):
+    tag, offset = self._GetConstant(index)
+    if tag == _CONSTANT_STRING:
+      return b's' + self.Utf8(struct.unpack_from('>H', self._data, offset)[0])
+    if tag in (3, 4, 5, 6):
+      # Compare the raw bytes of numbers so that e.g. NaNs compare equal.
+      raw = self._data[offset:offset + _CONSTANT_SIZES[tag]]
+      return struct.pack('>B', tag) + raw
+    raise ClassFormatError('Invalid ConstantValue tag: %d' % tag)
+
+  def _ReadAttributes(self):
+    ret = []
+    for _ in range(self._U2()):
+      name_index, length = self._Unpack('>HI')
+      ret.append((self.Utf8(name_index), self._pos, length))
+      self._pos += length
+    if self._pos > len(self._data):
+      raise ClassFormatError('Truncated class file')
+    return ret
+
+  def _ReadMembers(self):
+    ret = []
+    for _ in range(self._U2()):
+      access_flags, name_index, descriptor_index = self._Unpack('>HHH')
+      attributes = self._ReadAttributes()
+      ret.append((access_flags, self.Utf8(name_index),
+                  self.Utf8(descriptor_index), attributes))
+    return ret
+
+  def _DescribeAttributes(self, attributes):
+    parts = []
+    for name, offset, _ in attributes:
+      if name == b'Signature':
+        index = struct.unpack_from('>H', self._data, offset)[0]
+        parts.append(b'signature=' + self.Utf8(index))
+      elif name == b'ConstantValue':
+        index = struct.unpack_from('>H', self._data, offset)[0]
+        parts.append(b'value=' + self.ConstantValue(index))
+      elif name == b'Exceptions':
+        count = struct.unpack_from('>H', self._data, offset)[0]
+        indices = struct.unpack_from('>%dH' % count, self._data, offset + 2)
+        names = sorted(self.ClassName(i) for i in indices)
+        parts.append(b'throws=' + b','.join(names))
+    return sorted(parts)
+
+  def _DescribeInnerClassFlags(self, this_index, attributes):
+    """Returns the declared access flags of this class if it is nested.
+
+    The access flags of a nested class in its own header do not say whether it
+    is private or static. The InnerClasses attribute does.
+    """
+    for name, offset, _ in attributes:
+      if name != b'InnerClasses':
+        continue
+      count = struct.unpack_from('>H', self._data, offset)[0]
+      for i in range(count):
+        inner_index, _, _, flags = struct.unpack_from(
+            '>HHHH', self._data, offset + 2 + 8 * i)
+        if inner_index == this_index:
+          return flags
+    return None
+
+  def _ReadHeader(self):
+    magic, _, _ = self._Unpack('>IHH')
+    if magic != _MAGIC:
+      raise ClassFormatError('Not a class file')
+    self._ReadConstantPool()
+    access_flags, this_index, super_index = self._Unpack('>HHH')
+    interfaces = [self.ClassName(self._U2()) for _ in range(self._U2())]
+    return access_flags, this_index, super_index, interfaces
+
+  def ReadInfo(self):
+    """Returns the class hierarchy and references. See ReadClassInfo()."""
+    _, this_index, super_index, interfaces = self._ReadHeader()
+    references = set()
+    for index, (tag, _) in self._constants.items():
+      if tag == _CONSTANT_CLASS:
+        name = self.ClassName(index)
+        if name.startswith(b'['):
+          # Array classes, e.g. "[Lorg/chromium/Foo;".
+          references.update(_DESCRIPTOR_CLASS_RE.findall(name))
+        else:
+          references.add(name)
+      elif tag == _CONSTANT_UTF8:
+        references.update(_DESCRIPTOR_CLASS_RE.findall(self.Utf8(index)))
+    return (self.ClassName(this_index), self.ClassName(super_index), interfaces,
+            references)
+
+  def Describe(self):
+    """Returns a list of byte strings that together make up the ABI."""
+    access_flags, this_index, super_index, interfaces = self._ReadHeader()
+    fields = self._ReadMembers()
+    methods = self._ReadMembers()
+    attributes = self._ReadAttributes()
+
+    ret = [
+        b'class %d %s' % (access_flags & ~_ACC_SUPER,
+                          self.ClassName(this_index)),
+        b'extends ' + self.ClassName(super_index),
+        b'implements ' + b','.join(sorted(interfaces)),
+        b'inner %r' % self._DescribeInnerClassFlags(this_index, attributes),
+    ]
+    ret.extend(self._DescribeAttributes(attributes))
+    members = []
+    for kind, entries in ((b'field', fields), (b'method', methods)):
+      for flags, name, descriptor, member_attributes in entries:
+        if flags & (_ACC_PRIVATE | _ACC_SYNTHETIC) or name == b'<clinit>':
+          continue
+        members.append(b' '.join([kind, b'%d' % flags, name, descriptor] +
+                                 self._DescribeAttributes(member_attributes)))
+    ret.extend(sorted(members))
+    return ret
+
+
+def ComputeClassAbi(data):
+  """Returns a digest of the ABI of the class file whose contents are |data|.
+
+  Raises:
+    ClassFormatError: If |data| is not a valid class file.
+  """
+  md5 = hashlib.md5()
+  for line in _ClassReader(data).Describe():
+    md5.update(line)
+    md5.update(b'\n')
+  return md5.hexdigest()
+
+
+def ReadClassInfo(data):
+  """Returns the class hierarchy and references of a class file.
+
+  Args:
+    data: Contents of the class file.
+  Returns:
+    A (name, superclass name, interface names, referenced class names) tuple
+    of byte strings. Referenced classes are the ones named anywhere in the
+    constant pool, including in descriptors and signatures, so they are a
+    superset of the classes that the class uses.
+  Raises:
+    ClassFormatError: If |data| is not a valid class file.
+  """
+  return _ClassReader(data).ReadInfo()
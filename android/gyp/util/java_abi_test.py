@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import java_abi
+
+_ACC_PUBLIC = 0x0001
+_ACC_PRIVATE = 0x0002
+_ACC_STATIC = 0x0008
+_ACC_FINAL = 0x0010
+
+
+class _ClassBuilder(object):
+  """Builds minimal class files, since javac is not available to tests."""
+
+  def __init__(self, name, super_name='java/lang/Object'):
+    self._pool = []
+    self._pool_count = 1
+    self._name = name
+    self._super_name = super_name
+    self.fields = []
+    self.methods = []
+
+  def _Add(self, tag, payload, slots=1):
+    index = self._pool_count
+    self._pool.append(struct.pack('>B', tag) + payload)
+    self._pool_count += slots
+    return index
+
+  def _Utf8(self, s):
+    s = s.encode('utf-8')
+    return self._Add(1, struct.pack('>H', len(s)) + s)
+
+  def _Class(self, name):
+    return self._Add(7, struct.pack('>H', self._Utf8(name)))
+
+  def _Constant(self, value):
+    if isinstance(value, str):
+      return self._Add(8, struct.pack('>H', self._Utf8(value)))
+    if isinstance(value, float):
+      return self._Add(6, struct.pack('>d', value), slots=2)
+    if value > 0x7fffffff:
+      return self._Add(5, struct.pack('>q', value), slots=2)
+    return self._Add(3, struct.pack('>i', value))
+
+  def _Attribute(self, name, payload):
+    return struct.pack('>HI', self._Utf8(name), len(payload)) + payload
+
+  def _Member(self, member, is_field):
+    flags, name, descriptor, extra = member
+    attributes = []
+    if is_field and extra is not None:
+      attributes.append(
+          self._Attribute('ConstantValue',
+                          struct.pack('>H', self._Constant(extra))))
+    elif not is_field:
+      # Method bodies are not part of the ABI, so include them to check that.
+      code = struct.pack('>HHI', 1, 1, len(extra)) + extra + struct.pack(
+          '>HH', 0, 0)
+      attributes.append(self._Attribute('Code', code))
+    ret = struct.pack('>HHHH', flags, self._Utf8(name), self._Utf8(descriptor),
+                      len(attributes))
+    return ret + b''.join(attributes)
+
+  def Build(self):
+    this_index = self._Class(self._name)
+    super_index = self._Class(self._super_name)
+    fields = [self._Member(f, True) for f in self.fields]
+    methods = [self._Member(m, False) for m in self.methods]
+    ret = struct.pack('>IHHH', 0xCAFEBABE, 0, 52, self._pool_count)
+    ret += b''.join(self._pool)
+    ret += struct.pack('>HHHH', _ACC_PUBLIC | 0x0020, this_index, super_index,
+                       0)
+    ret += struct.pack('>H', len(fields)) + b''.join(fields)
+    ret += struct.pack('>H', len(methods)) + b''.join(methods)
+    ret += struct.pack('>H', 0)
+    return ret
+
+
+def _CreateBuilder():
+  builder = _ClassBuilder('org/chromium/Foo')
+  builder.fields = [
+      (_ACC_PUBLIC | _ACC_STATIC | _ACC_FINAL, 'SIZE', 'I', 10),
+      (_ACC_PUBLIC | _ACC_STATIC | _ACC_FINAL, 'BIG', 'J', 1 << 40),
+      (_ACC_PRIVATE, 'mValue', 'Ljava/lang/String;', None),
+  ]
+  builder.methods = [
+      (_ACC_PUBLIC, '<init>', '()V', b'\xb1'),
+      (_ACC_PUBLIC, 'getValue', '()Ljava/lang/String;', b'\x01\xb0'),
+      (_ACC_PRIVATE, 'helper', '()V', b'\xb1'),
+  ]
+  return builder
+
+
+class JavaAbiTest(unittest.TestCase):
+  def setUp(self):
+    self._builder = _CreateBuilder()
+    self._abi = java_abi.ComputeClassAbi(self._builder.Build())
+
+  def _AssertAbiChanged(self, changed):
+    abi = java_abi.ComputeClassAbi(self._builder.Build())
+    if changed:
+      self.assertNotEqual(self._abi, abi)
+    else:
+      self.assertEqual(self._abi, abi)
+
+  def testMethodBodyChange(self):
+    self._builder.methods[1] = (_ACC_PUBLIC, 'getValue',
+                                '()Ljava/lang/String;', b'\x01\x01\x57\xb0')
+    self._AssertAbiChanged(False)
+
+  def testPrivateMemberChanges(self):
+    self._builder.methods.append((_ACC_PRIVATE, 'helper2', '(I)V', b'\xb1'))
+    self._builder.fields[2] = (_ACC_PRIVATE, 'mValue', 'I', None)
+    self._AssertAbiChanged(False)
+
+  def testMemberOrder(self):
+    self._builder.methods.reverse()
+    self._builder.fields.reverse()
+    self._AssertAbiChanged(False)
+
+  def testPublicMethodAdded(self):
+    self._builder.methods.append((_ACC_PUBLIC, 'setValue', '(I)V', b'\xb1'))
+    self._AssertAbiChanged(True)
+
+  def testMethodVisibilityChange(self):
+    self._builder.methods[2] = (_ACC_PUBLIC, 'helper', '()V', b'\xb1')
+    self._AssertAbiChanged(True)
+
+  def testConstantValueChange(self):
+    # Constants are inlined into dependents.
+    self._builder.fields[0] = (_ACC_PUBLIC | _ACC_STATIC | _ACC_FINAL, 'SIZE',
+                               'I', 11)
+    self._AssertAbiChanged(True)
+
+  def testLongConstantValueChange(self):
+    self._builder.fields[1] = (_ACC_PUBLIC | _ACC_STATIC | _ACC_FINAL, 'BIG',
+                               'J', 1 << 41)
+    self._AssertAbiChanged(True)
+
+  def testSuperclassChange(self):
+    self._builder._super_name = 'java/lang/Exception'
+    self._AssertAbiChanged(True)
+
+  def testInvalidClassFile(self):
+    with self.assertRaises(java_abi.ClassFormatError):
+      java_abi.ComputeClassAbi(b'PK\x03\x04')
+    with self.assertRaises(java_abi.ClassFormatError):
+      java_abi.ComputeClassAbi(self._builder.Build()[:40])
+
+  def testReadClassInfo(self):
+    self._builder.methods.append(
+        (_ACC_PUBLIC, 'getBars', '()[Lorg/chromium/Bar;', b'\x01\xb0'))
+    self._builder.methods.append(
+        (_ACC_PUBLIC, 'getList', '()Ljava/util/List<Lorg/chromium/Baz;>;',
+         b'\x01\xb0'))
+    name, super_name, interfaces, references = java_abi.ReadClassInfo(
+        self._builder.Build())
+    self.assertEqual(b'org/chromium/Foo', name)
+    self.assertEqual(b'java/lang/Object', super_name)
+    self.assertEqual([], interfaces)
+    self.assertEqual(
+        set([
+            b'org/chromium/Foo', b'java/lang/Object', b'java/lang/String',
+            b'org/chromium/Bar', b'java/util/List', b'org/chromium/Baz'
+        ]), references)
+
+  def testIsAnonymousOrLocalClass(self):
+    self.assertTrue(java_abi.IsAnonymousOrLocalClass('org/Foo$1.class'))
+    self.assertTrue(java_abi.IsAnonymousOrLocalClass('org/Foo$Bar$2Baz.class'))
+    self.assertFalse(java_abi.IsAnonymousOrLocalClass('org/Foo$Bar.class'))
+    self.assertFalse(java_abi.IsAnonymousOrLocalClass('org/Foo.class'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,538 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Runs Java build tools in warm, long-lived JVMs.
+
+Starting a JVM and warming up its JIT is a large share of the time taken by
+Java build steps (javac, turbine, D8, R8), and a build runs thousands of them.
+When the ANDROID_JVM_WORKERS environment variable is set to the maximum number
+of JVMs to keep alive (e.g. ANDROID_JVM_WORKERS=8), CheckOutput() sends Java
+commands to a daemon instead of starting a JVM for each one. This works like
+Bazel's persistent workers:
+
+  * There is one daemon per output directory. It is started by the first
+    command that needs it, and exits after being idle for a while.
+  * Each JVM runs a single tool (a main class, classpath and set of JVM flags)
+    through //build/android/jvm_worker, one request at a time. Concurrent
+    requests are multiplexed onto different JVMs, and idle JVMs of other tools
+    are stopped to make room when needed.
+  * Commands that workers cannot run the same way (e.g. ones that set
+    environment variables), and commands whose daemon or JVM failed, run as a
+    subprocess, just like when workers are disabled.
+"""
+
+import argparse
+import collections
+import fcntl
+import functools
+import json
+import logging
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zipfile
+
+try:
+  import socketserver
+except ImportError:
+  import SocketServer as socketserver
+
+from util import build_utils
+
+_MAX_WORKERS_ENV = 'ANDROID_JVM_WORKERS'
+
+# Relative to the output directory, which is the working directory of build
+# steps. Keeps the socket path short.
+_WORKERS_DIR = '.jvm_workers'
+_SOCKET_PATH = os.path.join(_WORKERS_DIR, 'daemon.sock')
+_LOCK_PATH = os.path.join(_WORKERS_DIR, 'daemon.lock')
+_LOG_PATH = os.path.join(_WORKERS_DIR, 'daemon.log')
+# Exists when the daemon recently failed to start.
+_FAILED_START_PATH = os.path.join(_WORKERS_DIR, 'daemon.failed')
+_CLASSES_DIR = os.path.join(_WORKERS_DIR, 'classes')
+
+_DAEMON_START_TIMEOUT_SECONDS = 10
+_DAEMON_IDLE_TIMEOUT_SECONDS = 15 * 60
+
+_JAVA_PATH = os.path.join(build_utils.JAVA_HOME, 'bin', 'java')
+_JAVAC_MAIN_CLASS = 'com.sun.tools.javac.Main'
+_WORKER_MAIN_CLASS = 'org.chromium.build.JvmWorker'
+_WORKER_SOURCE = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                              'jvm_worker', 'java', 'org', 'chromium', 'build',
+                              'JvmWorker.java')
+
+# JVM flags that can be set once per JVM.
+_JVM_FLAG_PREFIXES = ('-D', '-X', '-ea', '-da', '-noverify')
+
+# A tool that a JVM worker runs. |classpath| is a colon-separated string.
+_Tool = collections.namedtuple('_Tool',
+                               'java jvm_flags classpath main_class')
+
+
+def _GetMaxWorkers():
+  try:
+    return int(os.environ.get(_MAX_WORKERS_ENV) or 0)
+  except ValueError:
+    return 0
+
+
+def _GetJarMainClass(jar_path):
+  """Returns the Main-Class of a jar that has no Class-Path, or None."""
+  try:
+    with zipfile.ZipFile(jar_path) as z:
+      manifest = z.read('META-INF/MANIFEST.MF').decode('utf-8')
+  except (IOError, KeyError, zipfile.BadZipfile):
+    return None
+  lines = []
+  for line in manifest.splitlines():
+    # Long values are continued on lines that start with a space.
+    if line.startswith(' ') and lines:
+      lines[-1] += line[1:]
+    else:
+      lines.append(line)
+  attributes = dict(l.split(': ', 1) for l in lines if ': ' in l)
+  if 'Class-Path' in attributes:
+    return None
+  return attributes.get('Main-Class')
+
+
+def _ParseJavaCommand(args):
+  """Splits a Java command into the tool to run and its arguments.
+
+  Handles "java [flags] [-cp classpath] main_class args",
+  "java [flags] -jar jar args" and "javac args".
+
+  Returns:
+    A tuple of (_Tool, tool arguments), or None if the command is not one that
+    a JVM worker can run.
+  """
+  if not args:
+    return None
+  if args[0] == build_utils.JAVAC_PATH:
+    # -J flags are for the JVM that runs javac.
+    if any(a.startswith('-J') for a in args[1:]):
+      return None
+    return _Tool(_JAVA_PATH, [], '', _JAVAC_MAIN_CLASS), args[1:]
+  if os.path.basename(args[0]) != 'java':
+    return None
+
+  jvm_flags = []
+  classpath = ''
+  i = 1
+  while i < len(args):
+    arg = args[i]
+    if arg in ('-cp', '-classpath', '--class-path') and i + 1 < len(args):
+      classpath = args[i + 1]
+      i += 2
+    elif arg == '-jar' and i + 1 < len(args):
+      main_class = _GetJarMainClass(args[i + 1])
+      if main_class is None:
+        return None
+      return _Tool(args[0], jvm_flags, args[i + 1], main_class), args[i + 2:]
+    elif arg.startswith(_JVM_FLAG_PREFIXES):
+      jvm_flags.append(arg)
+      i += 1
+    elif arg.startswith('-'):
+      return None
+    else:
+      return _Tool(args[0], jvm_flags, classpath, arg), args[i + 1:]
+  return None
+
+
+def _ComputeStamp(tool):
+  """Returns the mtimes of the JVM and classpath of |tool|, or None.
+
+  Requests with different stamps do not share JVMs, so that e.g. rebuilding a
+  tool's .jar does not leave JVMs running the old one.
+  """
+  paths = [tool.java] + [p for p in tool.classpath.split(':') if p]
+  try:
+    return [os.path.getmtime(p) for p in paths]
+  except OSError:
+    return None
+
+
+def _Connect():
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(_SOCKET_PATH)
+    return sock
+  except socket.error:
+    sock.close()
+    return None
+
+
+def _StartDaemon():
+  logging.info('Starting JVM worker daemon')
+  if os.path.exists(_SOCKET_PATH):
+    os.unlink(_SOCKET_PATH)
+  env = dict(os.environ)
+  gyp_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+  env['PYTHONPATH'] = os.pathsep.join(
+      p for p in (gyp_dir, env.get('PYTHONPATH')) if p)
+  cmd = [
+      sys.executable, '-m', 'util.jvm_workers', '--daemon',
+      str(_GetMaxWorkers())
+  ]
+  with open(os.devnull) as devnull, open(_LOG_PATH, 'w') as log:
+    # Detach the daemon from the build step, so that e.g. ninja does not wait
+    # for it to close stdout, and ctrl-c does not reach it.
+    subprocess.Popen(cmd,
+                     stdin=devnull,
+                     stdout=log,
+                     stderr=subprocess.STDOUT,
+                     env=env,
+                     close_fds=True,
+                     preexec_fn=os.setsid)
+
+
+def _ConnectOrStartDaemon():
+  sock = _Connect()
+  if sock:
+    return sock
+  build_utils.MakeDirectory(_WORKERS_DIR)
+  with open(_LOCK_PATH, 'w') as lock_file:
+    # Ensure that concurrent build steps start only one daemon.
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    sock = _Connect()
+    if sock:
+      return sock
+    # Do not make every build step wait for a daemon that cannot start.
+    if (os.path.exists(_FAILED_START_PATH) and time.time() -
+        os.path.getmtime(_FAILED_START_PATH) < _DAEMON_IDLE_TIMEOUT_SECONDS):
+      return None
+    _StartDaemon()
+    deadline = time.time() + _DAEMON_START_TIMEOUT_SECONDS
+    while time.time() < deadline:
+      time.sleep(0.05)
+      sock = _Connect()
+      if sock:
+        return sock
+    build_utils.Touch(_FAILED_START_PATH)
+  return None
+
+
+def _SendRequest(sock, request):
+  """Sends |request| to the daemon and returns its response."""
+  sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+  sock.shutdown(socket.SHUT_WR)
+  chunks = []
+  while True:
+    data = sock.recv(65536)
+    if not data:
+      break
+    chunks.append(data)
+  return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def _RunInDaemon(tool, tool_args, stamp, args, cwd, env):
+  """A build_utils.CheckOutput() run_func that runs |args| in a JVM worker."""
+  response = {}
+  sock = _ConnectOrStartDaemon()
+  if sock:
+    request = {'tool': list(tool), 'stamp': stamp, 'args': tool_args}
+    try:
+      response = _SendRequest(sock, request)
+    except (socket.error, ValueError) as e:
+      response = {'error': str(e)}
+    finally:
+      sock.close()
+  else:
+    response = {'error': 'Could not start the daemon. See ' + _LOG_PATH}
+
+  if 'returncode' in response:
+    stdout = response['stdout']
+    stderr = response['stderr']
+    if sys.version_info[0] == 2:
+      stdout = stdout.encode('utf-8')
+      stderr = stderr.encode('utf-8')
+    return response['returncode'], stdout, stderr
+
+  logging.warning('Running without a JVM worker: %s', response.get('error'))
+  child = subprocess.Popen(args,
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE,
+                           cwd=cwd,
+                           env=env)
+  stdout, stderr = child.communicate()
+  return child.returncode, stdout, stderr
+
+
+def CheckOutput(args, cwd=None, env=None, **kwargs):
+  """Same as build_utils.CheckOutput(), but uses JVM workers when enabled.
+
+  Commands that JVM workers cannot run are run as a subprocess.
+  """
+  parsed = None
+  if (_GetMaxWorkers() > 0 and env is None
+      and (cwd is None or os.path.abspath(cwd) == os.getcwd())):
+    parsed = _ParseJavaCommand(args)
+  stamp = parsed and _ComputeStamp(parsed[0])
+  if not stamp:
+    return build_utils.CheckOutput(args, cwd=cwd, env=env, **kwargs)
+  tool, tool_args = parsed
+  return build_utils.CheckOutput(args,
+                                 cwd=cwd,
+                                 run_func=functools.partial(
+                                     _RunInDaemon, tool, tool_args, stamp),
+                                 **kwargs)
+
+
+class _WorkerCrashed(Exception):
+  pass
+
+
+def _ReadExactly(f, size):
+  data = f.read(size)
+  if len(data) != size:
+    raise _WorkerCrashed('JVM worker exited')
+  return data
+
+
+class _Worker(object):
+  """A JVM that runs one tool. See JvmWorker.java for the protocol."""
+
+  def __init__(self, cmd):
+    self._proc = subprocess.Popen(cmd,
+                                  stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE,
+                                  close_fds=True)
+    self._next_request_id = 0
+
+  def IsAlive(self):
+    return self._proc.poll() is None
+
+  def Stop(self):
+    if self.IsAlive():
+      self._proc.kill()
+    self._proc.wait()
+
+  def Run(self, args):
+    """Returns (returncode, stdout, stderr) of running the tool with |args|.
+
+    Raises:
+      _WorkerCrashed: If the JVM exited. It cannot be used after that.
+    """
+    request_id = self._next_request_id
+    self._next_request_id += 1
+    encoded_args = [a.encode('utf-8') for a in args]
+    request = [struct.pack('>ii', request_id, len(encoded_args))]
+    for arg in encoded_args:
+      request += [struct.pack('>i', len(arg)), arg]
+    try:
+      self._proc.stdin.write(b''.join(request))
+      self._proc.stdin.flush()
+      response_id, returncode, stdout_size = struct.unpack(
+          '>iii', _ReadExactly(self._proc.stdout, 12))
+      stdout = _ReadExactly(self._proc.stdout, stdout_size)
+      stderr_size = struct.unpack('>i', _ReadExactly(self._proc.stdout, 4))[0]
+      stderr = _ReadExactly(self._proc.stdout, stderr_size)
+    except (IOError, OSError, _WorkerCrashed) as e:
+      self.Stop()
+      raise _WorkerCrashed(str(e))
+    if response_id != request_id:
+      self.Stop()
+      raise _WorkerCrashed('Expected response %d, got %d' %
+                           (request_id, response_id))
+    return (returncode, stdout.decode('utf-8', 'replace'),
+            stderr.decode('utf-8', 'replace'))
+
+
+class _WorkerPool(object):
+  """Runs requests on up to |max_workers| workers. Thread-safe.
+
+  Args:
+    max_workers: The maximum number of workers alive at a time.
+    start_func: A function that takes a key and returns a new _Worker for it.
+        Workers are reused only for requests with the same key.
+  """
+
+  def __init__(self, max_workers, start_func):
+    self._max_workers = max_workers
+    self._start_func = start_func
+    self._cond = threading.Condition()
+    self._num_workers = 0
+    # (key, _Worker) of idle workers, least recently used first.
+    self._idle = []
+
+  def _Acquire(self, key):
+    stopped = None
+    with self._cond:
+      while True:
+        for i, (idle_key, worker) in enumerate(self._idle):
+          if idle_key == key:
+            del self._idle[i]
+            return worker
+        if self._num_workers < self._max_workers:
+          self._num_workers += 1
+          break
+        if self._idle:
+          # Replace the least recently used worker of another tool.
+          _, stopped = self._idle.pop(0)
+          break
+        self._cond.wait()
+    if stopped:
+      stopped.Stop()
+    try:
+      return self._start_func(key)
+    except Exception:
+      self._Release(key, None)
+      raise
+
+  def _Release(self, key, worker):
+    with self._cond:
+      if worker and worker.IsAlive():
+        self._idle.append((key, worker))
+      else:
+        self._num_workers -= 1
+      self._cond.notify()
+
+  def Run(self, key, args):
+    """Returns (returncode, stdout, stderr) of running |args| on a worker."""
+    worker = self._Acquire(key)
+    try:
+      return worker.Run(args)
+    finally:
+      self._Release(key, worker)
+
+  def StopAll(self):
+    with self._cond:
+      for _, worker in self._idle:
+        worker.Stop()
+      self._num_workers -= len(self._idle)
+      self._idle = []
+
+
+_compile_lock = threading.Lock()
+# Set when compiling JvmWorker.java failed, so that it is not retried.
+_compile_error = []
+
+
+def _CompileWorkerClass():
+  """Compiles JvmWorker.java if it changed, and returns its classpath."""
+  class_path = os.path.join(_CLASSES_DIR, *
+                            _WORKER_MAIN_CLASS.split('.')) + '.class'
+  with _compile_lock:
+    if _compile_error:
+      raise Exception(_compile_error[0])
+    if build_utils.IsTimeStale(class_path, [_WORKER_SOURCE]):
+      logging.info('Compiling %s', _WORKER_SOURCE)
+      build_utils.DeleteDirectory(_CLASSES_DIR)
+      build_utils.MakeDirectory(_CLASSES_DIR)
+      try:
+        build_utils.CheckOutput(
+            [build_utils.JAVAC_PATH, '-d', _CLASSES_DIR, _WORKER_SOURCE],
+            fail_on_output=False)
+      except (build_utils.CalledProcessError, OSError) as e:
+        _compile_error.append('Failed to compile JvmWorker: %s' % e)
+        raise
+  return _CLASSES_DIR
+
+
+def _StartJvmWorker(key):
+  java, jvm_flags, classpath, main_class, _ = key
+  worker_classpath = _CompileWorkerClass()
+  if classpath:
+    worker_classpath += ':' + classpath
+  logging.info('Starting JVM for %s (%s)', main_class, classpath)
+  return _Worker([java] + list(jvm_flags) +
+                 ['-cp', worker_classpath, _WORKER_MAIN_CLASS, main_class])
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+  def handle(self):
+    try:
+      request = json.loads(self.rfile.readline().decode('utf-8'))
+    except ValueError:
+      return
+    tool = _Tool(*request['tool'])
+    key = (tool.java, tuple(tool.jvm_flags), tool.classpath, tool.main_class,
+           tuple(request['stamp']))
+    self.server.OnRequestStarted()
+    try:
+      returncode, stdout, stderr = self.server.pool.Run(key, request['args'])
+      response = {'returncode': returncode, 'stdout': stdout, 'stderr': stderr}
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception('Request for %s failed', tool.main_class)
+      response = {'error': str(e)}
+    finally:
+      self.server.OnRequestFinished()
+    self.wfile.write(json.dumps(response).encode('utf-8'))
+
+
+class _Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  """Serves requests from CheckOutput() until it is idle for |idle_timeout|."""
+
+  daemon_threads = True
+
+  def __init__(self, socket_path, max_workers, start_func, idle_timeout):
+    socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+    # Another daemon may replace the socket after this one stops accepting
+    # requests, in which case it must not delete it.
+    self._socket_inode = os.stat(socket_path).st_ino
+    self._socket_path = socket_path
+    self.pool = _WorkerPool(max_workers, start_func)
+    self._idle_timeout = idle_timeout
+    self._lock = threading.Lock()
+    self._num_active_requests = 0
+    self._last_request_time = time.time()
+
+  def OnRequestStarted(self):
+    with self._lock:
+      self._num_active_requests += 1
+
+  def OnRequestFinished(self):
+    with self._lock:
+      self._num_active_requests -= 1
+      self._last_request_time = time.time()
+
+  def _IsIdle(self):
+    with self._lock:
+      return (self._num_active_requests == 0 and
+              time.time() - self._last_request_time > self._idle_timeout)
+
+  def _ShutdownWhenIdle(self):
+    while not self._IsIdle():
+      time.sleep(min(self._idle_timeout, 30))
+    logging.info('Idle for %ss, exiting', self._idle_timeout)
+    self.shutdown()
+
+  def Serve(self):
+    watcher = threading.Thread(target=self._ShutdownWhenIdle)
+    watcher.daemon = True
+    watcher.start()
+    try:
+      self.serve_forever()
+    finally:
+      self.server_close()
+      self.pool.StopAll()
+      try:
+        if os.stat(self._socket_path).st_ino == self._socket_inode:
+          os.unlink(self._socket_path)
+      except OSError:
+        pass
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--daemon',
+                      type=int,
+                      required=True,
+                      metavar='MAX_WORKERS',
+                      help='Run the daemon, with at most this many JVMs.')
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=logging.INFO,
+                      format='%(asctime)s %(threadName)s: %(message)s')
+  daemon = _Daemon(_SOCKET_PATH, max(1, args.daemon), _StartJvmWorker,
+                   _DAEMON_IDLE_TIMEOUT_SECONDS)
+  daemon.Serve()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Measures a sequence of Java build steps with and without JVM workers.
+
+Each step compiles a small generated library with javac, and then dexes it
+with D8 (when //third_party/r8 is checked out), the way compile_java.py and
+dex.py do. The sequence is run once without workers, and then twice with
+workers: first without JVMs for these tools (which includes starting the
+daemon, unless it is already running), then with warm JVMs.
+
+Must be run from the output directory, e.g.:
+  cd out/Debug && ../../build/android/gyp/util/jvm_workers_benchmark.py
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import jvm_workers
+
+_R8_PATH = os.path.join(build_utils.DIR_SOURCE_ROOT, 'third_party', 'r8', 'lib',
+                        'r8.jar')
+
+
+def _WriteSources(src_dir, step, num_classes):
+  paths = []
+  package_dir = os.path.join(src_dir, 'org', 'chromium', 'step%d' % step)
+  build_utils.MakeDirectory(package_dir)
+  for i in range(num_classes):
+    path = os.path.join(package_dir, 'Class%d.java' % i)
+    with open(path, 'w') as f:
+      f.write('package org.chromium.step%d;\n' % step)
+      f.write('public class Class%d {\n' % i)
+      f.write('  public int compute(int x) { return x * %d; }\n' % i)
+      f.write('}\n')
+    paths.append(path)
+  return paths
+
+
+def _RunSteps(tmp_dir, num_steps, num_classes):
+  for step in range(num_steps):
+    step_dir = os.path.join(tmp_dir, 'step%d' % step)
+    classes_dir = os.path.join(step_dir, 'classes')
+    build_utils.MakeDirectory(classes_dir)
+    java_files = _WriteSources(os.path.join(step_dir, 'src'), step, num_classes)
+    jvm_workers.CheckOutput([build_utils.JAVAC_PATH, '-d', classes_dir] +
+                            java_files)
+    if os.path.exists(_R8_PATH):
+      jar_path = os.path.join(step_dir, 'classes.jar')
+      build_utils.ZipDir(jar_path, classes_dir)
+      dex_dir = os.path.join(step_dir, 'dex')
+      build_utils.MakeDirectory(dex_dir)
+      jvm_workers.CheckOutput(
+          build_utils.JavaCmd(verify=False) +
+          ['-cp', _R8_PATH, 'com.android.tools.r8.D8', '--output', dex_dir] +
+          [jar_path],
+          fail_on_output=False)
+
+
+def _Time(num_steps, num_classes):
+  with build_utils.TempDir() as tmp_dir:
+    start = time.time()
+    _RunSteps(tmp_dir, num_steps, num_classes)
+    return time.time() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--steps', type=int, default=20,
+                      help='Number of build steps in the sequence.')
+  parser.add_argument('--classes', type=int, default=20,
+                      help='Number of classes compiled by each step.')
+  parser.add_argument('--max-workers', type=int, default=4,
+                      help='Value of $%s when workers are enabled.' %
+                      jvm_workers._MAX_WORKERS_ENV)
+  args = parser.parse_args()
+
+  if not os.path.exists(_R8_PATH):
+    print('%s not found, running javac steps only.' % _R8_PATH)
+
+  os.environ.pop(jvm_workers._MAX_WORKERS_ENV, None)
+  without_workers = _Time(args.steps, args.classes)
+
+  os.environ[jvm_workers._MAX_WORKERS_ENV] = str(args.max_workers)
+  cold = _Time(args.steps, args.classes)
+  warm = _Time(args.steps, args.classes)
+
+  print('%-25s %9s %9s' % ('', 'Total', 'Per step'))
+  for name, total in (('Without workers', without_workers),
+                      ('With workers (cold)', cold),
+                      ('With workers (warm)', warm)):
+    print('%-25s %8.2fs %8.3fs' % (name, total, total / args.steps))
+  print('The daemon exits after %d minutes of inactivity.' %
+        (jvm_workers._DAEMON_IDLE_TIMEOUT_SECONDS // 60))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
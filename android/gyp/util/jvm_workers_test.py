@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import socket
+import sys
+import threading
+import unittest
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import jvm_workers
+
+# Speaks the protocol of JvmWorker.java, since tests cannot rely on a JDK.
+# Writes its pid and arguments to stdout, and exits when asked to crash.
+_FAKE_WORKER = r"""
+import os
+import struct
+import sys
+
+stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+
+
+def read(size):
+  data = stdin.read(size)
+  if len(data) != size:
+    sys.exit(0)
+  return data
+
+
+while True:
+  request_id, argc = struct.unpack('>ii', read(8))
+  args = [read(struct.unpack('>i', read(4))[0]).decode('utf-8')
+          for _ in range(argc)]
+  if args == ['crash']:
+    sys.exit(1)
+  out = ' '.join([str(os.getpid())] + args).encode('utf-8')
+  err = b'warning'
+  stdout.write(struct.pack('>iii', request_id, len(args), len(out)) + out +
+               struct.pack('>i', len(err)) + err)
+  stdout.flush()
+"""
+
+
+class JvmWorkersTest(unittest.TestCase):
+  def setUp(self):
+    self._tmp_dir_context = build_utils.TempDir()
+    self._tmp_dir = self._tmp_dir_context.__enter__()
+    self._fake_worker = os.path.join(self._tmp_dir, 'fake_worker.py')
+    with open(self._fake_worker, 'w') as f:
+      f.write(_FAKE_WORKER)
+    self._started_keys = []
+
+  def tearDown(self):
+    self._tmp_dir_context.__exit__(None, None, None)
+
+  def _StartFakeWorker(self, key):
+    self._started_keys.append(key)
+    return jvm_workers._Worker([sys.executable, self._fake_worker])
+
+  def _CreatePool(self, max_workers):
+    pool = jvm_workers._WorkerPool(max_workers, self._StartFakeWorker)
+    self.addCleanup(pool.StopAll)
+    return pool
+
+  def testParseJavaCommand(self):
+    tool, args = jvm_workers._ParseJavaCommand(
+        build_utils.JavaCmd(verify=False) +
+        ['-Dfoo=1', '-cp', 'r8.jar', 'com.android.tools.r8.D8', '--release'])
+    self.assertEqual(['-Xmx1G', '-noverify', '-Dfoo=1'], tool.jvm_flags)
+    self.assertEqual('r8.jar', tool.classpath)
+    self.assertEqual('com.android.tools.r8.D8', tool.main_class)
+    self.assertEqual(['--release'], args)
+
+  def testParseJavacCommand(self):
+    tool, args = jvm_workers._ParseJavaCommand(
+        [build_utils.JAVAC_PATH, '-g', '@files.txt'])
+    self.assertEqual('com.sun.tools.javac.Main', tool.main_class)
+    self.assertEqual(['-g', '@files.txt'], args)
+    self.assertIsNone(
+        jvm_workers._ParseJavaCommand([build_utils.JAVAC_PATH, '-J-Xmx2G']))
+
+  def testParseJarCommand(self):
+    jar_path = os.path.join(self._tmp_dir, 'tool.jar')
+    with zipfile.ZipFile(jar_path, 'w') as z:
+      z.writestr('META-INF/MANIFEST.MF',
+                 'Manifest-Version: 1.0\nMain-Class: org.chromium.Too\n l\n')
+    tool, args = jvm_workers._ParseJavaCommand(['java', '-jar', jar_path, 'a'])
+    self.assertEqual('org.chromium.Tool', tool.main_class)
+    self.assertEqual(jar_path, tool.classpath)
+    self.assertEqual(['a'], args)
+
+    with zipfile.ZipFile(jar_path, 'w') as z:
+      z.writestr('META-INF/MANIFEST.MF',
+                 'Main-Class: org.chromium.Tool\nClass-Path: other.jar\n')
+    self.assertIsNone(jvm_workers._ParseJavaCommand(['java', '-jar', jar_path]))
+
+  def testParseUnsupportedCommands(self):
+    self.assertIsNone(jvm_workers._ParseJavaCommand(['aapt2', 'link']))
+    self.assertIsNone(
+        jvm_workers._ParseJavaCommand(['java', '-javaagent:a.jar', 'Main']))
+    self.assertIsNone(jvm_workers._ParseJavaCommand(['java', '-cp', 'a.jar']))
+
+  def testWorkersAreReused(self):
+    pool = self._CreatePool(2)
+    returncode, stdout, stderr = pool.Run('d8', ['a', 'b'])
+    self.assertEqual(2, returncode)
+    self.assertEqual('warning', stderr)
+    pid, args = stdout.split(' ', 1)
+    self.assertEqual('a b', args)
+    self.assertEqual(pid, pool.Run('d8', [])[1])
+    self.assertNotEqual(pid, pool.Run('r8', [])[1])
+    self.assertEqual(['d8', 'r8'], self._started_keys)
+
+  def testLeastRecentlyUsedWorkerIsReplaced(self):
+    pool = self._CreatePool(2)
+    pool.Run('d8', [])
+    pool.Run('r8', [])
+    pool.Run('d8', [])
+    pool.Run('javac', [])
+    pool.Run('d8', [])
+    self.assertEqual(['d8', 'r8', 'javac'], self._started_keys)
+
+  def testConcurrentRequests(self):
+    pool = self._CreatePool(3)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(pool.Run('d8', [])))
+        for _ in range(10)
+    ]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(10, len(results))
+    self.assertLessEqual(len(self._started_keys), 3)
+
+  def testCrashedWorkerIsReplaced(self):
+    pool = self._CreatePool(1)
+    pid = pool.Run('d8', [])[1]
+    with self.assertRaises(jvm_workers._WorkerCrashed):
+      pool.Run('d8', ['crash'])
+    self.assertNotEqual(pid, pool.Run('d8', [])[1])
+
+  def testDaemon(self):
+    socket_path = os.path.join(self._tmp_dir, 'daemon.sock')
+    daemon = jvm_workers._Daemon(socket_path, 1, self._StartFakeWorker, 60)
+    thread = threading.Thread(target=daemon.Serve)
+    thread.start()
+    try:
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      sock.connect(socket_path)
+      request = {
+          'tool': ['java', ['-Xmx1G'], 'r8.jar', 'Main'],
+          'stamp': [1, 2],
+          'args': ['--foo'],
+      }
+      response = jvm_workers._SendRequest(sock, request)
+      sock.close()
+    finally:
+      daemon.shutdown()
+      thread.join()
+    self.assertEqual(1, response['returncode'])
+    self.assertTrue(response['stdout'].endswith(' --foo'))
+    self.assertEqual([('java', ('-Xmx1G', ), 'r8.jar', 'Main', (1, 2))],
+                     self._started_keys)
+    self.assertFalse(os.path.exists(socket_path))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -9,7 +9,10 @@ import hashlib
 import itertools
 import json
 import os
+import shutil
 import sys
+import tempfile
+import time
 import zipfile
 
 from util import build_utils
@@ -23,6 +26,10 @@ PRINT_EXPLANATIONS = int(os.environ.get('PRINT_BUILD_EXPLANATIONS', 0))
 # An escape hatch that causes all targets to be rebuilt.
 _FORCE_REBUILD = int(os.environ.get('FORCE_REBUILD', 0))
 
+# When set, file digests are memoized in this directory and shared between all
+# md5_check invocations. See _DigestCache.
+_DIGEST_CACHE_DIR = os.environ.get('MD5_CHECK_CACHE_DIR')
+
 
 def CallAndWriteDepfileIfStale(on_stale_md5,
                                options,
@@ -88,6 +95,10 @@ def CallAndRecordIfStale(function,
   To debug which files are out-of-date, set the environment variable:
       PRINT_MD5_DIFFS=1
 
+  To avoid re-reading unchanged input files between invocations, set the
+  environment variable:
+      MD5_CHECK_CACHE_DIR=/path/to/cache
+
   Args:
     function: The function to call.
     record_path: Path to record metadata.
@@ -114,6 +125,7 @@ def CallAndRecordIfStale(function,
   new_metadata = _Metadata(track_entries=pass_changes or PRINT_EXPLANATIONS)
   new_metadata.AddStrings(input_strings)
 
+  digest_cache = _DigestCache(_DIGEST_CACHE_DIR) if _DIGEST_CACHE_DIR else None
   zip_allowlist = set(track_subpaths_allowlist or [])
   for path in input_paths:
     # It's faster to md5 an entire zip file than it is to just locate & hash
@@ -122,7 +134,9 @@ def CallAndRecordIfStale(function,
       entries = _ExtractZipEntries(path)
       new_metadata.AddZipFile(path, entries)
     else:
-      new_metadata.AddFile(path, _ComputeTagForPath(path))
+      new_metadata.AddFile(path, _ComputeTagForPath(path, digest_cache))
+  if digest_cache:
+    digest_cache.Flush()
 
   old_metadata = None
   force = force or _FORCE_REBUILD
@@ -439,16 +453,108 @@ class _Metadata(object):
     return (entry['path'] for entry in subentries)
 
 
-def _ComputeTagForPath(path):
+class _DigestCache(object):
+  """On-disk memo of file digests shared by all md5_check invocations.
+
+  Entries are keyed by absolute path and are valid only while the file's
+  (inode, size, mtime_ns) is unchanged, so unchanged files are never re-read.
+  Entries are spread across shard files to limit contention between concurrent
+  build actions, and shards are replaced atomically. Losing an update to a
+  concurrent writer only results in a cache miss.
+
+  Args:
+    cache_dir: Directory to store shard files in.
+  """
+  # Files modified more recently than this are not cached, since a subsequent
+  # write within the filesystem's timestamp granularity would go unnoticed.
+  _MIN_AGE_SECONDS = 2
+
+  def __init__(self, cache_dir):
+    self._cache_dir = cache_dir
+    self._shards = {}
+    # Map of shard name -> {path: entry} for entries added by this process.
+    self._dirty = {}
+
+  @staticmethod
+  def _ShardName(path):
+    return hashlib.md5(path.encode('utf-8')).hexdigest()[:2]
+
+  def _ShardPath(self, name):
+    return os.path.join(self._cache_dir, name + '.json')
+
+  def _ReadShard(self, name):
+    try:
+      with open(self._ShardPath(name)) as f:
+        return json.load(f)
+    except (IOError, OSError, ValueError):
+      return {}
+
+  def GetDigest(self, path):
+    """Returns the md5 of the given file, re-reading it only if it changed."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = [stat.st_ino, stat.st_size, _GetMtimeNs(stat)]
+    name = self._ShardName(path)
+    shard = self._shards.get(name)
+    if shard is None:
+      shard = self._ReadShard(name)
+      self._shards[name] = shard
+    entry = shard.get(path)
+    if entry and entry[:3] == key:
+      return entry[3]
+
+    digest = _ComputeFileMd5(path)
+    if time.time() - stat.st_mtime >= self._MIN_AGE_SECONDS:
+      entry = key + [digest]
+      shard[path] = entry
+      self._dirty.setdefault(name, {})[path] = entry
+    return digest
+
+  def Flush(self):
+    """Writes entries added since the last Flush() to disk."""
+    if not self._dirty:
+      return
+    build_utils.MakeDirectory(self._cache_dir)
+    for name, entries in self._dirty.items():
+      # Re-read so that entries written by concurrent actions are kept.
+      shard = self._ReadShard(name)
+      shard.update(entries)
+      tmp_file = None
+      try:
+        with tempfile.NamedTemporaryFile(
+            'w', dir=self._cache_dir, suffix='.tmp', delete=False) as tmp_file:
+          json.dump(shard, tmp_file, separators=(',', ':'))
+        shutil.move(tmp_file.name, self._ShardPath(name))
+      except (IOError, OSError):
+        # The cache is best-effort.
+        if tmp_file and os.path.exists(tmp_file.name):
+          os.unlink(tmp_file.name)
+    self._dirty = {}
+
+
+def _GetMtimeNs(stat):
+  # st_mtime_ns does not exist in Python 2.
+  return getattr(stat, 'st_mtime_ns', None) or int(stat.st_mtime * 1e9)
+
+
+def _ComputeFileMd5(path):
+  md5 = hashlib.md5()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+      md5.update(chunk)
+  return md5.hexdigest()
+
+
+def _ComputeTagForPath(path, digest_cache=None):
+  # Cached digests are cheap, so use real content hashes even for large files.
+  if digest_cache:
+    return digest_cache.GetDigest(path)
   stat = os.stat(path)
   if stat.st_size > 1 * 1024 * 1024:
     # Fallback to mtime for large files so that md5_check does not take too long
     # to run.
     return stat.st_mtime
-  md5 = hashlib.md5()
-  with open(path, 'rb') as f:
-    md5.update(f.read())
-  return md5.hexdigest()
+  return _ComputeFileMd5(path)
 
 
 def _ComputeInlineMd5(iterable):
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Measures md5_check null-build time with and without MD5_CHECK_CACHE_DIR."""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import md5_check
+
+
+def _CreateInputs(base_dir, num_inputs, input_size):
+  paths = []
+  for i in range(num_inputs):
+    path = os.path.join(base_dir, 'input%d.jar' % i)
+    with open(path, 'wb') as f:
+      f.write(os.urandom(input_size))
+    # Inputs are usually older than the md5_check invocation.
+    os.utime(path, (1, 1))
+    paths.append(path)
+  return paths
+
+
+def _NullBuild(base_dir, num_targets, input_paths):
+  start = time.time()
+  for i in range(num_targets):
+    output_path = os.path.join(base_dir, 'target%d.out' % i)
+    md5_check.CallAndRecordIfStale(lambda p=output_path: build_utils.Touch(p),
+                                   input_paths=input_paths,
+                                   output_paths=[output_path])
+  return time.time() - start
+
+
+def _Measure(num_targets, input_paths, cache_dir):
+  md5_check._DIGEST_CACHE_DIR = cache_dir
+  with build_utils.TempDir() as out_dir:
+    # Initial build creates the .md5.stamp files (and warms the cache).
+    _NullBuild(out_dir, num_targets, input_paths)
+    return _NullBuild(out_dir, num_targets, input_paths)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--targets', type=int, default=200,
+                      help='Number of .md5.stamp targets.')
+  parser.add_argument('--inputs', type=int, default=50,
+                      help='Number of input files shared by all targets.')
+  parser.add_argument('--input-size', type=int, default=512 * 1024,
+                      help='Size of each input file in bytes.')
+  args = parser.parse_args()
+
+  with build_utils.TempDir() as input_dir:
+    input_paths = _CreateInputs(input_dir, args.inputs, args.input_size)
+    uncached = _Measure(args.targets, input_paths, None)
+    with build_utils.TempDir() as cache_dir:
+      cached = _Measure(args.targets, input_paths, cache_dir)
+
+  print('Null build of %d targets with %d inputs of %d bytes:' %
+        (args.targets, args.inputs, args.input_size))
+  print('  Without cache: %.3fs' % uncached)
+  print('  With cache:    %.3fs' % cached)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -5,6 +5,7 @@
 
 import fnmatch
 import os
+import shutil
 import sys
 import tempfile
 import unittest
@@ -173,6 +174,33 @@ class TestMd5Check(unittest.TestCase):
                                         input_file2.name, 'path/1.txt'),
                        added_or_modified_only=False)
 
+  def testDigestCache(self):
+    cache_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, cache_dir)
+    input_file = tempfile.NamedTemporaryFile(suffix='.txt')
+    input_file.write(b'aaaa')
+    input_file.flush()
+    # Make the file old enough to be cached.
+    os.utime(input_file.name, (1, 1))
+
+    cache = md5_check._DigestCache(cache_dir)
+    digest = cache.GetDigest(input_file.name)
+    cache.Flush()
+    self.assertTrue(os.listdir(cache_dir))
+
+    # Same size and timestamps, so the stale digest is returned without
+    # reading the file.
+    input_file.seek(0)
+    input_file.write(b'bbbb')
+    input_file.flush()
+    os.utime(input_file.name, (1, 1))
+    cache = md5_check._DigestCache(cache_dir)
+    self.assertEqual(digest, cache.GetDigest(input_file.name))
+
+    # Changing the timestamp invalidates the entry.
+    os.utime(input_file.name, (2, 2))
+    self.assertNotEqual(digest, cache.GetDigest(input_file.name))
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -28,7 +28,7 @@ from proto import Resources_pb2
 
 # First bytes in an .flat.arsc file.
 # uint32: Magic ("ARSC"), version (1), num_entries (1), type (0)
-_FLAT_ARSC_HEADER = 'AAPT\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00'
+_FLAT_ARSC_HEADER = b'AAPT\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00'
 
 # The package ID hardcoded for shared libraries. See
 # _HardcodeSharedLibraryDynamicAttributes() for more details. If this value
@@ -211,98 +211,259 @@ def HardcodeSharedLibraryDynamicAttributes(zip_path,
   _ProcessZip(zip_path, process_func)
 
 
+# Protobuf wire types. See
+# https://developers.google.com/protocol-buffers/docs/encoding#structure
+_WIRE_TYPE_VARINT = 0
+_WIRE_TYPE_FIXED64 = 1
+_WIRE_TYPE_LENGTH_DELIMITED = 2
+_WIRE_TYPE_FIXED32 = 5
+
+# Field numbers from Resources.proto of the messages that _ResourceStripper
+# descends into.
+_TABLE_PACKAGE_FIELD = 2
+_PACKAGE_TYPE_FIELD = 3
+_TYPE_NAME_FIELD = 2
+_TYPE_ENTRY_FIELD = 3
+_ENTRY_NAME_FIELD = 2
+_ENTRY_CONFIG_VALUE_FIELD = 6
+_CONFIG_VALUE_VALUE_FIELD = 2
+_VALUE_COMPOUND_VALUE_FIELD = 5
+_COMPOUND_VALUE_STYLE_FIELD = 2
+_STYLE_ENTRY_FIELD = 3
+_STYLE_ENTRY_KEY_FIELD = 3
+_REFERENCE_NAME_FIELD = 3
+
+# Returned by field filters to remove the field from its message.
+_DROP = object()
+
+
+def _ReadVarint(buf, pos):
+  result = 0
+  shift = 0
+  while True:
+    b = buf[pos]
+    pos += 1
+    result |= (b & 0x7f) << shift
+    if not b & 0x80:
+      return result, pos
+    shift += 7
+
+
+def _EncodeVarint(value):
+  ret = bytearray()
+  while value > 0x7f:
+    ret.append((value & 0x7f) | 0x80)
+    value >>= 7
+  ret.append(value)
+  return bytes(ret)
+
+
+def _IterFields(buf, start, end):
+  """Yields the fields of the serialized message in buf[start:end].
+
+  Yields:
+    Tuples of (field number, wire type, field start, value start, field end).
+    For length-delimited fields, the value excludes the length prefix.
+  """
+  pos = start
+  while pos < end:
+    field_start = pos
+    tag, pos = _ReadVarint(buf, pos)
+    wire_type = tag & 7
+    if wire_type == _WIRE_TYPE_VARINT:
+      value_start = pos
+      _, pos = _ReadVarint(buf, pos)
+    elif wire_type == _WIRE_TYPE_LENGTH_DELIMITED:
+      length, pos = _ReadVarint(buf, pos)
+      value_start = pos
+      pos += length
+    elif wire_type == _WIRE_TYPE_FIXED64:
+      value_start = pos
+      pos += 8
+    elif wire_type == _WIRE_TYPE_FIXED32:
+      value_start = pos
+      pos += 4
+    else:
+      raise Exception('Unsupported protobuf wire type: {}'.format(wire_type))
+    yield tag >> 3, wire_type, field_start, value_start, pos
+
+
 class _ResourceStripper(object):
+  """Removes resources from a serialized ResourceTable.
+
+  Works directly on the protobuf wire format rather than on Resources_pb2
+  messages: only the fields leading to resource names are decoded, and
+  everything else (including every message that does not change) is copied
+  as-is.
+  """
+
   def __init__(self, partial_path, keep_predicate):
     self.partial_path = partial_path
     self.keep_predicate = keep_predicate
-    self._has_changes = False
-
-  @staticmethod
-  def _IterStyles(entry):
-    for config_value in entry.config_value:
-      value = config_value.value
-      if value.HasField('compound_value'):
-        compound_value = value.compound_value
-        if compound_value.HasField('style'):
-          yield compound_value.style
-
-  def _StripStyles(self, entry, type_and_name):
+    self._data = None
+    self._buf = None
+
+  def _GetString(self, start, end, field_number):
+    """Returns the last value of the given string field of a message."""
+    ret = None
+    for number, wire_type, _, value_start, field_end in _IterFields(
+        self._buf, start, end):
+      if (number == field_number
+          and wire_type == _WIRE_TYPE_LENGTH_DELIMITED):
+        ret = self._data[value_start:field_end].decode('utf-8')
+    return ret
+
+  def _FilterMessage(self, start, end, field_number, field_filter):
+    """Applies |field_filter| to each |field_number| field of a message.
+
+    Args:
+      start: Offset of the message's first field.
+      end: Offset just past the message's last field.
+      field_number: Number of the length-delimited field to filter.
+      field_filter: Function of (value start, value end) returning None to
+        leave the field as-is, _DROP to remove it, or a new value.
+    Returns:
+      The new serialized message, or None if it is unchanged.
+    """
+    chunks = []
+    copied_until = start
+    for number, wire_type, field_start, value_start, field_end in _IterFields(
+        self._buf, start, end):
+      if (number != field_number
+          or wire_type != _WIRE_TYPE_LENGTH_DELIMITED):
+        continue
+      new_value = field_filter(value_start, field_end)
+      if new_value is None:
+        continue
+      chunks.append(self._data[copied_until:field_start])
+      if new_value is not _DROP:
+        chunks.append(_EncodeVarint(number << 3 | _WIRE_TYPE_LENGTH_DELIMITED))
+        chunks.append(_EncodeVarint(len(new_value)))
+        chunks.append(new_value)
+      copied_until = field_end
+    if not chunks:
+      return None
+    chunks.append(self._data[copied_until:end])
+    return b''.join(chunks)
+
+  def _StripStyles(self, start, end, type_and_name):
     # Strip style entries that refer to attributes that have been stripped.
-    for style in self._IterStyles(entry):
-      entries = style.entry
-      new_entries = []
-      for entry in entries:
-        full_name = '{}/{}'.format(type_and_name, entry.key.name)
-        if not self.keep_predicate(full_name):
-          logging.debug('Stripped %s/%s', self.partial_path, full_name)
-        else:
-          new_entries.append(entry)
-
-      if len(new_entries) != len(entries):
-        self._has_changes = True
-        del entries[:]
-        entries.extend(new_entries)
-
-  def _StripEntries(self, entries, type_name):
-    new_entries = []
-    for entry in entries:
-      type_and_name = '{}/{}'.format(type_name, entry.name)
+    def filter_style_entry(start, end):
+      key_name = ''
+      for number, _, _, value_start, field_end in _IterFields(
+          self._buf, start, end):
+        if number == _STYLE_ENTRY_KEY_FIELD:
+          key_name = self._GetString(value_start, field_end,
+                                     _REFERENCE_NAME_FIELD) or ''
+      full_name = '{}/{}'.format(type_and_name, key_name)
+      if not self.keep_predicate(full_name):
+        logging.debug('Stripped %s/%s', self.partial_path, full_name)
+        return _DROP
+      return None
+
+    def filter_style(start, end):
+      return self._FilterMessage(start, end, _STYLE_ENTRY_FIELD,
+                                 filter_style_entry)
+
+    def filter_compound_value(start, end):
+      return self._FilterMessage(start, end, _COMPOUND_VALUE_STYLE_FIELD,
+                                 filter_style)
+
+    def filter_value(start, end):
+      return self._FilterMessage(start, end, _VALUE_COMPOUND_VALUE_FIELD,
+                                 filter_compound_value)
+
+    def filter_config_value(start, end):
+      return self._FilterMessage(start, end, _CONFIG_VALUE_VALUE_FIELD,
+                                 filter_value)
+
+    return self._FilterMessage(start, end, _ENTRY_CONFIG_VALUE_FIELD,
+                               filter_config_value)
+
+  def _StripEntries(self, start, end):
+    type_name = self._GetString(start, end, _TYPE_NAME_FIELD) or ''
+
+    def filter_entry(start, end):
+      name = self._GetString(start, end, _ENTRY_NAME_FIELD) or ''
+      type_and_name = '{}/{}'.format(type_name, name)
       if not self.keep_predicate(type_and_name):
         logging.debug('Stripped %s/%s', self.partial_path, type_and_name)
-      else:
-        new_entries.append(entry)
-        self._StripStyles(entry, type_and_name)
+        return _DROP
+      # Only resources of type "style" have style values.
+      if type_name != 'style':
+        return None
+      return self._StripStyles(start, end, type_and_name)
 
-    if len(new_entries) != len(entries):
-      self._has_changes = True
-      del entries[:]
-      entries.extend(new_entries)
+    return self._FilterMessage(start, end, _TYPE_ENTRY_FIELD, filter_entry)
 
-  def StripTable(self, table):
-    self._has_changes = False
-    for package in table.package:
-      for _type in package.type:
-        self._StripEntries(_type.entry, _type.name)
-    return self._has_changes
+  def StripTable(self, data, start=0, end=None):
+    """Returns the serialized ResourceTable in data[start:end] with unwanted
+    resources removed, or None if there are none to remove."""
+    self._data = data
+    self._buf = bytearray(data)
 
+    def filter_package(start, end):
+      return self._FilterMessage(start, end, _PACKAGE_TYPE_FIELD,
+                                 self._StripEntries)
 
-def _TableFromFlatBytes(data):
+    try:
+      return self._FilterMessage(start, len(data) if end is None else end,
+                                 _TABLE_PACKAGE_FIELD, filter_package)
+    finally:
+      self._data = None
+      self._buf = None
+
+
+def _StripFlatTable(stripper, filename, data):
   # https://cs.android.com/android/platform/superproject/+/master:frameworks/base/tools/aapt2/format/Container.cpp
   size_idx = len(_FLAT_ARSC_HEADER)
   proto_idx = size_idx + 8
   if data[:size_idx] != _FLAT_ARSC_HEADER:
-    raise Exception('Error parsing {} in {}'.format(info.filename, zip_path))
+    raise Exception('Error parsing {} in {}'.format(filename,
+                                                    stripper.partial_path))
   # Size is stored as uint64.
   size = struct.unpack('<Q', data[size_idx:proto_idx])[0]
-  table = Resources_pb2.ResourceTable()
-  proto_bytes = data[proto_idx:proto_idx + size]
-  table.ParseFromString(proto_bytes)
-  return table
-
-
-def _FlatBytesFromTable(table):
-  proto_bytes = table.SerializeToString()
+  proto_bytes = stripper.StripTable(data, proto_idx, proto_idx + size)
+  if proto_bytes is None:
+    return None
   size = struct.pack('<Q', len(proto_bytes))
   overage = len(proto_bytes) % 4
-  padding = '\0' * (4 - overage) if overage else ''
-  return ''.join((_FLAT_ARSC_HEADER, size, proto_bytes, padding))
+  padding = b'\0' * (4 - overage) if overage else b''
+  return b''.join((_FLAT_ARSC_HEADER, size, proto_bytes, padding))
 
 
 def StripUnwantedResources(partial_path, keep_predicate):
   """Removes resources from .arsc.flat files inside of a .zip.
 
+  The .zip is rewritten only if some resources are removed, and then only the
+  .arsc.flat entries that contain them are modified.
+
   Args:
     partial_path: Path to a .zip containing .arsc.flat entries
-    keep_predicate: Given "$partial_path/$res_type/$res_name", returns
-      whether to keep the resource.
+    keep_predicate: Given "$res_type/$res_name" (or, for entries of styles,
+      "$res_type/$res_name/$attr_name"), returns whether to keep the
+      resource. Called once per resource, so it should be fast (e.g. a single
+      pre-compiled regex rather than a list of them).
   """
   stripper = _ResourceStripper(partial_path, keep_predicate)
+  new_entries = {}
+  with zipfile.ZipFile(partial_path) as src_zip:
+    for info in src_zip.infolist():
+      if info.filename.endswith('.arsc.flat'):
+        new_data = _StripFlatTable(stripper, info.filename, src_zip.read(info))
+        if new_data is not None:
+          new_entries[info.filename] = new_data
 
-  def process_file(filename, data):
-    if filename.endswith('.arsc.flat'):
-      table = _TableFromFlatBytes(data)
-      if stripper.StripTable(table):
-        data = _FlatBytesFromTable(table)
-    return data
+  if not new_entries:
+    return
 
-  _ProcessZip(partial_path, process_file)
+  # Stream entries into the new .zip one at a time rather than holding the
+  # whole partial in memory.
+  with zipfile.ZipFile(partial_path) as src_zip:
+    with build_utils.AtomicOutput(partial_path, only_if_changed=False) as f:
+      with zipfile.ZipFile(f, 'w') as dst_zip:
+        for info in src_zip.infolist():
+          data = new_entries.get(info.filename)
+          if data is None:
+            data = src_zip.read(info)
+          dst_zip.writestr(info, data)
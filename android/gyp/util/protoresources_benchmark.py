@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Measures protoresources.StripUnwantedResources() on locale partials.
+
+Compares it against parsing and re-serializing each table with Resources_pb2
+(the previous implementation), and checks that both produce the same tables.
+
+By default, partials the size of Chrome's translated strings are generated.
+To use real ones instead, pass the .zip files written by "aapt2 compile" (e.g.
+by temporarily keeping compile_resources.py's temp dir).
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import shutil
+import struct
+import sys
+import time
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import protoresources
+
+from proto import Resources_pb2
+
+
+def _ParseFlat(data):
+  size_idx = len(protoresources._FLAT_ARSC_HEADER)
+  size = struct.unpack('<Q', data[size_idx:size_idx + 8])[0]
+  table = Resources_pb2.ResourceTable()
+  table.ParseFromString(data[size_idx + 8:size_idx + 8 + size])
+  return table
+
+
+def _SerializeFlat(table):
+  proto_bytes = table.SerializeToString()
+  padding = b'\0' * (-len(proto_bytes) % 4)
+  return b''.join((protoresources._FLAT_ARSC_HEADER,
+                   struct.pack('<Q', len(proto_bytes)), proto_bytes, padding))
+
+
+def _StripWithProtobuf(partial_path, keep_predicate):
+  has_changes = False
+  zip_entries = []
+  with zipfile.ZipFile(partial_path) as src_zip:
+    for info in src_zip.infolist():
+      data = src_zip.read(info)
+      if info.filename.endswith('.arsc.flat'):
+        table = _ParseFlat(data)
+        changed = False
+        for package in table.package:
+          for _type in package.type:
+            entries = [
+                e for e in _type.entry
+                if keep_predicate('{}/{}'.format(_type.name, e.name))
+            ]
+            if len(entries) != len(_type.entry):
+              changed = True
+              del _type.entry[:]
+              _type.entry.extend(entries)
+            for entry in _type.entry:
+              type_and_name = '{}/{}'.format(_type.name, entry.name)
+              for config_value in entry.config_value:
+                style = config_value.value.compound_value.style
+                style_entries = [
+                    e for e in style.entry if keep_predicate('{}/{}'.format(
+                        type_and_name, e.key.name))
+                ]
+                if len(style_entries) != len(style.entry):
+                  changed = True
+                  del style.entry[:]
+                  style.entry.extend(style_entries)
+        if changed:
+          has_changes = True
+          data = _SerializeFlat(table)
+      zip_entries.append((info, data))
+  if has_changes:
+    with zipfile.ZipFile(partial_path, 'w') as dst_zip:
+      for info, data in zip_entries:
+        dst_zip.writestr(info, data)
+
+
+def _CreatePartials(out_dir, num_locales, num_strings, string_length):
+  paths = []
+  for i in range(num_locales):
+    table = Resources_pb2.ResourceTable()
+    package = table.package.add()
+    package.package_name = 'org.chromium.chrome'
+    _type = package.type.add()
+    _type.name = 'string'
+    for j in range(num_strings):
+      entry = _type.entry.add()
+      entry.name = 'string_%d' % j
+      config_value = entry.config_value.add()
+      config_value.config.locale = 'xx-r%02d' % i
+      config_value.value.item.str.value = 'x' * string_length
+    path = os.path.join(out_dir, '%d_values-xx-r%02d.zip' % (i, i))
+    with zipfile.ZipFile(path, 'w') as z:
+      z.writestr('values-xx-r%02d_strings.arsc.flat' % i, _SerializeFlat(table))
+    paths.append(path)
+  return paths
+
+
+def _Measure(strip_func, partials, keep_predicate, out_dir):
+  copies = []
+  for path in partials:
+    copy = os.path.join(out_dir, os.path.basename(path))
+    shutil.copyfile(path, copy)
+    copies.append(copy)
+  start = time.time()
+  for path in copies:
+    strip_func(path, keep_predicate)
+  return time.time() - start, copies
+
+
+def _ReadTables(partial_path):
+  with zipfile.ZipFile(partial_path) as z:
+    return [
+        _ParseFlat(z.read(name)) for name in sorted(z.namelist())
+        if name.endswith('.arsc.flat')
+    ]
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('partials', nargs='*',
+                      help='Partials to filter instead of generated ones.')
+  parser.add_argument('--locales', type=int, default=80,
+                      help='Number of partials to generate.')
+  parser.add_argument('--strings', type=int, default=5000,
+                      help='Number of strings per generated partial.')
+  parser.add_argument('--string-length', type=int, default=40,
+                      help='Length of each generated string.')
+  parser.add_argument('--exclude', action='append',
+                      default=[r'string/string_\d*7$', r'attr/.*_unused$'],
+                      help='Regex of resources to strip. May be repeated.')
+  args = parser.parse_args()
+
+  regex = re.compile('|'.join('(?:{})'.format(p) for p in args.exclude))
+  keep_predicate = lambda x: not regex.search(x)
+
+  with build_utils.TempDir() as tmp_dir:
+    partials = args.partials
+    if not partials:
+      partials_dir = os.path.join(tmp_dir, 'partials')
+      os.mkdir(partials_dir)
+      partials = _CreatePartials(partials_dir, args.locales, args.strings,
+                                 args.string_length)
+    input_size = sum(os.path.getsize(p) for p in partials)
+    print('Filtering %d partials (%.1f MiB):' % (len(partials),
+                                                input_size / 1024.0 / 1024))
+
+    results = []
+    for name, func in (('protobuf', _StripWithProtobuf),
+                       ('streaming', protoresources.StripUnwantedResources)):
+      out_dir = os.path.join(tmp_dir, name)
+      os.mkdir(out_dir)
+      elapsed, outputs = _Measure(func, partials, keep_predicate, out_dir)
+      print('  %-10s %.3fs' % (name, elapsed))
+      results.append(outputs)
+
+    for expected, actual in zip(*results):
+      if _ReadTables(expected) != _ReadTables(actual):
+        print('Mismatch for', os.path.basename(expected))
+        return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import struct
+import sys
+import unittest
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import protoresources
+
+from proto import Resources_pb2
+
+
+def _CreateTable():
+  table = Resources_pb2.ResourceTable()
+  package = table.package.add()
+  package.package_name = 'org.chromium.test'
+  strings = package.type.add()
+  strings.name = 'string'
+  for name in ('keep_me', 'strip_me', 'keep_me_too'):
+    entry = strings.entry.add()
+    entry.name = name
+    entry.config_value.add().value.item.str.value = name * 100
+  styles = package.type.add()
+  styles.name = 'style'
+  entry = styles.entry.add()
+  entry.name = 'Theme'
+  style = entry.config_value.add().value.compound_value.style
+  for attr_name in ('attr/keep_attr', 'attr/strip_attr'):
+    style_entry = style.entry.add()
+    style_entry.key.name = attr_name
+    style_entry.item.prim.int_decimal_value = 1
+  return table
+
+
+def _FlatBytesFromTable(table):
+  proto_bytes = table.SerializeToString()
+  padding = b'\0' * (-len(proto_bytes) % 4)
+  return b''.join((protoresources._FLAT_ARSC_HEADER,
+                   struct.pack('<Q', len(proto_bytes)), proto_bytes, padding))
+
+
+def _TableFromFlatBytes(data):
+  size_idx = len(protoresources._FLAT_ARSC_HEADER)
+  size = struct.unpack('<Q', data[size_idx:size_idx + 8])[0]
+  table = Resources_pb2.ResourceTable()
+  table.ParseFromString(data[size_idx + 8:size_idx + 8 + size])
+  return table
+
+
+def _KeepPredicate(name):
+  return 'strip' not in name
+
+
+class StripUnwantedResourcesTest(unittest.TestCase):
+  def _CreatePartial(self, tmp_dir, table):
+    partial_path = os.path.join(tmp_dir, 'partial.zip')
+    with zipfile.ZipFile(partial_path, 'w') as z:
+      z.writestr('values_strings.arsc.flat', _FlatBytesFromTable(table))
+      z.writestr('drawable_icon.png.flat', b'\x89PNG')
+    return partial_path
+
+  def testStripsEntriesAndStyleAttributes(self):
+    with build_utils.TempDir() as tmp_dir:
+      partial_path = self._CreatePartial(tmp_dir, _CreateTable())
+      protoresources.StripUnwantedResources(partial_path, _KeepPredicate)
+      with zipfile.ZipFile(partial_path) as z:
+        self.assertEqual(['values_strings.arsc.flat', 'drawable_icon.png.flat'],
+                         z.namelist())
+        self.assertEqual(b'\x89PNG', z.read('drawable_icon.png.flat'))
+        data = z.read('values_strings.arsc.flat')
+
+    self.assertEqual(0, len(data) % 4)
+    expected = _CreateTable()
+    del expected.package[0].type[0].entry[1]
+    theme = expected.package[0].type[1].entry[0]
+    del theme.config_value[0].value.compound_value.style.entry[1]
+    self.assertEqual(expected, _TableFromFlatBytes(data))
+
+  def testUnchangedPartialIsNotRewritten(self):
+    with build_utils.TempDir() as tmp_dir:
+      partial_path = self._CreatePartial(tmp_dir, _CreateTable())
+      os.utime(partial_path, (1, 1))
+      protoresources.StripUnwantedResources(partial_path, lambda _: True)
+      self.assertEqual(1, os.path.getmtime(partial_path))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -3,11 +3,13 @@
 # found in the LICENSE file.
 
 import argparse
+import atexit
 import collections
 import contextlib
 import itertools
 import os
 import re
+import select
 import shutil
 import subprocess
 import sys
@@ -572,11 +574,9 @@ def CreateRJavaFiles(srcjar_dir,
   root_r_java_dir = os.path.join(srcjar_dir, *root_r_java_package.split('.'))
   build_utils.MakeDirectory(root_r_java_dir)
   root_r_java_path = os.path.join(root_r_java_dir, 'R.java')
-  root_java_file_contents = _RenderRootRJavaSource(
-      root_r_java_package, all_resources_by_type, rjava_build_options,
-      grandparent_custom_package_name)
   with open(root_r_java_path, 'w') as f:
-    f.write(root_java_file_contents)
+    _WriteRootRJavaSource(f, root_r_java_package, all_resources_by_type,
+                          rjava_build_options, grandparent_custom_package_name)
 
   for package in packages:
     _CreateRJavaSourceFile(srcjar_dir, package, root_r_java_package,
@@ -643,112 +643,332 @@ def GetCustomPackagePath(package_name):
   return 'gen.' + package_name + '_module'
 
 
-def _RenderRootRJavaSource(package, all_resources_by_type, rjava_build_options,
-                           grandparent_custom_package_name):
-  """Render an R.java source file. See _CreateRJaveSourceFile for args info."""
-  final_resources_by_type = collections.defaultdict(list)
-  non_final_resources_by_type = collections.defaultdict(list)
-  for res_type, resources in all_resources_by_type.iteritems():
-    for entry in resources:
+def _WriteRootRJavaSource(f, package, all_resources_by_type,
+                          rjava_build_options, grandparent_custom_package_name):
+  """Writes an R.java source file. See _CreateRJaveSourceFile for args info.
+
+  Root R.java files have an entry for every resource of an APK, so they are
+  written line by line rather than rendered from a template.
+  """
+  final_resources_by_type = {}
+  non_final_resources_by_type = {}
+  resource_types = sorted(_ALL_RESOURCE_TYPES)
+  for res_type in resource_types:
+    final_resources = []
+    non_final_resources = []
+    for entry in all_resources_by_type.get(res_type, ()):
       # Entries in stylable that are not int[] are not actually resource ids
       # but constants.
       if rjava_build_options._IsResourceFinal(entry):
-        final_resources_by_type[res_type].append(entry)
+        final_resources.append(entry)
       else:
-        non_final_resources_by_type[res_type].append(entry)
-
-  # Keep these assignments all on one line to make diffing against regular
-  # aapt-generated files easier.
-  create_id = ('{{ e.resource_type }}.{{ e.name }} ^= packageIdTransform;')
-  create_id_arr = ('{{ e.resource_type }}.{{ e.name }}[i] ^='
-                   ' packageIdTransform;')
-  for_loop_condition = ('int i = {{ startIndex(e) }}; i < '
-                        '{{ e.resource_type }}.{{ e.name }}.length; ++i')
+        non_final_resources.append(entry)
+    final_resources_by_type[res_type] = final_resources
+    non_final_resources_by_type[res_type] = non_final_resources
 
   # Here we diverge from what aapt does. Because we have so many
   # resources, the onResourcesLoaded method was exceeding the 64KB limit that
   # Java imposes. For this reason we split onResourcesLoaded into different
   # methods for each resource type.
-  extends_string = ''
   dep_path = ''
   if grandparent_custom_package_name:
-    extends_string = 'extends {{ parent_path }}.R.{{ resource_type }} '
     dep_path = GetCustomPackagePath(grandparent_custom_package_name)
 
-  template = Template("""/* AUTO-GENERATED FILE.  DO NOT MODIFY. */
+  write = f.write
+  write('/* AUTO-GENERATED FILE.  DO NOT MODIFY. */\n\n')
+  write('package {};\n\n'.format(package))
+  write('public final class R {\n')
+  for res_type in resource_types:
+    extends_string = ''
+    if dep_path:
+      extends_string = 'extends {}.R.{} '.format(dep_path, res_type)
+    write('    public static class {} {} {{\n'.format(res_type, extends_string))
+    for e in final_resources_by_type[res_type]:
+      write('        public static final {} {} = {};\n'.format(
+          e.java_type, e.name, e.value))
+    for e in non_final_resources_by_type[res_type]:
+      if e.value != '0':
+        write('        public static {} {} = {};\n'.format(
+            e.java_type, e.name, e.value))
+      else:
+        write('        public static {} {};\n'.format(e.java_type, e.name))
+    write('    }\n')
 
-package {{ package }};
+  if rjava_build_options.has_on_resources_loaded:
+    if rjava_build_options.fake_on_resources_loaded:
+      write('    public static void onResourcesLoaded(int packageId) {\n')
+      write('    }\n')
+    else:
+      write('    private static boolean sResourcesDidLoad;\n')
+      write('    public static void onResourcesLoaded(int packageId) {\n')
+      write('        if (sResourcesDidLoad) {\n')
+      write('            return;\n')
+      write('        }\n')
+      write('        sResourcesDidLoad = true;\n')
+      write('        int packageIdTransform = (packageId ^ 0x7f) << 24;\n')
+      for res_type in resource_types:
+        write('        onResourcesLoaded{}(packageIdTransform);\n'.format(
+            res_type.title()))
+        for e in non_final_resources_by_type[res_type]:
+          if e.java_type == 'int[]':
+            # Keep these assignments all on one line to make diffing against
+            # regular aapt-generated files easier.
+            write('        for(int i = {}; i < {}.{}.length; ++i) {{\n'.format(
+                _GetNonSystemIndex(e), e.resource_type, e.name))
+            write('            {}.{}[i] ^= packageIdTransform;\n'.format(
+                e.resource_type, e.name))
+            write('        }\n')
+      write('    }\n')
+      for res_type in resource_types:
+        write('    private static void onResourcesLoaded{} (\n'.format(
+            res_type.title()))
+        write('            int packageIdTransform) {\n')
+        if res_type != 'styleable':
+          for e in non_final_resources_by_type[res_type]:
+            if e.java_type != 'int[]':
+              write('        {}.{} ^= packageIdTransform;\n'.format(
+                  e.resource_type, e.name))
+        write('    }\n')
+  write('}')
+
+
+# Lines that "aapt2 daemon" writes around commands. See DaemonCommand in
+# frameworks/base/tools/aapt2/cmd/Daemon.cpp.
+_AAPT2_DAEMON_READY = b'Ready'
+_AAPT2_DAEMON_DONE = b'Done'
+_AAPT2_DAEMON_ERROR = b'Error'
+
+_aapt2_daemons = {}
+
+# Marks commands that were queued when the daemon crashed.
+_LOST = object()
+
+
+def _DecodeOutput(output):
+  # For Python3 only:
+  if sys.version_info >= (3, ):
+    return output.decode('utf-8')
+  return output
+
+
+class Aapt2Daemon(object):
+  """Runs aapt2 commands in a long-lived "aapt2 daemon" process.
+
+  Saves starting a new aapt2 process for each command. Commands can be queued
+  with Send() and their results collected, in order, with Wait(), so that
+  callers can do other work while aapt2 runs.
+
+  The daemon is started on demand: if it crashes, only the commands that were
+  queued at the time fail, and the next one starts a new daemon. aapt2 versions
+  without daemon mode fall back to a process per command.
+
+  Not thread-safe. Use GetAapt2Daemon() to share a daemon within a process.
+  """
 
-public final class R {
-    {% for resource_type in resource_types %}
-    public static class {{ resource_type }} """ + extends_string + """ {
-        {% for e in final_resources[resource_type] %}
-        public static final {{ e.java_type }} {{ e.name }} = {{ e.value }};
-        {% endfor %}
-        {% for e in non_final_resources[resource_type] %}
-            {% if e.value != '0' %}
-        public static {{ e.java_type }} {{ e.name }} = {{ e.value }};
-            {% else %}
-        public static {{ e.java_type }} {{ e.name }};
-            {% endif %}
-        {% endfor %}
-    }
-    {% endfor %}
-    {% if has_on_resources_loaded %}
-      {% if fake_on_resources_loaded %}
-    public static void onResourcesLoaded(int packageId) {
-    }
-      {% else %}
-    private static boolean sResourcesDidLoad;
-    public static void onResourcesLoaded(int packageId) {
-        if (sResourcesDidLoad) {
-            return;
-        }
-        sResourcesDidLoad = true;
-        int packageIdTransform = (packageId ^ 0x7f) << 24;
-        {% for resource_type in resource_types %}
-        onResourcesLoaded{{ resource_type|title }}(packageIdTransform);
-        {% for e in non_final_resources[resource_type] %}
-        {% if e.java_type == 'int[]' %}
-        for(""" + for_loop_condition + """) {
-            """ + create_id_arr + """
-        }
-        {% endif %}
-        {% endfor %}
-        {% endfor %}
-    }
-    {% for res_type in resource_types %}
-    private static void onResourcesLoaded{{ res_type|title }} (
-            int packageIdTransform) {
-        {% for e in non_final_resources[res_type] %}
-        {% if res_type != 'styleable' and e.java_type != 'int[]' %}
-        """ + create_id + """
-        {% endif %}
-        {% endfor %}
-    }
-    {% endfor %}
-      {% endif %}
-    {% endif %}
-}
-""",
-                      trim_blocks=True,
-                      lstrip_blocks=True)
-  return template.render(
-      package=package,
-      resource_types=sorted(_ALL_RESOURCE_TYPES),
-      has_on_resources_loaded=rjava_build_options.has_on_resources_loaded,
-      fake_on_resources_loaded=rjava_build_options.fake_on_resources_loaded,
-      final_resources=final_resources_by_type,
-      non_final_resources=non_final_resources_by_type,
-      startIndex=_GetNonSystemIndex,
-      parent_path=dep_path)
+  def __init__(self, aapt2_path):
+    self._aapt2_path = aapt2_path
+    self._proc = None
+    self._has_daemon_mode = True
+    self._stderr_buf = b''
+    # (args, Popen) of queued commands. Popen is None for commands sent to the
+    # daemon, and _LOST for ones that were queued when it crashed.
+    self._pending = collections.deque()
+
+  def _Start(self):
+    self._proc = subprocess.Popen([self._aapt2_path, 'daemon'],
+                                  stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  close_fds=True)
+    self._stderr_buf = b''
+    # Read one byte at a time so that nothing after the first line is lost.
+    line = b''
+    while not line.endswith(b'\n'):
+      data = os.read(self._proc.stdout.fileno(), 1)
+      if not data:
+        break
+      line += data
+    if line.strip() != _AAPT2_DAEMON_READY:
+      self._Kill()
+      self._has_daemon_mode = False
+
+  def _Kill(self):
+    if self._proc:
+      if self._proc.poll() is None:
+        self._proc.kill()
+      self._proc.wait()
+      self._proc = None
+
+  def _DrainStdout(self):
+    stdout_fd = self._proc.stdout.fileno()
+    chunks = []
+    while select.select([stdout_fd], [], [], 0)[0]:
+      data = os.read(stdout_fd, 65536)
+      if not data:
+        break
+      chunks.append(data)
+    return b''.join(chunks)
+
+  def Send(self, args):
+    """Queues an aapt2 command, e.g. ['compile', '-o', out_path, in_path]."""
+    if self._proc is None and self._has_daemon_mode:
+      self._Start()
+    if not self._has_daemon_mode:
+      self._pending.append((args,
+                            subprocess.Popen([self._aapt2_path] + args,
+                                             stdout=subprocess.PIPE,
+                                             stderr=subprocess.PIPE)))
+      return
+    # Only one command is sent to the daemon at a time, since there is no
+    # other way to tell which command wrote what to stdout.
+    if not any(proc is None for _, proc in self._pending):
+      self._WriteRequest(args)
+    self._pending.append((args, None))
+
+  def _WriteRequest(self, args):
+    # Discard anything left over from a previous command.
+    self._DrainStdout()
+    # The daemon reads one argument per line, and an empty line after the last.
+    request = b''.join(a.encode('utf-8') + b'\n' for a in args) + b'\n'
+    try:
+      self._proc.stdin.write(request)
+      self._proc.stdin.flush()
+    except (IOError, OSError):
+      pass  # The daemon has died. Wait() reports it.
+
+  def _WaitForDaemon(self):
+    stdout_fd = self._proc.stdout.fileno()
+    stderr_fd = self._proc.stderr.fileno()
+    stdout_chunks = []
+    stderr_lines = []
+    failed = False
+    fds = [stdout_fd, stderr_fd]
+    while True:
+      while b'\n' in self._stderr_buf:
+        line, self._stderr_buf = self._stderr_buf.split(b'\n', 1)
+        if line == _AAPT2_DAEMON_DONE:
+          stdout_chunks.append(self._DrainStdout())
+          return not failed, b''.join(stdout_chunks), b''.join(stderr_lines)
+        if line == _AAPT2_DAEMON_ERROR:
+          failed = True
+        else:
+          stderr_lines.append(line + b'\n')
+
+      for fd in select.select(fds, [], [])[0]:
+        data = os.read(fd, 65536)
+        if fd == stdout_fd:
+          if data:
+            stdout_chunks.append(data)
+          else:
+            fds.remove(stdout_fd)
+        elif data:
+          self._stderr_buf += data
+        else:
+          # The daemon has crashed. Any other queued commands are lost too.
+          stderr_lines.append(self._stderr_buf)
+          stderr_lines.append(
+              b'aapt2 daemon exited with code %d\n' % self._proc.wait())
+          self._Kill()
+          self._pending = collections.deque(
+              (args, _LOST) for args, _ in self._pending)
+          return False, b''.join(stdout_chunks), b''.join(stderr_lines)
+
+  def _WaitForResult(self):
+    assert self._pending, 'Wait() called without Send()'
+    args, proc = self._pending.popleft()
+    if proc is _LOST:
+      success, stdout, stderr = False, b'', b'aapt2 daemon exited\n'
+    elif proc:
+      stdout, stderr = proc.communicate()
+      success = proc.returncode == 0
+    else:
+      success, stdout, stderr = self._WaitForDaemon()
+      if self._pending and self._pending[0][1] is None:
+        self._WriteRequest(self._pending[0][0])
+    return args, success, _DecodeOutput(stdout), _DecodeOutput(stderr)
+
+  def Run(self, args):
+    """Runs an aapt2 command.
+
+    Returns:
+      A tuple of (whether it succeeded, stdout, stderr).
+    """
+    self.Send(args)
+    return self._WaitForResult()[1:]
+
+  def Wait(self,
+           print_stdout=False,
+           print_stderr=True,
+           stderr_filter=None,
+           fail_on_output=True):
+    """Waits for the oldest command passed to Send() and returns its stdout.
+
+    Arguments have the same meaning as for build_utils.CheckOutput().
+
+    Raises:
+      build_utils.CalledProcessError: If the command failed.
+    """
+    args, success, stdout, stderr = self._WaitForResult()
+    args = [self._aapt2_path] + args
+    if stderr_filter is not None:
+      stderr = stderr_filter(stderr)
+    if not success:
+      raise build_utils.CalledProcessError(os.getcwd(), args, stdout + stderr)
+    if print_stdout:
+      sys.stdout.write(stdout)
+    if print_stderr:
+      sys.stderr.write(stderr)
+    if fail_on_output and ((print_stdout and stdout) or
+                           (print_stderr and stderr)):
+      raise build_utils.CalledProcessError(
+          os.getcwd(), args, 'Command failed because it wrote to stdout or '
+          'stderr.')
+    return stdout
+
+  def CheckOutput(self, args, **kwargs):
+    """Like build_utils.CheckOutput(), for aapt2 |args|."""
+    self.Send(args)
+    return self.Wait(**kwargs)
+
+  def Close(self):
+    if self._proc:
+      try:
+        self._proc.stdin.write(b'quit\n\n')
+        self._proc.stdin.close()
+        self._proc.wait()
+      except (IOError, OSError):
+        pass
+      self._Kill()
+
+
+def _CloseAapt2Daemons():
+  pid = os.getpid()
+  for (daemon_pid, _), daemon in _aapt2_daemons.items():
+    if daemon_pid == pid:
+      daemon.Close()
+
+
+def GetAapt2Daemon(aapt2_path):
+  """Returns this process's Aapt2Daemon for |aapt2_path|.
+
+  Processes fork()ed by parallel.BulkForkAndCall() get their own, so the jobs
+  of a BulkForkAndCall() share a daemon per worker process.
+  """
+  key = (os.getpid(), aapt2_path)
+  daemon = _aapt2_daemons.get(key)
+  if daemon is None:
+    if not _aapt2_daemons:
+      atexit.register(_CloseAapt2Daemons)
+    daemon = Aapt2Daemon(aapt2_path)
+    _aapt2_daemons[key] = daemon
+  return daemon
 
 
 def ExtractBinaryManifestValues(aapt2_path, apk_path):
   """Returns (version_code, version_name, package_name) for the given apk."""
-  output = subprocess.check_output([
-      aapt2_path, 'dump', 'xmltree', apk_path, '--file', 'AndroidManifest.xml'
-  ])
+  output = GetAapt2Daemon(aapt2_path).CheckOutput(
+      ['dump', 'xmltree', apk_path, '--file', 'AndroidManifest.xml'],
+      fail_on_output=False)
   version_code = re.search(r'versionCode.*?=(\d*)', output).group(1)
   version_name = re.search(r'versionName.*?="(.*?)"', output).group(1)
   package_name = re.search(r'package.*?="(.*?)"', output).group(1)
@@ -757,21 +977,19 @@ def ExtractBinaryManifestValues(aapt2_path, apk_path):
 
 def ExtractArscPackage(aapt2_path, apk_path):
   """Returns (package_name, package_id) of resources.arsc from apk_path."""
-  proc = subprocess.Popen([aapt2_path, 'dump', 'resources', apk_path],
-                          stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE)
-  for line in proc.stdout:
+  _, stdout, stderr = GetAapt2Daemon(aapt2_path).Run(
+      ['dump', 'resources', apk_path])
+  # aapt2 currently crashes when dumping webview resources, but not until after
+  # it prints the "Package" line (b/130553900).
+  for line in stdout.splitlines():
     # Package name=org.chromium.webview_shell id=7f
     if line.startswith('Package'):
-      proc.kill()
       parts = line.split()
       package_name = parts[1].split('=')[1]
       package_id = parts[2][3:]
       return package_name, int(package_id, 16)
 
-  # aapt2 currently crashes when dumping webview resources, but not until after
-  # it prints the "Package" line (b/130553900).
-  sys.stderr.write(proc.stderr.read())
+  sys.stderr.write(stderr)
   raise Exception('Failed to find arsc package name')
 
 
@@ -6,7 +6,10 @@
 
 import collections
 import os
+import shutil
+import stat
 import sys
+import tempfile
 import unittest
 
 sys.path.insert(
@@ -58,6 +61,38 @@ _TEST_NAMESPACES_1 = {'android': 'http://schemas.android.com/apk/res/android'}
 
 _TEST_RESOURCES_ALLOWLIST_1 = ['low_memory_error', 'structured_text']
 
+# Implements the "aapt2 daemon" protocol, with commands that exercise it.
+_FAKE_AAPT2 = '''\
+#!{python}
+import os
+import sys
+
+if sys.argv[1:] != ['daemon'] or os.environ.get('NO_DAEMON_MODE'):
+  sys.stderr.write('fallback ' + ' '.join(sys.argv[1:]) + '\\n')
+  sys.exit(1 if sys.argv[1:2] == ['fail'] else 0)
+print('Ready')
+sys.stdout.flush()
+while True:
+  args = []
+  for line in iter(sys.stdin.readline, ''):
+    if line == '\\n':
+      break
+    args.append(line[:-1])
+  else:
+    break
+  if args == ['quit']:
+    break
+  if args[0] == 'crash':
+    os._exit(3)
+  if args[0] == 'echo':
+    sys.stdout.write(' '.join(args[1:]) * int(os.environ.get('REPEAT', '1')))
+  sys.stdout.flush()
+  if args[0] == 'fail':
+    sys.stderr.write('failure message\\nError\\n')
+  sys.stderr.write('Done\\n')
+  sys.stderr.flush()
+'''
+
 # Extracted from one generated Chromium R.txt file, with string resource
 # names shuffled randomly.
 _TEST_R_TXT = r'''int anim abc_fade_in 0x7f050000
@@ -271,5 +306,58 @@ class ResourceUtilsTest(unittest.TestCase):
       self._CheckTestResourceFile(test_file, _TEST_XML_OUTPUT_2)
 
 
+class Aapt2DaemonTest(unittest.TestCase):
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp()
+    self._aapt2_path = os.path.join(self._tmp_dir, 'aapt2')
+    with open(self._aapt2_path, 'w') as f:
+      f.write(_FAKE_AAPT2.format(python=sys.executable))
+    os.chmod(self._aapt2_path, stat.S_IRWXU)
+    self._daemon = resource_utils.Aapt2Daemon(self._aapt2_path)
+
+  def tearDown(self):
+    self._daemon.Close()
+    os.environ.pop('NO_DAEMON_MODE', None)
+    os.environ.pop('REPEAT', None)
+    shutil.rmtree(self._tmp_dir)
+
+  def test_RunsCommandsInOneProcess(self):
+    self.assertEqual('a b', self._daemon.CheckOutput(['echo', 'a', 'b']))
+    proc = self._daemon._proc
+    self.assertEqual('c', self._daemon.CheckOutput(['echo', 'c']))
+    self.assertIs(proc, self._daemon._proc)
+
+  def test_QueuedCommands(self):
+    os.environ['REPEAT'] = '100000'
+    self._daemon.Send(['echo', 'a'])
+    self._daemon.Send(['echo', 'b'])
+    self.assertEqual('a' * 100000, self._daemon.Wait())
+    self.assertEqual('b' * 100000, self._daemon.Wait())
+
+  def test_Failure(self):
+    self.assertEqual((False, '', 'failure message\n'),
+                     self._daemon.Run(['fail']))
+    with self.assertRaises(build_utils.CalledProcessError):
+      self._daemon.CheckOutput(['fail'])
+    self.assertEqual('a', self._daemon.CheckOutput(['echo', 'a']))
+
+  def test_RestartsAfterCrash(self):
+    self._daemon.Send(['crash'])
+    self._daemon.Send(['echo', 'lost'])
+    success, _, stderr = self._daemon._WaitForResult()[1:]
+    self.assertFalse(success)
+    self.assertIn('exited with code 3', stderr)
+    with self.assertRaises(build_utils.CalledProcessError):
+      self._daemon.Wait()
+    self.assertEqual('a', self._daemon.CheckOutput(['echo', 'a']))
+
+  def test_FallbackWithoutDaemonMode(self):
+    os.environ['NO_DAEMON_MODE'] = '1'
+    self.assertEqual((True, '', 'fallback echo a\n'),
+                     self._daemon.Run(['echo', 'a']))
+    self.assertEqual((False, '', 'fallback fail\n'),
+                     self._daemon.Run(['fail']))
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -95,3 +95,26 @@ def AddToZipHermetic(zip_file,
     _SetAlignment(zip_file, zipinfo, alignment)
   build_utils.AddToZipHermetic(
       zip_file, zipinfo, src_path=src_path, data=data, compress=compress)
+
+
+def AddFilesToZipHermetic(zip_file, entries, jobs=1):
+  """Same as build_utils.AddFilesToZipHermetic(), but with alignment.
+
+  Args:
+    entries: Iterable of (zip_path, src_path, compress, alignment) tuples,
+        where |alignment| is the alignment of the data of the entry, or 0.
+  """
+  alignments = {}
+
+  def align(zip_obj, zip_info):
+    alignment = alignments.pop(zip_info.filename)
+    if alignment:
+      _SetAlignment(zip_obj, zip_info, alignment)
+
+  def iter_entries():
+    for zip_path, src_path, compress, alignment in entries:
+      alignments[zip_path] = alignment
+      yield zip_path, src_path, compress
+
+  build_utils.AddFilesToZipHermetic(
+      zip_file, iter_entries(), jobs=jobs, before_write=align)
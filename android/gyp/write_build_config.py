@@ -81,7 +81,10 @@ all *direct* dependencies of the current target.
     NOTE: Because the `.build_config` of a given target is always generated
     after the `.build_config` of its dependencies, the `write_build_config.py`
     script can use chains of `deps_configs` to compute transitive dependencies
-    for each target when needed.
+    for each target when needed. To avoid re-walking these chains, the list of
+    transitive dependencies (and their types) of each target is also written
+    to a binary `.build_config.bin` file next to its `.build_config` (see
+    `util/build_config_index.py`).
 
 ## Optional keys in `deps_info`:
 
@@ -583,7 +586,9 @@ import os
 import sys
 import xml.dom.minidom
 
+from util import build_config_index
 from util import build_utils
+from util import dependency_graph
 from util import resource_utils
 
 # Types that should never be used as a dependency of another build config.
@@ -650,14 +655,46 @@ def GetDepConfig(path):
   return dep_config_cache[path]
 
 
+dep_type_cache = {}
+def GetDepType(path):
+  if not path in dep_type_cache:
+    dep_type_cache[path] = GetDepConfig(path)['type']
+  return dep_type_cache[path]
+
+
+dep_direct_deps_cache = {}
+def GetDepDirectDeps(path):
+  """Returns the paths of the direct deps of |path|.
+
+  The .build_config.bin of |path| holds the direct deps of |path| and of all
+  of its transitive deps, so this parses no .build_config when it is
+  up-to-date.
+  """
+  if not path in dep_direct_deps_cache:
+    nodes = build_config_index.ReadIndex(path)
+    if nodes is None:
+      dep_direct_deps_cache[path] = GetDepConfig(path)['deps_configs']
+    else:
+      for node_path, node_type, node_deps in nodes:
+        dep_type_cache.setdefault(node_path, node_type)
+        dep_direct_deps_cache.setdefault(node_path, node_deps)
+  return dep_direct_deps_cache[path]
+
+
+dep_graph = dependency_graph.DependencyGraph(GetDepDirectDeps, GetDepType)
+
+
 def DepsOfType(wanted_type, configs):
   return [c for c in configs if c['type'] == wanted_type]
 
 
 def GetAllDepsConfigsInOrder(deps_config_paths, filter_func=None):
+  if filter_func is None:
+    return dep_graph.GetSortedTransitiveDependencies(deps_config_paths)
+
   def GetDeps(path):
     config = GetDepConfig(path)
-    if filter_func and not filter_func(config):
+    if not filter_func(config):
       return []
     return config['deps_configs']
 
@@ -679,6 +716,15 @@ def RemoveObjDups(obj, base, *key_path):
   target[:] = [x for x in target if x not in base_target]
 
 
+def _ExtendUnique(target, items):
+  """Appends the items that are not already in |target|, in order."""
+  seen = set(target)
+  for x in items:
+    if x not in seen:
+      seen.add(x)
+      target.append(x)
+
+
 class Deps(object):
   def __init__(self, direct_deps_config_paths):
     self._all_deps_config_paths = GetAllDepsConfigsInOrder(
@@ -686,15 +732,19 @@ class Deps(object):
     self._direct_deps_configs = [
         GetDepConfig(p) for p in direct_deps_config_paths
     ]
-    self._all_deps_configs = [
-        GetDepConfig(p) for p in self._all_deps_config_paths
-    ]
     self._direct_deps_config_paths = direct_deps_config_paths
+    self._all_deps_config_paths_by_type = {}
 
   def All(self, wanted_type=None):
+    # Only the .build_configs of the requested type are parsed.
     if wanted_type is None:
-      return self._all_deps_configs
-    return DepsOfType(wanted_type, self._all_deps_configs)
+      return [GetDepConfig(p) for p in self._all_deps_config_paths]
+    paths = self._all_deps_config_paths_by_type.get(wanted_type)
+    if paths is None:
+      paths = dep_graph.Select(self._all_deps_config_paths,
+                               dep_graph.TypeMask(wanted_type))
+      self._all_deps_config_paths_by_type[wanted_type] = paths
+    return [GetDepConfig(p) for p in paths]
 
   def Direct(self, wanted_type=None):
     if wanted_type is None:
@@ -708,7 +758,7 @@ class Deps(object):
     if path in self._direct_deps_config_paths:
       raise Exception('Cannot remove direct dep.')
     self._all_deps_config_paths.remove(path)
-    self._all_deps_configs.remove(GetDepConfig(path))
+    self._all_deps_config_paths_by_type.clear()
 
   def GradlePrebuiltJarPaths(self):
     ret = []
@@ -724,6 +774,7 @@ class Deps(object):
 
   def GradleLibraryProjectDeps(self):
     ret = []
+    seen_paths = set()
 
     def helper(cur):
       for config in cur.Direct('java_library'):
@@ -731,7 +782,8 @@ class Deps(object):
           pass
         elif config['gradle_treat_as_prebuilt']:
           helper(Deps(config['deps_configs']))
-        elif config not in ret:
+        elif config['path'] not in seen_paths:
+          seen_paths.add(config['path'])
           ret.append(config)
 
     helper(self)
@@ -780,15 +832,14 @@ def _MergeAssets(all_assets):
 
 def _ResolveGroups(configs):
   """Returns a list of configs with all groups inlined."""
-  ret = list(configs)
-  while True:
-    groups = DepsOfType('group', ret)
-    if not groups:
-      return ret
-    for config in groups:
-      index = ret.index(config)
-      expanded_configs = [GetDepConfig(p) for p in config['deps_configs']]
-      ret[index:index + 1] = expanded_configs
+  ret = []
+  for config in configs:
+    if config['type'] == 'group':
+      ret.extend(
+          _ResolveGroups(GetDepConfig(p) for p in config['deps_configs']))
+    else:
+      ret.append(config)
+  return ret
 
 
 def _DepsFromPaths(dep_paths,
@@ -1219,7 +1270,6 @@ def main(argv):
   direct_deps = deps.Direct()
   system_library_deps = deps.Direct('system_java_library')
   direct_library_deps = deps.Direct('java_library')
-  all_deps = deps.All()
   all_library_deps = deps.All('java_library')
   all_resources_deps = deps.All('android_resources')
 
@@ -1475,17 +1525,20 @@ def main(argv):
     # For feature modules, remove any resources that already exist in the base
     # module.
     if base_module_build_config:
+      base_deps_info = base_module_build_config['deps_info']
+      base_dependency_zips = set(base_deps_info['dependency_zips'])
       dependency_zips = [
-          c for c in dependency_zips
-          if c not in base_module_build_config['deps_info']['dependency_zips']
+          c for c in dependency_zips if c not in base_dependency_zips
       ]
+      base_dependency_zip_overlays = set(
+          base_deps_info['dependency_zip_overlays'])
       dependency_zip_overlays = [
-          c for c in dependency_zip_overlays if c not in
-          base_module_build_config['deps_info']['dependency_zip_overlays']
+          c for c in dependency_zip_overlays
+          if c not in base_dependency_zip_overlays
       ]
+      base_extra_package_names = set(base_deps_info['extra_package_names'])
       extra_package_names = [
-          c for c in extra_package_names if c not in
-          base_module_build_config['deps_info']['extra_package_names']
+          c for c in extra_package_names if c not in base_extra_package_names
       ]
 
     if options.type == 'android_apk' and options.tested_apk_config:
@@ -1560,7 +1613,7 @@ def main(argv):
       if 'extra_classpath_jars' in dep:
         javac_classpath.update(dep['extra_classpath_jars'])
         javac_interface_classpath.update(dep['extra_classpath_jars'])
-    for dep in all_deps:
+    for dep in deps.All():
       if 'extra_classpath_jars' in dep:
         javac_full_classpath.update(dep['extra_classpath_jars'])
         javac_full_interface_classpath.update(dep['extra_classpath_jars'])
@@ -1585,8 +1638,7 @@ def main(argv):
         if c.get('device_jar_path'))
     if options.type == 'android_app_bundle':
       for d in deps.Direct('android_app_bundle_module'):
-        device_classpath.extend(c for c in d.get('device_classpath', [])
-                                if c not in device_classpath)
+        _ExtendUnique(device_classpath, d.get('device_classpath', []))
 
   if options.type in ('dist_jar', 'java_binary', 'junit_binary'):
     # The classpath to use to run this target.
@@ -1748,7 +1800,7 @@ def main(argv):
 
   if options.type in ('android_apk', 'dist_aar',
       'dist_jar', 'android_app_bundle_module', 'android_app_bundle'):
-    for c in all_deps:
+    for c in deps.All():
       proguard_configs.extend(c.get('proguard_configs', []))
       extra_proguard_classpath_jars.extend(c.get('extra_classpath_jars', []))
     if options.type == 'android_app_bundle':
@@ -1756,9 +1808,8 @@ def main(argv):
         proguard_configs.extend(p for p in c.get('proguard_configs', []))
     if options.type == 'android_app_bundle':
       for d in deps.Direct('android_app_bundle_module'):
-        extra_proguard_classpath_jars.extend(
-            c for c in d.get('proguard_classpath_jars', [])
-            if c not in extra_proguard_classpath_jars)
+        _ExtendUnique(extra_proguard_classpath_jars,
+                      d.get('proguard_classpath_jars', []))
 
     if options.type == 'android_app_bundle':
       deps_proguard_enabled = []
@@ -1815,9 +1866,10 @@ def main(argv):
     # Add all tested classes to the test's classpath to ensure that the test's
     # java code is a superset of the tested apk's java code
     device_classpath_extended = list(device_classpath)
+    device_classpath_set = set(device_classpath)
     device_classpath_extended.extend(
         p for p in tested_apk_config['device_classpath']
-        if p not in device_classpath)
+        if p not in device_classpath_set)
     # Include in the classpath classes that are added directly to the apk under
     # test (those that are not a part of a java_library).
     javac_classpath.add(tested_apk_config['unprocessed_jar_path'])
@@ -1996,7 +2048,7 @@ def main(argv):
   if is_java_target:
     jar_to_target = {}
     _AddJarMapping(jar_to_target, [deps_info])
-    _AddJarMapping(jar_to_target, all_deps)
+    _AddJarMapping(jar_to_target, deps.All())
     if base_module_build_config:
       _AddJarMapping(jar_to_target, [base_module_build_config['deps_info']])
     if options.tested_apk_config:
@@ -2013,6 +2065,12 @@ def main(argv):
     ]
 
   build_utils.WriteJson(config, options.build_config, only_if_changed=True)
+  deps_configs = config['deps_info']['deps_configs']
+  build_config_index.WriteIndex(
+      options.build_config,
+      [(p, GetDepType(p), GetDepDirectDeps(p))
+       for p in GetAllDepsConfigsInOrder(deps_configs)] +
+      [(options.build_config, options.type, deps_configs)])
 
   if options.depfile:
     build_utils.WriteDepfile(options.depfile, options.build_config, all_inputs)
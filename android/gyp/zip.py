@@ -45,7 +45,8 @@ def main(args):
             files,
             out_zip,
             base_dir=options.input_files_base_dir,
-            compress_fn=lambda _: options.compress)
+            compress_fn=lambda _: options.compress,
+            jobs=build_utils.DefaultZipJobs())
 
       if options.input_zips:
         files = build_utils.ParseGnList(options.input_zips)
@@ -59,7 +60,8 @@ def main(args):
             out_zip,
             files,
             path_transform=path_transform,
-            compress=options.compress)
+            compress=options.compress,
+            jobs=build_utils.DefaultZipJobs())
 
   # Depfile used only by dist_jar().
   if options.depfile:
@@ -0,0 +1,128 @@
+// Copyright 2020 The Chromium Authors. All rights reserved.
+// Use of this source code is governed by a BSD-style license that can be
+// found in the LICENSE file.
+
+package org.chromium.build;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+
+/**
+ * Runs the main() of a tool once per request, so that many build steps can share a warm JVM.
+ *
+ * Used by build/android/gyp/util/jvm_workers.py. Usage: JvmWorker <tool main class>
+ *
+ * Requests are read from stdin, and responses are written to stdout, one at a time. All
+ * integers are big-endian int32s.
+ *   Request: request id, number of arguments, then (length, UTF-8 bytes) for each argument.
+ *   Response: request id, exit code, then (length, bytes) of the tool's stdout and stderr.
+ *
+ * Calls to System.exit() by the tool end the request rather than the JVM.
+ */
+public class JvmWorker {
+    private static class ExitException extends SecurityException {
+        final int mStatus;
+
+        ExitException(int status) {
+            super("System.exit(" + status + ")");
+            mStatus = status;
+        }
+    }
+
+    private static class ExitTrappingSecurityManager extends SecurityManager {
+        @Override
+        public void checkPermission(Permission perm) {}
+
+        @Override
+        public void checkPermission(Permission perm, Object context) {}
+
+        @Override
+        public void checkExit(int status) {
+            throw new ExitException(status);
+        }
+    }
+
+    private static String[] readRequestArgs(DataInputStream in) throws IOException {
+        String[] args = new String[in.readInt()];
+        for (int i = 0; i < args.length; i++) {
+            byte[] arg = new byte[in.readInt()];
+            in.readFully(arg);
+            args[i] = new String(arg, StandardCharsets.UTF_8);
+        }
+        return args;
+    }
+
+    private static int runTool(Method main, String[] args) {
+        try {
+            main.invoke(null, (Object) args);
+            return 0;
+        } catch (InvocationTargetException e) {
+            Throwable cause = e.getCause();
+            if (cause instanceof ExitException) {
+                return ((ExitException) cause).mStatus;
+            }
+            cause.printStackTrace();
+            return 1;
+        } catch (IllegalAccessException e) {
+            e.printStackTrace();
+            return 1;
+        }
+    }
+
+    private static void writeBytes(DataOutputStream out, byte[] data) throws IOException {
+        out.writeInt(data.length);
+        out.write(data);
+    }
+
+    public static void main(String[] args) throws Exception {
+        Method main = Class.forName(args[0]).getMethod("main", String[].class);
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        DataOutputStream out = new DataOutputStream(
+                new BufferedOutputStream(new FileOutputStream(FileDescriptor.out)));
+        PrintStream originalOut = System.out;
+        PrintStream originalErr = System.err;
+        System.setSecurityManager(new ExitTrappingSecurityManager());
+
+        while (true) {
+            int requestId;
+            try {
+                requestId = in.readInt();
+            } catch (EOFException e) {
+                return;
+            }
+            String[] toolArgs = readRequestArgs(in);
+
+            ByteArrayOutputStream toolOut = new ByteArrayOutputStream();
+            ByteArrayOutputStream toolErr = new ByteArrayOutputStream();
+            System.setOut(new PrintStream(toolOut, true, "UTF-8"));
+            System.setErr(new PrintStream(toolErr, true, "UTF-8"));
+            int exitCode;
+            try {
+                exitCode = runTool(main, toolArgs);
+            } finally {
+                System.out.flush();
+                System.err.flush();
+                System.setOut(originalOut);
+                System.setErr(originalErr);
+            }
+
+            out.writeInt(requestId);
+            out.writeInt(exitCode);
+            writeBytes(out, toolOut.toByteArray());
+            writeBytes(out, toolErr.toByteArray());
+            out.flush();
+        }
+    }
+}
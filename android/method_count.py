@@ -7,18 +7,20 @@ from __future__ import print_function
 
 import argparse
 import os
-import re
-import zipfile
 
 from pylib.dex import dex_parser
 
 
 class DexStatsCollector(object):
-  """Tracks count of method/field/string/type as well as unique methods."""
+  """Tracks count of method/field/string/type as well as unique items."""
 
   def __init__(self):
     # Signatures of all methods from all seen dex files.
     self._unique_methods = set()
+    # Type descriptors of all classes from all seen dex files.
+    self._unique_classes = set()
+    # All strings from all seen dex files.
+    self._unique_strings = set()
     # Map of label -> { metric -> count }.
     self._counts_by_label = {}
 
@@ -30,22 +32,25 @@ class DexStatsCollector(object):
         'strings': dexfile.header.string_ids_size,
         'types': dexfile.header.type_ids_size,
     }
-    self._unique_methods.update(dexfile.IterMethodSignatureParts())
+
+  def _CollectFromMultiDex(self, multidex):
+    self._unique_methods.update(multidex.GetMethodSignatures())
+    self._unique_classes.update(multidex.GetClassNames())
+    self._unique_strings.update(multidex.GetStrings())
 
   def CollectFromZip(self, label, path):
     """Add dex stats from an .apk/.jar/.aab/.zip."""
-    with zipfile.ZipFile(path, 'r') as z:
-      for subpath in z.namelist():
-        if not re.match(r'.*classes\d*\.dex$', subpath):
-          continue
-        dexfile = dex_parser.DexFile(bytearray(z.read(subpath)))
+    with dex_parser.MultiDexFile(path) as multidex:
+      for subpath, dexfile in multidex.dexfiles:
         self._CollectFromDexfile('{}!{}'.format(label, subpath), dexfile)
+      self._CollectFromMultiDex(multidex)
 
   def CollectFromDex(self, label, path):
     """Add dex stats from a .dex file."""
-    with open(path, 'rb') as f:
-      dexfile = dex_parser.DexFile(bytearray(f.read()))
-    self._CollectFromDexfile(label, dexfile)
+    with dex_parser.MultiDexFile(path) as multidex:
+      for _, dexfile in multidex.dexfiles:
+        self._CollectFromDexfile(label, dexfile)
+      self._CollectFromMultiDex(multidex)
 
   def MergeFrom(self, parent_label, other):
     """Add dex stats from another DexStatsCollector."""
@@ -54,12 +59,22 @@ class DexStatsCollector(object):
       new_label = '{}-{}'.format(parent_label, label)
       self._counts_by_label[new_label] = other_counts.copy()
     self._unique_methods.update(other._unique_methods)
+    self._unique_classes.update(other._unique_classes)
+    self._unique_strings.update(other._unique_strings)
     # pylint: enable=protected-access
 
   def GetUniqueMethodCount(self):
     """Returns total number of unique methods across encountered dex files."""
     return len(self._unique_methods)
 
+  def GetUniqueClassCount(self):
+    """Returns total number of unique classes across encountered dex files."""
+    return len(self._unique_classes)
+
+  def GetUniqueStringCount(self):
+    """Returns total number of unique strings across encountered dex files."""
+    return len(self._unique_strings)
+
   def GetCountsByLabel(self):
     """Returns dict of label -> {metric -> count}."""
     return self._counts_by_label
@@ -108,6 +123,8 @@ def main():
     print()
 
   print('Unique Methods:', collector.GetUniqueMethodCount())
+  print('Unique Classes:', collector.GetUniqueClassCount())
+  print('Unique Strings:', collector.GetUniqueStringCount())
   print('DexCache (Pre-Oreo):', collector.GetDexCacheSize(pre_oreo=True),
         'bytes of dirty memory')
   print('DexCache (Oreo+):', collector.GetDexCacheSize(pre_oreo=False),
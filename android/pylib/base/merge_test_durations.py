@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Updates a test durations file from the results of an externally sharded run.
+
+The shards of such runs run on different bots, so they cannot update the
+--test-durations-file themselves. The merge step of the run calls this with
+the --json-results-file of every shard instead.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir,
+                                    os.pardir)))
+from pylib.base import test_durations
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--durations-file',
+                      required=True,
+                      help='The --test-durations-file of the run.')
+  parser.add_argument('json_results_files',
+                      nargs='+',
+                      help='The --json-results-file of each shard.')
+  args = parser.parse_args()
+
+  store = test_durations.TestDurationStore(args.durations_file)
+  for path in args.json_results_files:
+    store.AddResultsFromJsonFile(path)
+  store.Save()
+
+
+if __name__ == '__main__':
+  main()
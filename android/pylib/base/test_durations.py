@@ -0,0 +1,165 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Historical test durations, used to balance tests across shards.
+
+Externally sharded runs do not update the durations file, since their shards
+run on different bots. Instead, the merge step of such runs updates it from
+the --json-results-file of every shard, with merge_test_durations.py.
+"""
+
+import fcntl
+import heapq
+import json
+import logging
+import os
+import tempfile
+
+from pylib.base import base_test_result
+from pylib.results import json_results
+
+# Weight given to the newest sample in the moving average of durations.
+_NEW_SAMPLE_WEIGHT = 0.5
+# Estimate for tests of unknown duration when there is no history at all.
+_DEFAULT_DURATION_MS = 1000
+
+# Only results of tests that ran to completion say how long they take.
+_TIMED_RESULT_TYPES = (
+    base_test_result.ResultType.PASS,
+    base_test_result.ResultType.FAIL,
+)
+
+
+class TestDurationStore(object):
+  """A persistent map of test name -> expected duration in milliseconds.
+
+  Args:
+    path: JSON file to load durations from and Save() them to, or None for a
+      store that lives only in memory.
+  """
+
+  def __init__(self, path=None):
+    self._path = path
+    self._durations = {}
+    # (test name, duration) of the tests that ran since the last Save().
+    self._samples = []
+    self._default_duration = None
+    if path:
+      self._Load()
+
+  def _Load(self):
+    self._durations = {}
+    self._default_duration = None
+    if os.path.exists(self._path):
+      try:
+        with open(self._path) as f:
+          self._durations = json.load(f)
+      except ValueError:
+        logging.warning('Ignoring corrupt test durations file: %s', self._path)
+
+  def __len__(self):
+    return len(self._durations)
+
+  def GetDuration(self, name):
+    """Returns the expected duration of a test.
+
+    Tests without history are assumed to take the median known duration.
+    """
+    duration = self._durations.get(name)
+    if duration is not None:
+      return duration
+    if self._default_duration is None:
+      known = sorted(self._durations.itervalues())
+      self._default_duration = (known[len(known) // 2] if known
+                                else _DEFAULT_DURATION_MS)
+    return self._default_duration
+
+  def AddResults(self, results):
+    """Updates durations from an iterable of BaseTestResult."""
+    for r in results:
+      if r.GetType() not in _TIMED_RESULT_TYPES or r.GetDuration() <= 0:
+        continue
+      self._AddSample(r.GetName(), r.GetDuration())
+      self._samples.append((r.GetName(), r.GetDuration()))
+
+  def _AddSample(self, name, duration):
+    old_duration = self._durations.get(name)
+    if old_duration is None:
+      self._durations[name] = duration
+    else:
+      self._durations[name] = (_NEW_SAMPLE_WEIGHT * duration +
+                               (1 - _NEW_SAMPLE_WEIGHT) * old_duration)
+    self._default_duration = None
+
+  def AddResultsFromJsonFile(self, json_path):
+    """Updates durations from a file written by --json-results-file."""
+    with open(json_path) as f:
+      self.AddResults(json_results.ParseResultsFromJson(json.load(f)))
+
+  def Save(self):
+    """Writes the durations, with the samples added since the last Save().
+
+    The samples are applied to the durations currently in the file, so that
+    the updates of concurrent test runners are not lost.
+    """
+    if not self._path or not self._samples:
+      return
+    with open(self._path + '.lock', 'a') as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        self._Load()
+        for name, duration in self._samples:
+          self._AddSample(name, duration)
+        self._samples = []
+        dir_name = os.path.dirname(self._path) or '.'
+        with tempfile.NamedTemporaryFile(
+            mode='w', dir=dir_name, delete=False) as tmp_file:
+          json.dump(self._durations, tmp_file, separators=(',', ':'))
+        # Atomic, so that test runners never see a partial file.
+        os.rename(tmp_file.name, self._path)
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def PartitionByDuration(items, num_partitions, get_duration):
+  """Splits |items| into partitions of roughly equal total duration.
+
+  Uses the longest-processing-time-first heuristic: items are assigned, longest
+  first, to the partition with the smallest total so far. Ties are broken by
+  position, so items of equal duration are dealt out round-robin.
+
+  Args:
+    items: The items to partition.
+    num_partitions: The number of partitions to create.
+    get_duration: Function returning the expected duration of an item.
+  Returns:
+    A list of |num_partitions| lists. Each keeps the relative order of its
+    items in |items|.
+  """
+  durations = [get_duration(item) for item in items]
+  order = sorted(xrange(len(items)), key=lambda i: -durations[i])
+  # (total duration, partition index)
+  heap = [(0, p) for p in xrange(num_partitions)]
+  assignments = [[] for _ in xrange(num_partitions)]
+  for i in order:
+    total, p = heapq.heappop(heap)
+    assignments[p].append(i)
+    heapq.heappush(heap, (total + durations[i], p))
+  return [[items[i] for i in sorted(a)] for a in assignments]
+
+
+def SortLongestFirst(items, get_duration):
+  """Sorts |items| by decreasing duration, keeping the order of ties.
+
+  When items are handed out from a shared queue (see TestCollection), starting
+  long ones first keeps a device from picking one up just as the others run
+  out of work.
+  """
+  return sorted(items, key=lambda item: -get_duration(item))
+
+
+def ComputeMakespan(partitions, get_duration):
+  """Returns the total duration of the longest of |partitions|."""
+  return max(sum(get_duration(item) for item in p) for p in partitions)
+
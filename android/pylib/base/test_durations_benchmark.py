@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Simulates test sharding on recorded results and reports the makespan.
+
+Each --json-results-file is replayed in turn, using the durations it records
+as ground truth and the other files as history (so the estimates are not
+better than they would have been on a real bot). The makespan, i.e. the time
+until the last device finishes, is reported for:
+
+  count: Equal-count shards (the former behavior).
+  duration: Shards balanced using historical durations.
+"""
+
+from __future__ import print_function
+
+import argparse
+import heapq
+import json
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir,
+                                    os.pardir)))
+from pylib.base import base_test_result
+from pylib.base import test_durations
+from pylib.results import json_results
+
+
+def _ReadDurations(json_path):
+  """Returns {test name: duration} of tests that ran to completion."""
+  with open(json_path) as f:
+    results = json_results.ParseResultsFromJson(json.load(f))
+  durations = {}
+  for r in results:
+    if (r.GetType() in (base_test_result.ResultType.PASS,
+                        base_test_result.ResultType.FAIL)
+        and r.GetName() not in durations):
+      durations[r.GetName()] = r.GetDuration()
+  return durations
+
+
+def _SimulateQueue(tests, num_devices, get_duration):
+  """Returns the makespan of devices taking tests from a shared queue."""
+  device_free_times = [0] * num_devices
+  for t in tests:
+    heapq.heappush(device_free_times,
+                   heapq.heappop(device_free_times) + get_duration(t))
+  return max(device_free_times)
+
+
+def _SimulateCountSharding(tests, num_shards, num_devices, get_duration):
+  makespans = []
+  for shard_index in xrange(num_shards):
+    shard = [t for t in tests if hash(t) % num_shards == shard_index]
+    makespans.append(
+        test_durations.ComputeMakespan(
+            [shard[i::num_devices] for i in xrange(num_devices)],
+            get_duration))
+  return max(makespans)
+
+
+def _SimulateDurationSharding(tests, num_shards, num_devices, history,
+                              get_duration):
+  makespans = []
+  for shard in test_durations.PartitionByDuration(sorted(tests), num_shards,
+                                                  history.GetDuration):
+    shard = test_durations.SortLongestFirst(shard, history.GetDuration)
+    makespans.append(_SimulateQueue(shard, num_devices, get_duration))
+  return max(makespans)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('json_results_files', nargs='+',
+                      help='Files written by test_runner.py '
+                      '--json-results-file.')
+  parser.add_argument('--devices', type=int, default=4,
+                      help='Number of devices per external shard.')
+  parser.add_argument('--shards', type=int, default=1,
+                      help='Number of external (swarming) shards.')
+  parser.add_argument('--output',
+                      help='Write a --test-durations-file built from all of '
+                      'the results to this path.')
+  args = parser.parse_args()
+
+  all_durations = [_ReadDurations(p) for p in args.json_results_files]
+  print('%-50s %8s %10s %10s' % ('Results file', 'Tests', 'count', 'duration'))
+  for i, (path, durations) in enumerate(
+      zip(args.json_results_files, all_durations)):
+    history = test_durations.TestDurationStore()
+    for j, other_durations in enumerate(all_durations):
+      if j != i or len(all_durations) == 1:
+        history.AddResults(
+            base_test_result.BaseTestResult(
+                name, base_test_result.ResultType.PASS, duration=duration)
+            for name, duration in other_durations.iteritems())
+    tests = sorted(durations)
+    count_makespan = _SimulateCountSharding(tests, args.shards, args.devices,
+                                            durations.get)
+    duration_makespan = _SimulateDurationSharding(
+        tests, args.shards, args.devices, history, durations.get)
+    print('%-50s %8d %9.1fs %9.1fs' %
+          (os.path.basename(path)[-50:], len(tests), count_makespan / 1000.0,
+           duration_makespan / 1000.0))
+
+  if args.output:
+    store = test_durations.TestDurationStore(args.output)
+    for path in args.json_results_files:
+      store.AddResultsFromJsonFile(path)
+    store.Save()
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittests for test_durations."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pylib.base import test_durations
+from pylib.base.base_test_result import BaseTestResult
+from pylib.base.base_test_result import ResultType
+
+
+class TestDurationStoreTest(unittest.TestCase):
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp()
+    self._path = os.path.join(self._tmp_dir, 'durations.json')
+
+  def tearDown(self):
+    shutil.rmtree(self._tmp_dir)
+
+  def testDefaultDuration(self):
+    store = test_durations.TestDurationStore()
+    self.assertEqual(test_durations._DEFAULT_DURATION_MS,
+                     store.GetDuration('unknown'))
+    store.AddResults([
+        BaseTestResult('a', ResultType.PASS, duration=10),
+        BaseTestResult('b', ResultType.PASS, duration=20),
+        BaseTestResult('c', ResultType.FAIL, duration=30),
+    ])
+    # The median of known durations.
+    self.assertEqual(20, store.GetDuration('unknown'))
+
+  def testAddResults(self):
+    store = test_durations.TestDurationStore()
+    store.AddResults([
+        BaseTestResult('a', ResultType.PASS, duration=100),
+        BaseTestResult('b', ResultType.CRASH, duration=100),
+        BaseTestResult('c', ResultType.NOTRUN),
+    ])
+    self.assertEqual(1, len(store))
+    store.AddResults([BaseTestResult('a', ResultType.PASS, duration=200)])
+    self.assertEqual(150, store.GetDuration('a'))
+
+  def testSaveAndLoad(self):
+    store = test_durations.TestDurationStore(self._path)
+    store.AddResults([BaseTestResult('a', ResultType.PASS, duration=100)])
+    store.Save()
+    self.assertEqual(100,
+                     test_durations.TestDurationStore(self._path).GetDuration(
+                         'a'))
+
+  def testConcurrentSaves(self):
+    store1 = test_durations.TestDurationStore(self._path)
+    store2 = test_durations.TestDurationStore(self._path)
+    store1.AddResults([BaseTestResult('a', ResultType.PASS, duration=100)])
+    store2.AddResults([BaseTestResult('b', ResultType.PASS, duration=50)])
+    store1.Save()
+    store2.Save()
+
+    store = test_durations.TestDurationStore(self._path)
+    self.assertEqual(100, store.GetDuration('a'))
+    self.assertEqual(50, store.GetDuration('b'))
+
+    # Samples are only applied once.
+    store2.Save()
+    store2.AddResults([BaseTestResult('a', ResultType.PASS, duration=200)])
+    store2.Save()
+    store = test_durations.TestDurationStore(self._path)
+    self.assertEqual(150, store.GetDuration('a'))
+
+  def testAddResultsFromJsonFile(self):
+    json_path = os.path.join(self._tmp_dir, 'results.json')
+    with open(json_path, 'w') as f:
+      json.dump({
+          'per_iteration_data': [{
+              'a': [{'status': 'SUCCESS', 'elapsed_time_ms': 5}],
+              'b': [{'status': 'FAILURE', 'elapsed_time_ms': 7}],
+          }],
+      }, f)
+    store = test_durations.TestDurationStore()
+    store.AddResultsFromJsonFile(json_path)
+    self.assertEqual(5, store.GetDuration('a'))
+    self.assertEqual(7, store.GetDuration('b'))
+
+
+class PartitionByDurationTest(unittest.TestCase):
+  def testEqualDurationsAreDealtRoundRobin(self):
+    tests = list('abcdefg')
+    self.assertEqual(
+        [tests[0::3], tests[1::3], tests[2::3]],
+        test_durations.PartitionByDuration(tests, 3, lambda _: 1))
+
+  def testBalancesDurations(self):
+    durations = {'a': 8, 'b': 1, 'c': 1, 'd': 1, 'e': 5, 'f': 2}
+    partitions = test_durations.PartitionByDuration(
+        sorted(durations), 2, durations.get)
+    self.assertEqual([['a', 'c'], ['b', 'd', 'e', 'f']], partitions)
+    self.assertEqual(
+        9, test_durations.ComputeMakespan(partitions, durations.get))
+
+  def testMorePartitionsThanItems(self):
+    self.assertEqual([['a'], [], []],
+                     test_durations.PartitionByDuration(['a'], 3,
+                                                        lambda _: 1))
+
+  def testSortLongestFirst(self):
+    durations = {'a': 1, 'b': 3, 'c': 1, 'd': 2}
+    self.assertEqual(['b', 'd', 'a', 'c'],
+                     test_durations.SortLongestFirst(
+                         sorted(durations), durations.get))
+
+
+if __name__ == '__main__':
+  unittest.main()
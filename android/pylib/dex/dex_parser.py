@@ -15,7 +15,7 @@ from __future__ import print_function
 import argparse
 import collections
 import errno
-import os
+import mmap
 import re
 import struct
 import sys
@@ -64,9 +64,17 @@ _ClassDefItem = collections.namedtuple(
     'class_idx,access_flags,superclass_idx,interfaces_off,source_file_idx,'
     'annotations_off,class_data_off,static_values_off')
 
+# Python 2's utf-8 codec already decodes surrogates.
+_SURROGATES = 'surrogatepass' if sys.version_info[0] >= 3 else 'strict'
+
+_DEX_PATH_PATTERN = re.compile(r'.*classes[0-9]*\.dex$')
+
 
 class _MemoryItemList(object):
-  """Base class for repeated memory items."""
+  """Base class for repeated memory items.
+
+  Items are decoded on first access.
+  """
 
   def __init__(self,
                reader,
@@ -90,65 +98,108 @@ class _MemoryItemList(object):
     """
     self.offset = offset
     self.size = size
-    reader.Seek(first_item_offset or offset)
-    self._items = [factory(reader) for _ in xrange(size)]
+    self._reader = reader
+    self._factory = factory
+    self._alignment = alignment
+    self._first_item_offset = first_item_offset or offset
+    self._items = None
+
+  def _DecodeItems(self):
+    self._reader.Seek(self._first_item_offset)
+    ret = [self._factory(self._reader) for _ in xrange(self.size)]
+    if self._alignment:
+      self._reader.AlignUpTo(self._alignment)
+    return ret
 
-    if alignment:
-      reader.AlignUpTo(alignment)
+  @property
+  def items(self):
+    if self._items is None:
+      self._items = self._DecodeItems()
+    return self._items
 
   def __iter__(self):
-    return iter(self._items)
+    return iter(self.items)
 
   def __getitem__(self, key):
-    return self._items[key]
+    return self.items[key]
 
   def __len__(self):
-    return len(self._items)
+    return self.size
 
   def __repr__(self):
     item_type_part = ''
     if self.size != 0:
-      item_type = type(self._items[0])
+      item_type = type(self[0])
       item_type_part = ', item type={}'.format(item_type.__name__)
 
     return '{}(offset={:#x}, size={}{})'.format(
         type(self).__name__, self.offset, self.size, item_type_part)
 
 
-class _TypeIdItemList(_MemoryItemList):
+class _FixedSizeItemList(_MemoryItemList):
+  """An item list whose items are all decoded with a single struct call."""
+
+  def __init__(self, reader, offset, size, item_type, item_fmt):
+    super(_FixedSizeItemList, self).__init__(reader, offset, size, None)
+    self._item_type = item_type
+    self._item_fmt = item_fmt
+
+  def _DecodeItems(self):
+    values = self._reader.ReadArray(self._item_fmt, self.size,
+                                    self._first_item_offset)
+    # Group the flat tuple of values into per-item chunks.
+    return [
+        self._item_type._make(chunk)
+        for chunk in zip(*[iter(values)] * len(self._item_fmt))
+    ]
+
+
+class _TypeIdItemList(_FixedSizeItemList):
 
   def __init__(self, reader, offset, size):
-    factory = lambda x: _TypeIdItem(x.ReadUInt())
-    super(_TypeIdItemList, self).__init__(reader, offset, size, factory)
+    super(_TypeIdItemList, self).__init__(reader, offset, size, _TypeIdItem,
+                                          'I')
 
 
-class _ProtoIdItemList(_MemoryItemList):
+class _ProtoIdItemList(_FixedSizeItemList):
 
   def __init__(self, reader, offset, size):
-    factory = lambda x: _ProtoIdItem(x.ReadUInt(), x.ReadUInt(), x.ReadUInt())
-    super(_ProtoIdItemList, self).__init__(reader, offset, size, factory)
+    super(_ProtoIdItemList, self).__init__(reader, offset, size, _ProtoIdItem,
+                                           'III')
 
 
-class _MethodIdItemList(_MemoryItemList):
+class _MethodIdItemList(_FixedSizeItemList):
 
   def __init__(self, reader, offset, size):
-    factory = (
-        lambda x: _MethodIdItem(x.ReadUShort(), x.ReadUShort(), x.ReadUInt()))
-    super(_MethodIdItemList, self).__init__(reader, offset, size, factory)
+    super(_MethodIdItemList, self).__init__(reader, offset, size,
+                                            _MethodIdItem, 'HHI')
 
 
 class _StringItemList(_MemoryItemList):
+  """Decodes strings individually on first access, and caches them."""
 
   def __init__(self, reader, offset, size):
-    reader.Seek(offset)
-    string_item_offsets = iter([reader.ReadUInt() for _ in xrange(size)])
+    super(_StringItemList, self).__init__(reader, offset, size, None)
+    self._string_data_offsets = None
+    self._strings = {}
 
-    def factory(x):
-      data_offset = next(string_item_offsets)
-      string = x.ReadString(data_offset)
-      return _StringDataItem(len(string), string)
+  def __getitem__(self, key):
+    if self._items is not None or not isinstance(key, int):
+      return self.items[key]
+    if key < 0:
+      key += self.size
+    ret = self._strings.get(key)
+    if ret is None:
+      if self._string_data_offsets is None:
+        self._string_data_offsets = self._reader.ReadArray(
+            'I', self.size, self.offset)
+      string = self._reader.ReadString(self._string_data_offsets[key])
+      ret = _StringDataItem(len(string), string)
+      self._strings[key] = ret
+    return ret
 
-    super(_StringItemList, self).__init__(reader, offset, size, factory)
+  def _DecodeItems(self):
+    return [self[i] for i in xrange(self.size)]
 
 
 class _TypeListItem(_MemoryItemList):
@@ -156,7 +207,6 @@ class _TypeListItem(_MemoryItemList):
   def __init__(self, reader):
     offset = reader.Tell()
     size = reader.ReadUInt()
-    factory = lambda x: _TypeItem(x.ReadUShort())
     # This is necessary because we need to extract the size of the type list
     # (in other cases the list size is provided in the header).
     first_item_offset = reader.Tell()
@@ -164,27 +214,34 @@ class _TypeListItem(_MemoryItemList):
         reader,
         offset,
         size,
-        factory,
+        None,
         alignment=4,
         first_item_offset=first_item_offset)
+    # Skip over the items so that the next list can be read.
+    reader.Seek(first_item_offset + 2 * size)
+    reader.AlignUpTo(4)
+
+  def _DecodeItems(self):
+    return [
+        _TypeItem(v)
+        for v in self._reader.ReadArray('H', self.size, self._first_item_offset)
+    ]
 
 
 class _TypeListItemList(_MemoryItemList):
 
   def __init__(self, reader, offset, size):
     super(_TypeListItemList, self).__init__(reader, offset, size, _TypeListItem)
+    # Each item's position depends on the size of the previous one, so this
+    # list is decoded eagerly (but the items themselves are lazy).
+    self._items = self._DecodeItems()
 
 
-class _ClassDefItemList(_MemoryItemList):
+class _ClassDefItemList(_FixedSizeItemList):
 
   def __init__(self, reader, offset, size):
-    reader.Seek(offset)
-
-    def factory(x):
-      return _ClassDefItem(*(x.ReadUInt()
-                             for _ in xrange(len(_ClassDefItem._fields))))
-
-    super(_ClassDefItemList, self).__init__(reader, offset, size, factory)
+    super(_ClassDefItemList, self).__init__(reader, offset, size,
+                                            _ClassDefItem, 'IIIIIIII')
 
 
 class _DexMapItem(object):
@@ -225,8 +282,15 @@ class _DexMapList(object):
 
 class _DexReader(object):
 
-  def __init__(self, data):
+  def __init__(self, data, base_offset=0):
+    """Reads dex items from a buffer.
+
+    Args:
+      data: bytearray, mmap or other buffer containing the dex file.
+      base_offset: Offset of the start of the dex file within |data|.
+    """
     self._data = data
+    self._base = base_offset
     self._pos = 0
 
   def Seek(self, offset):
@@ -244,6 +308,11 @@ class _DexReader(object):
   def ReadUInt(self):
     return self._ReadData('<I')
 
+  def ReadArray(self, item_fmt, count, offset):
+    """Returns a flat tuple of |count| items of |item_fmt| at |offset|."""
+    return struct.unpack_from('<' + item_fmt * count, self._data,
+                              self._base + offset)
+
   def ReadString(self, data_offset):
     string_length, string_offset = self._ReadULeb128(data_offset)
     string_data_offset = string_offset + data_offset
@@ -256,10 +325,11 @@ class _DexReader(object):
 
   def ReadHeader(self):
     header_fmt = '<' + ''.join(t[1] for t in _DEX_HEADER_FMT)
-    return DexHeader._make(struct.unpack_from(header_fmt, self._data))
+    return DexHeader._make(
+        struct.unpack_from(header_fmt, self._data, self._base))
 
   def _ReadData(self, fmt):
-    ret = struct.unpack_from(fmt, self._data, self._pos)[0]
+    ret = struct.unpack_from(fmt, self._data, self._base + self._pos)[0]
     self._pos += struct.calcsize(fmt)
     return ret
 
@@ -271,22 +341,52 @@ class _DexReader(object):
     Args:
       data_offset: Location of the unsigned LEB128.
     """
+    # A uleb128 is at most 5 bytes long. Slicing works for all buffer types.
+    start = self._base + data_offset
+    data = bytearray(self._data[start:start + 5])
     value = 0
     shift = 0
-    cur_offset = data_offset
+    cur_offset = 0
     while True:
-      byte = self._data[cur_offset]
+      byte = data[cur_offset]
       cur_offset += 1
       value |= (byte & 0b01111111) << shift
       if (byte & 0b10000000) == 0:
         break
       shift += 7
 
-    return value, cur_offset - data_offset
+    return value, cur_offset
 
   def _DecodeMUtf8(self, string_length, offset):
     """Returns the string located at the specified offset.
 
+    Tries to decode the whole string at once, and falls back to decoding it
+    one character at a time to handle (or report) unusual encodings.
+
+    Args:
+      string_length: The length of the decoded string.
+      offset: Offset to the beginning of the string.
+    """
+    start = self._base + offset
+    end = self._data.find(b'\0', start)
+    if end != -1:
+      raw = bytes(self._data[start:end])
+      try:
+        # Most strings are class and method names, which are ASCII.
+        if len(raw) == string_length:
+          return raw.decode('ascii')
+        # MUTF-8 differs from UTF-8 only in its encoding of U+0000 and of
+        # supplementary characters (as surrogate pairs).
+        ret = raw.replace(b'\xc0\x80', b'\0').decode('utf-8', _SURROGATES)
+        if len(ret) == string_length:
+          return ret
+      except UnicodeDecodeError:
+        pass
+    return self._DecodeMUtf8Slow(string_length, offset)
+
+  def _DecodeMUtf8Slow(self, string_length, offset):
+    """Returns the string located at the specified offset.
+
     See https://source.android.com/devices/tech/dalvik/dex-format#mutf-8
 
     Ported from the Android Java implementation:
@@ -369,13 +469,17 @@ class DexFile(object):
       0x4000: 'enum',
   }
 
-  def __init__(self, data):
+  def __init__(self, data, base_offset=0):
     """Decodes dex file memory sections.
 
+    Only the header and map list are decoded up-front. Other sections are
+    decoded as they are accessed.
+
     Args:
-      data: bytearray containing the contents of a dex file.
+      data: bytearray or mmap containing the contents of a dex file.
+      base_offset: Offset of the dex file within |data|.
     """
-    self.reader = _DexReader(data)
+    self.reader = _DexReader(data, base_offset)
     self.header = self.reader.ReadHeader()
     self.map_list = _DexMapList(self.reader, self.header.map_off)
     self.type_item_list = _TypeIdItemList(self.reader, self.header.type_ids_off,
@@ -405,6 +509,10 @@ class DexFile(object):
     string_item = self.string_item_list[string_item_idx]
     return string_item.data
 
+  def GetStrings(self, string_item_idxs):
+    """Returns a list of strings for the given list of string indices."""
+    return [self.string_item_list[i].data for i in string_item_idxs]
+
   def GetTypeString(self, type_item_idx):
     type_item = self.type_item_list[type_item_idx]
     return self.GetString(type_item.descriptor_idx)
@@ -439,6 +547,11 @@ class DexFile(object):
       yield (class_name_string, return_type_string, method_name_string,
              parameter_types)
 
+  def IterClassNames(self):
+    """Yields the type descriptors of classes defined in this dex file."""
+    for class_item in self.class_def_item_list:
+      yield self.GetTypeString(class_item.class_idx)
+
   def __repr__(self):
     items = [
         self.header,
@@ -453,6 +566,116 @@ class DexFile(object):
     return '\n'.join(str(item) for item in items)
 
 
+def _MapFile(path):
+  with open(path, 'rb') as f:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _ZipEntryDataOffset(data, zip_info):
+  """Returns the offset of a (stored) zip entry's contents within the zip."""
+  # See ZipFile.open(): the local header's extra field may differ from the one
+  # in the central directory.
+  name_len, extra_len = struct.unpack_from('<HH', data,
+                                           zip_info.header_offset + 26)
+  return zip_info.header_offset + 30 + name_len + extra_len
+
+
+def _OpenDexFiles(path, mapped_files):
+  """Returns [(name, DexFile)] for a .dex file, or for each classesN.dex in a zip.
+
+  Files are memory-mapped rather than read so that only the sections that are
+  accessed are paged in. Compressed dex files within zips are read into memory.
+
+  Args:
+    path: Path to a .dex, .jar, .zip, .aab or .apk file.
+    mapped_files: List to append the mmaps to, which the caller must close.
+  """
+  if not zipfile.is_zipfile(path):
+    mapped_files.append(_MapFile(path))
+    return [(path, DexFile(mapped_files[-1]))]
+
+  ret = []
+  mapped = None
+  with zipfile.ZipFile(path) as z:
+    for info in z.infolist():
+      if not _DEX_PATH_PATTERN.match(info.filename):
+        continue
+      if info.compress_type == zipfile.ZIP_STORED:
+        if not mapped:
+          mapped = _MapFile(path)
+          mapped_files.append(mapped)
+        ret.append((info.filename,
+                    DexFile(mapped, _ZipEntryDataOffset(mapped, info))))
+      else:
+        ret.append((info.filename, DexFile(bytearray(z.read(info)))))
+  return ret
+
+
+class MultiDexFile(object):
+  """Indexes classes, methods and strings across all dex files in a path.
+
+  Each index is built with a single pass over all dex files the first time it
+  is accessed. Dex files are memory-mapped until Close() is called, so use
+  this as a context manager:
+
+    with MultiDexFile(apk_path) as multidex:
+      method_count = len(multidex.GetMethodSignatures())
+
+  Fields:
+    dexfiles: List of (name, DexFile) for each dex file.
+  """
+
+  def __init__(self, path):
+    """Initialize instance.
+
+    Args:
+      path: Path to a .dex, .jar, .zip, .aab or .apk file.
+    """
+    self._mapped_files = []
+    self.dexfiles = _OpenDexFiles(path, self._mapped_files)
+    self._class_names = None
+    self._method_signatures = None
+    self._strings = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.Close()
+
+  def Close(self):
+    """Unmaps the dex files. They must not be used afterwards."""
+    self.dexfiles = []
+    for mapped in self._mapped_files:
+      mapped.close()
+    self._mapped_files = []
+
+  def GetClassNames(self):
+    """Returns the set of type descriptors of all defined classes."""
+    if self._class_names is None:
+      self._class_names = set()
+      for _, dexfile in self.dexfiles:
+        self._class_names.update(dexfile.IterClassNames())
+    return self._class_names
+
+  def GetMethodSignatures(self):
+    """Returns the set of unique IterMethodSignatureParts() tuples."""
+    if self._method_signatures is None:
+      self._method_signatures = set()
+      for _, dexfile in self.dexfiles:
+        self._method_signatures.update(dexfile.IterMethodSignatureParts())
+    return self._method_signatures
+
+  def GetStrings(self):
+    """Returns the set of all strings."""
+    if self._strings is None:
+      self._strings = set()
+      for _, dexfile in self.dexfiles:
+        self._strings.update(
+            dexfile.GetStrings(xrange(dexfile.header.string_ids_size)))
+    return self._strings
+
+
 class _DumpCommand(object):
 
   def __init__(self, dexfile):
@@ -498,8 +721,7 @@ class _DumpSummary(_DumpCommand):
     print(self._dexfile)
 
 
-def _DumpDexItems(dexfile_data, name, item):
-  dexfile = DexFile(bytearray(dexfile_data))
+def _DumpDexItems(dexfile, name, item):
   print('dex_parser: Dumping {} for {}'.format(item, name))
   cmds = {
       'summary': _DumpSummary,
@@ -527,22 +749,14 @@ def main():
       default='summary')
   args = parser.parse_args()
 
-  if os.path.splitext(args.input)[1] in ('.apk', '.jar', '.zip', '.aab'):
-    with zipfile.ZipFile(args.input) as z:
-      dex_file_paths = [
-          f for f in z.namelist() if re.match(r'.*classes[0-9]*\.dex$', f)
-      ]
-      if not dex_file_paths:
-        print('Error: {} does not contain any classes.dex files'.format(
-            args.input))
-        sys.exit(1)
-
-      for path in dex_file_paths:
-        _DumpDexItems(z.read(path), path, args.item)
-
-  else:
-    with open(args.input) as f:
-      _DumpDexItems(f.read(), args.input, args.item)
+  with MultiDexFile(args.input) as multidex:
+    if not multidex.dexfiles:
+      print('Error: {} does not contain any classes.dex files'.format(
+          args.input))
+      sys.exit(1)
+
+    for path, dexfile in multidex.dexfiles:
+      _DumpDexItems(dexfile, path, args.item)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zipfile
+
+from pylib.dex import dex_parser
+
+# pylint: disable=protected-access
+
+_STRINGS = [
+    u'LFoo;',
+    u'Ljava/lang/Object;',
+    u'Ljava/lang/Runnable;',
+    u'V',
+    u'run',
+    u'VI',
+    u'I',
+    u'bar',
+    u'caf\xe9',
+    u'a\x00b',
+    # A supplementary character, which is encoded as a surrogate pair.
+    u'\ud83d\ude00',
+]
+# Indices into _STRINGS.
+_TYPES = [0, 1, 2, 3, 6]
+# Indices into _TYPES.
+_TYPE_LISTS = [[2], [4]]
+# (shorty string, return type, index of parameter type list or None).
+_PROTOS = [(3, 3, None), (5, 3, 1)]
+# (class type, proto, name string).
+_METHODS = [(0, 0, 4), (0, 1, 7)]
+
+
+def _EncodeMUtf8(s):
+  utf16 = s.encode('utf-16-le', dex_parser._SURROGATES)
+  units = struct.unpack('<%dH' % len(s), utf16)
+  ret = bytearray()
+  for unit in units:
+    if 0 < unit < 0x80:
+      ret.append(unit)
+    elif unit < 0x800:
+      ret += bytearray([0xc0 | (unit >> 6), 0x80 | (unit & 0x3f)])
+    else:
+      ret += bytearray([
+          0xe0 | (unit >> 12), 0x80 | ((unit >> 6) & 0x3f), 0x80 | (unit & 0x3f)
+      ])
+  # All strings here are shorter than 128 UTF-16 units, so their ULEB128
+  # length is a single byte.
+  return bytearray([len(units)]) + ret + bytearray([0])
+
+
+def _BuildDexFile():
+  """Returns a minimal dex file with a class Foo that implements Runnable."""
+  string_ids_off = 0x70
+  type_ids_off = string_ids_off + 4 * len(_STRINGS)
+  proto_ids_off = type_ids_off + 4 * len(_TYPES)
+  method_ids_off = proto_ids_off + 12 * len(_PROTOS)
+  class_defs_off = method_ids_off + 8 * len(_METHODS)
+  data_off = class_defs_off + 32
+
+  data = bytearray()
+  type_list_offs = []
+  for type_list in _TYPE_LISTS:
+    type_list_offs.append(data_off + len(data))
+    data += struct.pack('<I%dH' % len(type_list), len(type_list), *type_list)
+    data += bytearray(-len(data) % 4)
+  string_data_offs = []
+  for s in _STRINGS:
+    string_data_offs.append(data_off + len(data))
+    data += _EncodeMUtf8(s)
+  data += bytearray(-len(data) % 4)
+  map_off = data_off + len(data)
+  data += struct.pack('<IHHII', 1, 0x1001, 0, len(_TYPE_LISTS),
+                      type_list_offs[0])
+
+  ids = struct.pack('<%dI' % len(_STRINGS), *string_data_offs)
+  ids += struct.pack('<%dI' % len(_TYPES), *_TYPES)
+  for shorty, return_type, params in _PROTOS:
+    params_off = type_list_offs[params] if params is not None else 0
+    ids += struct.pack('<III', shorty, return_type, params_off)
+  for class_type, proto, name in _METHODS:
+    ids += struct.pack('<HHI', class_type, proto, name)
+  ids += struct.pack('<8I', 0, 0x1, 1, type_list_offs[0], 0xffffffff, 0, 0, 0)
+
+  file_size = data_off + len(data)
+  header = struct.pack(
+      '<8sI20s20I', b'dex\n035\0', 0, b'\0' * 20, file_size, 0x70, 0x12345678,
+      0, 0, map_off, len(_STRINGS), string_ids_off, len(_TYPES), type_ids_off,
+      len(_PROTOS), proto_ids_off, 0, 0, len(_METHODS), method_ids_off, 1,
+      class_defs_off, len(data), data_off)
+  return bytearray(header + ids + data)
+
+
+class DexFileTest(unittest.TestCase):
+
+  def setUp(self):
+    self._dexfile = dex_parser.DexFile(_BuildDexFile())
+
+  def testGetStrings(self):
+    num_strings = self._dexfile.header.string_ids_size
+    self.assertEqual(_STRINGS, self._dexfile.GetStrings(range(num_strings)))
+
+  def testDecodeMUtf8Slow(self):
+    reader = self._dexfile.reader
+    for i, expected in enumerate(_STRINGS):
+      offset = reader.ReadArray('I', 1, 0x70 + 4 * i)[0]
+      self.assertEqual(expected, reader._DecodeMUtf8Slow(len(expected),
+                                                         offset + 1))
+
+  def testIterClassNames(self):
+    self.assertEqual(['LFoo;'], list(self._dexfile.IterClassNames()))
+
+  def testIterMethodSignatureParts(self):
+    self.assertEqual([('LFoo;', 'V', 'run', ()), ('LFoo;', 'V', 'bar',
+                                                  ('I', ))],
+                     list(self._dexfile.IterMethodSignatureParts()))
+
+  def testClassDefItems(self):
+    class_item = self._dexfile.class_def_item_list[0]
+    self.assertEqual('Ljava/lang/Object;',
+                     self._dexfile.GetTypeString(class_item.superclass_idx))
+    self.assertEqual(('Ljava/lang/Runnable;', ),
+                     self._dexfile.GetTypeListStringsByOffset(
+                         class_item.interfaces_off))
+    self.assertEqual(('public', ),
+                     dex_parser.DexFile.ResolveClassAccessFlags(
+                         class_item.access_flags))
+
+
+class MultiDexFileTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def testDexFile(self):
+    path = os.path.join(self._temp_dir, 'classes.dex')
+    with open(path, 'wb') as f:
+      f.write(_BuildDexFile())
+    with dex_parser.MultiDexFile(path) as multidex:
+      self.assertEqual([path], [name for name, _ in multidex.dexfiles])
+      self.assertEqual(set(['LFoo;']), multidex.GetClassNames())
+    self.assertEqual([], multidex.dexfiles)
+
+  def testZipFile(self):
+    path = os.path.join(self._temp_dir, 'test.apk')
+    with zipfile.ZipFile(path, 'w') as z:
+      z.writestr('AndroidManifest.xml', b'')
+      z.writestr(zipfile.ZipInfo('classes.dex'), bytes(_BuildDexFile()))
+      info = zipfile.ZipInfo('classes2.dex')
+      info.compress_type = zipfile.ZIP_DEFLATED
+      z.writestr(info, bytes(_BuildDexFile()))
+    with dex_parser.MultiDexFile(path) as multidex:
+      self.assertEqual(['classes.dex', 'classes2.dex'],
+                       [name for name, _ in multidex.dexfiles])
+      for _, dexfile in multidex.dexfiles:
+        self.assertEqual(['LFoo;'], list(dexfile.IterClassNames()))
+        self.assertEqual(_STRINGS[:5], dexfile.GetStrings(range(5)))
+      # Both dex files define the same class, methods and strings.
+      self.assertEqual(set(['LFoo;']), multidex.GetClassNames())
+      self.assertEqual(
+          set([('LFoo;', 'V', 'run', ()), ('LFoo;', 'V', 'bar', ('I', ))]),
+          multidex.GetMethodSignatures())
+      self.assertEqual(set(_STRINGS), multidex.GetStrings())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,261 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""An incremental parser for the stdout of gtest suites."""
+
+import re
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+from pylib.base import base_test_result
+
+# TODO(jbudorick): Remove these once we're no longer parsing stdout to generate
+# results.
+_RE_TEST_STATUS = re.compile(
+    # Test state.
+    r'\[ +((?:RUN)|(?:FAILED)|(?:OK)|(?:CRASHED)|(?:SKIPPED)) +\] ?'
+    # Test name.
+    r'([^ ]+)?'
+    # Optional parameters.
+    r'(?:, where'
+    #   Type parameter
+    r'(?: TypeParam = [^()]*(?: and)?)?'
+    #   Value parameter
+    r'(?: GetParam\(\) = [^()]*)?'
+    # End of optional parameters.
+    ')?'
+    # Optional test execution time.
+    r'(?: \((\d+) ms\))?$')
+# Crash detection constants.
+_RE_TEST_CURRENTLY_RUNNING = re.compile(r'\[ERROR:.*?\]'
+                                    r' Currently running: (.*)')
+_RE_DISABLED = re.compile(r'DISABLED_')
+_RE_FLAKY = re.compile(r'FLAKY_')
+
+# Detect stack line in stdout.
+_STACK_LINE_RE = re.compile(r'\s*#\d+')
+
+# Size of the log of a single test above which it is moved to a temp file.
+_MAX_LOG_MEMORY = 1024 * 1024
+
+# Number of stacks to symbolize in parallel. Each runs the stack tool.
+_SYMBOLIZE_THREADS = 2
+
+
+def TestNameWithoutDisabledPrefix(test_name):
+  """Modify the test name without disabled prefix if prefix 'DISABLED_' or
+  'FLAKY_' presents.
+
+  Args:
+    test_name: The name of a test.
+  Returns:
+    A test name without prefix 'DISABLED_' or 'FLAKY_'.
+  """
+  disabled_prefixes = [_RE_DISABLED, _RE_FLAKY]
+  for dp in disabled_prefixes:
+    test_name = dp.sub('', test_name)
+  return test_name
+
+
+def _ToBytes(line):
+  return line if isinstance(line, bytes) else line.encode('utf-8')
+
+
+def _FromBytes(data):
+  return data if isinstance(data, str) else data.decode('utf-8', 'replace')
+
+
+class _LogBuffer(object):
+  """The lines of a log, kept in memory until they outgrow |max_memory|.
+
+  Beyond that, lines are appended to an anonymous temp file.
+  """
+
+  def __init__(self, max_memory):
+    self._max_memory = max_memory
+    self._lines = []
+    self._size = 0
+    self._file = None
+
+  def Append(self, line):
+    self._lines.append(line)
+    self._size += len(line) + 1
+    if self._size > self._max_memory:
+      if not self._file:
+        self._file = tempfile.TemporaryFile()
+      self._file.writelines(_ToBytes(l) + b'\n' for l in self._lines)
+      self._lines = []
+      self._size = 0
+
+  def GetValue(self):
+    """Returns all lines, joined by newlines."""
+    in_memory = '\n'.join(self._lines)
+    if not self._file:
+      return in_memory
+    self._file.seek(0)
+    spilled = _FromBytes(self._file.read())
+    self._file.seek(0, 2)
+    if not self._lines:
+      return spilled[:-1]  # Strip the last newline.
+    return spilled + in_memory
+
+  def Close(self):
+    if self._file:
+      self._file.close()
+      self._file = None
+
+
+class GTestOutputParser(object):
+  """Turns gtest stdout into results, as it is produced.
+
+  Example:
+
+    parser = GTestOutputParser(symbolizer, device_abi)
+    for line in device.adb.IterShell(...):
+      parser.Feed(line)
+    results = parser.Finish()
+
+  A result is created as soon as the output shows that its test ended. The
+  output of each test is buffered until then, in a temp file if it is large,
+  and native stacks in it are symbolized on background threads. Thus only the
+  results themselves are kept in memory, and a caller that stops feeding
+  output (e.g. because of a timeout) still gets the results of the tests that
+  ended.
+  """
+
+  def __init__(self, symbolizer, device_abi, on_result=None,
+               max_log_memory=_MAX_LOG_MEMORY):
+    """Initializes the parser.
+
+    Args:
+      symbolizer: The symbolizer used to symbolize stack.
+      device_abi: Device abi that is needed for symbolization.
+      on_result: Optional function called with each BaseTestResult as soon as
+          it is created. Results that need symbolization are passed from a
+          background thread, and may be passed out of order.
+      max_log_memory: Size of the log of a test above which it is kept in a
+          temp file.
+    """
+    self._symbolizer = symbolizer
+    self._device_abi = device_abi
+    self._on_result = on_result
+    self._max_log_memory = max_log_memory
+    self._pool = None
+    # BaseTestResults, or AsyncResults of BaseTestResults being symbolized, in
+    # the order that tests ended.
+    self._results = []
+
+    self._duration = 0
+    self._fallback_result_type = None
+    self._log = _LogBuffer(max_log_memory)
+    self._stack = []
+    self._result_type = None
+    self._test_name = None
+
+  def GetNumCompleted(self):
+    """Returns the number of tests that ended so far.
+
+    This includes the tests whose results are still being symbolized.
+    """
+    return len(self._results)
+
+  def _Emit(self, result):
+    if self._on_result:
+      self._on_result(result)
+    return result
+
+  def _SymbolizeAndCreateResult(self, test_name, result_type, duration,
+                                log_string, stack):
+    stack_string = '\n'.join(
+        self._symbolizer.ExtractAndResolveNativeStackTraces(
+            stack, self._device_abi))
+    return self._Emit(base_test_result.BaseTestResult(
+        test_name, result_type, duration,
+        log='%s\n%s' % (log_string, stack_string)))
+
+  def _AddResult(self, result_type):
+    test_name = TestNameWithoutDisabledPrefix(self._test_name)
+    log_string = self._log.GetValue()
+    if not self._stack:
+      self._results.append(self._Emit(base_test_result.BaseTestResult(
+          test_name, result_type, self._duration, log=log_string + '\n')))
+      return
+    if not self._pool:
+      self._pool = ThreadPool(_SYMBOLIZE_THREADS)
+    self._results.append(self._pool.apply_async(
+        self._SymbolizeAndCreateResult,
+        (test_name, result_type, self._duration, log_string,
+         list(self._stack))))
+
+  def _HandlePossiblyUnknownTest(self, result_type=None):
+    if self._test_name is not None:
+      self._AddResult(result_type or self._fallback_result_type
+                      or base_test_result.ResultType.UNKNOWN)
+
+  def Feed(self, line):
+    """Parses the next line of output."""
+    matcher = _RE_TEST_STATUS.match(line)
+    if matcher:
+      if matcher.group(1) == 'RUN':
+        self._HandlePossiblyUnknownTest()
+        self._duration = 0
+        self._fallback_result_type = None
+        self._log.Close()
+        self._log = _LogBuffer(self._max_log_memory)
+        self._stack = []
+        self._result_type = None
+      elif matcher.group(1) == 'OK':
+        self._result_type = base_test_result.ResultType.PASS
+      elif matcher.group(1) == 'SKIPPED':
+        self._result_type = base_test_result.ResultType.SKIP
+      elif matcher.group(1) == 'FAILED':
+        self._result_type = base_test_result.ResultType.FAIL
+      elif matcher.group(1) == 'CRASHED':
+        self._fallback_result_type = base_test_result.ResultType.CRASH
+      # Be aware that test name and status might not appear on same line.
+      self._test_name = matcher.group(2) if matcher.group(2) else (
+          self._test_name)
+      self._duration = int(matcher.group(3)) if matcher.group(3) else 0
+
+    else:
+      # Needs another matcher here to match crashes, like those of DCHECK.
+      matcher = _RE_TEST_CURRENTLY_RUNNING.match(line)
+      if matcher:
+        self._test_name = matcher.group(1)
+        self._result_type = base_test_result.ResultType.CRASH
+        self._duration = 0 # Don't know.
+
+    if not matcher and _STACK_LINE_RE.match(line):
+      self._stack.append(line)
+    else:
+      self._log.Append(line)
+
+    if self._result_type and self._test_name:
+      # Don't bother symbolizing output if the test passed.
+      if self._result_type == base_test_result.ResultType.PASS:
+        self._stack = []
+      self._AddResult(self._result_type)
+      self._test_name = None
+
+  def Finish(self, unfinished_result_type=None):
+    """Ends parsing, and returns the results of all tests in the output.
+
+    Args:
+      unfinished_result_type: The type of the result of a test that started
+          but did not end (e.g. TIMEOUT if the output was cut short). By
+          default, it is CRASH if gtest reported a crash, and UNKNOWN
+          otherwise.
+    Returns:
+      A list of base_test_result.BaseTestResults, in the order that tests
+      ended.
+    """
+    self._HandlePossiblyUnknownTest(unfinished_result_type)
+    self._test_name = None
+    self._log.Close()
+    if self._pool:
+      self._pool.close()
+      self._pool.join()
+      self._pool = None
+    return [r if isinstance(r, base_test_result.BaseTestResult) else r.get()
+            for r in self._results]
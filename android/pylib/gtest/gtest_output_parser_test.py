@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import threading
+import unittest
+
+from pylib.base import base_test_result
+from pylib.gtest import gtest_output_parser
+
+
+class _FakeSymbolizer(object):
+  def __init__(self, release=None):
+    self.calls = []
+    self.threads = set()
+    # If set, symbolization blocks until this event is set.
+    self._release = release
+
+  def ExtractAndResolveNativeStackTraces(self, data_to_symbolize, device_abi):
+    self.calls.append((list(data_to_symbolize), device_abi))
+    self.threads.add(threading.current_thread().ident)
+    if self._release:
+      self._release.wait()
+    for line in data_to_symbolize:
+      yield 'symbolized' + line
+
+
+class GTestOutputParserTest(unittest.TestCase):
+
+  def testResultsAreEmittedWhenTestsEnd(self):
+    emitted = []
+    parser = gtest_output_parser.GTestOutputParser(
+        None, None, on_result=emitted.append)
+    parser.Feed('[ RUN      ] FooTest.Bar')
+    parser.Feed('some output')
+    self.assertEqual([], emitted)
+    parser.Feed('[       OK ] FooTest.Bar (1 ms)')
+    self.assertEqual(['FooTest.Bar'], [r.GetName() for r in emitted])
+    self.assertEqual(1, parser.GetNumCompleted())
+    self.assertEqual(
+        '[ RUN      ] FooTest.Bar\nsome output\n'
+        '[       OK ] FooTest.Bar (1 ms)\n', emitted[0].GetLog())
+    self.assertEqual(emitted, parser.Finish())
+
+  def testStacksAreSymbolizedInBackground(self):
+    symbolizer = _FakeSymbolizer()
+    parser = gtest_output_parser.GTestOutputParser(symbolizer, 'arm64-v8a')
+    for line in [
+        '[ RUN      ] FooTest.Bar',
+        '#00 pc 0001 libfoo.so',
+        '[  FAILED  ] FooTest.Bar (2 ms)',
+        '[ RUN      ] FooTest.Baz',
+        '#00 pc 0002 libfoo.so',
+        '[       OK ] FooTest.Baz (3 ms)',
+    ]:
+      parser.Feed(line)
+    results = parser.Finish()
+
+    self.assertEqual(['FooTest.Bar', 'FooTest.Baz'],
+                     [r.GetName() for r in results])
+    self.assertEqual(base_test_result.ResultType.FAIL, results[0].GetType())
+    self.assertEqual(2, results[0].GetDuration())
+    self.assertEqual(
+        '[ RUN      ] FooTest.Bar\n[  FAILED  ] FooTest.Bar (2 ms)\n'
+        'symbolized#00 pc 0001 libfoo.so', results[0].GetLog())
+    # Stacks of passing tests are not symbolized.
+    self.assertEqual([(['#00 pc 0001 libfoo.so'], 'arm64-v8a')],
+                     symbolizer.calls)
+    self.assertNotIn(threading.current_thread().ident, symbolizer.threads)
+
+  def testNumCompletedIncludesResultsBeingSymbolized(self):
+    symbolized = threading.Event()
+    symbolizer = _FakeSymbolizer(release=symbolized)
+    parser = gtest_output_parser.GTestOutputParser(symbolizer, 'arm64-v8a')
+    for line in [
+        '[ RUN      ] FooTest.Bar',
+        '#00 pc 0001 libfoo.so',
+        '[  FAILED  ] FooTest.Bar (2 ms)',
+    ]:
+      parser.Feed(line)
+    self.assertEqual(1, parser.GetNumCompleted())
+    symbolized.set()
+    self.assertEqual(['FooTest.Bar'], [r.GetName() for r in parser.Finish()])
+
+  def testLargeLogsAreSpilled(self):
+    parser = gtest_output_parser.GTestOutputParser(None, None,
+                                                   max_log_memory=10)
+    lines = ['[ RUN      ] FooTest.Bar'] + ['line %d' % i for i in range(100)]
+    for line in lines:
+      parser.Feed(line)
+    results = parser.Finish()
+    self.assertEqual(base_test_result.ResultType.UNKNOWN, results[0].GetType())
+    self.assertEqual('\n'.join(lines) + '\n', results[0].GetLog())
+
+  def testLogBuffer(self):
+    for max_memory in (0, 5, 1000):
+      log = gtest_output_parser._LogBuffer(max_memory)
+      self.assertEqual('', log.GetValue())
+      log.Append('ab')
+      log.Append('')
+      log.Append('cdef')
+      self.assertEqual('ab\n\ncdef', log.GetValue())
+      log.Append('g')
+      self.assertEqual('ab\n\ncdef\ng', log.GetValue())
+      log.Close()
+
+  def testUnfinishedTest(self):
+    parser = gtest_output_parser.GTestOutputParser(None, None)
+    parser.Feed('[ RUN      ] FooTest.Bar')
+    parser.Feed('[       OK ] FooTest.Bar (1 ms)')
+    parser.Feed('[ RUN      ] FooTest.Baz')
+    results = parser.Finish(
+        unfinished_result_type=base_test_result.ResultType.TIMEOUT)
+    self.assertEqual(['FooTest.Bar', 'FooTest.Baz'],
+                     [r.GetName() for r in results])
+    self.assertEqual(base_test_result.ResultType.TIMEOUT, results[1].GetType())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -16,6 +16,7 @@ from pylib import constants
 from pylib.constants import host_paths
 from pylib.base import base_test_result
 from pylib.base import test_instance
+from pylib.gtest import gtest_output_parser
 from pylib.symbols import stack_symbolizer
 from pylib.utils import test_filter
 
@@ -81,33 +82,14 @@ _EXTRA_SHARD_SIZE_LIMIT = (
     'org.chromium.native_test.NativeTestInstrumentationTestRunner.'
         'ShardSizeLimit')
 
-# TODO(jbudorick): Remove these once we're no longer parsing stdout to generate
-# results.
-_RE_TEST_STATUS = re.compile(
-    # Test state.
-    r'\[ +((?:RUN)|(?:FAILED)|(?:OK)|(?:CRASHED)|(?:SKIPPED)) +\] ?'
-    # Test name.
-    r'([^ ]+)?'
-    # Optional parameters.
-    r'(?:, where'
-    #   Type parameter
-    r'(?: TypeParam = [^()]*(?: and)?)?'
-    #   Value parameter
-    r'(?: GetParam\(\) = [^()]*)?'
-    # End of optional parameters.
-    ')?'
-    # Optional test execution time.
-    r'(?: \((\d+) ms\))?$')
 # Crash detection constants.
 _RE_TEST_ERROR = re.compile(r'FAILURES!!! Tests run: \d+,'
                                     r' Failures: \d+, Errors: 1')
-_RE_TEST_CURRENTLY_RUNNING = re.compile(r'\[ERROR:.*?\]'
-                                    r' Currently running: (.*)')
-_RE_DISABLED = re.compile(r'DISABLED_')
-_RE_FLAKY = re.compile(r'FLAKY_')
 
-# Detect stack line in stdout.
-_STACK_LINE_RE = re.compile(r'\s*#\d+')
+# Moved to gtest_output_parser, which does not depend on devil.
+TestNameWithoutDisabledPrefix = (
+    gtest_output_parser.TestNameWithoutDisabledPrefix)
+
 
 def ParseGTestListTests(raw_list):
   """Parses a raw test list as provided by --gtest_list_tests.
@@ -147,6 +129,8 @@ def ParseGTestListTests(raw_list):
 def ParseGTestOutput(output, symbolizer, device_abi):
   """Parses raw gtest output and returns a list of results.
 
+  See gtest_output_parser.GTestOutputParser to parse output as it is produced.
+
   Args:
     output: A list of output lines.
     symbolizer: The symbolizer used to symbolize stack.
@@ -154,79 +138,10 @@ def ParseGTestOutput(output, symbolizer, device_abi):
   Returns:
     A list of base_test_result.BaseTestResults.
   """
-  duration = 0
-  fallback_result_type = None
-  log = []
-  stack = []
-  result_type = None
-  results = []
-  test_name = None
-
-  def symbolize_stack_and_merge_with_log():
-    log_string = '\n'.join(log or [])
-    if not stack:
-      stack_string = ''
-    else:
-      stack_string = '\n'.join(
-          symbolizer.ExtractAndResolveNativeStackTraces(
-              stack, device_abi))
-    return '%s\n%s' % (log_string, stack_string)
-
-  def handle_possibly_unknown_test():
-    if test_name is not None:
-      results.append(base_test_result.BaseTestResult(
-          TestNameWithoutDisabledPrefix(test_name),
-          fallback_result_type or base_test_result.ResultType.UNKNOWN,
-          duration, log=symbolize_stack_and_merge_with_log()))
-
+  parser = gtest_output_parser.GTestOutputParser(symbolizer, device_abi)
   for l in output:
-    matcher = _RE_TEST_STATUS.match(l)
-    if matcher:
-      if matcher.group(1) == 'RUN':
-        handle_possibly_unknown_test()
-        duration = 0
-        fallback_result_type = None
-        log = []
-        stack = []
-        result_type = None
-      elif matcher.group(1) == 'OK':
-        result_type = base_test_result.ResultType.PASS
-      elif matcher.group(1) == 'SKIPPED':
-        result_type = base_test_result.ResultType.SKIP
-      elif matcher.group(1) == 'FAILED':
-        result_type = base_test_result.ResultType.FAIL
-      elif matcher.group(1) == 'CRASHED':
-        fallback_result_type = base_test_result.ResultType.CRASH
-      # Be aware that test name and status might not appear on same line.
-      test_name = matcher.group(2) if matcher.group(2) else test_name
-      duration = int(matcher.group(3)) if matcher.group(3) else 0
-
-    else:
-      # Needs another matcher here to match crashes, like those of DCHECK.
-      matcher = _RE_TEST_CURRENTLY_RUNNING.match(l)
-      if matcher:
-        test_name = matcher.group(1)
-        result_type = base_test_result.ResultType.CRASH
-        duration = 0 # Don't know.
-
-    if log is not None:
-      if not matcher and _STACK_LINE_RE.match(l):
-        stack.append(l)
-      else:
-        log.append(l)
-
-    if result_type and test_name:
-      # Don't bother symbolizing output if the test passed.
-      if result_type == base_test_result.ResultType.PASS:
-        stack = []
-      results.append(base_test_result.BaseTestResult(
-          TestNameWithoutDisabledPrefix(test_name), result_type, duration,
-          log=symbolize_stack_and_merge_with_log()))
-      test_name = None
-
-  handle_possibly_unknown_test()
-
-  return results
+    parser.Feed(l)
+  return parser.Finish()
 
 
 def ParseGTestXML(xml_content):
@@ -280,20 +195,6 @@ def ParseGTestJSON(json_content):
   return results
 
 
-def TestNameWithoutDisabledPrefix(test_name):
-  """Modify the test name without disabled prefix if prefix 'DISABLED_' or
-  'FLAKY_' presents.
-
-  Args:
-    test_name: The name of a test.
-  Returns:
-    A test name without prefix 'DISABLED_' or 'FLAKY_'.
-  """
-  disabled_prefixes = [_RE_DISABLED, _RE_FLAKY]
-  for dp in disabled_prefixes:
-    test_name = dp.sub('', test_name)
-  return test_name
-
 class GtestTestInstance(test_instance.TestInstance):
 
   def __init__(self, args, data_deps_delegate, error_func):
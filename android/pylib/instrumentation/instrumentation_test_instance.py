@@ -2,21 +2,24 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
 import copy
+import fnmatch
+import hashlib
+import json
 import logging
 import os
-import pickle
 import re
+import zipfile
 
 from devil.android import apk_helper
 from pylib import constants
 from pylib.base import base_test_result
 from pylib.base import test_exception
 from pylib.base import test_instance
-from pylib.constants import host_paths
 from pylib.instrumentation import test_result
 from pylib.instrumentation import instrumentation_parser
-from pylib.symbols import deobfuscator
+from pylib.symbols import mapping_deobfuscator
 from pylib.symbols import stack_symbolizer
 from pylib.utils import dexdump
 from pylib.utils import gold_utils
@@ -26,9 +29,6 @@ from pylib.utils import shared_preference_utils
 from pylib.utils import test_filter
 
 
-with host_paths.SysPath(host_paths.BUILD_COMMON_PATH):
-  import unittest_util # pylint: disable=import-error
-
 # Ref: http://developer.android.com/reference/android/app/Activity.html
 _ACTIVITY_RESULT_CANCELED = 0
 _ACTIVITY_RESULT_OK = -1
@@ -59,7 +59,7 @@ _PARAMETERIZED_COMMAND_LINE_FLAGS = 'ParameterizedCommandLineFlags'
 _PARAMETERIZED_COMMAND_LINE_FLAGS_SWITCHES = (
     'ParameterizedCommandLineFlags$Switches')
 _NATIVE_CRASH_RE = re.compile('(process|native) crash', re.IGNORECASE)
-_PICKLE_FORMAT_VERSION = 12
+_TEST_INDEX_FORMAT_VERSION = 1
 
 # The ID of the bundle value Instrumentation uses to report which test index the
 # results are for in a collection of tests. Note that this index is 1-based.
@@ -92,7 +92,7 @@ class CommandLineParameterizationException(test_exception.TestException):
     super(CommandLineParameterizationException, self).__init__(msg)
 
 
-class TestListPickleException(test_exception.TestException):
+class TestListIndexException(test_exception.TestException):
   pass
 
 
@@ -223,6 +223,106 @@ def _MaybeSetLog(bundle, current_result, symbolizer, device_abi):
       current_result.SetLog(bundle[_BUNDLE_STACK_ID])
 
 
+def _AnnotationValueMatches(filter_av, av):
+  if filter_av is None:
+    return True
+  elif isinstance(av, dict):
+    tav_from_dict = av['value']
+    # If tav_from_dict is an int, the 'in' operator breaks, so convert
+    # filter_av and manually compare. See https://crbug.com/1019707
+    if isinstance(tav_from_dict, int):
+      return int(filter_av) == tav_from_dict
+    else:
+      return filter_av in tav_from_dict
+  elif isinstance(av, list):
+    return filter_av in av
+  return filter_av == av
+
+
+def _AnyAnnotationMatches(filter_annotations, all_annotations):
+  return any(
+      ak in all_annotations
+      and _AnnotationValueMatches(av, all_annotations[ak])
+      for ak, av in filter_annotations)
+
+
+def _GetFilterableNames(test):
+  """Returns the names that a gtest-style filter can match |test| by."""
+  # Allow fully-qualified name as well as an omitted package.
+  unqualified_class_test = {
+    'class': test['class'].split('.')[-1],
+    'method': test['method']
+  }
+  names = [
+    GetTestName(test, sep='.'),
+    GetTestName(unqualified_class_test, sep='.'),
+    GetUniqueTestName(test, sep='.')
+  ]
+
+  if test['is_junit4']:
+    names += [
+        GetTestNameWithoutParameterPostfix(test, sep='.'),
+        GetTestNameWithoutParameterPostfix(unqualified_class_test, sep='.')
+    ]
+  return names
+
+
+class _TestFilterIndex(object):
+  """Lookup tables used by FilterTests() to avoid rescanning every test.
+
+  Tests are bucketed by annotation name up front, and by each of their
+  filterable names the first time a gtest filter is matched. Queries return
+  sets of indices into the list of tests.
+  """
+
+  def __init__(self, tests):
+    self._tests = tests
+    self._by_annotation = collections.defaultdict(list)
+    for i, t in enumerate(tests):
+      for a in t['annotations']:
+        self._by_annotation[a].append(i)
+    self._names = None
+    self._by_name = None
+
+  def _BuildNameIndex(self):
+    self._names = []
+    self._by_name = collections.defaultdict(list)
+    for i, t in enumerate(self._tests):
+      names = _GetFilterableNames(t)
+      self._names.append(names)
+      for name in names:
+        self._by_name[name].append(i)
+
+  def GetAll(self):
+    return set(xrange(len(self._tests)))
+
+  def MatchAnyAnnotationName(self, annotation_names):
+    matches = set()
+    for a in annotation_names:
+      matches.update(self._by_annotation.get(a, ()))
+    return matches
+
+  def MatchAnyPattern(self, patterns):
+    """Matches tests with a name that matches any of the gtest |patterns|."""
+    if '*' in patterns:
+      return self.GetAll()
+    if self._names is None:
+      self._BuildNameIndex()
+    matches = set()
+    wildcard_regexes = []
+    for pattern in patterns:
+      if any(c in pattern for c in '*?['):
+        wildcard_regexes.append(re.compile(fnmatch.translate(pattern)))
+      else:
+        matches.update(self._by_name.get(pattern, ()))
+    if wildcard_regexes:
+      for i, names in enumerate(self._names):
+        if i not in matches and any(
+            r.match(n) for r in wildcard_regexes for n in names):
+          matches.add(i)
+    return matches
+
+
 def FilterTests(tests, filter_str=None, annotations=None,
                 excluded_annotations=None):
   """Filter a list of tests
@@ -238,79 +338,43 @@ def FilterTests(tests, filter_str=None, annotations=None,
   Return:
     A list of filtered tests
   """
-  def gtest_filter(t):
-    if not filter_str:
-      return True
-    # Allow fully-qualified name as well as an omitted package.
-    unqualified_class_test = {
-      'class': t['class'].split('.')[-1],
-      'method': t['method']
-    }
-    names = [
-      GetTestName(t, sep='.'),
-      GetTestName(unqualified_class_test, sep='.'),
-      GetUniqueTestName(t, sep='.')
-    ]
-
-    if t['is_junit4']:
-      names += [
-          GetTestNameWithoutParameterPostfix(t, sep='.'),
-          GetTestNameWithoutParameterPostfix(unqualified_class_test, sep='.')
-      ]
+  index = _TestFilterIndex(tests)
 
+  # Gtest filtering
+  if filter_str:
     pattern_groups = filter_str.split('-')
+    # An empty group matches everything, as in gtest.
+    matches = index.MatchAnyPattern(pattern_groups[0].split(':')
+                                    if pattern_groups[0] else ['*'])
     if len(pattern_groups) > 1:
-      negative_filter = pattern_groups[1]
-      if unittest_util.FilterTestNames(names, negative_filter):
-        return []
-
-    positive_filter = pattern_groups[0]
-    return unittest_util.FilterTestNames(names, positive_filter)
-
-  def annotation_filter(all_annotations):
-    if not annotations:
-      return True
-    return any_annotation_matches(annotations, all_annotations)
-
-  def excluded_annotation_filter(all_annotations):
-    if not excluded_annotations:
-      return True
-    return not any_annotation_matches(excluded_annotations,
-                                      all_annotations)
-
-  def any_annotation_matches(filter_annotations, all_annotations):
-    return any(
-        ak in all_annotations
-        and annotation_value_matches(av, all_annotations[ak])
-        for ak, av in filter_annotations)
-
-  def annotation_value_matches(filter_av, av):
-    if filter_av is None:
-      return True
-    elif isinstance(av, dict):
-      tav_from_dict = av['value']
-      # If tav_from_dict is an int, the 'in' operator breaks, so convert
-      # filter_av and manually compare. See https://crbug.com/1019707
-      if isinstance(tav_from_dict, int):
-        return int(filter_av) == tav_from_dict
-      else:
-        return filter_av in tav_from_dict
-    elif isinstance(av, list):
-      return filter_av in av
-    return filter_av == av
+      matches -= index.MatchAnyPattern(pattern_groups[1].split(':')
+                                       if pattern_groups[1] else ['*'])
+  else:
+    matches = index.GetAll()
+
+  # Only tests that have one of the filter annotations at all can match it.
+  sized_tests = index.MatchAnyAnnotationName(_VALID_ANNOTATIONS)
+  if annotations:
+    annotated_tests = index.MatchAnyAnnotationName(
+        ak for ak, _ in annotations)
+  if excluded_annotations:
+    excluded_annotated_tests = index.MatchAnyAnnotationName(
+        ak for ak, _ in excluded_annotations)
 
   filtered_tests = []
-  for t in tests:
-    # Gtest filtering
-    if not gtest_filter(t):
-      continue
-
+  for i in sorted(matches):
+    t = tests[i]
     # Enforce that all tests declare their size.
-    if not any(a in _VALID_ANNOTATIONS for a in t['annotations']):
+    if i not in sized_tests:
       raise MissingSizeAnnotationError(GetTestName(t))
 
-    if (not annotation_filter(t['annotations'])
-        or not excluded_annotation_filter(t['annotations'])):
+    if annotations and (
+        i not in annotated_tests
+        or not _AnyAnnotationMatches(annotations, t['annotations'])):
+      continue
+    if excluded_annotations and (
+        i in excluded_annotated_tests
+        and _AnyAnnotationMatches(excluded_annotations, t['annotations'])):
       continue
 
     filtered_tests.append(t)
@@ -320,39 +384,119 @@ def FilterTests(tests, filter_str=None, annotations=None,
 
 # TODO(yolandyan): remove this once the tests are converted to junit4
 def GetAllTestsFromJar(test_jar):
-  pickle_path = '%s-proguard.pickle' % test_jar
+  index_path = '%s-proguard.test_index' % test_jar
+  content_hash = ComputeContentHash([test_jar])
   try:
-    tests = GetTestsFromPickle(pickle_path, os.path.getmtime(test_jar))
-  except TestListPickleException as e:
-    logging.info('Could not get tests from pickle: %s', e)
+    tests = GetTestsFromIndex(index_path, content_hash)
+  except TestListIndexException as e:
+    logging.info('Could not get tests from index: %s', e)
     logging.info('Getting tests from JAR via proguard.')
     tests = _GetTestsFromProguard(test_jar)
-    SaveTestsToPickle(pickle_path, tests)
+    SaveTestsToIndex(index_path, tests, content_hash)
   return tests
 
 
 def GetAllTestsFromApk(test_apk):
-  pickle_path = '%s-dexdump.pickle' % test_apk
+  index_path = '%s-dexdump.test_index' % test_apk
+  content_hash = ComputeContentHash([test_apk])
   try:
-    tests = GetTestsFromPickle(pickle_path, os.path.getmtime(test_apk))
-  except TestListPickleException as e:
-    logging.info('Could not get tests from pickle: %s', e)
+    tests = GetTestsFromIndex(index_path, content_hash)
+  except TestListIndexException as e:
+    logging.info('Could not get tests from index: %s', e)
     logging.info('Getting tests from dex via dexdump.')
     tests = _GetTestsFromDexdump(test_apk)
-    SaveTestsToPickle(pickle_path, tests)
+    SaveTestsToIndex(index_path, tests, content_hash)
   return tests
 
-def GetTestsFromPickle(pickle_path, test_mtime):
-  if not os.path.exists(pickle_path):
-    raise TestListPickleException('%s does not exist.' % pickle_path)
-  if os.path.getmtime(pickle_path) <= test_mtime:
-    raise TestListPickleException('File is stale: %s' % pickle_path)
 
-  with open(pickle_path, 'r') as f:
-    pickle_data = pickle.load(f)
-  if pickle_data['VERSION'] != _PICKLE_FORMAT_VERSION:
-    raise TestListPickleException('PICKLE_FORMAT_VERSION has changed.')
-  return pickle_data['TEST_METHODS']
+def ComputeContentHash(paths):
+  """Returns a hash of the contents of the given files.
+
+  Zip files (.apk, .jar) are hashed using the names, CRCs and sizes in their
+  central directory, which is much cheaper than reading their contents.
+  """
+  md5 = hashlib.md5()
+  for path in paths:
+    if zipfile.is_zipfile(path):
+      with zipfile.ZipFile(path) as z:
+        for info in z.infolist():
+          md5.update(('%s:%d:%d\n' % (info.filename, info.CRC,
+                                       info.file_size)).encode('utf-8'))
+    else:
+      with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+          md5.update(chunk)
+  return md5.hexdigest()
+
+
+def GetTestsFromIndex(index_path, content_hash):
+  """Reads a test list written by SaveTestsToIndex().
+
+  Raises:
+    TestListIndexException if the index is missing, was written by a different
+    version of this script, or is for different contents.
+  """
+  if not os.path.exists(index_path):
+    raise TestListIndexException('%s does not exist.' % index_path)
+  try:
+    with open(index_path) as f:
+      index_data = json.load(f)
+  except ValueError as e:
+    raise TestListIndexException('Corrupt index %s: %s' % (index_path, e))
+  if index_data.get('VERSION') != _TEST_INDEX_FORMAT_VERSION:
+    raise TestListIndexException('TEST_INDEX_FORMAT_VERSION has changed.')
+  if index_data['CONTENT_HASH'] != content_hash:
+    raise TestListIndexException('Index is stale: %s' % index_path)
+
+  # Annotation dicts are shared between tests, so must not be modified.
+  annotations = index_data['ANNOTATIONS']
+  tests = []
+  for class_annotations_id, methods, class_info in index_data['CLASSES']:
+    class_info['annotations'] = annotations[class_annotations_id]
+    class_info['methods'] = []
+    for method_annotations_id, method_info in methods:
+      method_info['annotations'] = annotations[method_annotations_id]
+      class_info['methods'].append(method_info)
+    tests.append(class_info)
+  return tests
+
+
+def SaveTestsToIndex(index_path, tests, content_hash):
+  """Writes a test list in a compact form that is fast to load.
+
+  Most tests share the same few sets of annotations, so each distinct set is
+  stored only once.
+  """
+  annotations = []
+  annotation_ids = {}
+
+  def annotations_id(a):
+    key = json.dumps(a, sort_keys=True)
+    if key not in annotation_ids:
+      annotation_ids[key] = len(annotations)
+      annotations.append(a)
+    return annotation_ids[key]
+
+  classes = []
+  for c in tests:
+    methods = []
+    for m in c['methods']:
+      method_info = dict(m)
+      methods.append([annotations_id(method_info.pop('annotations')),
+                      method_info])
+    class_info = dict(c)
+    del class_info['methods']
+    classes.append([annotations_id(class_info.pop('annotations')), methods,
+                    class_info])
+
+  index_data = {
+    'VERSION': _TEST_INDEX_FORMAT_VERSION,
+    'CONTENT_HASH': content_hash,
+    'ANNOTATIONS': annotations,
+    'CLASSES': classes,
+  }
+  with open(index_path, 'w') as index_file:
+    json.dump(index_data, index_file, separators=(',', ':'))
 
 
 # TODO(yolandyan): remove this once the test listing from java runner lands
@@ -413,14 +557,6 @@ def _GetTestsFromDexdump(test_apk):
           })
   return tests
 
-def SaveTestsToPickle(pickle_path, tests):
-  pickle_data = {
-    'VERSION': _PICKLE_FORMAT_VERSION,
-    'TEST_METHODS': tests,
-  }
-  with open(pickle_path, 'w') as pickle_file:
-    pickle.dump(pickle_data, pickle_file)
-
 
 class MissingJUnit4RunnerException(test_exception.TestException):
   """Raised when JUnit4 runner is not provided or specified in apk manifest"""
@@ -951,7 +1087,7 @@ class InstrumentationTestInstance(test_instance.TestInstance):
     self._data_deps.extend(
         self._data_deps_delegate(self._runtime_deps_path))
     if self._enable_java_deobfuscation:
-      self._deobfuscator = deobfuscator.DeobfuscatorPool(
+      self._deobfuscator = mapping_deobfuscator.MappingDeobfuscator(
           self.test_apk.path + '.mapping')
 
   def GetDataDependencies(self):
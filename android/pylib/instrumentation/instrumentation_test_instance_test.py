@@ -8,8 +8,11 @@
 # pylint: disable=protected-access
 
 import collections
+import os
+import shutil
 import tempfile
 import unittest
+import zipfile
 
 from pylib.base import base_test_result
 from pylib.instrumentation import instrumentation_test_instance
@@ -757,6 +760,54 @@ class InstrumentationTestInstanceTest(unittest.TestCase):
 
     self.assertEquals(actual_tests, expected_tests)
 
+  def testTestIndex_roundTrip(self):
+    raw_tests = [
+      {
+        'annotations': {'Feature': {'value': ['Foo']}},
+        'class': 'org.chromium.test.SampleTest',
+        'superclass': 'java.lang.Object',
+        'methods': [
+          {
+            'annotations': {'SmallTest': None},
+            'method': 'testMethod1',
+          },
+          {
+            'annotations': {'SmallTest': None},
+            'method': 'testMethod2',
+          },
+        ],
+      },
+    ]
+    tmp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tmp_dir)
+    index_path = os.path.join(tmp_dir, 'test.test_index')
+
+    instrumentation_test_instance.SaveTestsToIndex(index_path, raw_tests,
+                                                   'hash1')
+    self.assertEquals(
+        instrumentation_test_instance.GetTestsFromIndex(index_path, 'hash1'),
+        raw_tests)
+    with self.assertRaises(instrumentation_test_instance.TestListIndexException):
+      instrumentation_test_instance.GetTestsFromIndex(index_path, 'hash2')
+
+  def testComputeContentHash(self):
+    tmp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tmp_dir)
+    apk_path = os.path.join(tmp_dir, 'test.apk')
+
+    def write_apk(dex_contents):
+      with zipfile.ZipFile(apk_path, 'w') as z:
+        z.writestr('classes.dex', dex_contents)
+
+    write_apk('dex1')
+    hash1 = instrumentation_test_instance.ComputeContentHash([apk_path])
+    write_apk('dex1')
+    self.assertEquals(
+        instrumentation_test_instance.ComputeContentHash([apk_path]), hash1)
+    write_apk('dex2')
+    self.assertNotEquals(
+        instrumentation_test_instance.ComputeContentHash([apk_path]), hash1)
+
   def testGenerateTestResults_noStatus(self):
     results = instrumentation_test_instance.GenerateTestResults(
         None, None, [], 1000, None, None)
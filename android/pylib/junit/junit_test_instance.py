@@ -13,12 +13,14 @@ class JunitTestInstance(test_instance.TestInstance):
 
     self._coverage_dir = args.coverage_dir
     self._debug_socket = args.debug_socket
+    self._dynamic_sharding = args.dynamic_sharding
     self._coverage_on_the_fly = args.coverage_on_the_fly
     self._package_filter = args.package_filter
     self._resource_apk = args.resource_apk
     self._robolectric_runtime_deps_dir = args.robolectric_runtime_deps_dir
     self._runner_filter = args.runner_filter
     self._shards = args.shards
+    self._test_durations_file = args.test_durations_file
     self._test_filter = test_filter.InitializeFilterFromArgs(args)
     self._test_suite = args.test_suite
 
@@ -46,6 +48,10 @@ class JunitTestInstance(test_instance.TestInstance):
   def debug_socket(self):
     return self._debug_socket
 
+  @property
+  def dynamic_sharding(self):
+    return self._dynamic_sharding
+
   @property
   def package_filter(self):
     return self._package_filter
@@ -62,6 +68,10 @@ class JunitTestInstance(test_instance.TestInstance):
   def runner_filter(self):
     return self._runner_filter
 
+  @property
+  def test_durations_file(self):
+    return self._test_durations_file
+
   @property
   def test_filter(self):
     return self._test_filter
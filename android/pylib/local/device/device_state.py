@@ -0,0 +1,211 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Keeps track of the set-up steps done on devices across test runs."""
+
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+# Device file holding the token of the last test run, as devil's device cache
+# does with /data/local/tmp/cache_token.
+DEVICE_TOKEN_PATH = '/data/local/tmp/chromium_device_state_token'
+
+
+class DeviceState(object):
+  """The set-up steps done on a device since it last booted.
+
+  Each step, e.g. installing an APK or pushing data dependencies, is recorded
+  with a stamp of its inputs, and optionally with a stamp of its result on the
+  device. A step whose stamps have not changed since it was last done can be
+  skipped. Like devil's device caches, this is only used with
+  --enable-device-cache.
+
+  Each test run replaces a token on the device (see SwapDeviceToken()), so
+  that the state is dropped when another output directory ran tests on the
+  device in the meantime.
+  """
+
+  def __init__(self, serial, boot_id, token, steps=None):
+    """Initialize instance.
+
+    Args:
+      serial: Serial of the device.
+      boot_id: Random ID of the current boot of the device. Steps are
+        forgotten when the device reboots.
+      token: The token that this test run wrote to the device.
+      steps: Optional dict of the [stamp, device stamp] of steps done, by step
+        name.
+    """
+    self._serial = serial
+    self._boot_id = boot_id
+    self._token = token
+    self._steps = dict(steps or {})
+
+  @classmethod
+  def Load(cls, data, serial, boot_id, old_token, token):
+    """Returns the state written by Dump(), if the device is unchanged since.
+
+    Args:
+      data: The JSON string returned by Dump().
+      serial: Serial of the device.
+      boot_id: Random ID of the current boot of the device.
+      old_token: The token found on the device, or None.
+      token: The token that this test run wrote to the device.
+    Returns:
+      A DeviceState, with no steps done if |data| was not written for this
+      boot of the device, or if another test run used the device since.
+    """
+    try:
+      obj = json.loads(data)
+    except ValueError:
+      logging.warning('Ignoring corrupt device state of %s', serial)
+      obj = {}
+    if obj.get('serial') != serial or obj.get('boot_id') != boot_id:
+      return cls(serial, boot_id, token)
+    if not old_token or obj.get('token') != old_token:
+      logging.info('Device %s was used by another test run. Not using its '
+                   'device state.', serial)
+      return cls(serial, boot_id, token)
+    return cls(serial, boot_id, token, obj.get('steps'))
+
+  def Dump(self):
+    """Returns the state as a JSON string."""
+    return json.dumps({
+        'serial': self._serial,
+        'boot_id': self._boot_id,
+        'token': self._token,
+        'steps': self._steps,
+    }, indent=2, sort_keys=True)
+
+  def IsDone(self, name, stamp, get_device_stamp=None):
+    """Returns whether step |name| was done with inputs stamped |stamp|.
+
+    Args:
+      name: Name of the step.
+      stamp: Stamp of the inputs of the step.
+      get_device_stamp: Optional function returning a stamp of the result of
+        the step on the device. Only called if |stamp| matches.
+    """
+    if stamp is None or name not in self._steps:
+      return False
+    done_stamp, device_stamp = self._steps[name]
+    if done_stamp != stamp:
+      return False
+    return get_device_stamp is None or get_device_stamp() == device_stamp
+
+  def SetDone(self, name, stamp, device_stamp=None):
+    self._steps[name] = [stamp, device_stamp]
+
+  def SetNotDone(self, name):
+    self._steps.pop(name, None)
+
+
+def SwapDeviceToken(device):
+  """Writes a new token to the device.
+
+  Returns:
+    A tuple of the previous token, or None if there was none, and the new one.
+  """
+  token = uuid.uuid4().hex
+  old_token = device.RunShellCommand(
+      'cat %s 2>/dev/null; echo %s > %s' % (DEVICE_TOKEN_PATH, token,
+                                           DEVICE_TOKEN_PATH),
+      shell=True, check_return=True, single_line=True)
+  return old_token or None, token
+
+
+def RunStep(state, name, get_stamp, step, get_device_stamp=None):
+  """Runs a set-up step, unless |state| shows that it is done already.
+
+  Args:
+    state: The DeviceState of the device, or None if it is not kept.
+    name: Name of the step. Steps that change the same thing on the device,
+      e.g. that install the same package, must have the same name.
+    get_stamp: Function returning a stamp of the inputs of the step, or None
+      if the step must always run. Only called when |state| is not None.
+    step: Function doing the step.
+    get_device_stamp: Optional function returning a stamp of the result of
+      the step on the device, e.g. the path of an installed APK. The step is
+      not skipped if this changed since it was done, e.g. because of a manual
+      adb uninstall.
+  """
+  if state is None:
+    step()
+    return
+
+  stamp = get_stamp()
+  if state.IsDone(name, stamp, get_device_stamp):
+    logging.info('Skipping %s: already done on device.', name)
+    return
+  # Forget the step while it runs, so that it is not skipped next time if it
+  # fails part way.
+  state.SetNotDone(name)
+  step()
+  if stamp is not None:
+    state.SetDone(name, stamp,
+                  get_device_stamp() if get_device_stamp else None)
+
+
+def _IterFiles(host_path):
+  if not os.path.isdir(host_path):
+    yield host_path
+    return
+  for root, dirs, files in os.walk(host_path, followlinks=True):
+    dirs.sort()
+    for f in sorted(files):
+      yield os.path.join(root, f)
+
+
+def GetStamp(host_paths, *args):
+  """Returns a stamp of host files, and of other inputs of a step.
+
+  Like build steps, files are compared by mtime and size rather than by
+  content. Directories stand for all the files they contain.
+
+  Args:
+    host_paths: A list of paths of host files or directories.
+    *args: Other inputs of the step, compared by their repr().
+  Returns:
+    A string that changes when any of the inputs change.
+  """
+  md5 = hashlib.md5()
+  md5.update(repr(args))
+  for host_path in host_paths:
+    for path in _IterFiles(host_path):
+      try:
+        stat = os.stat(path)
+        md5.update('%s:%r:%d\n' % (path, stat.st_mtime, stat.st_size))
+      except OSError:
+        md5.update('%s:missing\n' % path)
+  return md5.hexdigest()
+
+
+def GetInstalledApkStamp(device, package):
+  """Returns a device stamp of the install of |package|.
+
+  The paths of the APKs of a package change with every install, so this also
+  changes when the package is reinstalled or uninstalled by other means. The
+  package manager is asked directly, since devil's device cache would not see
+  those changes either.
+  """
+  return '\n'.join(sorted(
+      device.RunShellCommand(['pm', 'path', package], check_return=False)))
+
+
+def GetApkInstallStamp(apk, *args):
+  """Returns a stamp of an APK and of the other arguments of its install.
+
+  Args:
+    apk: An apk_helper.ApkHelper.
+    *args: Other arguments of the install, e.g. permissions.
+  Returns:
+    A stamp, or None if |apk| is not a plain .apk file (e.g. a bundle), as
+    its inputs are not known then.
+  """
+  if not apk.path.endswith('.apk'):
+    return None
+  return GetStamp([apk.path], *args)
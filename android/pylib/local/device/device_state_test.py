@@ -0,0 +1,189 @@
+#!/usr/bin/env vpython
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pylib.local.device import device_state
+
+
+class DeviceStateTest(unittest.TestCase):
+
+  def _Dump(self):
+    state = device_state.DeviceState('serial', 'boot1', 'token1')
+    state.SetDone('install:org.chromium.foo', 'stamp')
+    return state.Dump()
+
+  def testLoad(self):
+    state = device_state.DeviceState.Load(self._Dump(), 'serial', 'boot1',
+                                          'token1', 'token2')
+    self.assertTrue(state.IsDone('install:org.chromium.foo', 'stamp'))
+    self.assertFalse(state.IsDone('install:org.chromium.foo', 'stamp2'))
+    # The next run expects the token of this one.
+    state = device_state.DeviceState.Load(state.Dump(), 'serial', 'boot1',
+                                          'token2', 'token3')
+    self.assertTrue(state.IsDone('install:org.chromium.foo', 'stamp'))
+
+  def testLoad_rebooted(self):
+    state = device_state.DeviceState.Load(self._Dump(), 'serial', 'boot2',
+                                          'token1', 'token2')
+    self.assertFalse(state.IsDone('install:org.chromium.foo', 'stamp'))
+
+  def testLoad_otherDevice(self):
+    state = device_state.DeviceState.Load(self._Dump(), 'serial2', 'boot1',
+                                          'token1', 'token2')
+    self.assertFalse(state.IsDone('install:org.chromium.foo', 'stamp'))
+
+  def testLoad_otherTestRun(self):
+    state = device_state.DeviceState.Load(self._Dump(), 'serial', 'boot1',
+                                          'other_token', 'token2')
+    self.assertFalse(state.IsDone('install:org.chromium.foo', 'stamp'))
+    state = device_state.DeviceState.Load(self._Dump(), 'serial', 'boot1',
+                                          None, 'token2')
+    self.assertFalse(state.IsDone('install:org.chromium.foo', 'stamp'))
+
+  def testLoad_corrupt(self):
+    state = device_state.DeviceState.Load('{', 'serial', 'boot1', 'token1',
+                                          'token2')
+    self.assertFalse(state.IsDone('install:org.chromium.foo', 'stamp'))
+
+  def testIsDone_deviceStamp(self):
+    state = device_state.DeviceState('serial', 'boot1', 'token1')
+    state.SetDone('install:org.chromium.foo', 'stamp', 'apk_path')
+    self.assertTrue(
+        state.IsDone('install:org.chromium.foo', 'stamp', lambda: 'apk_path'))
+    self.assertFalse(
+        state.IsDone('install:org.chromium.foo', 'stamp', lambda: ''))
+
+
+class RunStepTest(unittest.TestCase):
+
+  def setUp(self):
+    self._state = device_state.DeviceState('serial', 'boot1', 'token1')
+    self._runs = []
+
+  def _Step(self):
+    self._runs.append(1)
+
+  def testSkipsDoneSteps(self):
+    device_state.RunStep(self._state, 'step', lambda: 'a', self._Step)
+    device_state.RunStep(self._state, 'step', lambda: 'a', self._Step)
+    self.assertEquals(1, len(self._runs))
+
+    device_state.RunStep(self._state, 'step', lambda: 'b', self._Step)
+    self.assertEquals(2, len(self._runs))
+
+  def testDeviceStampChanged(self):
+    device_stamps = ['apk_path']
+    get_device_stamp = lambda: device_stamps[0]
+    device_state.RunStep(self._state, 'step', lambda: 'a', self._Step,
+                         get_device_stamp)
+    device_state.RunStep(self._state, 'step', lambda: 'a', self._Step,
+                         get_device_stamp)
+    self.assertEquals(1, len(self._runs))
+
+    # E.g. the package was uninstalled manually.
+    device_stamps[0] = ''
+    device_state.RunStep(self._state, 'step', lambda: 'a', self._Step,
+                         get_device_stamp)
+    self.assertEquals(2, len(self._runs))
+
+  def testNoState(self):
+    def get_stamp():
+      raise AssertionError('Stamp should not be needed.')
+
+    device_state.RunStep(None, 'step', get_stamp, self._Step)
+    device_state.RunStep(None, 'step', get_stamp, self._Step)
+    self.assertEquals(2, len(self._runs))
+
+  def testNoStamp(self):
+    device_state.RunStep(self._state, 'step', lambda: None, self._Step)
+    device_state.RunStep(self._state, 'step', lambda: None, self._Step)
+    self.assertEquals(2, len(self._runs))
+
+  def testFailedStep(self):
+    device_state.RunStep(self._state, 'step', lambda: 'a', self._Step)
+
+    def failing_step():
+      raise Exception('failed')
+
+    with self.assertRaises(Exception):
+      device_state.RunStep(self._state, 'step', lambda: 'b', failing_step)
+    self.assertFalse(self._state.IsDone('step', 'a'))
+    self.assertFalse(self._state.IsDone('step', 'b'))
+
+
+class _FakeDevice(object):
+
+  def __init__(self, output):
+    self._output = output
+    self.commands = []
+
+  def RunShellCommand(self, cmd, **_kwargs):
+    self.commands.append(cmd)
+    return self._output
+
+
+class SwapDeviceTokenTest(unittest.TestCase):
+
+  def testSwap(self):
+    device = _FakeDevice('token1')
+    old_token, token = device_state.SwapDeviceToken(device)
+    self.assertEquals('token1', old_token)
+    self.assertNotEquals('token1', token)
+    self.assertIn(token, device.commands[0])
+
+  def testNoToken(self):
+    old_token, token = device_state.SwapDeviceToken(_FakeDevice(''))
+    self.assertIsNone(old_token)
+    self.assertTrue(token)
+
+
+class GetStampTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+    self._file = os.path.join(self._temp_dir, 'dir', 'file')
+    os.makedirs(os.path.dirname(self._file))
+    with open(self._file, 'w') as f:
+      f.write('a')
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def testUnchanged(self):
+    self.assertEquals(
+        device_state.GetStamp([self._temp_dir], 'arg'),
+        device_state.GetStamp([self._temp_dir], 'arg'))
+
+  def testArgs(self):
+    self.assertNotEquals(
+        device_state.GetStamp([self._temp_dir], 'arg'),
+        device_state.GetStamp([self._temp_dir], 'arg2'))
+
+  def testFileChanged(self):
+    stamp = device_state.GetStamp([self._temp_dir])
+    with open(self._file, 'w') as f:
+      f.write('ab')
+    self.assertNotEquals(stamp, device_state.GetStamp([self._temp_dir]))
+
+  def testFileAdded(self):
+    stamp = device_state.GetStamp([self._temp_dir])
+    with open(os.path.join(self._temp_dir, 'file2'), 'w') as f:
+      f.write('a')
+    self.assertNotEquals(stamp, device_state.GetStamp([self._temp_dir]))
+
+  def testMissingFile(self):
+    missing_path = os.path.join(self._temp_dir, 'missing')
+    stamp = device_state.GetStamp([missing_path])
+    with open(missing_path, 'w') as f:
+      f.write('a')
+    self.assertNotEquals(stamp, device_state.GetStamp([missing_path]))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -21,6 +21,7 @@ from devil.utils import file_utils
 from devil.utils import parallelizer
 from pylib import constants
 from pylib.base import environment
+from pylib.local.device import device_state
 from pylib.utils import instrumentation_tracing
 from py_trace_event import trace_event
 
@@ -38,6 +39,11 @@ def _DeviceCachePath(device):
   return os.path.join(constants.GetOutDirectory(), file_name)
 
 
+def _DeviceStatePath(device):
+  file_name = 'device_state_%s.json' % device.adb.GetDeviceSerial()
+  return os.path.join(constants.GetOutDirectory(), file_name)
+
+
 def handle_shard_failures(f):
   """A decorator that handles device failures for per-device functions.
 
@@ -106,6 +112,7 @@ class LocalDeviceEnvironment(environment.Environment):
     self._device_serials = args.test_devices
     self._devices_lock = threading.Lock()
     self._devices = None
+    self._device_states = {}
     self._concurrent_adb = args.enable_concurrent_adb
     self._enable_device_cache = args.enable_device_cache
     self._logcat_monitors = []
@@ -115,6 +122,7 @@ class LocalDeviceEnvironment(environment.Environment):
     self._preferred_abis = None
     self._recover_devices = args.recover_devices
     self._skip_clear_data = args.skip_clear_data
+    self._test_durations_file = args.test_durations_file
     self._tool_name = args.tool
     self._trace_output = None
     if hasattr(args, 'trace_output'):
@@ -168,6 +176,11 @@ class LocalDeviceEnvironment(environment.Environment):
     def prepare_device(d):
       d.WaitUntilFullyBooted()
 
+      # Replaced by every test run, including those without the device cache,
+      # so that the device state of other output directories is not used
+      # after this run changed the device.
+      old_token, token = device_state.SwapDeviceToken(d)
+
       if self._enable_device_cache:
         cache_path = _DeviceCachePath(d)
         if os.path.exists(cache_path):
@@ -177,6 +190,20 @@ class LocalDeviceEnvironment(environment.Environment):
           # Delete cached file so that any exceptions cause it to be cleared.
           os.unlink(cache_path)
 
+        serial = d.adb.GetDeviceSerial()
+        boot_id = d.ReadFile('/proc/sys/kernel/random/boot_id').strip()
+        state_path = _DeviceStatePath(d)
+        if os.path.exists(state_path):
+          logging.info('Using device state: %s', state_path)
+          with open(state_path) as f:
+            state = device_state.DeviceState.Load(f.read(), serial, boot_id,
+                                                  old_token, token)
+          # Deleted for the same reason as the device cache.
+          os.unlink(state_path)
+        else:
+          state = device_state.DeviceState(serial, boot_id, token)
+        self._device_states[serial] = state
+
       if self._logcat_output_dir:
         logcat_file = os.path.join(
             self._logcat_output_dir,
@@ -215,6 +242,15 @@ class LocalDeviceEnvironment(environment.Environment):
       self._InitDevices()
     return self._devices
 
+  def GetDeviceState(self, device):
+    """Returns the DeviceState of |device|, or None if it is not kept.
+
+    Set-up steps run through device_state.RunStep() with it are skipped when
+    they were already done, by this or a previous test run, since the device
+    booted and no test run of another output directory used it.
+    """
+    return self._device_states.get(device.adb.GetDeviceSerial())
+
   @property
   def max_tries(self):
     return self._max_tries
@@ -231,6 +267,10 @@ class LocalDeviceEnvironment(environment.Environment):
   def skip_clear_data(self):
     return self._skip_clear_data
 
+  @property
+  def test_durations_file(self):
+    return self._test_durations_file
+
   @property
   def tool(self):
     return self._tool_name
@@ -273,6 +313,13 @@ class LocalDeviceEnvironment(environment.Environment):
             'Unable to write device cache as %s directory does not exist',
             os.path.dirname(cache_path))
 
+      state = self.GetDeviceState(d)
+      if state:
+        state_path = _DeviceStatePath(d)
+        with open(state_path, 'w') as f:
+          f.write(state.Dump())
+          logging.info('Wrote device state: %s', state_path)
+
     self.parallel_devices.pMap(tear_down_device)
 
     for m in self._logcat_monitors:
@@ -19,14 +19,19 @@ from devil.android import device_temp_file
 from devil.android import logcat_monitor
 from devil.android import ports
 from devil.android.sdk import version_codes
+from devil.utils import cmd_helper
 from devil.utils import reraiser_thread
 from incremental_install import installer
 from pylib import constants
 from pylib.base import base_test_result
+from pylib.base import test_durations
+from pylib.gtest import gtest_output_parser
 from pylib.gtest import gtest_test_instance
 from pylib.local import local_test_server_spawner
+from pylib.local.device import device_state
 from pylib.local.device import local_device_environment
 from pylib.local.device import local_device_test_run
+from pylib.utils import data_deps_sync
 from pylib.utils import google_storage_helper
 from pylib.utils import logdog_helper
 from py_trace_event import trace_event
@@ -160,6 +165,38 @@ def _GetLLVMProfilePath(device_coverage_dir, suite, coverage_index):
                                   str(coverage_index), '%2m.profraw']))
 
 
+def _IterShellCommand(device, cmd, cwd, env, timeout, output_handler):
+  """Runs |cmd| on |device|, passing each line of output as it is produced.
+
+  Args:
+    device: The device to run the command on.
+    cmd: The command, as a list of arguments.
+    cwd: The directory to run the command in.
+    env: A dict of environment variables to set for the command.
+    timeout: Timeout for the whole command, in seconds.
+    output_handler: Function called with each line of output.
+
+  Raises:
+    device_errors.CommandTimeoutError: The command timed out.
+  """
+  # Quotes the command the way RunShellCommand() does.
+  shell_cmd = ' '.join(cmd_helper.SingleQuote(c) for c in cmd)
+  if env:
+    env_string = ' '.join(
+        '%s=%s' % (k, cmd_helper.DoubleQuote(v)) for k, v in env.items())
+    shell_cmd = '%s %s' % (env_string, shell_cmd)
+  shell_cmd = 'cd %s && %s' % (cmd_helper.SingleQuote(cwd), shell_cmd)
+  try:
+    for line in device.adb.IterShell(shell_cmd, timeout=timeout):
+      output_handler(line.rstrip('\r'))
+  except cmd_helper.TimeoutError as e:
+    raise device_errors.CommandTimeoutError(str(e))
+  except subprocess.CalledProcessError:
+    # Executable tests return a nonzero exit code on test failure, which is
+    # fine from the test runner's perspective.
+    pass
+
+
 class _ApkDelegate(object):
   def __init__(self, test_instance, tool):
     self._activity = test_instance.activity
@@ -193,10 +230,23 @@ class _ApkDelegate(object):
           reinstall=True,
           permissions=self._permissions)
 
+  def GetInstallStepName(self):
+    return 'install:%s' % self._package
+
+  def GetInstallStamp(self):
+    # Incremental installs already check on the device what changed.
+    if self._test_apk_incremental_install_json:
+      return None
+    return device_state.GetApkInstallStamp(self._apk_helper,
+                                           self._permissions)
+
+  def GetDeviceInstallStamp(self, device):
+    return device_state.GetInstalledApkStamp(device, self._package)
+
   def ResultsDirectory(self, device):
     return device.GetApplicationDataDirectory(self._package)
 
-  def Run(self, test, device, flags=None, **kwargs):
+  def Run(self, test, device, flags=None, output_handler=None, **kwargs):
     extras = dict(self._extras)
     device_api = device.build_version_sdk
 
@@ -266,7 +316,19 @@ class _ApkDelegate(object):
               device, device_coverage_dir,
               os.path.join(self._coverage_dir, str(self._coverage_index)))
 
-      return device.ReadFile(stdout_file.name).splitlines()
+      if not output_handler:
+        return device.ReadFile(stdout_file.name).splitlines()
+
+      # The test's stdout is only available once it exits. Pull it rather than
+      # reading it into memory.
+      with tempfile_ext.NamedTemporaryDirectory() as host_dir:
+        host_stdout_file = os.path.join(host_dir, 'stdout.txt')
+        device.PullFile(stdout_file.name, host_stdout_file)
+        with open(host_stdout_file) as f:
+          for line in f:
+            for l in line.splitlines():
+              output_handler(l)
+      return None
 
   def PullAppFiles(self, device, files, directory):
     device_dir = device.GetApplicationDataDirectory(self._package)
@@ -309,12 +371,21 @@ class _ExeDelegate(object):
     device.PushChangedFiles([(self._host_dist_dir, self._device_dist_dir)],
                             delete_device_stale=True)
 
+  def GetInstallStepName(self):
+    return 'push:%s' % self._device_dist_dir
+
+  def GetInstallStamp(self):
+    return device_state.GetStamp([self._host_dist_dir])
+
+  def GetDeviceInstallStamp(self, device):
+    return device.PathExists(self._device_dist_dir)
+
   def ResultsDirectory(self, device):
     # pylint: disable=no-self-use
     # pylint: disable=unused-argument
     return constants.TEST_EXECUTABLE_DIR
 
-  def Run(self, test, device, flags=None, **kwargs):
+  def Run(self, test, device, flags=None, output_handler=None, **kwargs):
     tool = self._test_run.GetTool(device).GetTestWrapper()
     if tool:
       cmd = [tool]
@@ -350,10 +421,16 @@ class _ExeDelegate(object):
     except (device_errors.CommandFailedError, KeyError):
       pass
 
-    # Executable tests return a nonzero exit code on test failure, which is
-    # fine from the test runner's perspective; thus check_return=False.
-    output = device.RunShellCommand(
-        cmd, cwd=cwd, env=env, check_return=False, large_output=True, **kwargs)
+    if output_handler:
+      output = None
+      _IterShellCommand(device, cmd, cwd, env, kwargs.get('timeout'),
+                        output_handler)
+    else:
+      # Executable tests return a nonzero exit code on test failure, which is
+      # fine from the test runner's perspective; thus check_return=False.
+      output = device.RunShellCommand(
+          cmd, cwd=cwd, env=env, check_return=False, large_output=True,
+          **kwargs)
 
     if self._coverage_dir:
       _PullCoverageFiles(
@@ -402,7 +479,12 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
     def individual_device_set_up(device, host_device_tuples):
       def install_apk(dev):
         # Install test APK.
-        self._delegate.Install(dev)
+        device_state.RunStep(
+            self._env.GetDeviceState(dev),
+            self._delegate.GetInstallStepName(),
+            self._delegate.GetInstallStamp,
+            lambda: self._delegate.Install(dev),
+            lambda: self._delegate.GetDeviceInstallStamp(dev))
 
       def push_test_data(dev):
         # Push data dependencies.
@@ -410,17 +492,34 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
         host_device_tuples_substituted = [
             (h, local_device_test_run.SubstituteDeviceRoot(d, device_root))
             for h, d in host_device_tuples]
-        local_device_environment.place_nomedia_on_device(dev, device_root)
-        dev.PushChangedFiles(
-            host_device_tuples_substituted,
-            delete_device_stale=True,
-            # Some gtest suites, e.g. unit_tests, have data dependencies that
-            # can take longer than the default timeout to push. See
-            # crbug.com/791632 for context.
-            timeout=600)
-        if not host_device_tuples:
-          dev.RemovePath(device_root, force=True, recursive=True, rename=True)
-          dev.RunShellCommand(['mkdir', '-p', device_root], check_return=True)
+
+        def push():
+          local_device_environment.place_nomedia_on_device(dev, device_root)
+          if host_device_tuples:
+            data_deps_sync.SyncDataDeps(
+                dev,
+                host_device_tuples_substituted,
+                device_root,
+                checksums,
+                self._env.GetDeviceState(dev),
+                # Some gtest suites, e.g. unit_tests, have data dependencies
+                # that can take longer than the default timeout to push. See
+                # crbug.com/791632 for context.
+                timeout=600)
+          else:
+            dev.RemovePath(device_root, force=True, recursive=True,
+                           rename=True)
+            dev.RunShellCommand(['mkdir', '-p', device_root],
+                                check_return=True)
+
+        device_state.RunStep(
+            self._env.GetDeviceState(dev), 'push:%s' % device_root,
+            lambda: device_state.GetStamp([h for h, _ in host_device_tuples],
+                                          host_device_tuples_substituted),
+            push,
+            lambda: dev.PathExists(
+                data_deps_sync.GetDeviceManifestPath(device_root)
+                if host_device_tuples else device_root))
 
       def init_tool_and_start_servers(dev):
         tool = self.GetTool(dev)
@@ -472,9 +571,12 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
         for step in steps:
           step()
 
+    checksums = data_deps_sync.HostChecksums(
+        data_deps_sync.GetChecksumsCachePath())
     self._env.parallel_devices.pMap(
         individual_device_set_up,
         self._test_instance.GetDataDependencies())
+    checksums.Save()
 
   #override
   def _ShouldShard(self):
@@ -497,8 +599,8 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
 
     batch_size = self._test_instance.test_launcher_batch_limit
 
-    for i in xrange(0, device_count):
-      unbounded_shard = tests[i::device_count]
+    for unbounded_shard in test_durations.PartitionByDuration(
+        tests, device_count, self._GetTestDuration):
       shards += [
           unbounded_shard[j:j + batch_size]
           for j in xrange(0, len(unbounded_shard), batch_size)
@@ -648,6 +750,21 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
       tombstones.ClearAllTombstones(device)
     test_perf_output_filename = next(self._test_perf_output_filenames)
 
+    # Parse the output as it is produced, so that the results of tests that
+    # ended survive a timeout.
+    # TODO(jbudorick): Transition test scripts away from parsing stdout.
+    parser = None
+    if not (self._test_instance.enable_xml_result_parsing
+            or self._test_instance.isolated_script_test_output):
+      parser = gtest_output_parser.GTestOutputParser(
+          self._test_instance.symbolizer, device.product_cpu_abi)
+    unfinished_result_type = None
+
+    def handle_output_line(line):
+      logging.info(line)
+      if parser:
+        parser.Feed(line)
+
     if self._test_instance.isolated_script_test_output:
       suffix = '.json'
     else:
@@ -696,11 +813,20 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
               logging.info('  %s', f)
 
             with self._ArchiveLogcat(device, test) as logcat_file:
-              output = self._delegate.Run(test,
-                                          device,
-                                          flags=' '.join(flags),
-                                          timeout=timeout,
-                                          retries=0)
+              try:
+                self._delegate.Run(test,
+                                   device,
+                                   flags=' '.join(flags),
+                                   timeout=timeout,
+                                   retries=0,
+                                   output_handler=handle_output_line)
+              except device_errors.CommandTimeoutError:
+                # Tests that ended before the timeout keep their results, and
+                # the others are retried. Without any, the shard times out.
+                if not parser or not parser.GetNumCompleted():
+                  raise
+                logging.exception('gtest shard timed out.')
+                unfinished_result_type = base_test_result.ResultType.TIMEOUT
 
             if self._test_instance.enable_xml_result_parsing:
               try:
@@ -740,18 +866,13 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
     if not self._env.skip_clear_data:
       self._delegate.Clear(device)
 
-    for l in output:
-      logging.info(l)
-
     # Parse the output.
-    # TODO(jbudorick): Transition test scripts away from parsing stdout.
     if self._test_instance.enable_xml_result_parsing:
       results = gtest_test_instance.ParseGTestXML(gtest_xml)
     elif self._test_instance.isolated_script_test_output:
       results = gtest_test_instance.ParseGTestJSON(gtest_json)
     else:
-      results = gtest_test_instance.ParseGTestOutput(
-          output, self._test_instance.symbolizer, device.product_cpu_abi)
+      results = parser.Finish(unfinished_result_type=unfinished_result_type)
 
     tombstones_url = None
     for r in results:
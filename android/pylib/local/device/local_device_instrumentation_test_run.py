@@ -33,10 +33,12 @@ from pylib.base import base_test_result
 from pylib.base import output_manager
 from pylib.constants import host_paths
 from pylib.instrumentation import instrumentation_test_instance
+from pylib.local.device import device_state
 from pylib.local.device import local_device_environment
 from pylib.local.device import local_device_test_run
 from pylib.output import remote_output_manager
 from pylib.utils import chrome_proxy_utils
+from pylib.utils import data_deps_sync
 from pylib.utils import gold_utils
 from pylib.utils import instrumentation_tracing
 from pylib.utils import shared_preference_utils
@@ -240,11 +242,27 @@ class LocalDeviceInstrumentationTestRun(
         @trace_event.traced
         def install_helper_internal(d, apk_path=None):
           # pylint: disable=unused-argument
-          d.Install(apk,
-                    modules=modules,
-                    fake_modules=fake_modules,
-                    permissions=permissions,
-                    additional_locales=additional_locales)
+          def install():
+            d.Install(apk,
+                      modules=modules,
+                      fake_modules=fake_modules,
+                      permissions=permissions,
+                      additional_locales=additional_locales)
+
+          # Replacing or removing system packages changes what is installed
+          # until tear down, so installs are not skipped then.
+          state = None
+          if not (self._test_instance.replace_system_package
+                  or self._test_instance.system_packages_to_remove
+                  or self._test_instance.use_webview_provider):
+            state = self._env.GetDeviceState(d)
+          device_state.RunStep(
+              state, 'install:%s' % apk.GetPackageName(),
+              lambda: device_state.GetApkInstallStamp(
+                  apk, modules, fake_modules, permissions, additional_locales),
+              install,
+              lambda: device_state.GetInstalledApkStamp(
+                  d, apk.GetPackageName()))
 
         return install_helper_internal
 
@@ -332,15 +350,29 @@ class LocalDeviceInstrumentationTestRun(
         host_device_tuples_substituted = [
             (h, local_device_test_run.SubstituteDeviceRoot(d, device_root))
             for h, d in host_device_tuples]
-        logging.info('Pushing data dependencies.')
-        for h, d in host_device_tuples_substituted:
-          logging.debug('  %r -> %r', h, d)
-        local_device_environment.place_nomedia_on_device(dev, device_root)
-        dev.PushChangedFiles(host_device_tuples_substituted,
-                             delete_device_stale=True)
-        if not host_device_tuples_substituted:
-          dev.RunShellCommand(['rm', '-rf', device_root], check_return=True)
-          dev.RunShellCommand(['mkdir', '-p', device_root], check_return=True)
+
+        def push():
+          logging.info('Pushing data dependencies.')
+          for h, d in host_device_tuples_substituted:
+            logging.debug('  %r -> %r', h, d)
+          local_device_environment.place_nomedia_on_device(dev, device_root)
+          if host_device_tuples_substituted:
+            data_deps_sync.SyncDataDeps(dev, host_device_tuples_substituted,
+                                        device_root, checksums,
+                                        self._env.GetDeviceState(dev))
+          else:
+            dev.RunShellCommand(['rm', '-rf', device_root], check_return=True)
+            dev.RunShellCommand(['mkdir', '-p', device_root],
+                                check_return=True)
+
+        device_state.RunStep(
+            self._env.GetDeviceState(dev), 'push:%s' % device_root,
+            lambda: device_state.GetStamp([h for h, _ in host_device_tuples],
+                                          host_device_tuples_substituted),
+            push,
+            lambda: dev.PathExists(
+                data_deps_sync.GetDeviceManifestPath(device_root)
+                if host_device_tuples_substituted else device_root))
 
       @trace_event.traced
       def create_flag_changer(dev):
@@ -390,9 +422,12 @@ class LocalDeviceInstrumentationTestRun(
           logging.error('Bug report saved to %s', report_file.Link())
         raise
 
+    checksums = data_deps_sync.HostChecksums(
+        data_deps_sync.GetChecksumsCachePath())
     self._env.parallel_devices.pMap(
         individual_device_set_up,
         self._test_instance.GetDataDependencies())
+    checksums.Save()
     # Created here instead of on a per-test basis so that the downloaded
     # expectations can be re-used between tests, saving a significant amount
     # of time.
@@ -830,23 +865,22 @@ class LocalDeviceInstrumentationTestRun(
 
   def _GetTestsFromRunner(self):
     test_apk_path = self._test_instance.test_apk.path
-    pickle_path = '%s-runner.pickle' % test_apk_path
-    # For incremental APKs, the code doesn't live in the apk, so instead check
-    # the timestamp of the target's .stamp file.
+    index_path = '%s-runner.test_index' % test_apk_path
+    # For incremental APKs, the code doesn't live in the apk, so instead hash
+    # the target's dex files as well.
+    test_paths = [test_apk_path]
     if self._test_instance.test_apk_incremental_install_json:
       with open(self._test_instance.test_apk_incremental_install_json) as f:
         data = json.load(f)
       out_dir = constants.GetOutDirectory()
-      test_mtime = max(
-          os.path.getmtime(os.path.join(out_dir, p)) for p in data['dex_files'])
-    else:
-      test_mtime = os.path.getmtime(test_apk_path)
+      test_paths.extend(os.path.join(out_dir, p) for p in data['dex_files'])
+    content_hash = instrumentation_test_instance.ComputeContentHash(test_paths)
 
     try:
-      return instrumentation_test_instance.GetTestsFromPickle(
-          pickle_path, test_mtime)
-    except instrumentation_test_instance.TestListPickleException as e:
-      logging.info('Could not get tests from pickle: %s', e)
+      return instrumentation_test_instance.GetTestsFromIndex(
+          index_path, content_hash)
+    except instrumentation_test_instance.TestListIndexException as e:
+      logging.info('Could not get tests from index: %s', e)
     logging.info('Getting tests by having %s list them.',
                  self._test_instance.junit4_runner_class)
     def list_tests(d):
@@ -892,7 +926,8 @@ class LocalDeviceInstrumentationTestRun(
     # Get the first viable list of raw tests
     raw_tests = [tl for tl in raw_test_lists if tl][0]
 
-    instrumentation_test_instance.SaveTestsToPickle(pickle_path, raw_tests)
+    instrumentation_test_instance.SaveTestsToIndex(index_path, raw_tests,
+                                                   content_hash)
     return raw_tests
 
   @contextlib.contextmanager
@@ -19,6 +19,7 @@ from pylib import valgrind_tools
 from pylib.base import base_test_result
 from pylib.base import test_run
 from pylib.base import test_collection
+from pylib.base import test_durations
 from pylib.local.device import local_device_environment
 
 
@@ -52,6 +53,8 @@ class LocalDeviceTestRun(test_run.TestRun):
   def __init__(self, env, test_instance):
     super(LocalDeviceTestRun, self).__init__(env, test_instance)
     self._tools = {}
+    self._test_durations = None
+    self._externally_sharded = False
     env.SetPreferredAbis(test_instance.GetPreferredAbis())
 
   #override
@@ -173,8 +176,11 @@ class LocalDeviceTestRun(test_run.TestRun):
 
           try:
             if self._ShouldShard():
-              tc = test_collection.TestCollection(
-                  self._CreateShards(grouped_tests))
+              shards = self._CreateShards(grouped_tests)
+              if self._env.test_durations_file:
+                shards = test_durations.SortLongestFirst(
+                    shards, self._GetTestDuration)
+              tc = test_collection.TestCollection(shards)
               self._env.parallel_devices.pMap(
                   run_tests_on_device, tc, try_results).pGet(None)
             else:
@@ -191,6 +197,7 @@ class LocalDeviceTestRun(test_run.TestRun):
             raise
 
           self._env.IncrementCurrentTry()
+          self._RecordTestDurations(try_results)
           tests = self._GetTestsToRetry(tests, try_results)
 
           logging.info('FINISHED TRY #%d/%d', tries + 1, self._env.max_tries)
@@ -240,6 +247,11 @@ class LocalDeviceTestRun(test_run.TestRun):
     if total_shards < 0 or shard_index < 0 or total_shards <= shard_index:
       raise InvalidShardingSettings(shard_index, total_shards)
 
+    self._externally_sharded = total_shards > 1
+    if self._GetTestDurations():
+      return self._ApplyExternalShardingByDuration(tests, shard_index,
+                                                   total_shards)
+
     sharded_tests = []
     for t in self._GroupTests(tests):
       if (hash(self._GetUniqueTestName(t[0] if isinstance(t, list) else t)) %
@@ -251,6 +263,45 @@ class LocalDeviceTestRun(test_run.TestRun):
 
     return sharded_tests
 
+  def _ApplyExternalShardingByDuration(self, tests, shard_index,
+                                       total_shards):
+    # Every shard must compute the same partitions, so do not depend on the
+    # order in which tests were listed.
+    groups = sorted(
+        self._GroupTests(tests),
+        key=lambda t: self._GetUniqueTestName(t[0] if isinstance(t, list)
+                                              else t))
+    sharded_tests = []
+    for t in test_durations.PartitionByDuration(
+        groups, total_shards, self._GetTestDuration)[shard_index]:
+      if isinstance(t, list):
+        sharded_tests.extend(t)
+      else:
+        sharded_tests.append(t)
+    return sharded_tests
+
+  def _GetTestDurations(self):
+    if self._test_durations is None:
+      self._test_durations = test_durations.TestDurationStore(
+          self._env.test_durations_file)
+    return self._test_durations
+
+  def _GetTestDuration(self, test):
+    """Returns the expected duration of a test, or a list of tests."""
+    if isinstance(test, list):
+      return sum(self._GetTestDuration(t) for t in test)
+    return self._GetTestDurations().GetDuration(self._GetUniqueTestName(test))
+
+  def _RecordTestDurations(self, try_results):
+    if not self._env.test_durations_file:
+      return
+    test_durations_store = self._GetTestDurations()
+    test_durations_store.AddResults(try_results.GetAll())
+    # External shards run on different bots, so the merge step of the run
+    # updates the file instead (see merge_test_durations.py).
+    if not self._externally_sharded:
+      test_durations_store.Save()
+
   def GetTool(self, device):
     if str(device) not in self._tools:
       self._tools[str(device)] = valgrind_tools.CreateTool(
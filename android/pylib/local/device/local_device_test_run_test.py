@@ -8,6 +8,7 @@
 import unittest
 
 from pylib.base import base_test_result
+from pylib.base import test_durations
 from pylib.local.device import local_device_test_run
 
 import mock  # pylint: disable=import-error
@@ -167,6 +168,20 @@ class LocalDeviceTestRunTest(unittest.TestCase):
     self.assertIsInstance(tests_to_retry[0], dict)
     self.assertEquals(tests[1], tests_to_retry[0])
 
+  def testApplyExternalSharding_byDuration(self):
+    test_run = TestLocalDeviceTestRun()
+    test_run._test_durations = test_durations.TestDurationStore()
+    test_run._test_durations.AddResults(
+        base_test_result.BaseTestResult(
+            name, base_test_result.ResultType.PASS, duration=duration)
+        for name, duration in (('Slow', 100), ('Fast1', 10), ('Fast2', 10)))
+    tests = ['Fast1', 'Slow', 'Fast2']
+
+    self.assertEquals(['Slow'],
+                      test_run._ApplyExternalSharding(tests, 0, 2))
+    self.assertEquals(['Fast1', 'Fast2'],
+                      test_run._ApplyExternalSharding(tests, 1, 2))
+
 
 if __name__ == '__main__':
   unittest.main(verbosity=2)
@@ -10,10 +10,13 @@ import os
 import select
 import subprocess
 import sys
+import tempfile
 import zipfile
+from multiprocessing.pool import ThreadPool
 
 from pylib import constants
 from pylib.base import base_test_result
+from pylib.base import test_durations
 from pylib.base import test_run
 from pylib.constants import host_paths
 from pylib.results import json_results
@@ -45,10 +48,20 @@ _MAX_SHARDS = 10
 # and 6 sec with 2 or more shards.
 _MIN_CLASSES_PER_SHARD = 8
 
+# Directory within the output directory where test classes of jars and the
+# durations of test classes are kept between runs.
+_CACHE_DIR = 'junit_test_cache'
+_TEST_CLASSES_CACHE_FILE = 'test_classes.json'
+
+# With --dynamic-sharding, the number of batches of test classes created for
+# each shard. Each batch starts a JVM.
+_BATCHES_PER_SHARD = 3
+
 
 class LocalMachineJunitTestRun(test_run.TestRun):
   def __init__(self, env, test_instance):
     super(LocalMachineJunitTestRun, self).__init__(env, test_instance)
+    self._test_durations = None
 
   #override
   def TestPackage(self):
@@ -118,6 +131,32 @@ class LocalMachineJunitTestRun(test_run.TestRun):
 
     return jvm_args
 
+  def _GetTestDurationsFile(self):
+    return self._test_instance.test_durations_file or os.path.join(
+        constants.GetOutDirectory(), _CACHE_DIR,
+        '%s_durations.json' % self._test_instance.suite)
+
+  def _GetTestDurations(self):
+    if self._test_durations is None:
+      self._test_durations = test_durations.TestDurationStore(
+          self._GetTestDurationsFile())
+    return self._test_durations
+
+  def _GetTestClassDuration(self, test_class):
+    return self._GetTestDurations().GetDuration(_GetTestClassName(test_class))
+
+  def _RecordTestClassDurations(self, results_list):
+    # The durations of classes are only known when all of their tests ran.
+    if (self._test_instance.test_filter or self._test_instance.package_filter
+        or self._test_instance.runner_filter):
+      return
+    durations_dir = os.path.dirname(self._GetTestDurationsFile())
+    if not os.path.isdir(durations_dir):
+      os.makedirs(durations_dir)
+    store = self._GetTestDurations()
+    store.AddResults(GetTestClassResults(results_list))
+    store.Save()
+
   #override
   def RunTests(self, results):
     wrapper_path = os.path.join(constants.GetOutDirectory(), 'bin', 'helper',
@@ -130,20 +169,32 @@ class LocalMachineJunitTestRun(test_run.TestRun):
       test_classes = []
       shards = 1
     else:
-      test_classes = _GetTestClasses(wrapper_path)
-      shards = ChooseNumOfShards(test_classes, self._test_instance.shards)
+      test_classes = _GetTestClasses(
+          wrapper_path,
+          os.path.join(constants.GetOutDirectory(), _CACHE_DIR,
+                       _TEST_CLASSES_CACHE_FILE))
+      shards = ChooseNumOfShards(test_classes, self._test_instance.shards,
+                                 self._GetTestClassDuration)
 
     logging.info('Running tests on %d shard(s).', shards)
-    group_test_list = GroupTestsForShard(shards, test_classes)
+    # With dynamic sharding, shards take batches of test classes, longest
+    # first, from a shared queue as they finish. This makes up for durations
+    # that differ from their history, at the cost of starting more JVMs.
+    num_batches = shards
+    if shards > 1 and self._test_instance.dynamic_sharding:
+      num_batches = min(len(test_classes), shards * _BATCHES_PER_SHARD)
+    group_test_list = GroupTestsForShard(num_batches, test_classes,
+                                         self._GetTestClassDuration)
 
     with tempfile_ext.NamedTemporaryDirectory() as temp_dir:
-      cmd_list = [[wrapper_path] for _ in range(shards)]
+      cmd_list = [[wrapper_path] for _ in range(num_batches)]
       json_result_file_paths = [
-          os.path.join(temp_dir, 'results%d.json' % i) for i in range(shards)
+          os.path.join(temp_dir, 'results%d.json' % i)
+          for i in range(num_batches)
       ]
       jar_args_list = self._CreateJarArgsList(json_result_file_paths,
-                                              group_test_list, shards)
-      for i in range(shards):
+                                              group_test_list, num_batches)
+      for i in range(num_batches):
         cmd_list[i].extend(['--jar-args', '"%s"' % ' '.join(jar_args_list[i])])
 
       jvm_args = self._CreateJvmArgsList()
@@ -153,12 +204,15 @@ class LocalMachineJunitTestRun(test_run.TestRun):
 
       AddPropertiesJar(cmd_list, temp_dir, self._test_instance.resource_apk)
 
-      procs = [
-          subprocess.Popen(cmd,
-                           stdout=subprocess.PIPE,
-                           stderr=subprocess.STDOUT) for cmd in cmd_list
-      ]
-      PrintProcessesStdout(procs)
+      if num_batches > shards:
+        RunCommandsFromQueue(cmd_list, shards)
+      else:
+        procs = [
+            subprocess.Popen(cmd,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT) for cmd in cmd_list
+        ]
+        PrintProcessesStdout(procs)
 
       results_list = []
       try:
@@ -173,6 +227,8 @@ class LocalMachineJunitTestRun(test_run.TestRun):
           base_test_result.BaseTestResult(
               'Test Runner Failure', base_test_result.ResultType.UNKNOWN)
         ]
+      else:
+        self._RecordTestClassDurations(results_list)
 
       test_run_results = base_test_result.TestRunResults()
       test_run_results.AddResults(results_list)
@@ -195,7 +251,7 @@ def AddPropertiesJar(cmd_list, temp_dir, resource_apk):
     cmd.extend(['--classpath', properties_jar_path])
 
 
-def ChooseNumOfShards(test_classes, shards):
+def ChooseNumOfShards(test_classes, shards, get_duration=None):
   # Don't override requests to not shard.
   if shards == 1:
     return 1
@@ -208,31 +264,88 @@ def ChooseNumOfShards(test_classes, shards):
   # Can have at minimum one test_class per shard.
   shards = min(len(test_classes), shards)
 
+  if get_duration and test_classes:
+    # No shard finishes before the longest test class does, so more shards
+    # than that would need only add JVM start-up time.
+    durations = [get_duration(c) for c in test_classes]
+    if max(durations) > 0:
+      shards = min(shards, max(1, int(sum(durations) // max(durations))))
+
   return shards
 
 
-def GroupTestsForShard(num_of_shards, test_classes):
+def _GetTestFilter(test_class):
+  return test_class.replace('.class', '*').replace('/', '.')
+
+
+def _GetTestClassName(test_class):
+  """Returns the name of a test class, given its path in a jar."""
+  if test_class.endswith('.class'):
+    test_class = test_class[:-len('.class')]
+  return test_class.replace('/', '.')
+
+
+def GroupTestsForShard(num_of_shards, test_classes, get_duration=None):
   """Groups tests that will be ran on each shard.
 
   Args:
     num_of_shards: number of shards to split tests between.
     test_classes: A list of test_class files in the jar.
+    get_duration: Optional function returning the expected duration of a test
+      class. When given, shards get test classes of about the same total
+      duration, and the longest shards come first.
 
   Return:
     Returns a dictionary containing a list of test classes.
   """
   test_dict = {i: [] for i in range(num_of_shards)}
 
+  if get_duration:
+    partitions = test_durations.PartitionByDuration(test_classes,
+                                                    num_of_shards, get_duration)
+    partitions = test_durations.SortLongestFirst(
+        partitions, lambda p: sum(get_duration(c) for c in p))
+    for i, partition in enumerate(partitions):
+      test_dict[i] = [_GetTestFilter(c) for c in partition]
+    return test_dict
+
   # Round robin test distribiution to reduce chance that a sequential group of
   # classes all have an unusually high number of tests.
   for count, test_cls in enumerate(test_classes):
-    test_cls = test_cls.replace('.class', '*')
-    test_cls = test_cls.replace('/', '.')
-    test_dict[count % num_of_shards].append(test_cls)
+    test_dict[count % num_of_shards].append(_GetTestFilter(test_cls))
 
   return test_dict
 
 
+def GetTestClassResults(results):
+  """Returns a result per test class, lasting as long as its tests did.
+
+  Test names are expected to be "<class name>#<method name>", as written by the
+  junit test runner. Classes with tests that did not run to completion are
+  left out, since their duration is not known.
+
+  Args:
+    results: An iterable of BaseTestResult.
+  Returns:
+    A list of BaseTestResult, of type PASS, named after test classes.
+  """
+  durations = collections.defaultdict(int)
+  incomplete = set()
+  for r in results:
+    class_name = r.GetName().split('#')[0]
+    if r.GetType() not in (base_test_result.ResultType.PASS,
+                           base_test_result.ResultType.FAIL,
+                           base_test_result.ResultType.SKIP):
+      incomplete.add(class_name)
+    durations[class_name] += r.GetDuration()
+  return [
+      base_test_result.BaseTestResult(
+          name, base_test_result.ResultType.PASS, duration=duration)
+      for name, duration in sorted(durations.iteritems())
+      if name not in incomplete
+  ]
+
+
 def PrintProcessesStdout(procs):
   """Prints the stdout of all the processes.
 
@@ -265,10 +378,80 @@ def PrintProcessesStdout(procs):
     sys.stdout.write(''.join(outputs[p.stdout.fileno()]))
 
 
-def _GetTestClasses(file_path):
+def RunCommandsFromQueue(cmd_list, num_workers):
+  """Runs commands in order, |num_workers| at a time.
+
+  Each worker takes the next command from a shared queue as soon as its
+  previous one exits, so workers that get short commands run more of them.
+  The output of each command is printed once it exits.
+
+  Args:
+    cmd_list: A list of commands.
+    num_workers: The number of commands to run at a time.
+  """
+
+  def run_command(cmd):
+    proc = subprocess.Popen(cmd,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    return proc.communicate()[0]
+
+  pool = ThreadPool(num_workers)
+  try:
+    for output in pool.imap_unordered(run_command, cmd_list):
+      sys.stdout.write(output)
+  finally:
+    pool.close()
+    pool.join()
+
+
+class _TestClassesCache(object):
+  """The test classes of jars, kept in a file between runs.
+
+  The classes of a jar are listed again only when its mtime or size changes.
+  """
+
+  def __init__(self, path=None):
+    self._path = path
+    self._entries = {}
+    self._dirty = False
+    if path and os.path.exists(path):
+      try:
+        with open(path) as f:
+          self._entries = json.load(f)
+      except ValueError:
+        logging.warning('Ignoring corrupt test classes cache: %s', path)
+
+  def GetTestClasses(self, test_jar_path):
+    stat = os.stat(test_jar_path)
+    stamp = [stat.st_mtime, stat.st_size]
+    entry = self._entries.get(test_jar_path)
+    if entry and entry['stamp'] == stamp:
+      return entry['classes']
+    test_classes = _GetTestClassesFromJar(test_jar_path)
+    self._entries[test_jar_path] = {'stamp': stamp, 'classes': test_classes}
+    self._dirty = True
+    return test_classes
+
+  def Save(self):
+    if not self._path or not self._dirty:
+      return
+    dir_name = os.path.dirname(self._path)
+    if not os.path.isdir(dir_name):
+      os.makedirs(dir_name)
+    with tempfile.NamedTemporaryFile(
+        mode='w', dir=dir_name, delete=False) as tmp_file:
+      json.dump(self._entries, tmp_file, separators=(',', ':'))
+    # Atomic, so that concurrent test runs never see a partial file.
+    os.rename(tmp_file.name, self._path)
+    self._dirty = False
+
+
+def _GetTestClasses(file_path, cache_path=None):
   test_jar_paths = subprocess.check_output([file_path, '--print-classpath'])
   test_jar_paths = test_jar_paths.split(':')
 
+  cache = _TestClassesCache(cache_path)
   test_classes = []
   for test_jar in test_jar_paths:
     # Avoid searching through jars that are for the test runner.
@@ -285,8 +468,9 @@ def _GetTestClasses(file_path):
         test_jar_path = os.path.join(constants.DIR_SOURCE_ROOT,
                                      test_jar[len(src_relpath):])
 
-    test_classes += _GetTestClassesFromJar(test_jar_path)
+    test_classes += cache.GetTestClasses(test_jar_path)
 
+  cache.Save()
   logging.info('Found %d test classes in class_path jars.', len(test_classes))
   return test_classes
 
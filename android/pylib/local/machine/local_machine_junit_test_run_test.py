@@ -8,6 +8,7 @@
 import os
 import unittest
 
+from pylib.base import base_test_result
 from pylib.local.machine import local_machine_junit_test_run
 from py_utils import tempfile_ext
 from mock import patch  # pylint: disable=import-error
@@ -90,6 +91,84 @@ class LocalMachineJunitTestRunTests(unittest.TestCase):
     }
     self.assertDictEqual(results, ans_dict)
 
+  def testGroupTestsForShard_withDurations(self):
+    durations = {
+        'a/A.class': 10,
+        'a/B.class': 1,
+        'a/C.class': 6,
+        'a/D.class': 4,
+    }
+    results = local_machine_junit_test_run.GroupTestsForShard(
+        2, sorted(durations), durations.get)
+    ans_dict = {
+        0: ['a.A*', 'a.B*'],
+        1: ['a.C*', 'a.D*'],
+    }
+    self.assertDictEqual(results, ans_dict)
+
+  @patch('multiprocessing.cpu_count')
+  def testChooseNumOfShards_withDurations(self, mock_cpu_count):
+    mock_cpu_count.return_value = 36
+    test_classes = ['Test%d' % i for i in range(40)]
+
+    # Shards can't finish before the longest test class does.
+    durations = dict.fromkeys(test_classes, 1)
+    durations['Test0'] = 10
+    shards = local_machine_junit_test_run.ChooseNumOfShards(
+        test_classes, 5, durations.get)
+    self.assertEquals(4, shards)
+
+    # Equal durations don't change the number of shards.
+    shards = local_machine_junit_test_run.ChooseNumOfShards(
+        test_classes, 5, lambda _: 1)
+    self.assertEquals(5, shards)
+
+  def testGetTestClassResults(self):
+    def result(name, result_type, duration):
+      return base_test_result.BaseTestResult(name, result_type,
+                                             duration=duration)
+
+    results = [
+        result('org.A#test1', base_test_result.ResultType.PASS, 10),
+        result('org.A#test2', base_test_result.ResultType.FAIL, 20),
+        result('org.B#test1', base_test_result.ResultType.PASS, 5),
+        result('org.B#test2', base_test_result.ResultType.CRASH, 0),
+        result('org.C#test1', base_test_result.ResultType.SKIP, 0),
+    ]
+    class_results = local_machine_junit_test_run.GetTestClassResults(results)
+    self.assertEquals(
+        [('org.A', 30), ('org.C', 0)],
+        [(r.GetName(), r.GetDuration()) for r in class_results])
+    for r in class_results:
+      self.assertEquals(base_test_result.ResultType.PASS, r.GetType())
+
+  @patch('pylib.local.machine.local_machine_junit_test_run.'
+         '_GetTestClassesFromJar')
+  def testTestClassesCache(self, mock_get_test_classes):
+    mock_get_test_classes.return_value = ['org/A.class']
+    with tempfile_ext.NamedTemporaryDirectory() as temp_dir:
+      jar_path = os.path.join(temp_dir, 'test.jar')
+      with open(jar_path, 'w') as f:
+        f.write('jar')
+      cache_path = os.path.join(temp_dir, 'cache', 'test_classes.json')
+
+      cache = local_machine_junit_test_run._TestClassesCache(cache_path)
+      self.assertEquals(['org/A.class'], cache.GetTestClasses(jar_path))
+      cache.Save()
+      self.assertEquals(1, mock_get_test_classes.call_count)
+
+      # The jar is unchanged, so its classes come from the cache.
+      cache = local_machine_junit_test_run._TestClassesCache(cache_path)
+      self.assertEquals(['org/A.class'], cache.GetTestClasses(jar_path))
+      self.assertEquals(1, mock_get_test_classes.call_count)
+
+      with open(jar_path, 'w') as f:
+        f.write('new jar')
+      mock_get_test_classes.return_value = ['org/B.class']
+      cache = local_machine_junit_test_run._TestClassesCache(cache_path)
+      self.assertEquals(['org/B.class'], cache.GetTestClasses(jar_path))
+      self.assertEquals(2, mock_get_test_classes.call_count)
+
 
 if __name__ == '__main__':
   unittest.main()
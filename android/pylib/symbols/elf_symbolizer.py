@@ -2,6 +2,7 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import binascii
 import collections
 import datetime
 import logging
@@ -10,6 +11,7 @@ import os
 import posixpath
 import Queue
 import re
+import struct
 import subprocess
 import sys
 import threading
@@ -26,6 +28,11 @@ ADDR2LINE_RECYCLE_LIMIT = 4000
 ELF_MAGIC = '\x7f\x45\x4c\x46'
 
 
+# From elf.h.
+_PT_NOTE = 4
+_NT_GNU_BUILD_ID = 3
+
+
 def ContainsElfMagic(file_path):
   if os.path.getsize(file_path) < 4:
     return False
@@ -37,6 +44,57 @@ def ContainsElfMagic(file_path):
     return False
 
 
+def GetBuildId(file_path):
+  """Returns the GNU build-id of an ELF file as a hex string, or None.
+
+  Reads only the ELF and program headers and PT_NOTE segments.
+  """
+  try:
+    with open(file_path, 'rb') as f:
+      header = f.read(64)
+      if header[:4] != b'\x7fELF':
+        return None
+      is_64 = header[4:5] == b'\x02'
+      endian = '<' if header[5:6] == b'\x01' else '>'
+      if is_64:
+        phoff, = struct.unpack_from(endian + 'Q', header, 32)
+        phentsize, phnum = struct.unpack_from(endian + 'HH', header, 54)
+      else:
+        phoff, = struct.unpack_from(endian + 'I', header, 28)
+        phentsize, phnum = struct.unpack_from(endian + 'HH', header, 42)
+
+      for i in xrange(phnum):
+        f.seek(phoff + i * phentsize)
+        phdr = f.read(phentsize)
+        p_type, = struct.unpack_from(endian + 'I', phdr, 0)
+        if p_type != _PT_NOTE:
+          continue
+        if is_64:
+          p_offset, = struct.unpack_from(endian + 'Q', phdr, 8)
+          p_filesz, = struct.unpack_from(endian + 'Q', phdr, 32)
+        else:
+          p_offset, = struct.unpack_from(endian + 'I', phdr, 4)
+          p_filesz, = struct.unpack_from(endian + 'I', phdr, 16)
+        f.seek(p_offset)
+        notes = f.read(p_filesz)
+
+        # Each note is: namesz, descsz, type, name, desc (4-byte aligned).
+        pos = 0
+        while pos + 12 <= len(notes):
+          namesz, descsz, note_type = struct.unpack_from(endian + 'III', notes,
+                                                         pos)
+          pos += 12
+          name = notes[pos:pos + namesz]
+          pos += (namesz + 3) & ~3
+          desc = notes[pos:pos + descsz]
+          pos += (descsz + 3) & ~3
+          if note_type == _NT_GNU_BUILD_ID and name.rstrip(b'\0') == b'GNU':
+            return binascii.hexlify(desc).decode('ascii')
+  except (IOError, OSError, struct.error):
+    pass
+  return None
+
+
 class ELFSymbolizer(object):
   """An uber-fast (multiprocessing, pipelined and asynchronous) ELF symbolizer.
 
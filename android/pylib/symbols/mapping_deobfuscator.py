@@ -0,0 +1,304 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""An in-process replacement for java_deobfuscate.
+
+MappingDeobfuscator implements the same line transformations as
+//build/android/stacktrace/java/org/chromium/build/FlushingReTrace.java (i.e.
+ProGuard's ReTrace with Chromium's line regular expression), but looks names
+up in a mapping_index.MappingIndex rather than parsing the mapping file into a
+JVM. Start-up therefore costs a memory-map of an index that is built once per
+mapping, and a single instance can serve concurrent callers.
+"""
+
+import re
+
+from pylib.symbols import mapping_index
+
+# Keep in sync with FlushingReTrace.java.
+_LOGCAT_PREFIX = (r'(?:[VDIWEF]/.*?\( *\d+\): |'
+                  r'\d\d-\d\d [0-9:. ]+[VDIWEF] .*?: )?')
+_LINE_PARSE_REGEX = (
+    _LOGCAT_PREFIX + r'(?:'
+    r'(?:.*?(?::|\bat)\s+%c\.%m\s*\(\s*%s(?:\s*:\s*%l\s*)?\))|'
+    r'(?:.*java\.lang\.NullPointerException.*["\']%t\s*%c\.(?:%f|%m\(%a\))'
+    r'["\'].*)|'
+    r'(?:java\.lang\.VerifyError: %c)|'
+    r'(?:java\.lang\.NoSuchFieldError: No instance field %f of type .*? in '
+    r'class L%C;)|'
+    r'(?:.*?Object of type %c .*)|'
+    r'(?:.*L%C;.*)|'
+    r'(?:.*?%c#%m.*?)|'
+    r'(?:.* isTestClass for %c)|'
+    r'(?:Caused by: %c:.*)|'
+    r'(?:.*?%c\.%m)|'
+    r'(?:.*?"%c\.%m".*)|'
+    r'(?:.*\b(?:[Cc]lass|[Tt]ype)\b.*?"%c".*)|'
+    r'(?:.*\b(?:[Cc]lass|[Tt]ype)\b.*?%c)|'
+    r'(?:%c:.*)|'
+    r'(?:%c)'
+    r')')
+
+# Expansions of ReTrace's placeholders.
+_REGEX_CLASS = r'(?:[^\s":./()]+\.)*[^\s":./()]+'
+_REGEX_TYPE = _REGEX_CLASS + r'(?:\[\])*'
+_PLACEHOLDER_REGEXES = {
+    'c': _REGEX_CLASS,
+    'C': r'(?:[^\s":./()]+/)*[^\s":./()]+',
+    's': r'[^:()]*',
+    'l': r'\d+',
+    't': _REGEX_TYPE,
+    'f': r'<?\b[^\s":./()]+>?',
+    'm': r'<?\b[^\s":./()]+>?',
+    'a': r'(?:%s(?:\s*,\s*%s)*)?' % (_REGEX_TYPE, _REGEX_TYPE),
+}
+
+
+def _CompileLinePattern(regex):
+  """Returns (compiled regex, list of placeholder types of each group)."""
+  group_types = []
+
+  def expand(m):
+    group_types.append(m.group(1))
+    return '(%s)' % _PLACEHOLDER_REGEXES[m.group(1)]
+
+  expanded = re.sub(r'%([cCsltfma])', expand, regex)
+  # ReTrace requires the whole line to match.
+  return re.compile(r'(?:%s)\Z' % expanded), group_types
+
+
+_LINE_PATTERN, _GROUP_TYPES = _CompileLinePattern(_LINE_PARSE_REGEX)
+
+
+class _Frame(object):
+  def __init__(self, class_name=None, source_file=None, line_number=0,
+               type_name=None, field_name=None, method_name=None,
+               arguments=None):
+    self.class_name = class_name
+    self.source_file = source_file
+    self.line_number = line_number
+    self.type_name = type_name
+    self.field_name = field_name
+    self.method_name = method_name
+    self.arguments = arguments
+
+
+def _SourceFileName(class_name):
+  simple_name = class_name[class_name.rfind('.') + 1:]
+  return simple_name.split('$', 1)[0] + '.java'
+
+
+def _IsIdentifierChar(c):
+  return c.isalnum() or c in '_$'
+
+
+def _TrimCommonPrefix(line, previous_line):
+  """Blanks out the part of |line| that is shared with |previous_line|.
+
+  Used to present ambiguous alternatives more cleanly, like ReTrace does.
+  Returns None if the lines are identical.
+  """
+  end = 0
+  while (end < len(line) and end < len(previous_line)
+         and line[end] == previous_line[end]):
+    end += 1
+  if end == len(line):
+    return None
+  # Do not clear a partially-shared identifier.
+  while end > 0 and _IsIdentifierChar(line[end - 1]):
+    end -= 1
+  return ''.join(' ' if not c.isspace() else c
+                 for c in line[:end]) + line[end:]
+
+
+class MappingDeobfuscator(object):
+  """Deobfuscates names in lines of text using a ProGuard mapping.
+
+  Has the same interface as deobfuscator.Deobfuscator, but is thread-safe and
+  runs in-process.
+  """
+
+  def __init__(self, mapping_path, index_path=None):
+    self._index = mapping_index.OpenIndex(mapping_path, index_path)
+    self._closed = False
+
+  def IsClosed(self):
+    return self._closed
+
+  def IsBusy(self):
+    return False
+
+  def IsReady(self):
+    return not self._closed
+
+  def _OriginalClassName(self, obfuscated_name):
+    return (self._index.GetOriginalClassName(obfuscated_name)
+            or obfuscated_name)
+
+  def _OriginalType(self, obfuscated_type):
+    array_index = obfuscated_type.find('[')
+    if array_index < 0:
+      return self._OriginalClassName(obfuscated_type)
+    return (self._OriginalClassName(obfuscated_type[:array_index]) +
+            obfuscated_type[array_index:])
+
+  def _OriginalArguments(self, obfuscated_arguments):
+    return ','.join(
+        self._OriginalType(a.strip())
+        for a in obfuscated_arguments.split(',') if a.strip())
+
+  def _Parse(self, line):
+    """Returns (match, _Frame) for |line|, or None if it does not match."""
+    m = _LINE_PATTERN.match(line)
+    if not m:
+      return None
+    frame = _Frame()
+    for group_type, value in zip(_GROUP_TYPES, m.groups()):
+      if value is None:
+        continue
+      if group_type == 'c':
+        frame.class_name = value
+      elif group_type == 'C':
+        frame.class_name = value.replace('/', '.')
+      elif group_type == 's':
+        frame.source_file = value
+      elif group_type == 'l':
+        frame.line_number = int(value)
+      elif group_type == 't':
+        frame.type_name = value
+      elif group_type == 'f':
+        frame.field_name = value
+      elif group_type == 'm':
+        frame.method_name = value
+      elif group_type == 'a':
+        frame.arguments = value
+    return m, frame
+
+  def _Transform(self, obfuscated):
+    """Returns the original frames for an obfuscated one."""
+    original_class_name = self._OriginalClassName(obfuscated.class_name)
+    original_type = None
+    if obfuscated.type_name is not None:
+      original_type = self._OriginalType(obfuscated.type_name)
+    frames = []
+
+    if obfuscated.field_name is not None:
+      for info in self._index.GetFields(original_class_name,
+                                        obfuscated.field_name):
+        if original_type is None or original_type == info.original_type:
+          frames.append(
+              _Frame(info.original_class_name,
+                     _SourceFileName(info.original_class_name),
+                     obfuscated.line_number, info.original_type,
+                     info.original_name, obfuscated.method_name,
+                     obfuscated.arguments))
+
+    if obfuscated.method_name is not None:
+      original_arguments = None
+      if obfuscated.arguments is not None:
+        original_arguments = self._OriginalArguments(obfuscated.arguments)
+      line_number = obfuscated.line_number
+      for info in self._index.GetMethods(original_class_name,
+                                         obfuscated.method_name):
+        # Like ReTrace, frames without a line number match all methods of the
+        # name, as do methods without line ranges.
+        if (line_number != 0 and info.obfuscated_last_line != 0
+            and not (info.obfuscated_first_line <= line_number <=
+                     info.obfuscated_last_line)):
+          continue
+        if original_type is not None and original_type != info.original_type:
+          continue
+        if (original_arguments is not None
+            and original_arguments != info.arguments):
+          continue
+
+        original_line = line_number
+        if info.original_first_line != info.obfuscated_first_line:
+          # Shift the line number when there is enough information to do so.
+          if (info.original_last_line != 0
+              and info.original_last_line != info.original_first_line
+              and info.obfuscated_first_line != 0 and line_number != 0):
+            original_line = (info.original_first_line -
+                             info.obfuscated_first_line + line_number)
+          else:
+            original_line = info.original_first_line
+        frames.append(
+            _Frame(info.original_class_name,
+                   _SourceFileName(info.original_class_name), original_line,
+                   info.original_type, obfuscated.field_name,
+                   info.original_name, info.arguments))
+
+    if not frames:
+      frames.append(
+          _Frame(original_class_name, _SourceFileName(original_class_name),
+                 obfuscated.line_number, obfuscated.type_name,
+                 obfuscated.field_name, obfuscated.method_name,
+                 obfuscated.arguments))
+    return frames
+
+  @staticmethod
+  def _Format(line, match, frame):
+    parts = []
+    pos = 0
+    for i, group_type in enumerate(_GROUP_TYPES):
+      start = match.start(i + 1)
+      if start < 0:
+        continue
+      parts.append(line[pos:start])
+      if group_type == 'c':
+        parts.append(frame.class_name)
+      elif group_type == 'C':
+        parts.append(frame.class_name.replace('.', '/'))
+      elif group_type == 's':
+        parts.append(frame.source_file)
+      elif group_type == 'l':
+        parts.append(str(frame.line_number))
+      elif group_type == 't':
+        parts.append(frame.type_name)
+      elif group_type == 'f':
+        parts.append(frame.field_name)
+      elif group_type == 'm':
+        parts.append(frame.method_name)
+      elif group_type == 'a':
+        parts.append(frame.arguments)
+      pos = match.end(i + 1)
+    parts.append(line[pos:])
+    return ''.join(parts)
+
+  def _TransformLine(self, line, out_lines):
+    parsed = self._Parse(line)
+    if not parsed:
+      out_lines.append(line)
+      return
+    match, obfuscated = parsed
+    previous_line = None
+    for frame in self._Transform(obfuscated):
+      retraced_line = self._Format(line, match, frame)
+      trimmed_line = retraced_line
+      if previous_line is not None and obfuscated.line_number == 0:
+        trimmed_line = _TrimCommonPrefix(retraced_line, previous_line)
+      if trimmed_line is not None:
+        out_lines.append(trimmed_line)
+      previous_line = retraced_line
+
+  def TransformLines(self, lines):
+    """Deobfuscates obfuscated names found in the given lines.
+
+    Args:
+      lines: A list of strings without trailing newlines.
+
+    Returns:
+      A list of strings without trailing newlines. Inlined frames produce
+      additional lines.
+    """
+    if self._closed:
+      return lines
+    out_lines = []
+    for line in lines:
+      self._TransformLine(line, out_lines)
+    return out_lines
+
+  def Close(self):
+    # The index is left mapped, since other threads may still be using it.
+    self._closed = True
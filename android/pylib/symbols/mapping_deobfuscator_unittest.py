@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pylib.symbols import mapping_deobfuscator
+from pylib.symbols import mapping_index
+
+# Same as in //build/android/stacktrace/java_deobfuscate_test.py, plus an
+# inlined method.
+_TEST_MAP = """\
+# compiler: R8
+this.was.Deobfuscated -> FOO:
+    int[] mFontFamily -> a
+    1:3:void someMethod(int,android.os.Bundle):65:67 -> bar
+    4:4:void other.Inlinee.inlined():10:10 -> baz
+    4:4:void caller():20 -> baz
+never.Deobfuscated -> NOTFOO:
+    int[] mFontFamily -> a
+    1:3:void someMethod(int,android.os.Bundle):65:67 -> bar
+"""
+
+_LINE_PREFIXES = [
+    '',
+    # logcat -v threadtime
+    '09-08 14:38:35.535 18029 18084 E qcom_sensors_hal: ',
+    # logcat
+    'W/GCM     (15158): ',
+    'W/GCM     (  158): ',
+]
+
+_TEST_DATA = [
+    ('', ''),
+    ('FOO', 'this.was.Deobfuscated'),
+    ('FOO.bar', 'this.was.Deobfuscated.someMethod'),
+    ('Here is a FOO', 'Here is a FOO'),
+    ('Here is a class FOO', 'Here is a class this.was.Deobfuscated'),
+    ('Here is a class FOO baz', 'Here is a class FOO baz'),
+    ('Here is a "FOO" baz', 'Here is a "FOO" baz'),
+    ('Here is a type "FOO" baz', 'Here is a type "this.was.Deobfuscated" baz'),
+    ('Here is a "FOO.bar" baz',
+     'Here is a "this.was.Deobfuscated.someMethod" baz'),
+    ('SomeError: SomeFrameworkClass in isTestClass for FOO',
+     'SomeError: SomeFrameworkClass in isTestClass for this.was.Deobfuscated'),
+    ('Here is a FOO.bar', 'Here is a this.was.Deobfuscated.someMethod'),
+    ('Here is a FOO.bar baz', 'Here is a FOO.bar baz'),
+    ('END FOO#bar', 'END this.was.Deobfuscated#someMethod'),
+    ('new-instance 3810 (LSome/Framework/Class;) in LFOO;',
+     'new-instance 3810 (LSome/Framework/Class;) in Lthis/was/Deobfuscated;'),
+    ('FOO: Error message', 'this.was.Deobfuscated: Error message'),
+    ('Caused by: FOO: Error message',
+     'Caused by: this.was.Deobfuscated: Error message'),
+    ('\tat FOO.bar(PG:1)',
+     '\tat this.was.Deobfuscated.someMethod(Deobfuscated.java:65)'),
+    ('\t at\t FOO.bar\t (\t PG:\t 3\t )',
+     '\t at\t this.was.Deobfuscated.someMethod\t (\t Deobfuscated.java:\t 67\t )'
+     ),
+    ('Unable to start activity ComponentInfo{garbage.in/here.test}:'
+     ' java.lang.NullPointerException: Attempt to invoke interface method'
+     ' \'void FOO.bar(int,android.os.Bundle)\' on a null object reference',
+     'Unable to start activity ComponentInfo{garbage.in/here.test}:'
+     ' java.lang.NullPointerException: Attempt to invoke interface method'
+     ' \'void this.was.Deobfuscated.someMethod(int,android.os.Bundle)\' on a'
+     ' null object reference'),
+    ('Caused by: java.lang.NullPointerException: Attempt to read from field'
+     ' \'int[] FOO.a\' on a null object reference',
+     'Caused by: java.lang.NullPointerException: Attempt to read from field'
+     ' \'int[] this.was.Deobfuscated.mFontFamily\' on a null object reference'),
+    ('java.lang.VerifyError: FOO', 'java.lang.VerifyError: this.was.Deobfuscated'),
+    ('java.lang.NoSuchFieldError: No instance field a of type '
+     'Ljava/lang/Class; in class LFOO;',
+     'java.lang.NoSuchFieldError: No instance field mFontFamily of type '
+     'Ljava/lang/Class; in class Lthis/was/Deobfuscated;'),
+    ('NOTFOO: Object of type FOO was not destroyed...',
+     'NOTFOO: Object of type this.was.Deobfuscated was not destroyed...'),
+]
+
+
+class MappingDeobfuscatorTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp()
+    self._mapping_path = os.path.join(self._tmp_dir, 'test.mapping')
+    with open(self._mapping_path, 'w') as f:
+      f.write(_TEST_MAP)
+
+  def tearDown(self):
+    shutil.rmtree(self._tmp_dir)
+
+  def _CreateDeobfuscator(self):
+    return mapping_deobfuscator.MappingDeobfuscator(self._mapping_path)
+
+  def testTransformLines(self):
+    deobfuscator = self._CreateDeobfuscator()
+    for prefix in _LINE_PREFIXES:
+      actual = deobfuscator.TransformLines(
+          [prefix + line for line, _ in _TEST_DATA])
+      expected = [prefix + line for _, line in _TEST_DATA]
+      self.assertEqual(expected, actual)
+
+  def testInlinedFrames(self):
+    deobfuscator = self._CreateDeobfuscator()
+    self.assertEqual([
+        '\tat other.Inlinee.inlined(Inlinee.java:10)',
+        '\tat this.was.Deobfuscated.caller(Deobfuscated.java:20)',
+    ], deobfuscator.TransformLines(['\tat FOO.baz(PG:4)']))
+
+  def testIndexIsReused(self):
+    self._CreateDeobfuscator()
+    index_path = self._mapping_path + '.index'
+    self.assertTrue(os.path.exists(index_path))
+    os.utime(index_path, (1, 1))
+    self._CreateDeobfuscator()
+    self.assertEqual(1, os.path.getmtime(index_path))
+
+  def testIndexIsRebuiltWhenStale(self):
+    self._CreateDeobfuscator()
+    with open(self._mapping_path, 'w') as f:
+      f.write(_TEST_MAP.replace('FOO', 'QUUX'))
+    deobfuscator = self._CreateDeobfuscator()
+    self.assertEqual(['this.was.Deobfuscated', 'FOO'],
+                     deobfuscator.TransformLines(['QUUX', 'FOO']))
+
+  def testIndexLookups(self):
+    index = mapping_index.OpenIndex(self._mapping_path)
+    self.assertEqual('never.Deobfuscated', index.GetOriginalClassName('NOTFOO'))
+    self.assertIsNone(index.GetOriginalClassName('BAR'))
+    self.assertEqual([], index.GetMethods('this.was.Deobfuscated', 'a'))
+    fields = index.GetFields('this.was.Deobfuscated', 'a')
+    self.assertEqual(['mFontFamily'], [f.original_name for f in fields])
+    methods = index.GetMethods('this.was.Deobfuscated', 'baz')
+    self.assertEqual(['other.Inlinee', 'this.was.Deobfuscated'],
+                     [m.original_class_name for m in methods])
+    index.Close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,333 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A compact, memory-mapped index of a ProGuard / R8 mapping file.
+
+Mapping files for large apps are hundreds of MB of text. Parsing them takes
+tens of seconds, so this module converts them once into a binary index that
+is stored next to the mapping (and rebuilt when the mapping changes). Opening
+the index only memory-maps it, so it is shared through the page cache between
+all processes that use the same mapping.
+
+Index layout (all integers are little-endian):
+  Header: magic, mapping size, mapping mtime, then the number and offsets of
+      the tables below.
+  Class table: (obfuscated name, original name, first member, member count)
+      records, sorted by obfuscated name.
+  Original-name table: indices into the class table, sorted by original name.
+  Member table: (obfuscated name, original name, original class, type,
+      arguments, obfuscated first/last line, original first/last line)
+      records. The members of each class are contiguous and sorted by
+      obfuscated name, keeping the mapping's order for equal names.
+  String table: (u16 length, utf-8 bytes) entries, referenced by offset.
+"""
+
+import hashlib
+import io
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+
+_MAGIC = b'CRMAPIX1'
+_HEADER_FORMAT = '<8sQQIIIIII'
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_CLASS_FORMAT = '<IIII'
+_CLASS_SIZE = struct.calcsize(_CLASS_FORMAT)
+_MEMBER_FORMAT = '<IIIIIiiii'
+_MEMBER_SIZE = struct.calcsize(_MEMBER_FORMAT)
+# String offset used for the arguments of fields.
+_NO_STRING = 0xffffffff
+
+# E.g.: this.was.Deobfuscated -> FOO:
+_CLASS_LINE_RE = re.compile(r'^(\S.*?)\s*->\s*(\S.*?)\s*:\s*$')
+# E.g.:     int[] mFontFamily -> a
+# E.g.:     1:3:void someMethod(int,android.os.Bundle):65:67 -> bar
+_MEMBER_LINE_RE = re.compile(
+    r'^\s+(?:(\d+):(\d+):)?(\S+)\s+([^\s(]+)'
+    r'(?:\(([^)]*)\)(?::(\d+)(?::(\d+))?)?)?\s*->\s*(\S+)\s*$')
+
+if sys.version_info[0] == 2:
+  _ToBytes = lambda s: s.encode('utf-8') if isinstance(s, unicode) else s
+  _FromBytes = lambda b: b
+else:
+  _ToBytes = lambda s: s if isinstance(s, bytes) else s.encode('utf-8')
+  _FromBytes = lambda b: b.decode('utf-8')
+
+
+def _GetMtimeNs(st):
+  return getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1e9)
+
+
+class MethodInfo(object):
+  """A method or field (with |arguments| set to None) from a mapping file."""
+
+  def __init__(self, original_class_name, original_name, original_type,
+               arguments, obfuscated_first_line, obfuscated_last_line,
+               original_first_line, original_last_line):
+    self.original_class_name = original_class_name
+    self.original_name = original_name
+    self.original_type = original_type
+    self.arguments = arguments
+    self.obfuscated_first_line = obfuscated_first_line
+    self.obfuscated_last_line = obfuscated_last_line
+    self.original_first_line = original_first_line
+    self.original_last_line = original_last_line
+
+
+class _IndexWriter(object):
+  def __init__(self):
+    self._strings = bytearray()
+    self._string_offsets = {}
+    self._classes = []
+    self._members = bytearray()
+    self._num_members = 0
+    self._cur_class = None
+    self._cur_members = []
+
+  def _Intern(self, s):
+    s = _ToBytes(s)
+    offset = self._string_offsets.get(s)
+    if offset is None:
+      offset = len(self._strings)
+      self._strings += struct.pack('<H', len(s))
+      self._strings += s
+      self._string_offsets[s] = offset
+    return offset
+
+  def _FinishClass(self):
+    if self._cur_class is None:
+      return
+    # Stable, so inlined frames keep their order.
+    self._cur_members.sort(key=lambda m: m[0])
+    first_member = self._num_members
+    for member in self._cur_members:
+      self._members += struct.pack(_MEMBER_FORMAT, *member[1])
+    self._num_members += len(self._cur_members)
+    obfuscated_name, original_name = self._cur_class
+    self._classes.append((_ToBytes(obfuscated_name), _ToBytes(original_name),
+                          first_member, len(self._cur_members)))
+    self._cur_class = None
+    self._cur_members = []
+
+  def AddClass(self, original_name, obfuscated_name):
+    self._FinishClass()
+    self._cur_class = (obfuscated_name, original_name)
+
+  def AddMember(self, obfuscated_name, original_name, original_class_name,
+                original_type, arguments, obfuscated_first_line,
+                obfuscated_last_line, original_first_line, original_last_line):
+    if self._cur_class is None:
+      return
+    fields = (self._Intern(obfuscated_name), self._Intern(original_name),
+              self._Intern(original_class_name), self._Intern(original_type),
+              _NO_STRING if arguments is None else self._Intern(arguments),
+              obfuscated_first_line, obfuscated_last_line,
+              original_first_line, original_last_line)
+    self._cur_members.append((_ToBytes(obfuscated_name), fields))
+
+  def Write(self, f, mapping_size, mapping_mtime_ns):
+    self._FinishClass()
+    self._classes.sort(key=lambda c: c[0])
+    by_original = sorted(range(len(self._classes)),
+                         key=lambda i: self._classes[i][1])
+    classes_offset = _HEADER_SIZE
+    by_original_offset = classes_offset + len(self._classes) * _CLASS_SIZE
+    members_offset = by_original_offset + len(self._classes) * 4
+    strings_offset = members_offset + len(self._members)
+
+    f.write(struct.pack(_HEADER_FORMAT, _MAGIC, mapping_size,
+                        mapping_mtime_ns, len(self._classes),
+                        self._num_members, classes_offset, by_original_offset,
+                        members_offset, strings_offset))
+    for obfuscated_name, original_name, first_member, count in self._classes:
+      f.write(struct.pack(_CLASS_FORMAT, self._Intern(obfuscated_name),
+                          self._Intern(original_name), first_member, count))
+    f.write(struct.pack('<%dI' % len(by_original), *by_original))
+    f.write(self._members)
+    f.write(self._strings)
+
+
+def _ParseMapping(mapping_path, writer):
+  """Feeds the classes and members of a mapping file to |writer|."""
+  original_class_name = None
+  with io.open(mapping_path, encoding='utf-8') as f:
+    for line in f:
+      if not line.strip() or line.lstrip().startswith('#'):
+        continue
+      if not line[0].isspace():
+        m = _CLASS_LINE_RE.match(line)
+        if m:
+          original_class_name = m.group(1)
+          writer.AddClass(original_class_name, m.group(2))
+        continue
+
+      m = _MEMBER_LINE_RE.match(line)
+      if not m:
+        continue
+      (obf_first, obf_last, member_type, name, arguments, orig_first, orig_last,
+       obfuscated_name) = m.groups()
+      # Members inlined from other classes have fully-qualified names.
+      member_class_name, _, name = name.rpartition('.')
+      obf_first = int(obf_first or 0)
+      obf_last = int(obf_last or 0)
+      first, last = obf_first, obf_last
+      if orig_first:
+        first = int(orig_first)
+        last = int(orig_last) if orig_last else first
+      writer.AddMember(obfuscated_name, name,
+                       member_class_name or original_class_name, member_type,
+                       arguments, obf_first, obf_last, first, last)
+
+
+def BuildIndex(mapping_path, index_path):
+  """Converts |mapping_path| into an index at |index_path| (atomically)."""
+  st = os.stat(mapping_path)
+  writer = _IndexWriter()
+  _ParseMapping(mapping_path, writer)
+  index_dir = os.path.dirname(os.path.abspath(index_path))
+  with tempfile.NamedTemporaryFile(dir=index_dir, delete=False) as f:
+    try:
+      writer.Write(f, st.st_size, _GetMtimeNs(st))
+    except:
+      os.unlink(f.name)
+      raise
+  os.rename(f.name, index_path)
+
+
+def _IsIndexUpToDate(mapping_path, index_path):
+  try:
+    with open(index_path, 'rb') as f:
+      header = f.read(_HEADER_SIZE)
+  except IOError:
+    return False
+  if len(header) != _HEADER_SIZE:
+    return False
+  magic, size, mtime_ns = struct.unpack_from(_HEADER_FORMAT, header)[:3]
+  st = os.stat(mapping_path)
+  return (magic == _MAGIC and size == st.st_size
+          and mtime_ns == _GetMtimeNs(st))
+
+
+def OpenIndex(mapping_path, index_path=None):
+  """Returns a MappingIndex for |mapping_path|, building it if necessary.
+
+  Args:
+    mapping_path: Path to a ProGuard / R8 mapping file.
+    index_path: Where to store the index. Defaults to next to the mapping,
+      or to the temp directory when that is not writable.
+  """
+  if index_path is None:
+    index_path = mapping_path + '.index'
+    if not os.access(os.path.dirname(os.path.abspath(index_path)), os.W_OK):
+      path_hash = hashlib.md5(_ToBytes(os.path.abspath(mapping_path)))
+      index_path = os.path.join(
+          tempfile.gettempdir(), '%s.%s.index' % (
+              os.path.basename(mapping_path), path_hash.hexdigest()[:8]))
+  if not _IsIndexUpToDate(mapping_path, index_path):
+    BuildIndex(mapping_path, index_path)
+  return MappingIndex(index_path)
+
+
+class MappingIndex(object):
+  """Read-only lookups into an index written by BuildIndex(). Thread-safe."""
+
+  def __init__(self, index_path):
+    with open(index_path, 'rb') as f:
+      if os.fstat(f.fileno()).st_size == _HEADER_SIZE:
+        # Empty mapping. mmap() does not like zero-length tails, so read it.
+        self._data = f.read()
+      else:
+        self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, _, _, self._num_classes, _, self._classes_offset,
+     self._by_original_offset, self._members_offset,
+     self._strings_offset) = struct.unpack_from(_HEADER_FORMAT, self._data)
+    assert magic == _MAGIC, 'Invalid mapping index: ' + index_path
+
+  def _GetBytes(self, offset):
+    offset += self._strings_offset
+    length, = struct.unpack_from('<H', self._data, offset)
+    return self._data[offset + 2:offset + 2 + length]
+
+  def _GetString(self, offset):
+    return _FromBytes(self._GetBytes(offset))
+
+  def _GetClass(self, i):
+    return struct.unpack_from(_CLASS_FORMAT, self._data,
+                              self._classes_offset + i * _CLASS_SIZE)
+
+  def _ClassIndexByOriginalName(self, i):
+    return struct.unpack_from('<I', self._data,
+                              self._by_original_offset + i * 4)[0]
+
+  def _FindClass(self, name, by_original):
+    """Binary searches for a class. Returns its class record, or None."""
+    name = _ToBytes(name)
+    lo, hi = 0, self._num_classes
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if by_original:
+        record = self._GetClass(self._ClassIndexByOriginalName(mid))
+        key = self._GetBytes(record[1])
+      else:
+        record = self._GetClass(mid)
+        key = self._GetBytes(record[0])
+      if key < name:
+        lo = mid + 1
+      elif key > name:
+        hi = mid
+      else:
+        return record
+    return None
+
+  def GetOriginalClassName(self, obfuscated_name):
+    """Returns the original name of a class, or None if it is not mapped."""
+    record = self._FindClass(obfuscated_name, by_original=False)
+    return self._GetString(record[1]) if record else None
+
+  def _GetMember(self, i):
+    return struct.unpack_from(_MEMBER_FORMAT, self._data,
+                              self._members_offset + i * _MEMBER_SIZE)
+
+  def _GetMembers(self, original_class_name, obfuscated_name, methods):
+    record = self._FindClass(original_class_name, by_original=True)
+    if not record:
+      return []
+    name = _ToBytes(obfuscated_name)
+    # Find the first member with the given name.
+    lo, hi = record[2], record[2] + record[3]
+    end = hi
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self._GetBytes(self._GetMember(mid)[0]) < name:
+        lo = mid + 1
+      else:
+        hi = mid
+    ret = []
+    for i in range(lo, end):
+      member = self._GetMember(i)
+      if self._GetBytes(member[0]) != name:
+        break
+      if (member[4] != _NO_STRING) != methods:
+        continue
+      ret.append(
+          MethodInfo(self._GetString(member[2]), self._GetString(member[1]),
+                     self._GetString(member[3]),
+                     self._GetString(member[4]) if methods else None,
+                     *member[5:]))
+    return ret
+
+  def GetMethods(self, original_class_name, obfuscated_name):
+    """Returns MethodInfos for the methods of a class with the given name."""
+    return self._GetMembers(original_class_name, obfuscated_name, True)
+
+  def GetFields(self, original_class_name, obfuscated_name):
+    """Returns MethodInfos for the fields of a class with the given name."""
+    return self._GetMembers(original_class_name, obfuscated_name, False)
+
+  def Close(self):
+    if isinstance(self._data, mmap.mmap):
+      self._data.close()
@@ -0,0 +1,142 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Symbolizes native stack frames, e.g. from logcat, without the stack tool."""
+
+import collections
+import re
+
+from pylib.symbols import symbol_utils
+
+# E.g.: "#01 pc 00180c8d  /data/app/.../lib/arm/libbase.cr.so (Foo+8)"
+# E.g.: "#06 pc 0x0000d519 /apex/com.android.runtime/lib/libart.so"
+# E.g.: "#02 pc 0003a2b4  /data/app/.../base.apk (offset 0x1d4000)"
+_FRAME_RE = re.compile(
+    r'\s*#\d+\s+(?:pc\s+)?(?:0x)?(?P<rel_pc>[0-9a-f]{8,16})\s+'
+    r'(?P<location>\S+)(?:\s+\(offset 0x(?P<offset>[0-9a-f]+)\))?')
+_BUILD_ID_RE = re.compile(r'\(BuildId: ([0-9a-f]+)\)')
+
+# What addr2line returns for addresses it cannot symbolize.
+_UNKNOWN_SYMBOL_PREFIX = '??'
+
+
+class NativeFrameSymbolizer(object):
+  """Symbolizes the native stack frames in lines of text, in-process.
+
+  Unlike the stack tool, which is started for every stack, this keeps its
+  symbolizers warm: addr2line processes and symbols are shared by all the
+  stacks symbolized by the process (see symbolizer_service). Host libraries
+  are found through a symbol_utils.HostLibraryFinder, and are matched by
+  build-id when frames have one.
+
+  Usage is the following:
+    symbolizer = NativeFrameSymbolizer('arm64-v8a', host_lib_finder)
+    lines = symbolizer.SymbolizeLines(stack_lines)
+  """
+
+  # Fields:
+  #   host_path: Host path of the unstripped library.
+  #   lib_offset: Integer offset of the frame in the library.
+  #   location: Device path of the library, to print.
+  #   start: Position in the line where the location starts.
+  #   end: Position in the line where the location (and offset) ends.
+  _Frame = collections.namedtuple(
+      '_Frame', 'host_path,lib_offset,location,start,end')
+
+  def __init__(self, android_abi, host_lib_finder, apk_translator=None,
+               host_resolver=None, symbol_cache_dir=None):
+    """Initialize instance.
+
+    Args:
+      android_abi: Android CPU ABI name (e.g. 'armeabi-v7a').
+      host_lib_finder: A symbol_utils.HostLibraryFinder instance used to
+        locate unstripped libraries on the host.
+      apk_translator: Optional apk_native_libs.ApkLibraryPathTranslator used
+        to symbolize frames of libraries mapped directly from APKs.
+      host_resolver: Optional symbol_utils.SymbolResolver that accepts host
+        library paths. Defaults to a symbol_utils.ElfSymbolResolver.
+      symbol_cache_dir: Optional directory used by the default resolver to
+        persist symbols across runs, keyed by library build-id.
+    """
+    self._host_lib_finder = host_lib_finder
+    self._apk_translator = apk_translator
+    self._resolver = host_resolver or symbol_utils.ElfSymbolResolver(
+        symbol_cache_dir=symbol_cache_dir)
+    self._resolver.SetAndroidAbi(android_abi)
+    # Maps (device library path, build-id) to host library paths.
+    self._host_paths = {}
+
+  def _FindHostLibrary(self, device_lib_path, build_id):
+    key = (device_lib_path, build_id)
+    if key not in self._host_paths:
+      self._host_paths[key] = self._host_lib_finder.Find(
+          device_lib_path, build_id)
+    return self._host_paths[key]
+
+  def _ParseFrame(self, line):
+    """Returns a _Frame for a stack frame line of a known library, or None."""
+    m = _FRAME_RE.match(line)
+    if not m:
+      return None
+
+    location = m.group('location')
+    offset = m.group('offset')
+    lib_offset = int(m.group('rel_pc'), 16)
+    # For a library mapped from an APK, the unwinder either names the library
+    # (".../base.apk!libfoo.so"), with |rel_pc| relative to it, or gives the
+    # load base of the library within the APK, with |rel_pc| relative to it.
+    if location.endswith('.apk') and offset:
+      if not self._apk_translator:
+        return None
+      location, load_base = self._apk_translator.TranslatePath(
+          location, int(offset, 16))
+      lib_offset += load_base
+    if not location.endswith('.so'):
+      # E.g. .oat or .odex files.
+      return None
+
+    m_build_id = _BUILD_ID_RE.search(line, m.end())
+    # Only the library name matters, including in ".../base.apk!libfoo.so".
+    host_path = self._FindHostLibrary(
+        location.rpartition('!')[2], m_build_id.group(1) if m_build_id else None)
+    if not host_path:
+      return None
+    return self._Frame(host_path, lib_offset, location, m.start('location'),
+                       m.end())
+
+  def SymbolizeLines(self, lines):
+    """Symbolizes the stack frames in |lines|.
+
+    Args:
+      lines: A list of lines, e.g. logcat messages of a native crash.
+    Returns:
+      A list with a line for each one of |lines|, where the location of the
+      frames that could be symbolized is followed by their symbol info, like
+      symbol_utils.BacktraceTranslator does. Other lines are unchanged. None
+      if no frame could be symbolized.
+    """
+    frames = [self._ParseFrame(line) for line in lines]
+    offsets_map = collections.defaultdict(set)
+    for frame in frames:
+      if frame:
+        offsets_map[frame.host_path].add(frame.lib_offset)
+    if not offsets_map:
+      return None
+
+    # Recording all offsets first lets them be symbolized in batches.
+    for host_path, lib_offsets in offsets_map.items():
+      self._resolver.AddLibraryOffsets(host_path, lib_offsets)
+
+    result = []
+    symbolized = False
+    for line, frame in zip(lines, frames):
+      symbol_info = frame and self._resolver.FindSymbolInfo(frame.host_path,
+                                                            frame.lib_offset)
+      if not symbol_info or symbol_info.startswith(_UNKNOWN_SYMBOL_PREFIX):
+        result.append(line)
+        continue
+      symbolized = True
+      result.append('%s%s (%s)%s' % (line[:frame.start], frame.location,
+                                     symbol_info, line[frame.end:]))
+    return result if symbolized else None
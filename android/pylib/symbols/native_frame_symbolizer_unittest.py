@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pylib.symbols import mock_addr2line
+from pylib.symbols import native_frame_symbolizer
+from pylib.symbols import symbol_utils
+from pylib.symbols import symbolizer_service_unittest
+
+_MOCK_A2L_PATH = os.path.join(os.path.dirname(mock_addr2line.__file__),
+                              'mock_addr2line')
+
+
+class _MockApkTranslator(object):
+  """Maps offsets >= 0x100000 in any APK to libfoo.so, loaded there."""
+
+  def TranslatePath(self, apk_path, apk_offset):
+    if apk_offset < 0x100000:
+      return apk_path, apk_offset
+    return apk_path + '!lib/libfoo.so', apk_offset - 0x100000
+
+
+class NativeFrameSymbolizerTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp()
+    symbolizer_service_unittest.CreateElfWithBuildId(
+        os.path.join(self._tmp_dir, 'libfoo.so'), 'aaaa')
+    self._finder = symbol_utils.HostLibraryFinder()
+    self._finder.AddSearchDir(self._tmp_dir)
+
+  def tearDown(self):
+    shutil.rmtree(self._tmp_dir)
+
+  def _CreateSymbolizer(self, apk_translator=None):
+    return native_frame_symbolizer.NativeFrameSymbolizer(
+        'arm64-v8a', self._finder, apk_translator=apk_translator,
+        host_resolver=symbol_utils.ElfSymbolResolver(
+            addr2line_path_for_tests=_MOCK_A2L_PATH))
+
+  def testSymbolizeLines(self):
+    symbolizer = self._CreateSymbolizer()
+    lines = [
+        '*** *** *** *** *** *** *** *** *** *** *** *** *** *** *** ***',
+        '    #00 pc 00000010  /data/app/com.foo-1/lib/arm64/libfoo.so',
+        '    #01 pc 0x00000020 /data/app/com.foo-1/lib/arm64/libfoo.so (Foo+8)',
+        '    #02 pc 00000030  /system/lib64/libc.so (abort+164)',
+        '    #03 pc 00000040  /data/app/com.foo-1/oat/arm64/base.odex',
+    ]
+    self.assertEqual([
+        lines[0],
+        '    #00 pc 00000010  /data/app/com.foo-1/lib/arm64/libfoo.so '
+        '(mock_sym_for_addr_16 [mock_src/libfoo.so.c:16])',
+        '    #01 pc 0x00000020 /data/app/com.foo-1/lib/arm64/libfoo.so '
+        '(mock_sym_for_addr_32 [mock_src/libfoo.so.c:32]) (Foo+8)',
+        lines[3],
+        lines[4],
+    ], symbolizer.SymbolizeLines(lines))
+
+  def testNothingToSymbolize(self):
+    symbolizer = self._CreateSymbolizer()
+    self.assertIsNone(symbolizer.SymbolizeLines([
+        'Abort message: crashed',
+        '    #00 pc 00000030  /system/lib64/libc.so (abort+164)',
+    ]))
+
+  def testBuildIds(self):
+    symbolizer = self._CreateSymbolizer()
+    self.assertIsNotNone(symbolizer.SymbolizeLines([
+        '#00 pc 00000010  /data/app/com.foo-1/lib/arm64/libfoo.so '
+        '(BuildId: aaaa)'
+    ]))
+    # A stale host library must not be used.
+    self.assertIsNone(symbolizer.SymbolizeLines([
+        '#00 pc 00000010  /data/app/com.foo-1/lib/arm64/libfoo.so '
+        '(BuildId: bbbb)'
+    ]))
+
+  def testLibrariesMappedFromApk(self):
+    lines = [
+        '#00 pc 00000010  /data/app/com.foo-1/base.apk (offset 0x100100)',
+        '#01 pc 00000020  /data/app/com.foo-1/base.apk!libfoo.so',
+    ]
+    self.assertEqual([
+        '#00 pc 00000010  /data/app/com.foo-1/base.apk!lib/libfoo.so '
+        '(mock_sym_for_addr_272 [mock_src/libfoo.so.c:272])',
+        '#01 pc 00000020  /data/app/com.foo-1/base.apk!libfoo.so '
+        '(mock_sym_for_addr_32 [mock_src/libfoo.so.c:32])',
+    ], self._CreateSymbolizer(_MockApkTranslator()).SymbolizeLines(lines))
+    # Without a translator, only the library name tells which library it is.
+    self.assertEqual(lines[0], self._CreateSymbolizer().SymbolizeLines(lines)[0])
+
+
+if __name__ == '__main__':
+  unittest.main()
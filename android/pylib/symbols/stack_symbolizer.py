@@ -10,11 +10,15 @@ import time
 
 from devil.utils import cmd_helper
 from pylib import constants
+from pylib.symbols import symbol_utils
 
 _STACK_TOOL = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..',
                           'third_party', 'android_platform', 'development',
                           'scripts', 'stack')
 ABI_REG = re.compile('ABI: \'(.+?)\'')
+# E.g. "#00 pc 0001a2b4  /data/app/.../libfoo.so (Foo+8) (BuildId: 0a1b2c)".
+_BUILD_ID_FRAME_RE = re.compile(
+    r'#\d+\s+pc\s+[0-9a-f]+\s+(\S+).*\(BuildId: ([0-9a-f]+)\)')
 
 
 def _DeviceAbiToArch(device_abi):
@@ -33,6 +37,8 @@ class Symbolizer(object):
   def __init__(self, apk_under_test=None):
     self._apk_under_test = apk_under_test
     self._time_spent_symbolizing = 0
+    self._host_lib_finder = None
+    self._checked_build_ids = set()
 
 
   def __del__(self):
@@ -46,6 +52,32 @@ class Symbolizer(object):
           'Total time spent symbolizing: %.2fs', self._time_spent_symbolizing)
 
 
+  def _GetHostLibraryFinder(self):
+    if not self._host_lib_finder:
+      out_dir = constants.GetOutDirectory()
+      self._host_lib_finder = symbol_utils.HostLibraryFinder(
+          index_path=os.path.join(out_dir, 'lib.unstripped.index.json'))
+      self._host_lib_finder.AddSearchDir(os.path.join(out_dir,
+                                                      'lib.unstripped'))
+    return self._host_lib_finder
+
+
+  def _CheckHostLibraries(self, data_to_symbolize):
+    """Warn about host libraries that do not match the device's build-ids.
+
+    The stack tool looks libraries up by name only, so stale host libraries
+    would otherwise silently produce wrong symbols.
+    """
+    finder = self._GetHostLibraryFinder()
+    for line in data_to_symbolize:
+      m = _BUILD_ID_FRAME_RE.search(line)
+      if not m or m.groups() in self._checked_build_ids:
+        continue
+      self._checked_build_ids.add(m.groups())
+      # Logs a warning on mismatch.
+      finder.Find(*m.groups())
+
+
   def ExtractAndResolveNativeStackTraces(self, data_to_symbolize,
                                          device_abi, include_stack=True):
     """Run the stack tool for given input.
@@ -68,6 +100,8 @@ class Symbolizer(object):
       logging.warning('No device_abi can be found.')
       return
 
+    self._CheckHostLibraries(data_to_symbolize)
+
     cmd = [_STACK_TOOL, '--arch', arch, '--output-directory',
            constants.GetOutDirectory(), '--more-info']
     env = dict(os.environ)
@@ -6,12 +6,14 @@ from __future__ import print_function
 
 import bisect
 import collections
+import json
 import logging
 import os
 import re
 
 from pylib.constants import host_paths
 from pylib.symbols import elf_symbolizer
+from pylib.symbols import symbolizer_service
 
 
 def _AndroidAbiToCpuArch(android_abi):
@@ -44,11 +46,33 @@ class HostLibraryFinder(object):
     3) Call Find(device_libpath) repeatedly to translate a device-specific
        library path into the corresponding host path to the unstripped
        version.
+
+  Libraries are looked up through an index of the search directories that maps
+  basenames and GNU build-ids to host paths. The index is refreshed
+  incrementally: a directory is only re-listed when its mtime changes, and a
+  library's build-id is only re-read when its mtime or size changes. If
+  |index_path| is given, the index is persisted there between runs.
   """
-  def __init__(self):
-    """Initialize instance."""
+  def __init__(self, index_path=None):
+    """Initialize instance.
+
+    Args:
+      index_path: Optional path of a JSON file used to persist the index.
+    """
     self._search_dirs = []
-    self._lib_map = {}        # Map of library name to host file paths.
+    self._index_path = index_path
+    # Maps search dir -> {'mtime': dir mtime,
+    #                     'libs': {name: [mtime, size, build_id]}}.
+    self._dir_index = {}
+    self._index_dirty = False
+    self._lib_map = None      # Map of library name to host file path.
+    self._build_id_map = None  # Map of build-id to host file path.
+    if index_path:
+      try:
+        with open(index_path) as f:
+          self._dir_index = json.load(f)
+      except (IOError, OSError, ValueError):
+        pass
 
   def AddSearchDir(self, lib_dir):
     """Add a directory to the search path for host native shared libraries.
@@ -62,31 +86,108 @@ class HostLibraryFinder(object):
     if not os.path.isdir(lib_dir):
       logging.warning('Ignoring invalid host library directory: %s', lib_dir)
       return
-    self._search_dirs.append(lib_dir)
-    self._lib_map = {}  # Reset the map.
+    self._search_dirs.append(os.path.abspath(lib_dir))
+    self._lib_map = None  # Reset the maps.
+
+  def _RefreshDir(self, lib_dir):
+    """Update the index entry of |lib_dir|. Returns whether it changed."""
+    dir_mtime = os.path.getmtime(lib_dir)
+    entry = self._dir_index.get(lib_dir)
+    if entry and entry['mtime'] == dir_mtime:
+      return False
+
+    old_libs = entry['libs'] if entry else {}
+    libs = {}
+    for name in os.listdir(lib_dir):
+      if name.startswith('.'):
+        continue
+      libs[name] = self._IndexLib(os.path.join(lib_dir, name),
+                                  old_libs.get(name))
+    self._dir_index[lib_dir] = {'mtime': dir_mtime, 'libs': libs}
+    self._index_dirty = True
+    return True
 
-  def Find(self, device_libpath):
+  @staticmethod
+  def _IndexLib(lib_path, old_info):
+    """Return the [mtime, size, build_id] index entry of a library."""
+    try:
+      st = os.stat(lib_path)
+    except OSError:
+      return [None, None, None]
+    if old_info and old_info[:2] == [st.st_mtime, st.st_size]:
+      return old_info
+    return [st.st_mtime, st.st_size, elf_symbolizer.GetBuildId(lib_path)]
+
+  def _GetMaps(self):
+    """Return the (name -> path, build-id -> path) maps, refreshing them."""
+    changed = False
+    for lib_dir in self._search_dirs:
+      changed |= self._RefreshDir(lib_dir)
+    if changed or self._lib_map is None:
+      self._lib_map = {}
+      self._build_id_map = {}
+      # Earlier search directories take precedence.
+      for lib_dir in reversed(self._search_dirs):
+        for name, (_, _, build_id) in self._dir_index[lib_dir][
+            'libs'].iteritems():
+          lib_path = os.path.join(lib_dir, name)
+          self._lib_map[name] = lib_path
+          if build_id:
+            self._build_id_map[build_id] = lib_path
+    if self._index_dirty and self._index_path:
+      self._WriteIndex()
+    return self._lib_map, self._build_id_map
+
+  def _WriteIndex(self):
+    tmp_path = self._index_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(self._dir_index, f)
+    os.rename(tmp_path, self._index_path)
+    self._index_dirty = False
+
+  def _GetBuildId(self, lib_path):
+    """Return the build-id of an indexed library, re-reading it if stale."""
+    lib_dir, name = os.path.split(lib_path)
+    libs = self._dir_index[lib_dir]['libs']
+    info = self._IndexLib(lib_path, libs[name])
+    if info is not libs[name]:
+      # Overwritten in-place, which does not update the directory mtime.
+      libs[name] = info
+      self._index_dirty = True
+      self._lib_map = None
+    return info[2]
+
+  def Find(self, device_libpath, build_id=None):
     """Find the host file path matching a specific device library path.
 
     Args:
       device_libpath: device-specific file path to library or executable.
+      build_id: Optional GNU build-id (as a hex string) of the device
+        library. When given, only a host library with the same build-id is
+        returned.
     Returns:
       host file path to the unstripped version of the library, or None.
     """
-    host_lib_path = None
     lib_name = os.path.basename(device_libpath)
-    host_lib_path = self._lib_map.get(lib_name)
+    if not self._search_dirs:
+      return None
+    lib_map, build_id_map = self._GetMaps()
+    if build_id:
+      host_lib_path = build_id_map.get(build_id)
+      if host_lib_path and self._GetBuildId(host_lib_path) == build_id:
+        return host_lib_path
+      host_lib_path = lib_map.get(lib_name)
+      if host_lib_path:
+        # The library may have been rebuilt in-place since it was indexed.
+        if self._GetBuildId(host_lib_path) == build_id:
+          return host_lib_path
+        logging.warning('Host library %s does not match build-id %s of %s',
+                        host_lib_path, build_id, device_libpath)
+        return None
+
+    host_lib_path = lib_map.get(lib_name)
     if not host_lib_path:
-      for search_dir in self._search_dirs:
-        lib_path = os.path.join(search_dir, lib_name)
-        if os.path.exists(lib_path):
-          host_lib_path = lib_path
-          break
-
-      if not host_lib_path:
-        logging.debug('Could not find host library for: %s', lib_name)
-      self._lib_map[lib_name] = host_lib_path
-
+      logging.debug('Could not find host library for: %s', lib_name)
     return host_lib_path
 
 
@@ -180,24 +281,28 @@ class SymbolResolver(object):
 
 class ElfSymbolResolver(SymbolResolver):
   """A SymbolResolver that can symbolize host path + offset values using
-     an elf_symbolizer.ELFSymbolizer instance.
+     a symbolizer_service.SymbolizerService instance.
   """
-  def __init__(self, addr2line_path_for_tests=None):
+  def __init__(self, addr2line_path_for_tests=None, symbol_cache_dir=None):
+    """Initialize instance.
+
+    Args:
+      addr2line_path_for_tests: Optional addr2line path, used by unit tests.
+      symbol_cache_dir: Optional directory used to persist symbolization
+        results across runs, keyed by library build-id.
+    """
     super(ElfSymbolResolver, self).__init__()
     self._addr2line_path = addr2line_path_for_tests
-
-    # Used to cache one ELFSymbolizer instance per library path.
-    self._elf_symbolizer_cache = {}
+    self._symbol_cache_dir = symbol_cache_dir
 
     # Used to cache FindSymbolInfo() results. Maps host library paths
     # to (offset -> symbol info string) dictionaries.
     self._symbol_info_cache = collections.defaultdict(dict)
     self._allow_symbolizer = True
 
-  def _CreateSymbolizerFor(self, host_path):
-    """Create the ELFSymbolizer instance associated with a given lib path."""
-    addr2line_path = self._addr2line_path
-    if not addr2line_path:
+  def _GetService(self):
+    """Return the SymbolizerService, shared by all resolvers in the process."""
+    if not self._addr2line_path:
       if not self._android_abi:
         raise Exception(
             'Android CPU ABI must be set before calling FindSymbolInfo!')
@@ -205,9 +310,8 @@ class ElfSymbolResolver(SymbolResolver):
       cpu_arch = _AndroidAbiToCpuArch(self._android_abi)
       self._addr2line_path = host_paths.ToolPath('addr2line', cpu_arch)
 
-    return elf_symbolizer.ELFSymbolizer(
-        elf_file_path=host_path, addr2line_path=self._addr2line_path,
-        callback=ElfSymbolResolver._Callback, inlines=True)
+    return symbolizer_service.GetSharedService(
+        self._addr2line_path, inlines=True, cache_dir=self._symbol_cache_dir)
 
   def DisallowSymbolizerForTesting(self):
     """Disallow FindSymbolInfo() from using a symbolizer.
@@ -227,45 +331,27 @@ class ElfSymbolResolver(SymbolResolver):
     Returns:
       A symbol info string, or None.
     """
+    if host_path not in self._symbol_info_cache:
+      # If there are pre-recorded offsets for this path, symbolize them now,
+      # as a single batch.
+      offsets = self._lib_offsets_map.get(host_path)
+      if offsets:
+        self._SymbolizeOffsets(host_path, offsets)
+
     offset_map = self._symbol_info_cache[host_path]
     symbol_info = offset_map.get(offset)
-    if symbol_info:
+    if symbol_info or not self._allow_symbolizer:
       return symbol_info
 
-    # Create symbolizer on demand.
-    symbolizer = self._elf_symbolizer_cache.get(host_path)
-    if not symbolizer:
-      symbolizer = self._CreateSymbolizerFor(host_path)
-      self._elf_symbolizer_cache[host_path] = symbolizer
-
-      # If there are pre-recorded offsets for this path, symbolize them now.
-      offsets = self._lib_offsets_map.get(host_path)
-      if offsets:
-        offset_map = {}
-        for pre_offset in offsets:
-          symbolizer.SymbolizeAsync(
-              pre_offset, callback_arg=(offset_map, pre_offset))
-        symbolizer.WaitForIdle()
-        self._symbol_info_cache[host_path] = offset_map
-
-        symbol_info = offset_map.get(offset)
-        if symbol_info:
-          return symbol_info
-
-    if not self._allow_symbolizer:
-      return None
-
-    # Symbolize single offset. Slower if addresses are not provided in
-    # increasing order to addr2line.
-    symbolizer.SymbolizeAsync(offset,
-                              callback_arg=(offset_map, offset))
-    symbolizer.WaitForIdle()
+    self._SymbolizeOffsets(host_path, [offset])
     return offset_map.get(offset)
 
-  @staticmethod
-  def _Callback(sym_info, callback_arg):
-    offset_map, offset = callback_arg
-    offset_map[offset] = str(sym_info)
+  def _SymbolizeOffsets(self, host_path, offsets):
+    offsets = sorted(offsets)
+    results = self._GetService().SymbolizeMany(host_path, offsets)
+    offset_map = self._symbol_info_cache[host_path]
+    for offset, sym_info in zip(offsets, results):
+      offset_map[offset] = str(sym_info)
 
 
 class DeviceSymbolResolver(SymbolResolver):
@@ -275,10 +361,14 @@ class DeviceSymbolResolver(SymbolResolver):
     1) Create new instance, passing a parent SymbolResolver instance that
        accepts host-specific paths, and a HostLibraryFinder instance.
 
-    2) Optional: call AddApkOffsets() to add offsets from within an APK
+    2) Optional: call SetLibraryBuildId() for each library whose build-id is
+       known (e.g. from BacktraceTranslator.FindLibraryBuildIds()), so that
+       only a host library with the same build-id is used for it.
+
+    3) Optional: call AddApkOffsets() to add offsets from within an APK
        that contains uncompressed native shared libraries.
 
-    3) Use it as any SymbolResolver instance.
+    4) Use it as any SymbolResolver instance.
   """
   def __init__(self, host_resolver, host_lib_finder):
     """Initialize instance.
@@ -293,11 +383,29 @@ class DeviceSymbolResolver(SymbolResolver):
     self._host_lib_finder = host_lib_finder
     self._bad_device_lib_paths = set()
     self._host_resolver = host_resolver
+    self._build_ids = {}  # Map of device library path to GNU build-id.
 
   def SetAndroidAbi(self, android_abi):
     super(DeviceSymbolResolver, self).SetAndroidAbi(android_abi)
     self._host_resolver.SetAndroidAbi(android_abi)
 
+  def SetLibraryBuildId(self, device_lib_path, build_id):
+    """Record the GNU build-id of a given device library.
+
+    When known, the build-id is used to select the matching host library, and
+    to reject stale host libraries. This must be called before
+    AddLibraryOffsets() and FindSymbolInfo() for the same library.
+
+    Args:
+      device_lib_path: A device-specific library path.
+      build_id: GNU build-id as a hex string (e.g. from a tombstone).
+    """
+    self._build_ids[device_lib_path] = build_id
+
+  def _FindHostLibrary(self, device_lib_path):
+    return self._host_lib_finder.Find(device_lib_path,
+                                      self._build_ids.get(device_lib_path))
+
   def AddLibraryOffsets(self, device_lib_path, lib_offsets):
     """Associate a set of wanted offsets to a given device library.
 
@@ -313,7 +421,7 @@ class DeviceSymbolResolver(SymbolResolver):
     if device_lib_path in self._bad_device_lib_paths:
       return
 
-    host_lib_path = self._host_lib_finder.Find(device_lib_path)
+    host_lib_path = self._FindHostLibrary(device_lib_path)
     if not host_lib_path:
       # NOTE: self._bad_device_lib_paths is only used to only print this
       #       warning once per bad library.
@@ -359,7 +467,7 @@ class DeviceSymbolResolver(SymbolResolver):
     Returns:
       Corresponding symbol information string, or None.
     """
-    host_path = self._host_lib_finder.Find(device_path)
+    host_path = self._FindHostLibrary(device_path)
     if not host_path:
       return None
 
@@ -555,7 +663,9 @@ class BacktraceTranslator(object):
     2) If the tombstone / logcat input is available, one can call
        FindLibraryOffsets() in order to detect which library offsets
        will need to be symbolized during a future parse. Doing so helps
-       speed up the ELF symbolizer.
+       speed up the ELF symbolizer. FindLibraryBuildIds() similarly detects
+       the build-ids of the libraries, for
+       DeviceSymbolResolver.SetLibraryBuildId().
     3) For each tombstone/logcat input line, call TranslateLine() to
        try to detect and symbolize backtrace lines.
   """
@@ -565,12 +675,13 @@ class BacktraceTranslator(object):
   #   rel_pc: Instruction pointer, relative to offset in library start.
   #   location: Library or APK file path.
   #   offset: Load base of executable code in library or apk file path.
+  #   build_id: GNU build-id of the library, or None if not known.
   #   match: The corresponding regular expression match object.
   # Note:
   #   The actual instruction pointer always matches the position at
   #   |offset + rel_pc| in |location|.
   LineTuple = collections.namedtuple('BacktraceLineTuple',
-                                      'rel_pc,location,offset,match')
+                                      'rel_pc,location,offset,build_id,match')
 
   def __init__(self, android_abi, apk_translator):
     """Initialize instance.
@@ -589,7 +700,8 @@ class BacktraceTranslator(object):
         r'(..)\s+' +
         r'(?P<rel_pc>' + hex_addr + r')\s+' +
         r'(?P<location>[^ \t]+)' +
-        r'(\s+\(offset 0x(?P<offset>[0-9a-f]+)\))?')
+        r'(\s+\(offset 0x(?P<offset>[0-9a-f]+)\))?' +
+        r'(.*\(BuildId: (?P<build_id>[0-9a-f]+)\))?')
 
     # In certain cases, offset will be provided as <location>+0x<offset>
     # instead of <location> (offset 0x<offset>). This is a regexp to detect
@@ -631,6 +743,7 @@ class BacktraceTranslator(object):
 
     offset = int(offset, 16)
     rel_pc = int(m.group('rel_pc'), 16)
+    build_id = m.group('build_id')
 
     # Two cases to consider here:
     #
@@ -644,14 +757,14 @@ class BacktraceTranslator(object):
     #
     if location.endswith('.so'):
       # For a native library directly mapped from the file system,
-      return self.LineTuple(rel_pc, location, offset, m)
+      return self.LineTuple(rel_pc, location, offset, build_id, m)
 
     if location.endswith('.apk'):
       # For a native library inside an memory-mapped APK file,
       new_location, new_offset = self._apk_translator.TranslatePath(
           location, offset)
 
-      return self.LineTuple(rel_pc, new_location, new_offset, m)
+      return self.LineTuple(rel_pc, new_location, new_offset, build_id, m)
 
     # Ignore anything else (e.g. .oat or .odex files).
     return None
@@ -677,6 +790,25 @@ class BacktraceTranslator(object):
       result[t.location].add(t.offset + t.rel_pc)
     return result
 
+  def FindLibraryBuildIds(self, input_lines, in_section=False):
+    """Parse a tombstone's backtrace section and find library build-ids in it.
+
+    Args:
+      input_lines: List or iterables of intput tombstone lines.
+      in_section: Optional. If True, considers that the stack section has
+        already started.
+    Returns:
+      A dictionary mapping device library paths to their GNU build-ids, for
+      the libraries whose build-id appears in the backtrace.
+    """
+    self._in_section = in_section
+    result = {}
+    for line in input_lines:
+      t = self._ParseLine(line)
+      if t and t.build_id:
+        result[t.location] = t.build_id
+    return result
+
   def TranslateLine(self, line, symbol_resolver):
     """Symbolize backtrace line if recognized.
 
@@ -14,6 +14,7 @@ import unittest
 from pylib.symbols import apk_native_libs_unittest
 from pylib.symbols import mock_addr2line
 from pylib.symbols import symbol_utils
+from pylib.symbols import symbolizer_service_unittest
 
 _MOCK_ELF_DATA = apk_native_libs_unittest.MOCK_ELF_DATA
 
@@ -759,6 +760,100 @@ class HostLibraryFinderTest(unittest.TestCase):
       self.assertIsNone(
           finder.Find('/data/data/com.example.app-1/lib/libunknown.so'))
 
+  def testBuildIds(self):
+    with _TempDir() as tmp_dir:
+      aaa_dir = os.path.join(tmp_dir, 'aaa')
+      bbb_dir = os.path.join(tmp_dir, 'bbb')
+      os.makedirs(aaa_dir)
+      os.makedirs(bbb_dir)
+      host_libfoo_path = os.path.join(aaa_dir, 'libfoo.so')
+      host_libfoo2_path = os.path.join(bbb_dir, 'libfoo.so')
+      symbolizer_service_unittest.CreateElfWithBuildId(host_libfoo_path, 'aa')
+      symbolizer_service_unittest.CreateElfWithBuildId(host_libfoo2_path, 'bb')
+
+      finder = symbol_utils.HostLibraryFinder()
+      finder.AddSearchDir(aaa_dir)
+      finder.AddSearchDir(bbb_dir)
+
+      device_path = '/data/data/com.example.app-1/lib/libfoo.so'
+      self.assertEqual(host_libfoo_path, finder.Find(device_path))
+      self.assertEqual(host_libfoo_path, finder.Find(device_path, 'aa'))
+      self.assertEqual(host_libfoo2_path, finder.Find(device_path, 'bb'))
+      # Stale host libraries are never returned.
+      self.assertIsNone(finder.Find(device_path, 'cc'))
+
+  def testPersistentIndex(self):
+    with _TempDir() as tmp_dir:
+      lib_dir = os.path.join(tmp_dir, 'lib.unstripped')
+      index_path = os.path.join(tmp_dir, 'index.json')
+      host_libfoo_path = os.path.join(lib_dir, 'libfoo.so')
+      os.makedirs(lib_dir)
+      symbolizer_service_unittest.CreateElfWithBuildId(host_libfoo_path, 'aa')
+
+      finder = symbol_utils.HostLibraryFinder(index_path=index_path)
+      finder.AddSearchDir(lib_dir)
+      device_path = '/data/data/com.example.app-1/lib/libfoo.so'
+      self.assertEqual(host_libfoo_path, finder.Find(device_path, 'aa'))
+      self.assertTrue(os.path.exists(index_path))
+
+      # Libraries overwritten in-place are re-indexed.
+      symbolizer_service_unittest.CreateElfWithBuildId(host_libfoo_path,
+                                                       'bbbb')
+      finder = symbol_utils.HostLibraryFinder(index_path=index_path)
+      finder.AddSearchDir(lib_dir)
+      self.assertIsNone(finder.Find(device_path, 'aa'))
+      self.assertEqual(host_libfoo_path, finder.Find(device_path, 'bbbb'))
+
+      # Including when only the new build-id is looked up.
+      symbolizer_service_unittest.CreateElfWithBuildId(host_libfoo_path,
+                                                       'cccccc')
+      self.assertEqual(host_libfoo_path, finder.Find(device_path, 'cccccc'))
+
+
+class _RecordingSymbolResolver(symbol_utils.SymbolResolver):
+  """A host SymbolResolver that records the host paths it is asked about."""
+
+  def __init__(self):
+    super(_RecordingSymbolResolver, self).__init__()
+    self.host_paths = []
+
+  def AddLibraryOffsets(self, lib_path, lib_offsets):
+    self.host_paths.append(lib_path)
+
+  def FindSymbolInfo(self, lib_path, lib_offset):
+    self.host_paths.append(lib_path)
+    return 'symbol'
+
+
+class DeviceSymbolResolverTest(unittest.TestCase):
+
+  def testLibraryBuildIds(self):
+    with _TempDir() as tmp_dir:
+      aaa_dir = os.path.join(tmp_dir, 'aaa')
+      bbb_dir = os.path.join(tmp_dir, 'bbb')
+      os.makedirs(aaa_dir)
+      os.makedirs(bbb_dir)
+      host_libfoo_path = os.path.join(aaa_dir, 'libfoo.so')
+      host_libfoo2_path = os.path.join(bbb_dir, 'libfoo.so')
+      symbolizer_service_unittest.CreateElfWithBuildId(host_libfoo_path, 'aa')
+      symbolizer_service_unittest.CreateElfWithBuildId(host_libfoo2_path, 'bb')
+      finder = symbol_utils.HostLibraryFinder()
+      finder.AddSearchDir(aaa_dir)
+      finder.AddSearchDir(bbb_dir)
+
+      host_resolver = _RecordingSymbolResolver()
+      resolver = symbol_utils.DeviceSymbolResolver(host_resolver, finder)
+      device_path = '/data/data/com.example.app-1/lib/libfoo.so'
+      resolver.SetLibraryBuildId(device_path, 'bb')
+      resolver.AddLibraryOffsets(device_path, [0x10])
+      self.assertEqual('symbol', resolver.FindSymbolInfo(device_path, 0x10))
+      self.assertEqual([host_libfoo2_path, host_libfoo2_path],
+                       host_resolver.host_paths)
+
+      # Stale host libraries are never used.
+      resolver.SetLibraryBuildId(device_path, 'cc')
+      self.assertIsNone(resolver.FindSymbolInfo(device_path, 0x10))
+
 
 class ElfSymbolResolverTest(unittest.TestCase):
 
@@ -907,6 +1002,20 @@ class BacktraceTranslatorTest(unittest.TestCase):
                                                             apk_translator)
     self.assertTrue(backtrace_translator)
 
+  def testFindLibraryBuildIds(self):
+    backtrace_translator = symbol_utils.BacktraceTranslator(
+        'test-abi', MockApkTranslator())
+    input_backtrace = [
+        'backtrace:',
+        '    #00 pc 00001234  /data/app/com.example.app-1/lib/arm/libfoo.so '
+        '(offset 0x1000) (Foo+8) (BuildId: 0a1b2c)',
+        '    #01 pc 00005678  /data/app/com.example.app-1/lib/arm/libbar.so '
+        '(offset 0x2000)',
+    ]
+    self.assertEqual(
+        {'/data/app/com.example.app-1/lib/arm/libfoo.so': '0a1b2c'},
+        backtrace_translator.FindLibraryBuildIds(input_backtrace))
+
   def testFindLibraryOffsets(self):
     android_abi = 'test-abi'
     apk_translator = MockApkTranslator(_TEST_APK_LIBS)
@@ -0,0 +1,283 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A long-lived addr2line service shared by all symbolization requests.
+
+Starting addr2line on a large unstripped library is expensive (it has to load
+and index all of the library's debug info). SymbolizerService keeps a bounded
+pool of warm ELFSymbolizer instances, keyed by the library's GNU build-id, so
+that repeated requests for the same library (e.g. from several stack traces)
+only pay this cost once.
+
+Results are also memoized in an optional on-disk SymbolCache keyed by build-id
+and address, so that re-symbolizing a known stack is free even across runs.
+"""
+
+import atexit
+import collections
+import json
+import os
+import tempfile
+import threading
+
+from pylib.symbols import elf_symbolizer
+
+_TMP_SUFFIX = '.tmp'
+
+# Maps (addr2line_path, inlines, cache_dir) to SymbolizerService instances.
+_shared_services = {}
+_shared_services_lock = threading.Lock()
+
+
+def _SymbolInfoToFrames(sym_info):
+  """Flattens an ELFSymbolInfo (and its inlined_by chain) to a list of lists."""
+  frames = []
+  while sym_info:
+    frames.append([sym_info.name, sym_info.source_path, sym_info.source_line,
+                   sym_info.was_ambiguous, sym_info.disambiguated])
+    sym_info = sym_info.inlined_by
+  return frames
+
+
+def _FramesToSymbolInfo(frames):
+  """Inverse of _SymbolInfoToFrames()."""
+  head = None
+  for name, source_path, source_line, was_ambiguous, disambiguated in reversed(
+      frames):
+    sym_info = elf_symbolizer.ELFSymbolInfo(name, source_path, source_line,
+                                            was_ambiguous, disambiguated)
+    sym_info.inlined_by = head
+    head = sym_info
+  return head
+
+
+class SymbolCache(object):
+  """An on-disk memo of (build-id, address) -> symbol frames.
+
+  Each build-id is stored as one JSON file. The number of files is capped by
+  evicting the least-recently-used ones: files are touched when they are read
+  from as well as when they are written.
+
+  New entries are only written by Flush(), which merges them with the entries
+  that concurrent processes wrote in the meantime.
+
+  Args:
+    cache_dir: Directory to store entries in. Created if it does not exist.
+    max_libraries: Maximum number of build-ids to keep, or None for no limit.
+  """
+
+  def __init__(self, cache_dir, max_libraries=256):
+    self._cache_dir = cache_dir
+    self._max_libraries = max_libraries
+    self._loaded = {}
+    # Maps keys to the entries that were Put() since the last Flush().
+    self._pending = {}
+    self._touched = set()
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+
+  def _EntryPath(self, key):
+    return os.path.join(self._cache_dir, key + '.json')
+
+  def _Read(self, key):
+    try:
+      with open(self._EntryPath(key)) as f:
+        return json.load(f)
+    except (IOError, OSError, ValueError):
+      return {}
+
+  def _Load(self, key):
+    entries = self._loaded.get(key)
+    if entries is None:
+      entries = self._Read(key)
+      self._loaded[key] = entries
+    return entries
+
+  def Get(self, key, addr):
+    """Returns the cached ELFSymbolInfo for |addr|, or None."""
+    frames = self._Load(key).get(str(addr))
+    if not frames:
+      return None
+    if key not in self._touched:
+      self._touched.add(key)
+      try:
+        os.utime(self._EntryPath(key), None)
+      except OSError:
+        pass  # Evicted by a concurrent process.
+    return _FramesToSymbolInfo(frames)
+
+  def Put(self, key, addr, sym_info):
+    frames = _SymbolInfoToFrames(sym_info)
+    self._Load(key)[str(addr)] = frames
+    self._pending.setdefault(key, {})[str(addr)] = frames
+
+  def Flush(self):
+    """Writes the entries that were Put() since the last Flush() to disk."""
+    if not self._pending:
+      return
+    for key, new_entries in self._pending.items():
+      entries = self._Read(key)
+      entries.update(new_entries)
+      with tempfile.NamedTemporaryFile(
+          mode='w', dir=self._cache_dir, suffix=_TMP_SUFFIX,
+          delete=False) as tmp_file:
+        json.dump(entries, tmp_file, separators=(',', ':'))
+      # Atomic, so concurrent readers never see a partial entry.
+      os.rename(tmp_file.name, self._EntryPath(key))
+      self._loaded[key] = entries
+      self._touched.add(key)
+    self._pending.clear()
+    self._MaybeEvict()
+
+  def _MaybeEvict(self):
+    if self._max_libraries is None:
+      return
+    entries = []
+    for name in os.listdir(self._cache_dir):
+      if name.endswith(_TMP_SUFFIX):
+        continue
+      path = os.path.join(self._cache_dir, name)
+      try:
+        entries.append((os.path.getmtime(path), path))
+      except OSError:
+        continue
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - self._max_libraries)]:
+      try:
+        os.unlink(path)
+      except OSError:
+        pass  # Already evicted by a concurrent process.
+
+
+class SymbolizerService(object):
+  """Symbolizes addresses using a pool of warm ELFSymbolizer instances.
+
+  Thread-safe: requests are serialized, which is what addr2line wants anyway
+  (each ELFSymbolizer already shards work over several addr2line processes).
+
+  Args:
+    addr2line_path: Path of the toolchain's addr2line binary.
+    inlines: Whether to resolve inlined frames (see ELFSymbolizer).
+    cache_dir: Optional directory for a persistent SymbolCache.
+    max_warm_libraries: Maximum number of libraries to keep addr2line
+      processes alive for. The least-recently-used one is shut down first.
+    max_concurrent_jobs: Forwarded to each ELFSymbolizer.
+  """
+
+  def __init__(self, addr2line_path, inlines=True, cache_dir=None,
+               max_warm_libraries=8, max_concurrent_jobs=None):
+    self._addr2line_path = addr2line_path
+    self._inlines = inlines
+    self._max_warm_libraries = max_warm_libraries
+    self._max_concurrent_jobs = max_concurrent_jobs
+    self._symbol_cache = SymbolCache(cache_dir) if cache_dir else None
+    # Maps library key -> ELFSymbolizer, in LRU order.
+    self._symbolizers = collections.OrderedDict()
+    # Maps host path -> (mtime, key), to avoid re-reading build-ids.
+    self._library_keys = {}
+    self._lock = threading.Lock()
+    self.num_cache_hits = 0
+    self.num_addr2line_requests = 0
+
+  def _GetLibraryKey(self, elf_file_path):
+    """Returns the build-id of a library, or its path if it has none."""
+    try:
+      mtime = os.path.getmtime(elf_file_path)
+    except OSError:
+      mtime = None
+    cached = self._library_keys.get(elf_file_path)
+    if cached and cached[0] == mtime:
+      return cached[1], cached[2]
+    build_id = elf_symbolizer.GetBuildId(elf_file_path) if mtime else None
+    key = build_id or os.path.abspath(elf_file_path)
+    self._library_keys[elf_file_path] = (mtime, key, build_id)
+    return key, build_id
+
+  def _GetSymbolizer(self, key, elf_file_path):
+    symbolizer = self._symbolizers.pop(key, None)
+    if symbolizer is None:
+      symbolizer = elf_symbolizer.ELFSymbolizer(
+          elf_file_path=elf_file_path, addr2line_path=self._addr2line_path,
+          callback=SymbolizerService._Callback, inlines=self._inlines,
+          max_concurrent_jobs=self._max_concurrent_jobs)
+      while len(self._symbolizers) >= self._max_warm_libraries:
+        _, evicted = self._symbolizers.popitem(last=False)
+        evicted.Join()
+    self._symbolizers[key] = symbolizer
+    return symbolizer
+
+  def SymbolizeMany(self, elf_file_path, addresses):
+    """Symbolizes a batch of addresses within a single library.
+
+    Args:
+      elf_file_path: Host path of the unstripped library.
+      addresses: Iterable of integer addresses (offsets) in the library.
+    Returns:
+      A list of ELFSymbolInfo, in the same order as |addresses|.
+    """
+    addresses = list(addresses)
+    with self._lock:
+      key, build_id = self._GetLibraryKey(elf_file_path)
+      # Only build-ids identify library contents reliably enough to persist.
+      cache_key = None
+      if self._symbol_cache and build_id:
+        cache_key = build_id if self._inlines else build_id + '-noinlines'
+
+      results = {}
+      if cache_key:
+        for addr in set(addresses):
+          sym_info = self._symbol_cache.Get(cache_key, addr)
+          if sym_info:
+            results[addr] = sym_info
+        self.num_cache_hits += len(results)
+
+      missing = sorted(set(addresses).difference(results))
+      if missing:
+        symbolizer = self._GetSymbolizer(key, elf_file_path)
+        # addr2line is much faster when addresses are requested in order.
+        for addr in missing:
+          symbolizer.SymbolizeAsync(addr, callback_arg=(results, addr))
+        symbolizer.WaitForIdle()
+        self.num_addr2line_requests += len(missing)
+        if cache_key:
+          for addr in missing:
+            # Unknown ('??') results are not kept, since they may be due to
+            # addr2line failing rather than to the address.
+            if results[addr].name:
+              self._symbol_cache.Put(cache_key, addr, results[addr])
+
+      return [results[addr] for addr in addresses]
+
+  def Close(self):
+    """Shuts down all addr2line processes and writes the symbol cache."""
+    with self._lock:
+      while self._symbolizers:
+        _, symbolizer = self._symbolizers.popitem()
+        symbolizer.Join()
+      if self._symbol_cache:
+        self._symbol_cache.Flush()
+
+  @staticmethod
+  def _Callback(sym_info, callback_arg):
+    results, addr = callback_arg
+    results[addr] = sym_info
+
+
+def GetSharedService(addr2line_path, inlines=True, cache_dir=None):
+  """Returns a process-wide SymbolizerService for the given configuration."""
+  config = (addr2line_path, inlines, cache_dir)
+  with _shared_services_lock:
+    service = _shared_services.get(config)
+    if service is None:
+      service = SymbolizerService(addr2line_path, inlines=inlines,
+                                  cache_dir=cache_dir)
+      if not _shared_services:
+        atexit.register(_CloseSharedServices)
+      _shared_services[config] = service
+    return service
+
+
+def _CloseSharedServices():
+  for service in _shared_services.values():
+    service.Close()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+from pylib.symbols import elf_symbolizer
+from pylib.symbols import mock_addr2line
+from pylib.symbols import symbolizer_service
+
+_MOCK_A2L_PATH = os.path.join(os.path.dirname(mock_addr2line.__file__),
+                              'mock_addr2line')
+_UNKNOWN_MOCK_ADDR = 2 * 1024 * 1024
+_INLINE_MOCK_ADDR = 3 * 1024 * 1024
+
+
+def CreateElfWithBuildId(path, build_id):
+  """Writes a minimal 64-bit ELF file with a single GNU build-id note."""
+  desc = bytearray.fromhex(build_id)
+  note = struct.pack('<III', 4, len(desc), 3) + b'GNU\0' + bytes(desc)
+  header = b'\x7fELF\x02\x01\x01' + b'\0' * 9
+  header += struct.pack('<HHIQQQIHHHHHH', 3, 183, 1, 0, 64, 0, 0, 64, 56, 1,
+                        0, 0, 0)
+  phdr = struct.pack('<IIQQQQQQ', 4, 4, 120, 0, 0, len(note), len(note), 4)
+  with open(path, 'wb') as f:
+    f.write(header + phdr + note)
+
+
+class SymbolizerServiceTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp()
+    # Removed after the services, which write their caches when closed.
+    self.addCleanup(shutil.rmtree, self._tmp_dir)
+    self._lib_path = os.path.join(self._tmp_dir, 'libmock.so')
+    CreateElfWithBuildId(self._lib_path, '0123456789abcdef')
+
+  def _CreateService(self, **kwargs):
+    service = symbolizer_service.SymbolizerService(_MOCK_A2L_PATH, **kwargs)
+    self.addCleanup(service.Close)
+    return service
+
+  def _CheckSymbols(self, results, addresses, lib_name='libmock.so'):
+    self.assertEqual(len(results), len(addresses))
+    for sym_info, addr in zip(results, addresses):
+      self.assertEqual(sym_info.name, 'mock_sym_for_addr_%d' % addr)
+      self.assertEqual(sym_info.source_path, 'mock_src/%s.c' % lib_name)
+      self.assertEqual(sym_info.source_line, addr)
+
+  def testGetBuildId(self):
+    self.assertEqual(elf_symbolizer.GetBuildId(self._lib_path),
+                     '0123456789abcdef')
+    self.assertIsNone(elf_symbolizer.GetBuildId('/no/such/libmock.so'))
+
+  def testSymbolizeMany(self):
+    service = self._CreateService()
+    addresses = [30, 10, 20, 10]
+    self._CheckSymbols(service.SymbolizeMany(self._lib_path, addresses),
+                       addresses)
+    self.assertEqual(service.num_addr2line_requests, 3)
+
+  def testInlines(self):
+    service = self._CreateService(inlines=True)
+    sym_info, = service.SymbolizeMany(self._lib_path, [_INLINE_MOCK_ADDR])
+    self.assertIsNotNone(sym_info.inlined_by)
+
+  def testWarmSymbolizersAreReused(self):
+    service = self._CreateService(max_warm_libraries=1)
+    service.SymbolizeMany(self._lib_path, [1])
+    symbolizer = service._symbolizers.values()[0]
+    service.SymbolizeMany(self._lib_path, [2])
+    self.assertIs(service._symbolizers.values()[0], symbolizer)
+
+    # Libraries without a build-id are keyed by path.
+    service.SymbolizeMany('/some/path/libother.so', [3])
+    self.assertEqual(service._symbolizers.keys(),
+                     [os.path.abspath('/some/path/libother.so')])
+
+  def testDiskCache(self):
+    cache_dir = os.path.join(self._tmp_dir, 'cache')
+    addresses = [1, 2, 3]
+    service = self._CreateService(cache_dir=cache_dir)
+    service.SymbolizeMany(self._lib_path, addresses)
+    # The cache is written when the service is closed.
+    self.assertFalse(os.listdir(cache_dir))
+    service.Close()
+
+    service = self._CreateService(cache_dir=cache_dir)
+    results = service.SymbolizeMany(self._lib_path, addresses + [4])
+    self._CheckSymbols(results, addresses + [4])
+    self.assertEqual(service.num_cache_hits, 3)
+    self.assertEqual(service.num_addr2line_requests, 1)
+
+  def testDiskCacheSkipsUnknownSymbols(self):
+    cache_dir = os.path.join(self._tmp_dir, 'cache')
+    service = self._CreateService(cache_dir=cache_dir)
+    sym_info, = service.SymbolizeMany(self._lib_path, [_UNKNOWN_MOCK_ADDR])
+    self.assertIsNone(sym_info.name)
+    service.Close()
+
+    service = self._CreateService(cache_dir=cache_dir)
+    service.SymbolizeMany(self._lib_path, [_UNKNOWN_MOCK_ADDR])
+    self.assertEqual(service.num_cache_hits, 0)
+    self.assertEqual(service.num_addr2line_requests, 1)
+
+  def testDiskCacheMergesConcurrentWrites(self):
+    cache_dir = os.path.join(self._tmp_dir, 'cache')
+    cache1 = symbolizer_service.SymbolCache(cache_dir)
+    cache2 = symbolizer_service.SymbolCache(cache_dir)
+    sym_info = elf_symbolizer.ELFSymbolInfo('name', 'path', 1)
+    self.assertIsNone(cache1.Get('a', 1))
+    self.assertIsNone(cache2.Get('a', 2))
+    cache1.Put('a', 1, sym_info)
+    cache2.Put('a', 2, sym_info)
+    cache1.Flush()
+    cache2.Flush()
+
+    cache = symbolizer_service.SymbolCache(cache_dir)
+    self.assertIsNotNone(cache.Get('a', 1))
+    self.assertIsNotNone(cache.Get('a', 2))
+
+  def testDiskCacheEvictsLeastRecentlyRead(self):
+    cache = symbolizer_service.SymbolCache(
+        os.path.join(self._tmp_dir, 'cache'), max_libraries=2)
+    sym_info = elf_symbolizer.ELFSymbolInfo('name', 'path', 1)
+    for i, key in enumerate(('a', 'b')):
+      cache.Put(key, i, sym_info)
+      cache.Flush()
+      os.utime(cache._EntryPath(key), (i + 1, i + 1))
+
+    # Reading 'a' makes 'b' the least recently used entry.
+    cache = symbolizer_service.SymbolCache(cache._cache_dir, max_libraries=2)
+    self.assertIsNotNone(cache.Get('a', 0))
+    cache.Put('c', 2, sym_info)
+    cache.Flush()
+    self.assertEqual(sorted(os.listdir(cache._cache_dir)),
+                     ['a.json', 'c.json'])
+
+  def testDiskCacheEviction(self):
+    cache = symbolizer_service.SymbolCache(
+        os.path.join(self._tmp_dir, 'cache'), max_libraries=2)
+    sym_info = elf_symbolizer.ELFSymbolInfo('name', 'path', 1)
+    for i, key in enumerate(('a', 'b', 'c')):
+      cache.Put(key, i, sym_info)
+      cache.Flush()
+      # Make mtimes distinct.
+      os.utime(cache._EntryPath(key), (time.time() + i, time.time() + i))
+    self.assertEqual(sorted(os.listdir(cache._cache_dir)),
+                     ['b.json', 'c.json'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,196 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Pushes test data dependencies to devices, using checksum manifests.
+
+Pushing data dependencies with PushChangedFiles() checksums every file on
+both the host and the device, for every run. Instead, the checksums of host
+files are cached in the output directory, and the checksums of the files
+last pushed to a device are kept in a manifest on the device. Only the files
+whose checksums differ from the manifest are pushed.
+
+The manifest is only trusted when the DeviceState of the test run records
+it, i.e. with --enable-device-cache and when no test run of another output
+directory used the device since it was written.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import tempfile
+import threading
+
+from devil.android import device_errors
+from pylib import constants
+
+_CHECKSUMS_CACHE_FILE = 'test_data_checksums.json'
+_DEVICE_MANIFEST_FILE = '.data_deps_manifest.json'
+
+
+def GetChecksumsCachePath():
+  """Returns the path of the host checksums cache of the output directory."""
+  return os.path.join(constants.GetOutDirectory(), _CHECKSUMS_CACHE_FILE)
+
+
+class HostChecksums(object):
+  """The checksums of host files, kept in a file between runs.
+
+  A file is checksummed again only when its mtime or size changes, so that
+  after a build only the files that it changed are read. Thread-safe.
+  """
+
+  def __init__(self, cache_path=None):
+    """Initialize instance.
+
+    Args:
+      cache_path: Optional path of the file to keep checksums in.
+    """
+    self._cache_path = cache_path
+    # Maps host paths to [mtime, size, checksum].
+    self._entries = {}
+    self._dirty = False
+    self._lock = threading.Lock()
+    if cache_path and os.path.exists(cache_path):
+      try:
+        with open(cache_path) as f:
+          self._entries = json.load(f)
+      except ValueError:
+        logging.warning('Ignoring corrupt checksums cache: %s', cache_path)
+
+  def Get(self, host_path):
+    """Returns the MD5 checksum of the file at |host_path|."""
+    stat = os.stat(host_path)
+    with self._lock:
+      entry = self._entries.get(host_path)
+    if entry and entry[:2] == [stat.st_mtime, stat.st_size]:
+      return entry[2]
+
+    md5 = hashlib.md5()
+    with open(host_path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        md5.update(chunk)
+    checksum = md5.hexdigest()
+    with self._lock:
+      self._entries[host_path] = [stat.st_mtime, stat.st_size, checksum]
+      self._dirty = True
+    return checksum
+
+  def Save(self):
+    """Writes the checksums to the cache file, if any changed."""
+    with self._lock:
+      if not self._cache_path or not self._dirty:
+        return
+      cache_dir = os.path.dirname(self._cache_path)
+      with tempfile.NamedTemporaryFile(
+          mode='w', dir=cache_dir, delete=False) as tmp_file:
+        json.dump(self._entries, tmp_file, separators=(',', ':'))
+      # Atomic, as test runs of other suites may use the same cache.
+      os.rename(tmp_file.name, self._cache_path)
+      self._dirty = False
+
+
+def _ListFiles(host_device_tuples):
+  """Returns (host file, device file) tuples for all files to push."""
+  files = []
+  for host_path, device_path in host_device_tuples:
+    if not os.path.isdir(host_path):
+      files.append((host_path, device_path))
+      continue
+    for root, dirs, file_names in os.walk(host_path, followlinks=True):
+      dirs.sort()
+      rel_dir = os.path.relpath(root, host_path)
+      device_dir = device_path
+      if rel_dir != os.curdir:
+        device_dir = posixpath.join(device_path, *rel_dir.split(os.sep))
+      for file_name in sorted(file_names):
+        files.append((os.path.join(root, file_name),
+                      posixpath.join(device_dir, file_name)))
+  return files
+
+
+def GetDeviceManifestPath(device_root):
+  """Returns the device path of the manifest of syncs to |device_root|."""
+  return posixpath.join(device_root, _DEVICE_MANIFEST_FILE)
+
+
+def _ReadDeviceManifest(device, manifest_path):
+  """Returns the contents of the manifest on the device, or None."""
+  try:
+    return device.ReadFile(manifest_path)
+  except device_errors.CommandFailedError:
+    return None
+
+
+def _GetManifestStamp(manifest_data):
+  return hashlib.md5(manifest_data.encode('utf-8')).hexdigest()
+
+
+def SyncDataDeps(device, host_device_tuples, device_root, checksums, state,
+                 timeout=None):
+  """Pushes the data dependencies that changed since the last sync.
+
+  The manifest of what was pushed is kept in |device_root|, and a stamp of it
+  in |state|. Unless both match, e.g. the first time, without
+  --enable-device-cache, or after a test run of another output directory, this
+  falls back to pushing all the data dependencies with PushChangedFiles(),
+  which also removes stale files from pushed directories.
+
+  Args:
+    device: The DeviceUtils instance to push to.
+    host_device_tuples: A list of (host path, device path) tuples, as for
+      PushChangedFiles(). Paths can be files or directories.
+    device_root: Device directory to keep the manifest in.
+    checksums: The HostChecksums to use for host files.
+    state: The DeviceState of |device|, or None if it is not kept.
+    timeout: Optional timeout of the push, in seconds.
+  """
+  if state is None:
+    device.PushChangedFiles(host_device_tuples, delete_device_stale=True,
+                            timeout=timeout)
+    return
+
+  files = _ListFiles(host_device_tuples)
+  new_manifest = {d: checksums.Get(h) for h, d in files}
+  manifest_path = GetDeviceManifestPath(device_root)
+  step_name = 'data_deps_manifest:%s' % device_root
+  old_manifest = None
+  old_manifest_data = _ReadDeviceManifest(device, manifest_path)
+  if old_manifest_data is None:
+    logging.info('No data deps manifest on device. Pushing all files.')
+  elif not state.IsDone(step_name, _GetManifestStamp(old_manifest_data)):
+    logging.info('Data deps manifest on device is not from this output '
+                 'directory. Pushing all files.')
+  else:
+    try:
+      old_manifest = json.loads(old_manifest_data)
+    except ValueError:
+      logging.warning('Ignoring corrupt manifest on device: %s', manifest_path)
+
+  # The manifest is forgotten first, so that a sync that fails part way is
+  # followed by a full push.
+  state.SetNotDone(step_name)
+  if old_manifest is None:
+    device.PushChangedFiles(host_device_tuples, delete_device_stale=True,
+                            timeout=timeout)
+  else:
+    changed_files = [(h, d) for h, d in files
+                     if old_manifest.get(d) != new_manifest[d]]
+    stale_files = [d for d in old_manifest if d not in new_manifest]
+    logging.info('Data deps: %d of %d files changed, %d removed.',
+                 len(changed_files), len(files), len(stale_files))
+    if not changed_files and not stale_files:
+      state.SetDone(step_name, _GetManifestStamp(old_manifest_data))
+      return
+    device.RemovePath([manifest_path] + stale_files, force=True)
+    if changed_files:
+      # Only the changed files are checksummed on the device, and they are
+      # pushed together in a single zip when there are many of them.
+      device.PushChangedFiles(changed_files, timeout=timeout)
+
+  manifest_data = json.dumps(new_manifest, separators=(',', ':'),
+                             sort_keys=True)
+  device.WriteFile(manifest_path, manifest_data)
+  state.SetDone(step_name, _GetManifestStamp(manifest_data))
@@ -0,0 +1,149 @@
+#!/usr/bin/env vpython
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# pylint: disable=protected-access
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from devil.android import device_errors
+from pylib.local.device import device_state
+from pylib.utils import data_deps_sync
+
+import mock  # pylint: disable=import-error
+
+
+class DataDepsSyncTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+    self._data_dir = os.path.join(self._temp_dir, 'data')
+    os.makedirs(os.path.join(self._data_dir, 'sub'))
+    self._file_a = self._WriteFile(os.path.join(self._data_dir, 'a'), 'a')
+    self._file_b = self._WriteFile(
+        os.path.join(self._data_dir, 'sub', 'b'), 'b')
+    self._checksums = data_deps_sync.HostChecksums()
+    self._device = mock.Mock()
+    self._state = device_state.DeviceState('serial', 'boot_id', 'token')
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def _WriteFile(self, path, contents):
+    with open(path, 'w') as f:
+      f.write(contents)
+    return path
+
+  def _SetManifest(self, trusted=True, **checksums):
+    manifest_data = json.dumps({
+        '/root/data/%s' % k.replace('_', '/'): v
+        for k, v in checksums.iteritems()
+    })
+    self._device.ReadFile.return_value = manifest_data
+    if trusted:
+      self._state.SetDone('data_deps_manifest:/root',
+                          data_deps_sync._GetManifestStamp(manifest_data))
+
+  def _Sync(self, host_device_tuples=None, state=True):
+    data_deps_sync.SyncDataDeps(
+        self._device, host_device_tuples or [(self._data_dir, '/root/data')],
+        '/root', self._checksums, self._state if state else None)
+
+  def testListFiles(self):
+    self.assertEquals(
+        [(self._file_a, '/root/data/a'), (self._file_b, '/root/data/sub/b'),
+         (self._file_a, '/root/other')],
+        data_deps_sync._ListFiles([(self._data_dir, '/root/data'),
+                                   (self._file_a, '/root/other')]))
+
+  def testHostChecksums(self):
+    cache_path = os.path.join(self._temp_dir, 'checksums.json')
+    os.utime(self._file_a, (1000, 1000))
+    checksums = data_deps_sync.HostChecksums(cache_path)
+    checksum = checksums.Get(self._file_a)
+    checksums.Save()
+
+    # Files are not read again unless their mtime or size change.
+    self._WriteFile(self._file_a, 'c')
+    os.utime(self._file_a, (1000, 1000))
+    checksums = data_deps_sync.HostChecksums(cache_path)
+    self.assertEquals(checksum, checksums.Get(self._file_a))
+
+    self._WriteFile(self._file_a, 'cc')
+    self.assertNotEquals(checksum, checksums.Get(self._file_a))
+
+  def testSyncDataDeps_noManifest(self):
+    self._device.ReadFile.side_effect = device_errors.CommandFailedError('')
+    host_device_tuples = [(self._data_dir, '/root/data')]
+
+    self._Sync(host_device_tuples)
+    self._device.PushChangedFiles.assert_called_once_with(
+        host_device_tuples, delete_device_stale=True, timeout=None)
+    manifest_path, manifest = self._device.WriteFile.call_args[0]
+    self.assertEquals('/root/.data_deps_manifest.json', manifest_path)
+    self.assertEquals(
+        {
+            '/root/data/a': self._checksums.Get(self._file_a),
+            '/root/data/sub/b': self._checksums.Get(self._file_b),
+        }, json.loads(manifest))
+    # The manifest written is trusted by the next sync.
+    self.assertTrue(
+        self._state.IsDone('data_deps_manifest:/root',
+                           data_deps_sync._GetManifestStamp(manifest)))
+
+  def testSyncDataDeps_untrustedManifest(self):
+    # E.g. written by a test run of another output directory.
+    self._SetManifest(trusted=False,
+                      a=self._checksums.Get(self._file_a),
+                      sub_b=self._checksums.Get(self._file_b))
+    host_device_tuples = [(self._data_dir, '/root/data')]
+
+    self._Sync(host_device_tuples)
+    self._device.PushChangedFiles.assert_called_once_with(
+        host_device_tuples, delete_device_stale=True, timeout=None)
+    self.assertEquals(1, self._device.WriteFile.call_count)
+
+  def testSyncDataDeps_noDeviceState(self):
+    self._SetManifest(a=self._checksums.Get(self._file_a),
+                      sub_b=self._checksums.Get(self._file_b))
+    host_device_tuples = [(self._data_dir, '/root/data')]
+
+    self._Sync(host_device_tuples, state=False)
+    self.assertFalse(self._device.ReadFile.called)
+    self._device.PushChangedFiles.assert_called_once_with(
+        host_device_tuples, delete_device_stale=True, timeout=None)
+    self.assertFalse(self._device.WriteFile.called)
+
+  def testSyncDataDeps_changedFiles(self):
+    self._SetManifest(a='old', sub_b=self._checksums.Get(self._file_b),
+                      c='stale')
+
+    self._Sync()
+    self._device.RemovePath.assert_called_once_with(
+        ['/root/.data_deps_manifest.json', '/root/data/c'], force=True)
+    self._device.PushChangedFiles.assert_called_once_with(
+        [(self._file_a, '/root/data/a')], timeout=None)
+    self.assertEquals(1, self._device.WriteFile.call_count)
+
+  def testSyncDataDeps_unchanged(self):
+    self._SetManifest(a=self._checksums.Get(self._file_a),
+                      sub_b=self._checksums.Get(self._file_b))
+
+    self._Sync()
+    self.assertFalse(self._device.PushChangedFiles.called)
+    # The manifest is left as it is.
+    self.assertFalse(self._device.RemovePath.called)
+    self.assertFalse(self._device.WriteFile.called)
+    self.assertTrue(
+        self._state.IsDone('data_deps_manifest:/root',
+                           data_deps_sync._GetManifestStamp(
+                               self._device.ReadFile.return_value)))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
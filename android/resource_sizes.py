@@ -15,12 +15,13 @@ import collections
 from contextlib import contextmanager
 import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import posixpath
 import re
 import struct
 import sys
-import tempfile
+import threading
 import zipfile
 import zlib
 
@@ -87,6 +88,9 @@ _READELF_SIZES_METRICS = {
         '.gnu.version_d', '.gnu.version_r', '.interp', '.gcc_except_table'
     ]
 }
+# Bump when the meaning of cached measurements changes.
+_MEASUREMENT_CACHE_VERSION = 1
+_MAX_MEASUREMENT_CACHE_ENTRIES = 10000
 
 
 class _AccumulatingReporter(object):
@@ -126,6 +130,63 @@ class _ChartJsonReporter(_AccumulatingReporter):
                                                  value, units)
 
 
+class _MeasurementCache(object):
+  """Memoizes expensive measurements of zip entries and files.
+
+  Measurements are keyed by CRC-32 and size, which zip entries record in
+  their headers, so unchanged entries are recognized without re-measuring
+  them. When |cache_path| is set, measurements are persisted there between
+  runs. Thread-safe.
+  """
+
+  def __init__(self, cache_path=None):
+    self._cache_path = cache_path
+    self._entries = {}
+    self._used_keys = set()
+    self._lock = threading.Lock()
+    if cache_path and os.path.exists(cache_path):
+      try:
+        with open(cache_path) as f:
+          data = json.load(f)
+        if data.get('version') == _MEASUREMENT_CACHE_VERSION:
+          self._entries = data['entries']
+      except ValueError:
+        logging.warning('Ignoring corrupt measurement cache: %s', cache_path)
+
+  def GetOrCompute(self, key_parts, compute_func):
+    """Returns the value for |key_parts|, calling |compute_func| if needed.
+
+    Values must be JSON-serializable.
+    """
+    key = ':'.join(str(p) for p in key_parts)
+    with self._lock:
+      self._used_keys.add(key)
+      if key in self._entries:
+        return self._entries[key]
+    value = compute_func()
+    with self._lock:
+      self._entries[key] = value
+    return value
+
+  def Flush(self):
+    """Writes the cache, keeping entries used by this run first."""
+    if not self._cache_path:
+      return
+    keys = list(self._used_keys)
+    keys += [k for k in self._entries if k not in self._used_keys]
+    entries = {k: self._entries[k] for k in keys[:_MAX_MEASUREMENT_CACHE_ENTRIES]}
+    with build_utils.AtomicOutput(self._cache_path, mode='w') as f:
+      json.dump({'version': _MEASUREMENT_CACHE_VERSION, 'entries': entries}, f)
+
+
+def _ComputeFileCrc(path):
+  crc = 0
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+      crc = zlib.crc32(chunk, crc)
+  return crc & 0xffffffff
+
+
 def _PercentageDifference(a, b):
   if a == 0:
     return 0
@@ -172,7 +233,15 @@ def _RunReadelf(so_path, options, tool_prefix=''):
       [tool_prefix + 'readelf'] + options + [so_path])
 
 
-def _ExtractLibSectionSizesFromApk(apk_path, lib_path, tool_prefix):
+def _ExtractLibSectionSizesFromApk(apk_path, lib_info, tool_prefix,
+                                   measurement_cache):
+  section_sizes = measurement_cache.GetOrCompute(
+      ('lib', lib_info.CRC, lib_info.file_size),
+      lambda: _ComputeLibSectionSizes(apk_path, lib_info.filename, tool_prefix))
+  return {str(k): v for k, v in section_sizes.iteritems()}
+
+
+def _ComputeLibSectionSizes(apk_path, lib_path, tool_prefix):
   with Unzip(apk_path, filename=lib_path) as extracted_lib_path:
     grouped_section_sizes = collections.defaultdict(int)
     no_bits_section_sizes, section_sizes = _CreateSectionNameSizeMap(
@@ -191,7 +260,7 @@ def _ExtractLibSectionSizesFromApk(apk_path, lib_path, tool_prefix):
       sys.stderr.write('Unknown elf section header: %s\n' % section_header)
       grouped_section_sizes['other'] += section_size
 
-    return grouped_section_sizes
+    return dict(grouped_section_sizes)
 
 
 def _CreateSectionNameSizeMap(so_path, tool_prefix):
@@ -207,7 +276,16 @@ def _CreateSectionNameSizeMap(so_path, tool_prefix):
   return no_bits_section_sizes, section_sizes
 
 
-def _ParseManifestAttributes(apk_path):
+def _ParseManifestAttributes(apk_path, measurement_cache):
+  with zipfile.ZipFile(apk_path) as z:
+    info = z.getinfo('AndroidManifest.xml')
+  return tuple(
+      measurement_cache.GetOrCompute(
+          ('manifest', info.CRC, info.file_size),
+          lambda: _ComputeManifestAttributes(apk_path)))
+
+
+def _ComputeManifestAttributes(apk_path):
   # Check if the manifest specifies whether or not to extract native libs.
   output = cmd_helper.GetCmdOutput([
       _AAPT_PATH.read(), 'd', 'xmltree', apk_path, 'AndroidManifest.xml'])
@@ -240,7 +318,7 @@ def _NormalizeLanguagePaks(translations, factor):
 
 
 def _NormalizeResourcesArsc(apk_path, num_arsc_files, num_translations,
-                            out_dir):
+                            out_dir, measurement_cache):
   """Estimates the expected overhead of untranslated strings in resources.arsc.
 
   See http://crbug.com/677966 for why this is necessary.
@@ -255,6 +333,13 @@ def _NormalizeResourcesArsc(apk_path, num_arsc_files, num_translations,
       raise Exception('Missing expected file: %s, try rebuilding.' % ap_path)
     apk_path = ap_path
 
+  return measurement_cache.GetOrCompute(
+      ('arsc', _ComputeFileCrc(apk_path), os.path.getsize(apk_path),
+       num_translations),
+      lambda: _ComputeUntranslatedStringsSize(apk_path, num_translations))
+
+
+def _ComputeUntranslatedStringsSize(apk_path, num_translations):
   aapt_output = _RunAaptDumpResources(apk_path)
   # en-rUS is in the default config and may be cluttered with non-translatable
   # strings, so en-rGB is a better baseline for finding missing translations.
@@ -343,6 +428,7 @@ def _AnalyzeInternal(apk_path,
                      dex_stats_collector,
                      out_dir,
                      tool_prefix,
+                     measurement_cache,
                      apks_path=None,
                      split_name=None):
   """Analyse APK to determine size contributions of different file classes.
@@ -386,7 +472,8 @@ def _AnalyzeInternal(apk_path,
     zipalign_overhead += sum(len(i.extra) for i in apk_contents)
     signing_block_size = _MeasureApkSignatureBlock(apk)
 
-  _, skip_extract_lib, _ = _ParseManifestAttributes(apk_path)
+  _, skip_extract_lib, _ = _ParseManifestAttributes(apk_path,
+                                                    measurement_cache)
 
   # Pre-L: Dalvik - .odex file is simply decompressed/optimized dex file (~1x).
   # L, M: ART - .odex file is compiled version of the dex file (~4x).
@@ -515,7 +602,7 @@ def _AnalyzeInternal(apk_path,
   if is_shared_apk:
     report_func('InstallSize', 'Estimated installed size (Android Go)',
                 int(total_install_size_android_go), 'bytes')
-  transfer_size = _CalculateCompressedSize(apk_path)
+  transfer_size = _CalculateCompressedSize(apk_path, measurement_cache)
   report_func('TransferSize', 'Transfer size (deflate)', transfer_size, 'bytes')
 
   # Size of main dex vs remaining.
@@ -529,8 +616,9 @@ def _AnalyzeInternal(apk_path,
   main_lib_info = native_code.FindLargest()
   native_code_unaligned_size = 0
   for lib_info in native_code.AllEntries():
-    section_sizes = _ExtractLibSectionSizesFromApk(apk_path, lib_info.filename,
-                                                   tool_prefix)
+    section_sizes = _ExtractLibSectionSizesFromApk(apk_path, lib_info,
+                                                   tool_prefix,
+                                                   measurement_cache)
     native_code_unaligned_size += sum(
         v for k, v in section_sizes.iteritems() if k != 'bss')
     # Size of main .so vs remaining.
@@ -607,7 +695,8 @@ def _AnalyzeInternal(apk_path,
       normalized_apk_size += _NormalizeResourcesArsc(apk_path,
                                                      arsc.GetNumEntries(),
                                                      num_arsc_translations,
-                                                     out_dir)
+                                                     out_dir,
+                                                     measurement_cache)
 
   # It will be -Inf for .apk files with multiple .arsc files and no out_dir set.
   if normalized_apk_size < 0:
@@ -629,7 +718,13 @@ def _AnalyzeInternal(apk_path,
   return normalized_apk_size
 
 
-def _CalculateCompressedSize(file_path):
+def _CalculateCompressedSize(file_path, measurement_cache):
+  return measurement_cache.GetOrCompute(
+      ('deflate', _ComputeFileCrc(file_path), os.path.getsize(file_path)),
+      lambda: _ComputeCompressedSize(file_path))
+
+
+def _ComputeCompressedSize(file_path):
   CHUNK_SIZE = 256 * 1024
   compressor = zlib.compressobj()
   total_size = 0
@@ -679,69 +774,113 @@ def _IterSplits(namelist):
           yield subpath, split_name
 
 
-def _ExtractToTempFile(zip_obj, subpath, temp_file):
-  temp_file.seek(0)
-  temp_file.truncate()
-  temp_file.write(zip_obj.read(subpath))
-  temp_file.flush()
+def _ExtractToFile(zip_obj, subpath, path):
+  with open(path, 'wb') as f:
+    f.write(zip_obj.read(subpath))
+  return path
+
 
+def _PrefetchMeasurements(apk_paths, tool_prefix, measurement_cache, jobs):
+  """Fills |measurement_cache| with measurements of |apk_paths| in parallel.
 
-def _AnalyzeApkOrApks(report_func, apk_path, args):
+  Results are the same as those computed lazily by _AnalyzeInternal(), so
+  this only changes how long the analysis takes.
+  """
+  lib_tasks = []
+  apk_tasks = []
+  for apk_path in apk_paths:
+    apk_tasks.append(
+        (_ParseManifestAttributes, (apk_path, measurement_cache)))
+    apk_tasks.append(
+        (_CalculateCompressedSize, (apk_path, measurement_cache)))
+    with zipfile.ZipFile(apk_path) as z:
+      for info in z.infolist():
+        if info.filename.endswith('.so'):
+          lib_tasks.append((info.file_size, _ExtractLibSectionSizesFromApk,
+                            (apk_path, info, tool_prefix, measurement_cache)))
+  # Start the largest libraries first, since they take the longest.
+  lib_tasks.sort(key=lambda t: -t[0])
+  tasks = [t[1:] for t in lib_tasks] + apk_tasks
+
+  # The work happens in readelf / aapt subprocesses and in zlib, which does
+  # not hold the GIL, so threads are enough.
+  pool = ThreadPool(jobs)
+  try:
+    pool.map(lambda task: task[0](*task[1]), tasks)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _AnalyzeApkOrApks(report_func, apk_path, args, measurement_cache):
   # Create DexStatsCollector here to track unique methods across base & chrome
   # modules.
   dex_stats_collector = method_count.DexStatsCollector()
   out_dir, tool_prefix = _ConfigOutDirAndToolsPrefix(args.out_dir)
 
   if apk_path.endswith('.apk'):
-    sdk_version, _, _ = _ParseManifestAttributes(apk_path)
+    if args.jobs > 1:
+      _PrefetchMeasurements([apk_path], tool_prefix, measurement_cache,
+                            args.jobs)
+    sdk_version, _, _ = _ParseManifestAttributes(apk_path, measurement_cache)
     _AnalyzeInternal(apk_path, sdk_version, report_func, dex_stats_collector,
-                     out_dir, tool_prefix)
+                     out_dir, tool_prefix, measurement_cache)
   elif apk_path.endswith('.apks'):
-    with tempfile.NamedTemporaryFile(suffix='.apk') as f:
-      with zipfile.ZipFile(apk_path) as z:
-        # Currently bundletool is creating two apks when .apks is created
-        # without specifying an sdkVersion. Always measure the one with an
-        # uncompressed shared library.
-        try:
-          info = z.getinfo('splits/base-master_2.apk')
-        except KeyError:
-          info = z.getinfo('splits/base-master.apk')
-        _ExtractToTempFile(z, info.filename, f)
-        sdk_version, _, _ = _ParseManifestAttributes(f.name)
-
-        orig_report_func = report_func
-        report_func = _AccumulatingReporter()
-
-        def do_measure(split_name, on_demand):
-          logging.info('Measuring %s on_demand=%s', split_name, on_demand)
-          # Use no-op reporting functions to get normalized size for DFMs.
-          inner_report_func = report_func
-          inner_dex_stats_collector = dex_stats_collector
-          if on_demand:
-            inner_report_func = lambda *_: None
-            inner_dex_stats_collector = method_count.DexStatsCollector()
-
-          size = _AnalyzeInternal(f.name,
-                                  sdk_version,
-                                  inner_report_func,
-                                  inner_dex_stats_collector,
-                                  out_dir,
-                                  tool_prefix,
-                                  apks_path=apk_path,
-                                  split_name=split_name)
-          report_func('DFM_' + split_name, 'Size with hindi', size, 'bytes')
-
-        # Measure base outside of the loop since we've already extracted it.
-        do_measure('base', on_demand=False)
-
-        for subpath, split_name in _IterSplits(z.namelist()):
-          if split_name != 'base':
-            _ExtractToTempFile(z, subpath, f)
-            _, _, on_demand = _ParseManifestAttributes(f.name)
-            do_measure(split_name, on_demand=on_demand)
-
-        report_func.DumpReports(orig_report_func)
-        report_func = orig_report_func
+    with build_utils.TempDir() as temp_dir, zipfile.ZipFile(apk_path) as z:
+      # Currently bundletool is creating two apks when .apks is created
+      # without specifying an sdkVersion. Always measure the one with an
+      # uncompressed shared library.
+      try:
+        info = z.getinfo('splits/base-master_2.apk')
+      except KeyError:
+        info = z.getinfo('splits/base-master.apk')
+      # Maps split name -> path of the extracted split, in measuring order.
+      split_paths = collections.OrderedDict()
+      split_paths['base'] = _ExtractToFile(
+          z, info.filename, os.path.join(temp_dir, 'base.apk'))
+      for subpath, split_name in _IterSplits(z.namelist()):
+        if split_name != 'base':
+          split_paths[split_name] = _ExtractToFile(
+              z, subpath, os.path.join(temp_dir, split_name + '.apk'))
+
+      if args.jobs > 1:
+        _PrefetchMeasurements(split_paths.values(), tool_prefix,
+                              measurement_cache, args.jobs)
+      sdk_version, _, _ = _ParseManifestAttributes(split_paths['base'],
+                                                   measurement_cache)
+
+      orig_report_func = report_func
+      report_func = _AccumulatingReporter()
+
+      def do_measure(split_name, split_path, on_demand):
+        logging.info('Measuring %s on_demand=%s', split_name, on_demand)
+        # Use no-op reporting functions to get normalized size for DFMs.
+        inner_report_func = report_func
+        inner_dex_stats_collector = dex_stats_collector
+        if on_demand:
+          inner_report_func = lambda *_: None
+          inner_dex_stats_collector = method_count.DexStatsCollector()
+
+        size = _AnalyzeInternal(split_path,
+                                sdk_version,
+                                inner_report_func,
+                                inner_dex_stats_collector,
+                                out_dir,
+                                tool_prefix,
+                                measurement_cache,
+                                apks_path=apk_path,
+                                split_name=split_name)
+        report_func('DFM_' + split_name, 'Size with hindi', size, 'bytes')
+
+      for split_name, split_path in split_paths.iteritems():
+        on_demand = False
+        if split_name != 'base':
+          _, _, on_demand = _ParseManifestAttributes(split_path,
+                                                     measurement_cache)
+        do_measure(split_name, split_path, on_demand=on_demand)
+
+      report_func.DumpReports(orig_report_func)
+      report_func = orig_report_func
   else:
     raise Exception('Unknown file type: ' + apk_path)
 
@@ -763,6 +902,8 @@ def _ResourceSizes(args):
   reporter = _ChartJsonReporter(chartjson)
   # Create DexStatsCollector here to track unique methods across trichrome APKs.
   dex_stats_collector = method_count.DexStatsCollector()
+  measurement_cache = _MeasurementCache(
+      args.cache_dir and os.path.join(args.cache_dir, 'measurements.json'))
 
   specs = [
       ('Chrome_', args.trichrome_chrome),
@@ -772,14 +913,16 @@ def _ResourceSizes(args):
   for prefix, path in specs:
     if path:
       reporter.trace_title_prefix = prefix
-      child_dex_stats_collector = _AnalyzeApkOrApks(reporter, path, args)
+      child_dex_stats_collector = _AnalyzeApkOrApks(reporter, path, args,
+                                                    measurement_cache)
       dex_stats_collector.MergeFrom(prefix, child_dex_stats_collector)
 
   if any(path for _, path in specs):
     reporter.SynthesizeTotals(dex_stats_collector.GetUniqueMethodCount())
   else:
-    _AnalyzeApkOrApks(reporter, args.input, args)
+    _AnalyzeApkOrApks(reporter, args.input, args, measurement_cache)
 
+  measurement_cache.Flush()
   if chartjson:
     _DumpChartJson(args, chartjson)
 
@@ -840,6 +983,15 @@ def main():
       help='Output the results to a file in the given '
       'format instead of printing the results.')
   argparser.add_argument('--loadable_module', help='Obsolete (ignored).')
+  argparser.add_argument(
+      '--jobs',
+      type=int,
+      default=1,
+      help='Number of splits / native libraries to measure in parallel.')
+  argparser.add_argument(
+      '--cache-dir',
+      help='Directory in which to cache measurements of zip entries between '
+      'runs. Entries are keyed by CRC and size.')
 
   # Accepted to conform to the isolated script interface, but ignored.
   argparser.add_argument(
@@ -95,6 +95,13 @@ def AddTestLauncherOptions(parser):
       '--test-launcher-total-shards',
       type=int, default=os.environ.get('GTEST_TOTAL_SHARDS', 1),
       help='Total number of external shards.')
+  parser.add_argument(
+      '--test-durations-file',
+      type=os.path.realpath,
+      help='JSON file of historical per-test durations, used to balance tests '
+           'across devices and external shards. Updated with the durations '
+           'of the tests that run, except by external shards, whose results '
+           'are merged in with pylib/base/merge_test_durations.py.')
 
   test_filter.AddFilterOptions(parser)
 
@@ -278,7 +285,9 @@ def AddDeviceOptions(parser):
   parser.add_argument(
       '--enable-device-cache',
       action='store_true',
-      help='Cache device state to disk between runs')
+      help='Cache device state to disk between runs. APK installs and data '
+      'dependency pushes that are unchanged since a previous run are skipped, '
+      'unless the device rebooted in between.')
   parser.add_argument(
       '--skip-clear-data',
       action='store_true',
@@ -661,6 +670,12 @@ def AddJUnitTestOptions(parser):
       help='Number of shards to run junit tests in parallel on. Only 1 shard '
       'is supported when test-filter is specified. Values less than 1 will '
       'use auto select.')
+  parser.add_argument(
+      '--dynamic-sharding',
+      action='store_true',
+      help='Split tests into more batches than shards, which shards run, '
+      'longest first, as they become free. Makes up for tests that take '
+      'longer than in past runs, at the cost of starting more JVMs.')
   parser.add_argument(
       '-s', '--test-suite', required=True,
       help='JUnit test suite to run.')
@@ -31,6 +31,30 @@ _CHROMIUM_ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
 BUILD_VARS_FILENAME = 'build_vars.json'
 IMPORT_RE = re.compile(r'^import\("//(\S+)"\)')
 
+# Strings made only of these characters (printable ASCII except '"', '$' and
+# '\') need no escaping.
+_GN_PLAIN_STRING_RE = re.compile(r'[ !#%-\[\]-~]*\Z')
+
+# A GN escape sequence, or a trailing backslash.
+_GN_ESCAPE_RE = re.compile(r'\\(?:([$"\\])|\Z)')
+
+# Whitespace and comments between tokens.
+_GN_SKIP_PATTERN = r'(?:[ \t\n]+|#[^\n]*)*'
+_GN_SKIP_RE = re.compile(_GN_SKIP_PATTERN)
+
+# Matches the next token after any whitespace and comments, in a single call.
+# The name of the matched group is the kind of the token. 'other' matches a
+# character that starts no token, or '' at the end of the input.
+_GN_TOKEN_RE = re.compile(
+    _GN_SKIP_PATTERN + r'(?:(?P<string>"[^"\\]*(?:\\.[^"\\]*)*")'
+    r'|(?P<number>-?[0-9]+)'
+    r'|(?P<ident>[^\W\d]\w*)'
+    r'|(?P<punct>[][{},=])'
+    r'|(?P<other>.|\Z))', re.DOTALL | re.UNICODE)
+
+# The contents of a string, up to its closing quote.
+_GN_STRING_BODY_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+
 
 class GNError(Exception):
   pass
@@ -39,6 +63,11 @@ class GNError(Exception):
 # Computes ASCII code of an element of encoded Python 2 str / Python 3 bytes.
 _Ord = ord if sys.version_info.major < 3 else lambda c: c
 
+if sys.version_info.major < 3:
+  _basestring_compat = basestring
+else:
+  _basestring_compat = str
+
 
 def _TranslateToGnChars(s):
   for decoded_ch in s.encode('utf-8'):  # str in Python 2, bytes in Python 3.
@@ -51,6 +80,123 @@ def _TranslateToGnChars(s):
       yield '$0x%02X' % code
 
 
+def _EscapeGNString(s):
+  if _GN_PLAIN_STRING_RE.match(s):
+    return str(s)
+  return ''.join(_TranslateToGnChars(s))
+
+
+def _ScalarToGNToken(v):
+  """Returns the GN token for a string, bool or int, or None for other types."""
+  if isinstance(v, _basestring_compat):
+    return '"' + _EscapeGNString(v) + '"'
+  if isinstance(v, bool):
+    return 'true' if v else 'false'
+  if isinstance(v, int):
+    return str(v)
+  return None
+
+
+def _GenerateGNTokens(v, level):
+  """Emits all output tokens of |v| without intervening whitespaces."""
+  tok = _ScalarToGNToken(v)
+  if tok is not None:
+    yield tok
+
+  elif isinstance(v, list):
+    yield '['
+    for i, item in enumerate(v):
+      if i > 0:
+        yield ','
+      # Avoid a nested generator per item for the common list of scalars.
+      tok = _ScalarToGNToken(item)
+      if tok is not None:
+        yield tok
+      else:
+        for tok in _GenerateGNTokens(item, level + 1):
+          yield tok
+    yield ']'
+
+  elif isinstance(v, dict):
+    if level > 0:
+      yield '{'
+    for key in sorted(v):
+      if not isinstance(key, _basestring_compat):
+        raise GNError('Dictionary key is not a string.')
+      if not key or key[0].isdigit() or not key.replace('_', '').isalnum():
+        raise GNError('Dictionary key is not a valid GN identifier.')
+      yield key  # No quotations.
+      yield '='
+      for tok in _GenerateGNTokens(v[key], level + 1):
+        yield tok
+    if level > 0:
+      yield '}'
+
+  else:  # Not supporting float: Add only when needed.
+    raise GNError('Unsupported type when printing to GN.')
+
+
+def _CanStart(tok):
+  return tok and tok not in ',}]='
+
+
+def _CanEnd(tok):
+  return tok and tok not in ',{[='
+
+
+def _PlainGlue(gen):
+  """Adds whitespaces, trying to keep everything (except dicts) in 1 line."""
+  prev_tok = None
+  for i, tok in enumerate(gen):
+    if i > 0:
+      if _CanEnd(prev_tok) and _CanStart(tok):
+        yield '\n'  # New dict item.
+      elif prev_tok == '[' and tok == ']':
+        yield '  '  # Special case for [].
+      elif tok != ',':
+        yield ' '
+    yield tok
+    prev_tok = tok
+
+
+def _PrettyGlue(gen):
+  """Adds whitespaces so non-empty lists can span multiple lines, with indent.
+  """
+  prev_tok = None
+  level = 0
+  for i, tok in enumerate(gen):
+    if i > 0:
+      if _CanEnd(prev_tok) and _CanStart(tok):
+        yield '\n' + '  ' * level  # New dict item.
+      elif tok == '=' or prev_tok in '=':
+        yield ' '  # Separator before and after '=', on same line.
+    if tok in ']}':
+      level -= 1
+    # Exclude '[]' and '{}' cases.
+    if int(prev_tok == '[') + int(tok == ']') == 1 or \
+       int(prev_tok == '{') + int(tok == '}') == 1:
+      yield '\n' + '  ' * level
+    yield tok
+    if tok in '[{':
+      level += 1
+    if tok == ',':
+      yield '\n' + '  ' * level
+    prev_tok = tok
+
+
+def _GenerateGNChunks(value, pretty):
+  """Yields the pieces of ToGNString(value, pretty), in order."""
+  has_newline = isinstance(value, dict)
+  for chunk in (_PrettyGlue if pretty else _PlainGlue)(
+      _GenerateGNTokens(value, 0)):
+    if not has_newline and '\n' in chunk:
+      has_newline = True
+    yield chunk
+  # Add terminating '\n' for dict |value| or multi-line output.
+  if has_newline:
+    yield '\n'
+
+
 def ToGNString(value, pretty=False):
   """Returns a stringified GN equivalent of a Python value.
 
@@ -65,96 +211,33 @@ def ToGNString(value, pretty=False):
   Raises:
     GNError: |value| cannot be printed to GN.
   """
+  return ''.join(_GenerateGNChunks(value, pretty))
 
-  if sys.version_info.major < 3:
-    basestring_compat = basestring
-  else:
-    basestring_compat = str
-
-  # Emits all output tokens without intervening whitespaces.
-  def GenerateTokens(v, level):
-    if isinstance(v, basestring_compat):
-      yield '"' + ''.join(_TranslateToGnChars(v)) + '"'
-
-    elif isinstance(v, bool):
-      yield 'true' if v else 'false'
 
-    elif isinstance(v, int):
-      yield str(v)
+def WriteGNString(value, output_file, pretty=False, buffer_size=1 << 16):
+  """Writes ToGNString(value, pretty) to |output_file|, without building it.
 
-    elif isinstance(v, list):
-      yield '['
-      for i, item in enumerate(v):
-        if i > 0:
-          yield ','
-        for tok in GenerateTokens(item, level + 1):
-          yield tok
-      yield ']'
-
-    elif isinstance(v, dict):
-      if level > 0:
-        yield '{'
-      for key in sorted(v):
-        if not isinstance(key, basestring_compat):
-          raise GNError('Dictionary key is not a string.')
-        if not key or key[0].isdigit() or not key.replace('_', '').isalnum():
-          raise GNError('Dictionary key is not a valid GN identifier.')
-        yield key  # No quotations.
-        yield '='
-        for tok in GenerateTokens(v[key], level + 1):
-          yield tok
-      if level > 0:
-        yield '}'
+  Meant for large lists, whose serialized form need not be held in memory.
 
-    else:  # Not supporting float: Add only when needed.
-      raise GNError('Unsupported type when printing to GN.')
-
-  can_start = lambda tok: tok and tok not in ',}]='
-  can_end = lambda tok: tok and tok not in ',{[='
+  Args:
+    value: The Python value to convert.
+    output_file: A file object opened in text mode.
+    pretty: See ToGNString().
+    buffer_size: Number of characters to batch between writes.
 
-  # Adds whitespaces, trying to keep everything (except dicts) in 1 line.
-  def PlainGlue(gen):
-    prev_tok = None
-    for i, tok in enumerate(gen):
-      if i > 0:
-        if can_end(prev_tok) and can_start(tok):
-          yield '\n'  # New dict item.
-        elif prev_tok == '[' and tok == ']':
-          yield '  '  # Special case for [].
-        elif tok != ',':
-          yield ' '
-      yield tok
-      prev_tok = tok
-
-  # Adds whitespaces so non-empty lists can span multiple lines, with indent.
-  def PrettyGlue(gen):
-    prev_tok = None
-    level = 0
-    for i, tok in enumerate(gen):
-      if i > 0:
-        if can_end(prev_tok) and can_start(tok):
-          yield '\n' + '  ' * level  # New dict item.
-        elif tok == '=' or prev_tok in '=':
-          yield ' '  # Separator before and after '=', on same line.
-      if tok in ']}':
-        level -= 1
-      # Exclude '[]' and '{}' cases.
-      if int(prev_tok == '[') + int(tok == ']') == 1 or \
-         int(prev_tok == '{') + int(tok == '}') == 1:
-        yield '\n' + '  ' * level
-      yield tok
-      if tok in '[{':
-        level += 1
-      if tok == ',':
-        yield '\n' + '  ' * level
-      prev_tok = tok
-
-  token_gen = GenerateTokens(value, 0)
-  ret = ''.join((PrettyGlue if pretty else PlainGlue)(token_gen))
-  # Add terminating '\n' for dict |value| or multi-line output.
-  if isinstance(value, dict) or '\n' in ret:
-    return ret + '\n'
-  return ret
+  Raises:
+    GNError: |value| cannot be printed to GN. Some output may have been written.
+  """
+  pending = []
+  pending_size = 0
+  for chunk in _GenerateGNChunks(value, pretty):
+    pending.append(chunk)
+    pending_size += len(chunk)
+    if pending_size >= buffer_size:
+      output_file.write(''.join(pending))
+      pending = []
+      pending_size = 0
+  output_file.write(''.join(pending))
 
 
 def FromGNString(input_string):
@@ -229,27 +312,11 @@ def UnescapeGNString(value):
   Args:
     value: Input string to unescape.
   """
-  result = ''
-  i = 0
-  while i < len(value):
-    if value[i] == '\\':
-      if i < len(value) - 1:
-        next_char = value[i + 1]
-        if next_char in ('$', '"', '\\'):
-          # These are the escaped characters GN supports.
-          result += next_char
-          i += 1
-        else:
-          # Any other backslash is a literal.
-          result += '\\'
-    else:
-      result += value[i]
-    i += 1
-  return result
-
-
-def _IsDigitOrMinus(char):
-  return char in '-0123456789'
+  if '\\' not in value:
+    return value
+  # Backslash followed by '$', '"' or '\' is an escape. Any other backslash is
+  # a literal, except for a trailing one, which is dropped.
+  return _GN_ESCAPE_RE.sub(lambda m: m.group(1) or '', value)
 
 
 class GNValueParser(object):
@@ -259,6 +326,9 @@ class GNValueParser(object):
 
   If you expect input as a specific type, you can also call one of the Parse*
   functions directly. All functions throw GNError on invalid input.
+
+  Input is split into tokens by a single precompiled regular expression, so
+  each token costs one regex match rather than a Python loop per character.
   """
 
   def __init__(self, string, checkout_root=_CHROMIUM_ROOT):
@@ -292,24 +362,26 @@ class GNValueParser(object):
     # imports.
     self.ReplaceImports()
 
+  def ConsumeCommentAndWhitespace(self):
+    self.cur = _GN_SKIP_RE.match(self.input, self.cur).end()
+
+  def _NextToken(self):
+    """Returns the match of the next token, without consuming it."""
+    return _GN_TOKEN_RE.match(self.input, self.cur)
 
-  def _ConsumeWhitespace(self):
-    while not self.IsDone() and self.input[self.cur] in ' \t\n':
-      self.cur += 1
+  def _Consume(self, token):
+    self.cur = token.end()
 
-  def ConsumeCommentAndWhitespace(self):
-    self._ConsumeWhitespace()
+  def _Remaining(self, token):
+    return self.input[token.start(token.lastgroup):]
 
-    # Consume each comment, line by line.
-    while not self.IsDone() and self.input[self.cur] == '#':
-      # Consume the rest of the comment, up until the end of the line.
-      while not self.IsDone() and self.input[self.cur] != '\n':
-        self.cur += 1
-      # Move the cursor to the next line (if there is one).
-      if not self.IsDone():
-        self.cur += 1
+  @staticmethod
+  def _IsEnd(token):
+    return token.lastgroup == 'other' and not token.group('other')
 
-      self._ConsumeWhitespace()
+  @staticmethod
+  def _IsPunct(token, char):
+    return token.lastgroup == 'punct' and token.group('punct') == char
 
   def Parse(self):
     """Converts a string representing a printed GN value to the Python type.
@@ -333,9 +405,11 @@ class GNValueParser(object):
       GNError: Parse fails.
     """
     result = self._ParseAllowTrailing()
-    self.ConsumeCommentAndWhitespace()
-    if not self.IsDone():
-      raise GNError("Trailing input after parsing:\n  " + self.input[self.cur:])
+    token = self._NextToken()
+    if not self._IsEnd(token):
+      raise GNError("Trailing input after parsing:\n  " +
+                    self._Remaining(token))
+    self._Consume(token)
     return result
 
   def ParseArgs(self):
@@ -349,194 +423,167 @@ class GNValueParser(object):
     d = {}
 
     self.ReplaceImports()
-    self.ConsumeCommentAndWhitespace()
-
-    while not self.IsDone():
-      ident = self._ParseIdent()
-      self.ConsumeCommentAndWhitespace()
-      if self.input[self.cur] != '=':
-        raise GNError("Unexpected token: " + self.input[self.cur:])
-      self.cur += 1
-      self.ConsumeCommentAndWhitespace()
-      val = self._ParseAllowTrailing()
-      self.ConsumeCommentAndWhitespace()
-      d[ident] = val
-
-    return d
+    while True:
+      token = self._NextToken()
+      if self._IsEnd(token):
+        self._Consume(token)
+        return d
+      self._ParseAssignment(token, d)
+
+  def _ParseAssignment(self, token, d):
+    """Parses "<ident> = <value>" starting at |token| into |d|."""
+    if token.lastgroup != 'ident':
+      raise GNError("Expected an identifier: " + self._Remaining(token))
+    self._Consume(token)
+    ident = token.group('ident')
+    token = self._NextToken()
+    if not self._IsPunct(token, '='):
+      raise GNError("Unexpected token: " + self._Remaining(token))
+    self._Consume(token)
+    d[ident] = self._ParseAllowTrailing()
 
   def _ParseAllowTrailing(self):
     """Internal version of Parse() that doesn't check for trailing stuff."""
-    self.ConsumeCommentAndWhitespace()
-    if self.IsDone():
+    return self._ParseValue(self._NextToken())
+
+  def _ParseValue(self, token):
+    """Parses the value that starts at |token|."""
+    kind = token.lastgroup
+    if kind == 'string':
+      self._Consume(token)
+      return UnescapeGNString(token.group(kind)[1:-1])
+    if kind == 'number':
+      self._Consume(token)
+      return int(token.group(kind))
+    if kind == 'punct':
+      if token.group(kind) == '[':
+        self._Consume(token)
+        return self._ParseListItems()
+      if token.group(kind) == '{':
+        self._Consume(token)
+        return self._ParseScopeItems()
+    elif kind == 'ident':
+      if token.group(kind) == 'true':
+        self._Consume(token)
+        return True
+      if token.group(kind) == 'false':
+        self._Consume(token)
+        return False
+    elif self._IsEnd(token):
       raise GNError("Expected input to parse.")
+    elif token.group(kind) == '"':
+      self._RaiseBadString(token)
+    raise GNError("Unexpected token: " + self._Remaining(token))
 
-    next_char = self.input[self.cur]
-    if next_char == '[':
-      return self.ParseList()
-    elif next_char == '{':
-      return self.ParseScope()
-    elif _IsDigitOrMinus(next_char):
-      return self.ParseNumber()
-    elif next_char == '"':
-      return self.ParseString()
-    elif self._ConstantFollows('true'):
-      return True
-    elif self._ConstantFollows('false'):
-      return False
-    else:
-      raise GNError("Unexpected token: " + self.input[self.cur:])
-
-  def _ParseIdent(self):
-    ident = ''
-
-    next_char = self.input[self.cur]
-    if not next_char.isalpha() and not next_char=='_':
-      raise GNError("Expected an identifier: " + self.input[self.cur:])
-
-    ident += next_char
-    self.cur += 1
-
-    next_char = self.input[self.cur]
-    while next_char.isalpha() or next_char.isdigit() or next_char=='_':
-      ident += next_char
-      self.cur += 1
-      next_char = self.input[self.cur]
-
-    return ident
+  def _RaiseBadString(self, token):
+    begin = token.end()
+    if _GN_STRING_BODY_RE.match(self.input, begin).end() < len(self.input):
+      raise GNError('String ends in a backslash in:\n  ' + self.input)
+    raise GNError('Unterminated string:\n  ' + self.input[begin:])
 
   def ParseNumber(self):
-    self.ConsumeCommentAndWhitespace()
-    if self.IsDone():
+    token = self._NextToken()
+    if self._IsEnd(token):
       raise GNError('Expected number but got nothing.')
-
-    begin = self.cur
-
-    # The first character can include a negative sign.
-    if not self.IsDone() and _IsDigitOrMinus(self.input[self.cur]):
-      self.cur += 1
-    while not self.IsDone() and self.input[self.cur].isdigit():
-      self.cur += 1
-
-    number_string = self.input[begin:self.cur]
-    if not len(number_string) or number_string == '-':
+    if token.lastgroup != 'number':
       raise GNError('Not a valid number.')
-    return int(number_string)
+    self._Consume(token)
+    return int(token.group('number'))
 
   def ParseString(self):
-    self.ConsumeCommentAndWhitespace()
-    if self.IsDone():
+    token = self._NextToken()
+    if self._IsEnd(token):
       raise GNError('Expected string but got nothing.')
-
-    if self.input[self.cur] != '"':
-      raise GNError('Expected string beginning in a " but got:\n  ' +
-                    self.input[self.cur:])
-    self.cur += 1  # Skip over quote.
-
-    begin = self.cur
-    while not self.IsDone() and self.input[self.cur] != '"':
-      if self.input[self.cur] == '\\':
-        self.cur += 1  # Skip over the backslash.
-        if self.IsDone():
-          raise GNError('String ends in a backslash in:\n  ' + self.input)
-      self.cur += 1
-
-    if self.IsDone():
-      raise GNError('Unterminated string:\n  ' + self.input[begin:])
-
-    end = self.cur
-    self.cur += 1  # Consume trailing ".
-
-    return UnescapeGNString(self.input[begin:end])
+    if token.lastgroup == 'string':
+      return self._ParseValue(token)
+    if token.group(token.lastgroup) == '"':
+      self._RaiseBadString(token)
+    raise GNError('Expected string beginning in a " but got:\n  ' +
+                  self._Remaining(token))
 
   def ParseList(self):
-    self.ConsumeCommentAndWhitespace()
-    if self.IsDone():
+    token = self._NextToken()
+    if self._IsEnd(token):
       raise GNError('Expected list but got nothing.')
 
     # Skip over opening '['.
-    if self.input[self.cur] != '[':
-      raise GNError('Expected [ for list but got:\n  ' + self.input[self.cur:])
-    self.cur += 1
-    self.ConsumeCommentAndWhitespace()
-    if self.IsDone():
-      raise GNError('Unterminated list:\n  ' + self.input)
-
+    if not self._IsPunct(token, '['):
+      raise GNError('Expected [ for list but got:\n  ' + self._Remaining(token))
+    self._Consume(token)
+    return self._ParseListItems()
+
+  def _ParseListItems(self):
+    """Parses the rest of a list whose opening '[' has been consumed."""
+    # This loop is the hot path for long lists, so avoid helper calls in it.
+    match = _GN_TOKEN_RE.match
     list_result = []
     previous_had_trailing_comma = True
-    while not self.IsDone():
-      if self.input[self.cur] == ']':
-        self.cur += 1  # Skip over ']'.
+    while True:
+      token = match(self.input, self.cur)
+      kind = token.lastgroup
+      if kind == 'punct' and token.group(kind) == ']':
+        self.cur = token.end()
         return list_result
+      if self._IsEnd(token):
+        raise GNError('Unterminated list:\n  ' + self.input)
 
       if not previous_had_trailing_comma:
         raise GNError('List items not separated by comma.')
 
-      list_result += [ self._ParseAllowTrailing() ]
-      self.ConsumeCommentAndWhitespace()
-      if self.IsDone():
-        break
+      if kind == 'string':
+        self.cur = token.end()
+        list_result.append(UnescapeGNString(token.group(kind)[1:-1]))
+      else:
+        list_result.append(self._ParseValue(token))
 
       # Consume comma if there is one.
-      previous_had_trailing_comma = self.input[self.cur] == ','
+      token = match(self.input, self.cur)
+      previous_had_trailing_comma = (token.lastgroup == 'punct'
+                                     and token.group('punct') == ',')
       if previous_had_trailing_comma:
-        # Consume comma.
-        self.cur += 1
-        self.ConsumeCommentAndWhitespace()
-
-    raise GNError('Unterminated list:\n  ' + self.input)
+        self.cur = token.end()
 
   def ParseScope(self):
-    self.ConsumeCommentAndWhitespace()
-    if self.IsDone():
+    token = self._NextToken()
+    if self._IsEnd(token):
       raise GNError('Expected scope but got nothing.')
 
     # Skip over opening '{'.
-    if self.input[self.cur] != '{':
-      raise GNError('Expected { for scope but got:\n ' + self.input[self.cur:])
-    self.cur += 1
-    self.ConsumeCommentAndWhitespace()
-    if self.IsDone():
-      raise GNError('Unterminated scope:\n ' + self.input)
+    if not self._IsPunct(token, '{'):
+      raise GNError('Expected { for scope but got:\n ' + self._Remaining(token))
+    self._Consume(token)
+    return self._ParseScopeItems()
 
+  def _ParseScopeItems(self):
+    """Parses the rest of a scope whose opening '{' has been consumed."""
     scope_result = {}
-    while not self.IsDone():
-      if self.input[self.cur] == '}':
-        self.cur += 1
+    while True:
+      token = self._NextToken()
+      if self._IsPunct(token, '}'):
+        self._Consume(token)
         return scope_result
+      if self._IsEnd(token):
+        raise GNError('Unterminated scope:\n ' + self.input)
+      self._ParseAssignment(token, scope_result)
 
-      ident = self._ParseIdent()
-      self.ConsumeCommentAndWhitespace()
-      if self.input[self.cur] != '=':
-        raise GNError("Unexpected token: " + self.input[self.cur:])
-      self.cur += 1
-      self.ConsumeCommentAndWhitespace()
-      val = self._ParseAllowTrailing()
-      self.ConsumeCommentAndWhitespace()
-      scope_result[ident] = val
-
-    raise GNError('Unterminated scope:\n ' + self.input)
 
-  def _ConstantFollows(self, constant):
-    """Checks and maybe consumes a string constant at current input location.
-
-    Param:
-      constant: The string constant to check.
-
-    Returns:
-      True if |constant| follows immediately at the current location in the
-      input. In this case, the string is consumed as a side effect. Otherwise,
-      returns False and the current position is unchanged.
-    """
-    end = self.cur + len(constant)
-    if end > len(self.input):
-      return False  # Not enough room.
-    if self.input[self.cur:end] == constant:
-      self.cur = end
-      return True
-    return False
+# Maps the absolute path of a build_vars.json to ((mtime, size), contents).
+_build_vars_cache = {}
 
 
 def ReadBuildVars(output_directory):
-  """Parses $output_directory/build_vars.json into a dict."""
-  with open(os.path.join(output_directory, BUILD_VARS_FILENAME)) as f:
-    return json.load(f)
+  """Parses $output_directory/build_vars.json into a dict.
+
+  The result is cached per output directory, and the file is read again only
+  when its mtime or size changes. Each call returns a new dict, which callers
+  are free to modify.
+  """
+  path = os.path.abspath(os.path.join(output_directory, BUILD_VARS_FILENAME))
+  stat = os.stat(path)
+  stamp = (stat.st_mtime, stat.st_size)
+  entry = _build_vars_cache.get(path)
+  if entry is None or entry[0] != stamp:
+    with open(path) as f:
+      entry = (stamp, json.load(f))
+    _build_vars_cache[path] = entry
+  return dict(entry[1])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Measures the speed of parsing and printing GN values with gn_helpers.
+
+Inputs are generated to resemble a large args.gn, a long list of sources
+passed on a command line, and a build_vars.json.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import gn_helpers
+
+
+def _CreateArgsGn(num_args):
+  lines = ['# Build arguments.']
+  for i in range(num_args):
+    if i % 3 == 0:
+      value = 'true' if i % 2 else 'false'
+      lines.append('use_feature_%d = %s  # Comment.' % (i, value))
+    elif i % 3 == 1:
+      lines.append('target_name_%d = "//some/path:target_%d"' % (i, i))
+    else:
+      lines.append('level_%d = %d' % (i, i))
+  return '\n'.join(lines) + '\n'
+
+
+def _CreateSourceList(num_items):
+  return ['../../some/dir/source_file_%d.cc' % i for i in range(num_items)]
+
+
+def _Measure(name, func, number):
+  seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+  print('%-32s %10.3fms' % (name, seconds * 1000))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--args', type=int, default=300,
+                      help='Number of assignments in the generated args.gn.')
+  parser.add_argument('--items', type=int, default=20000,
+                      help='Number of items in the generated list.')
+  parser.add_argument('--number', type=int, default=10,
+                      help='Number of runs to average for each measurement.')
+  args = parser.parse_args()
+
+  args_gn = _CreateArgsGn(args.args)
+  sources = _CreateSourceList(args.items)
+  sources_gn = gn_helpers.ToGNString(sources)
+  number = args.number
+
+  _Measure('FromGNArgs(args.gn)', lambda: gn_helpers.FromGNArgs(args_gn),
+           number)
+  _Measure('FromGNString(list)', lambda: gn_helpers.FromGNString(sources_gn),
+           number)
+  _Measure('ToGNString(list)', lambda: gn_helpers.ToGNString(sources), number)
+  _Measure('ToGNString(list, pretty=True)',
+           lambda: gn_helpers.ToGNString(sources, pretty=True), number)
+
+  output_dir = tempfile.mkdtemp()
+  try:
+    with open(os.devnull, 'w') as devnull:
+      _Measure('WriteGNString(list)',
+               lambda: gn_helpers.WriteGNString(sources, devnull), number)
+
+    build_vars = dict(('var_%d' % i, 'value_%d' % i) for i in range(args.args))
+    with open(os.path.join(output_dir, gn_helpers.BUILD_VARS_FILENAME),
+              'w') as f:
+      json.dump(build_vars, f)
+
+    def read_uncached():
+      gn_helpers._build_vars_cache.clear()
+      gn_helpers.ReadBuildVars(output_dir)
+
+    _Measure('ReadBuildVars (uncached)', read_uncached, number)
+    _Measure('ReadBuildVars (cached)',
+             lambda: gn_helpers.ReadBuildVars(output_dir), number)
+  finally:
+    shutil.rmtree(output_dir)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
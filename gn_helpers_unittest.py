@@ -3,12 +3,20 @@
 # found in the LICENSE file.
 
 import mock
+import os
+import shutil
 import sys
+import tempfile
 import textwrap
 import unittest
 
 import gn_helpers
 
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+
 
 class UnitTest(unittest.TestCase):
   def test_ToGNString(self):
@@ -75,12 +83,40 @@ class UnitTest(unittest.TestCase):
       out_pretty = gn_helpers.ToGNString(obj, pretty=True)
       self.assertEqual(exp_pretty, out_pretty)
 
+  def test_WriteGNString(self):
+    values = [
+        list(range(1000)),
+        {
+            'files': ['file%d.cc' % i for i in range(500)],
+            'n': 1
+        },
+        '\\$"',
+        [],
+    ]
+    for value in values:
+      for pretty in (False, True):
+        f = StringIO()
+        gn_helpers.WriteGNString(value, f, pretty=pretty, buffer_size=100)
+        self.assertEqual(gn_helpers.ToGNString(value, pretty=pretty),
+                         f.getvalue())
+
+  def test_RoundTrip(self):
+    value = [1, -2, True, 'a"$\\b', ['c', []], {'d': ['e', 3]}]
+    for pretty in (False, True):
+      self.assertEqual(
+          value, gn_helpers.FromGNString(
+              gn_helpers.ToGNString(value, pretty=pretty)))
+    args = {'foo': ['x%d' % i for i in range(100)], 'bar': {'baz': False}}
+    self.assertEqual(args, gn_helpers.FromGNArgs(gn_helpers.ToGNString(args)))
+
   def test_UnescapeGNString(self):
     # Backslash followed by a \, $, or " means the folling character without
     # the special meaning. Backslash followed by everything else is a literal.
     self.assertEqual(
         gn_helpers.UnescapeGNString('\\as\\$\\\\asd\\"'),
         '\\as$\\asd"')
+    # A trailing backslash is dropped.
+    self.assertEqual(gn_helpers.UnescapeGNString('as\\'), 'as')
 
   def test_FromGNString(self):
     self.assertEqual(
@@ -122,6 +158,9 @@ class UnitTest(unittest.TestCase):
     with self.assertRaises(gn_helpers.GNError):
       parser = gn_helpers.GNValueParser('"trailing')  # Unterminated.
       parser.ParseString()
+    with self.assertRaises(gn_helpers.GNError):
+      parser = gn_helpers.GNValueParser('"trailing\\')  # Ends in backslash.
+      parser.ParseString()
 
   def test_ParseList(self):
     parser = gn_helpers.GNValueParser('[1,]')  # Optional end comma OK.
@@ -311,5 +350,28 @@ class UnitTest(unittest.TestCase):
       parser.ReplaceImports()
 
 
+  def test_ReadBuildVars(self):
+    output_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, output_dir)
+    path = os.path.join(output_dir, gn_helpers.BUILD_VARS_FILENAME)
+    with open(path, 'w') as f:
+      f.write('{"android_sdk_version": "29"}')
+    build_vars = gn_helpers.ReadBuildVars(output_dir)
+    self.assertEqual({'android_sdk_version': '29'}, build_vars)
+
+    # Callers may modify the returned dict without affecting later calls.
+    build_vars['android_sdk_version'] = '30'
+    with mock.patch('json.load') as json_load:
+      self.assertEqual({'android_sdk_version': '29'},
+                       gn_helpers.ReadBuildVars(output_dir))
+    json_load.assert_not_called()
+
+    # The file is read again when it changes.
+    with open(path, 'w') as f:
+      f.write('{"android_sdk_version": "30", "x": "y"}')
+    self.assertEqual({'android_sdk_version': '30', 'x': 'y'},
+                     gn_helpers.ReadBuildVars(output_dir))
+
+
 if __name__ == '__main__':
   unittest.main()